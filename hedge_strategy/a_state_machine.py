@@ -0,0 +1,353 @@
+"""
+A账户事件驱动状态机
+替代固定5秒轮询的主循环：
+
+    IDLE → QUOTING → FILLED → AWAITING_HEDGE → HEDGED → IDLE
+
+- 成交事件来自A账户WebSocket（WebSocket线程投递到事件循环）
+- 对冲结果来自Redis的B账户通知（success/failed）
+- 挂单超时、对冲超时用截止时间驱动，不再固定sleep
+- REST对账（活跃订单+持仓）只作为低频兜底
+- 对冲失败进入PAUSED；失败订单的最终对冲成功（B残余重试）或对账确认A/B持仓平衡后恢复挂单
+"""
+
+import asyncio
+import logging
+import time
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class AState:
+    """A账户状态"""
+    IDLE = "IDLE"  # 无挂单，可以挂新单
+    QUOTING = "QUOTING"  # 限价单挂单中
+    FILLED = "FILLED"  # 限价单已成交（瞬时状态）
+    AWAITING_HEDGE = "AWAITING_HEDGE"  # 等待B账户对冲结果
+    HEDGED = "HEDGED"  # B账户对冲成功（瞬时状态）
+    PAUSED = "PAUSED"  # B账户对冲失败，等待B重试成功或对账确认持仓平衡
+
+
+# 事件类型
+EVENT_ORDER_FILLED = "order_filled"
+EVENT_HEDGE_SUCCESS = "hedge_success"
+EVENT_HEDGE_FAILED = "hedge_failed"
+EVENT_STOP = "stop"
+
+
+class AStateMachine:
+    """A账户状态机"""
+
+    def __init__(
+            self,
+            account_a_manager,
+            requote_engine,
+            base_amount_multiplier: int,
+            price_multiplier: int,
+            reconcile: Callable[[], Awaitable[Dict[str, Any]]],
+            fetch_active_orders: Callable[[], Awaitable[list]],
+            on_hedge_timeout: Callable[[], Awaitable[None]],
+            maker_order_time_out: float = 30,
+            hedge_timeout: float = 30,
+            reconcile_interval: float = 60,
+            retry_delay: float = 5
+    ):
+        """
+        初始化状态机
+
+        Args:
+            account_a_manager: A账户管理器
+            requote_engine: 超时挂单重挂引擎
+            base_amount_multiplier: 基础数量乘数
+            price_multiplier: 价格乘数
+            reconcile: REST对账回调，返回 {active_orders, position_size, sign, hedge_valid, hedge_message,
+                       hedge_balanced}
+            fetch_active_orders: 查询A账户活跃订单的回调（挂单超时时使用）
+            on_hedge_timeout: 等待对冲超时的处理回调（紧急平仓）
+            maker_order_time_out: 挂单超时时间（秒）
+            hedge_timeout: 等待B对冲结果的超时时间（秒）
+            reconcile_interval: REST对账间隔（秒）
+            retry_delay: 挂单失败后的重试间隔（秒）
+        """
+        self.account_a_manager = account_a_manager
+        self.requote_engine = requote_engine
+        self.base_amount_multiplier = base_amount_multiplier
+        self.price_multiplier = price_multiplier
+        self.reconcile = reconcile
+        self.fetch_active_orders = fetch_active_orders
+        self.on_hedge_timeout = on_hedge_timeout
+        self.maker_order_time_out = maker_order_time_out
+        self.hedge_timeout = hedge_timeout
+        self.reconcile_interval = reconcile_interval
+        self.retry_delay = retry_delay
+
+        self.state = AState.IDLE
+        self.state_since = time.monotonic()
+        self.position_size = Decimal(0)  # 持仓绝对值
+        self.sign = 0  # 1=多头, -1=空头, 0=无持仓
+        self.blocked_reason: Optional[str] = None  # 对账发现异常时暂停挂新单
+
+        self.quote_deadline: Optional[float] = None
+        self.hedge_deadline: Optional[float] = None
+        self.retry_at: Optional[float] = None
+        self.reconcile_at = 0.0
+        self.awaiting_order_index: Optional[int] = None
+
+        self.events: Optional[asyncio.Queue] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.running = False
+
+        self.cycles = 0
+        self.reconciles = 0
+
+    # ---------- 事件投递（可在任意线程调用） ----------
+
+    def post_event(self, kind: str, data: Optional[Dict[str, Any]] = None):
+        """
+        投递事件到状态机
+
+        Args:
+            kind: 事件类型
+            data: 事件数据
+        """
+        if self.loop is None or self.events is None:
+            return
+        self.loop.call_soon_threadsafe(self.events.put_nowait, (kind, data or {}))
+
+    def on_order_filled(self, fill: Dict[str, Any]):
+        """A账户限价单成交回调（WebSocket线程）"""
+        self.post_event(EVENT_ORDER_FILLED, fill)
+
+    def on_hedge_message(self, message: Dict[str, Any]):
+        """B账户对冲结果回调（Redis订阅回调，可在任意线程调用）"""
+        self.account_a_manager.on_b_account_filled(message)
+        if message.get("status", "success") == "success":
+            self.post_event(EVENT_HEDGE_SUCCESS, message)
+        else:
+            self.post_event(EVENT_HEDGE_FAILED, message)
+
+    # ---------- 主循环 ----------
+
+    def _transition(self, state: str, reason: str = ""):
+        """切换状态并记录日志"""
+        if state == self.state:
+            return
+        elapsed = time.monotonic() - self.state_since
+        logging.info(f"🔄 状态 {self.state} → {state}（停留{elapsed:.3f}秒）{reason}")
+        self.state = state
+        self.state_since = time.monotonic()
+
+    def _next_timeout(self) -> float:
+        """距离最近一个截止时间的秒数"""
+        deadlines = [self.reconcile_at]
+        if self.state == AState.QUOTING and self.quote_deadline is not None:
+            deadlines.append(self.quote_deadline)
+        if self.state == AState.AWAITING_HEDGE and self.hedge_deadline is not None:
+            deadlines.append(self.hedge_deadline)
+        if self.state == AState.IDLE and self.retry_at is not None:
+            deadlines.append(self.retry_at)
+        return max(min(deadlines) - time.monotonic(), 0)
+
+    async def run(self):
+        """运行状态机直到stop()"""
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        self.running = True
+
+        while self.running:
+            try:
+                if time.monotonic() >= self.reconcile_at:
+                    await self._reconcile()
+
+                if self.state == AState.IDLE:
+                    await self._maybe_quote()
+
+                try:
+                    kind, data = await asyncio.wait_for(self.events.get(), self._next_timeout())
+                except asyncio.TimeoutError:
+                    await self._on_deadline()
+                    continue
+
+                if kind == EVENT_STOP:
+                    break
+                await self._on_event(kind, data)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"状态机处理异常: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    def stop(self):
+        """停止状态机（可在信号处理等任意线程调用）"""
+        self.running = False
+        self.post_event(EVENT_STOP)
+
+    # ---------- 事件处理 ----------
+
+    async def _on_event(self, kind: str, data: Dict[str, Any]):
+        if kind == EVENT_ORDER_FILLED:
+            self._apply_fill(data)
+            if not data.get("is_final", True):
+                # 部分成交：B端会累计后对冲，订单仍在挂单中
+                logging.info(f"部分成交: order_index={data.get('order_index')}, size={data.get('size')}")
+                return
+            if self.state in (AState.QUOTING, AState.IDLE):
+                self._transition(AState.FILLED, f"order_index={data.get('order_index')}")
+                # 成交通知已由A账户管理器发出，直接进入等待对冲
+                self.awaiting_order_index = data.get("order_index")
+                self.hedge_deadline = time.monotonic() + self.hedge_timeout
+                self._transition(AState.AWAITING_HEDGE)
+
+        elif kind == EVENT_HEDGE_SUCCESS:
+            if self.state not in (AState.AWAITING_HEDGE, AState.PAUSED):
+                logging.info(f"收到非等待状态下的对冲成功通知（当前{self.state}），忽略")
+                return
+            if not data.get("a_order_final", True):
+                # 部分成交的中间对冲，等订单最后一笔对冲完成
+                return
+            a_order_index = data.get("a_order_index")
+            if self.state == AState.PAUSED and (a_order_index is None or a_order_index != self.awaiting_order_index):
+                # 暂停中只认失败订单自己的最终对冲，其他情况交给对账核对持仓
+                logging.info(f"暂停中收到订单{a_order_index}的对冲成功通知，等待订单{self.awaiting_order_index}，忽略")
+                return
+            if a_order_index is not None and self.awaiting_order_index is not None \
+                    and a_order_index != self.awaiting_order_index:
+                logging.info(f"对冲通知对应订单{a_order_index}，当前等待{self.awaiting_order_index}，忽略")
+                return
+            if self.state == AState.PAUSED:
+                self.account_a_manager.resume_trading(f"订单{a_order_index}重试对冲成功")
+            self.cycles += 1
+            self._transition(AState.HEDGED, f"第{self.cycles}轮完成")
+            self.blocked_reason = None
+            self.hedge_deadline = None
+            self.awaiting_order_index = None
+            self._transition(AState.IDLE)
+
+        elif kind == EVENT_HEDGE_FAILED:
+            self.hedge_deadline = None
+            if data.get("a_order_index") is not None:
+                # 记录失败的订单，它的最终对冲成功时恢复
+                self.awaiting_order_index = data["a_order_index"]
+            retry_in = data.get("retry_in")
+            retry_note = f"B将在{retry_in:.0f}秒后重试" if retry_in is not None else "等待B重试"
+            self._transition(AState.PAUSED, f"B账户对冲失败，{retry_note}，重试成功或对账确认持仓平衡后恢复")
+
+    async def _on_deadline(self):
+        now = time.monotonic()
+
+        if self.state == AState.QUOTING and self.quote_deadline is not None and now >= self.quote_deadline:
+            await self._requote_stale_orders()
+
+        elif self.state == AState.AWAITING_HEDGE and self.hedge_deadline is not None and now >= self.hedge_deadline:
+            logging.error(f"❌ 等待B账户对冲超过{self.hedge_timeout}秒，执行紧急平仓！")
+            self.hedge_deadline = None
+            await self.on_hedge_timeout()
+            self._transition(AState.IDLE, "紧急平仓后重新对账")
+            self.reconcile_at = 0.0
+
+        elif self.state == AState.IDLE and self.retry_at is not None and now >= self.retry_at:
+            self.retry_at = None
+
+    def _apply_fill(self, fill: Dict[str, Any]):
+        """用成交更新本地持仓（买入加仓，卖出减仓）"""
+        try:
+            size = Decimal(str(fill.get("size", "0")))
+        except Exception:
+            return
+        signed = self.position_size * (self.sign or 1)
+        signed += size if fill.get("side") == "buy" else -size
+        self.position_size = abs(signed)
+        self.sign = 0 if signed == 0 else (1 if signed > 0 else -1)
+
+    # ---------- 动作 ----------
+
+    async def _maybe_quote(self):
+        """IDLE状态下按持仓挂开仓单或平仓单"""
+        if self.blocked_reason or self.account_a_manager.pause_trading:
+            return
+        if self.retry_at is not None:
+            return
+
+        if self.position_size == 0:
+            logging.info("[状态机] 无持仓，限价开多...")
+            success = await self.account_a_manager.create_limit_buy_order(
+                self.base_amount_multiplier, self.price_multiplier, []
+            )
+        elif self.sign == 1:
+            logging.info("[状态机] 持有多头，限价平多...")
+            success = await self.account_a_manager.create_limit_sell_order(
+                self.base_amount_multiplier, self.price_multiplier, []
+            )
+        else:
+            logging.error(f"⚠️ 异常：A账户出现空头持仓！size={self.position_size}，请人工检查并清空持仓！")
+            self.blocked_reason = "A账户空头持仓"
+            return
+
+        if success:
+            self.quote_deadline = time.monotonic() + self.maker_order_time_out
+            self._transition(AState.QUOTING)
+        else:
+            logging.warning(f"创建订单失败，{self.retry_delay}秒后重试...")
+            self.retry_at = time.monotonic() + self.retry_delay
+
+    async def _requote_stale_orders(self):
+        """挂单超时：撤单并重挂（同一次提交）"""
+        active_orders = await self.fetch_active_orders()
+        if not active_orders:
+            # 订单已不在（成交事件稍后到达或被撤），交给对账
+            self.quote_deadline = None
+            self.reconcile_at = 0.0
+            return
+        for active_order in active_orders:
+            await self.requote_engine.requote(active_order)
+        self.quote_deadline = time.monotonic() + self.maker_order_time_out
+
+    async def _reconcile(self):
+        """REST兜底对账：以交易所状态为准修正本地状态"""
+        self.reconcile_at = time.monotonic() + self.reconcile_interval
+        self.reconciles += 1
+        try:
+            snapshot = await self.reconcile()
+        except Exception as e:
+            logging.error(f"对账失败: {e}")
+            return
+
+        self.position_size = Decimal(str(snapshot["position_size"]))
+        self.sign = snapshot["sign"]
+        active_orders = snapshot["active_orders"]
+
+        if self.state == AState.PAUSED:
+            if not snapshot.get("hedge_balanced", False):
+                return
+            # 对冲失败的数量已被补齐（B重试成功的通知可能已丢失或被合并），恢复后按对账结果继续
+            self.account_a_manager.resume_trading("对账确认A/B持仓平衡")
+            self.awaiting_order_index = None
+            self._transition(AState.IDLE, "对账确认A/B持仓平衡，恢复挂单")
+
+        if self.state in (AState.IDLE, AState.QUOTING):
+            if not snapshot.get("hedge_valid", True):
+                self.blocked_reason = snapshot.get("hedge_message")
+                logging.warning(f"⚠️ 对冲状态异常，暂停挂新单: {self.blocked_reason}")
+            else:
+                self.blocked_reason = None
+
+        if active_orders and self.state == AState.IDLE:
+            self.quote_deadline = self._deadline_from_orders(active_orders)
+            self._transition(AState.QUOTING, "对账发现活跃订单")
+        elif not active_orders and self.state == AState.QUOTING:
+            self._transition(AState.IDLE, "对账发现挂单已不存在")
+        elif active_orders and self.state == AState.QUOTING:
+            self.quote_deadline = self._deadline_from_orders(active_orders)
+
+    def _deadline_from_orders(self, active_orders) -> float:
+        """按交易所返回的created_at计算挂单超时截止时间（单调时钟）"""
+        created_at = min(
+            order.additional_properties.get("created_at", time.time())
+            for order in active_orders
+        )
+        return time.monotonic() + max(created_at + self.maker_order_time_out - time.time(), 0)
+
+    def stats(self) -> str:
+        """返回状态机统计"""
+        return f"状态机: state={self.state}, 完成轮数={self.cycles}, 对账次数={self.reconciles}"
@@ -19,8 +19,15 @@ sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tem
 import lighter
 from lighter import WsClient
 from redis_messenger import RedisMessenger
+from rest_gateway import get_gateway
+from auth_token_cache import get_auth_token_cache
+from nonce_allocator import get_nonce_allocator
+from metrics import WS_RECONNECTS
 from utils import get_orderbook_price_at_depth, calculate_avg_price
 
+# 已撤销订单收到终态推送后在pending_orders中保留的时长（秒），其间晚到的成交仍按限价单通知B对冲
+CLOSED_ORDER_GRACE = 30
+
 
 class AccountAManager:
     """A账户管理器 - 做多账户，支持WebSocket实时监听订单成交"""
@@ -34,7 +41,9 @@ class AccountAManager:
             base_amount: int,
             depth: int,
             poll_interval: int = 1,
-            ws_url: Optional[str] = None
+            ws_url: Optional[str] = None,
+            order_book_feed=None,
+            depth_selector=None
     ):
         """
         初始化A账户管理器
@@ -48,6 +57,8 @@ class AccountAManager:
             depth: 挂单档位
             poll_interval: 轮询间隔（秒）
             ws_url: WebSocket服务器地址（可选）
+            order_book_feed: 本地订单簿订阅OrderBookFeed（可选，提供后挂单取价读内存）
+            depth_selector: 自适应挂单档位DepthSelector（可选，提供后每次挂单按其当前档位取价）
         """
         self.signer_client = signer_client
         self.redis_messenger = redis_messenger
@@ -57,6 +68,11 @@ class AccountAManager:
         self.depth = depth
         self.poll_interval = poll_interval
         self.ws_url = ws_url
+        self.order_book_feed = order_book_feed
+        self.depth_selector = depth_selector
+        self.gateway = get_gateway()
+        self.auth_token_cache = get_auth_token_cache(signer_client)
+        self.nonce_allocator = get_nonce_allocator(signer_client)
 
         self.current_client_order_index = None
         self.current_order_index = None  # 系统分配的订单索引
@@ -72,6 +88,10 @@ class AccountAManager:
         self.ws_heartbeat_thread: Optional[threading.Thread] = None
         self.ws_running = False
         self.pending_orders = {}  # 跟踪待成交订单 {order_index: order_info}
+        self.pending_client_orders = {}  # 已提交、尚未拿到order_index的订单 {client_order_index: order_info}
+        self._resolve_tasks = set()  # 后台补查order_index的任务
+        self.fill_listeners = []  # 限价单成交回调（在WebSocket线程中调用）
+        self.account_listeners = []  # 账户推送回调（在WebSocket线程中调用，如持仓簿）
         self.last_ws_message_time = time.time()  # 最后收到消息的时间
 
         logging.info(f"A账户管理器初始化完成: account={account_index}, market={market_index}")
@@ -103,12 +123,7 @@ class AccountAManager:
                     return False
 
                 # 获取买N档价格
-                price_str = await get_orderbook_price_at_depth(
-                    self.signer_client.api_client,
-                    self.market_index,
-                    self.depth,
-                    is_bid=True
-                )
+                price_str = await self._get_price_at_depth(is_bid=True)
 
                 if price_str is None:
                     logging.error("无法获取订单簿价格")
@@ -117,10 +132,9 @@ class AccountAManager:
                 # 转换价格为整数格式
                 price_dec = Decimal(price_str)
 
-                # 生成client_order_index（使用时间戳+随机数避免冲突）
-                # import random
-                # client_order_index = int(time.time() * 1000) + random.randint(1, 999)
-                client_order_index = 0
+                # 生成client_order_index（毫秒时间戳），下单前登记，WebSocket推送订单时转入pending_orders
+                client_order_index = int(time.time() * 1000)
+                self.track_client_order(client_order_index, 'buy', str(self.base_amount), price_str)
 
                 # 创建限价买单
                 logging.info(f"创建限价买单: price={price_str}, amount={self.base_amount}")
@@ -140,47 +154,38 @@ class AccountAManager:
                 if err:
                     # 检查是否是nonce错误
                     if "invalid nonce" in str(err).lower():
-                        logging.warning(f"Nonce错误，刷新nonce管理器后重试 (尝试 {retry_count + 1}/{max_retries})")
-                        # 强制刷新nonce
-                        self.signer_client.nonce_manager.hard_refresh_nonce(self.signer_client.api_key_index)
+                        logging.warning(f"Nonce错误，同步nonce后重试 (尝试 {retry_count + 1}/{max_retries})")
+                        # 等待（合并后的）nonce同步完成后立即重试
+                        self.pending_client_orders.pop(client_order_index, None)
+                        await self.nonce_allocator.handle_invalid_nonce()
                         retry_count += 1
-                        await asyncio.sleep(1)  # 短暂等待
                         continue
                     else:
                         logging.error(f"创建订单失败: {err}")
+                        self.pending_client_orders.pop(client_order_index, None)
                         return False
 
                 if resp.code != 200:
                     logging.error(f"创建订单失败: code={resp.code}, msg={resp.message}")
+                    self.pending_client_orders.pop(client_order_index, None)
                     return False
+                self.nonce_allocator.confirm_current()
 
                 # 记录客户端订单索引 - order_index由系统分配，我们使用client_order_index跟踪
                 self.current_client_order_index = client_order_index
                 logging.info(f"限价买单创建成功: client_order_index={client_order_index}, tx_hash={resp.tx_hash}")
                 
-                # 查询订单获取order_index（系统分配的）
-                await asyncio.sleep(1)  # 等待订单上链
-                order_info = await self._get_order_by_client_index(client_order_index)
-                if order_info:
-                    self.current_order_index = order_info.order_index
-                    # 添加到待成交订单列表
-                    self.pending_orders[self.current_order_index] = {
-                        'client_order_index': client_order_index,
-                        'side': 'buy',
-                        'initial_amount': order_info.initial_base_amount,
-                        'price': price_str
-                    }
-                    logging.info(f"订单已添加到监控列表: order_index={self.current_order_index}")
+                # order_index由WebSocket订单推送登记，推送未及时到达时后台用REST补查，不阻塞下单流程
+                self.schedule_resolve_client_order(client_order_index)
 
                 return True
 
             except Exception as e:
                 if "invalid nonce" in str(e).lower():
-                    logging.warning(f"Nonce异常，刷新nonce管理器后重试 (尝试 {retry_count + 1}/{max_retries}): {e}")
-                    # 强制刷新nonce
-                    self.signer_client.nonce_manager.hard_refresh_nonce(self.signer_client.api_key_index)
+                    logging.warning(f"Nonce异常，同步nonce后重试 (尝试 {retry_count + 1}/{max_retries}): {e}")
+                    # 等待（合并后的）nonce同步完成后立即重试
+                    await self.nonce_allocator.handle_invalid_nonce()
                     retry_count += 1
-                    await asyncio.sleep(1)  # 短暂等待
                     continue
                 else:
                     logging.error(f"创建限价买单异常: {e}")
@@ -216,12 +221,7 @@ class AccountAManager:
                     return False
 
                 # 获取卖N档价格
-                price_str = await get_orderbook_price_at_depth(
-                    self.signer_client.api_client,
-                    self.market_index,
-                    self.depth,
-                    is_bid=False
-                )
+                price_str = await self._get_price_at_depth(is_bid=False)
 
                 if price_str is None:
                     logging.error("无法获取订单簿价格")
@@ -230,10 +230,9 @@ class AccountAManager:
                 # 转换价格为整数格式
                 price_dec = Decimal(price_str)
 
-                # 生成client_order_index（使用时间戳+随机数避免冲突）
-                # import random
-                # client_order_index = int(time.time() * 1000) + random.randint(1, 999)
-                client_order_index = 0
+                # 生成client_order_index（毫秒时间戳），下单前登记，WebSocket推送订单时转入pending_orders
+                client_order_index = int(time.time() * 1000)
+                self.track_client_order(client_order_index, 'sell', str(self.base_amount), price_str)
 
                 # 创建限价买单
                 logging.info(f"创建限价卖单: price={price_str}, amount={self.base_amount}")
@@ -253,47 +252,38 @@ class AccountAManager:
                 if err:
                     # 检查是否是nonce错误
                     if "invalid nonce" in str(err).lower():
-                        logging.warning(f"Nonce错误，刷新nonce管理器后重试 (尝试 {retry_count + 1}/{max_retries})")
-                        # 强制刷新nonce
-                        self.signer_client.nonce_manager.hard_refresh_nonce(self.signer_client.api_key_index)
+                        logging.warning(f"Nonce错误，同步nonce后重试 (尝试 {retry_count + 1}/{max_retries})")
+                        # 等待（合并后的）nonce同步完成后立即重试
+                        self.pending_client_orders.pop(client_order_index, None)
+                        await self.nonce_allocator.handle_invalid_nonce()
                         retry_count += 1
-                        await asyncio.sleep(1)  # 短暂等待
                         continue
                     else:
                         logging.error(f"创建订单失败: {err}")
+                        self.pending_client_orders.pop(client_order_index, None)
                         return False
 
                 if resp.code != 200:
                     logging.error(f"创建订单失败: code={resp.code}, msg={resp.message}")
+                    self.pending_client_orders.pop(client_order_index, None)
                     return False
+                self.nonce_allocator.confirm_current()
 
                 # 记录客户端订单索引 - order_index由系统分配，我们使用client_order_index跟踪
                 self.current_client_order_index = client_order_index
                 logging.info(f"限价卖单创建成功: client_order_index={client_order_index}, tx_hash={resp.tx_hash}")
                 
-                # 查询订单获取order_index（系统分配的）
-                await asyncio.sleep(1)  # 等待订单上链
-                order_info = await self._get_order_by_client_index(client_order_index)
-                if order_info:
-                    self.current_order_index = order_info.order_index
-                    # 添加到待成交订单列表
-                    self.pending_orders[self.current_order_index] = {
-                        'client_order_index': client_order_index,
-                        'side': 'sell',
-                        'initial_amount': order_info.initial_base_amount,
-                        'price': price_str
-                    }
-                    logging.info(f"订单已添加到监控列表: order_index={self.current_order_index}")
+                # order_index由WebSocket订单推送登记，推送未及时到达时后台用REST补查，不阻塞下单流程
+                self.schedule_resolve_client_order(client_order_index)
 
                 return True
 
             except Exception as e:
                 if "invalid nonce" in str(e).lower():
-                    logging.warning(f"Nonce异常，刷新nonce管理器后重试 (尝试 {retry_count + 1}/{max_retries}): {e}")
-                    # 强制刷新nonce
-                    self.signer_client.nonce_manager.hard_refresh_nonce(self.signer_client.api_key_index)
+                    logging.warning(f"Nonce异常，同步nonce后重试 (尝试 {retry_count + 1}/{max_retries}): {e}")
+                    # 等待（合并后的）nonce同步完成后立即重试
+                    await self.nonce_allocator.handle_invalid_nonce()
                     retry_count += 1
-                    await asyncio.sleep(1)  # 短暂等待
                     continue
                 else:
                     logging.error(f"创建限价买单异常: {e}")
@@ -302,6 +292,31 @@ class AccountAManager:
         logging.error(f"创建限价买单失败，已重试{max_retries}次")
         return False
 
+    async def _get_price_at_depth(self, is_bid: bool) -> Optional[str]:
+        """
+        获取挂单档位价格：有本地订单簿时读内存，否则走REST
+        
+        Args:
+            is_bid: True表示买盘，False表示卖盘
+        
+        Returns:
+            价格字符串或None
+        """
+        depth = self.depth_selector.select() if self.depth_selector is not None else self.depth
+        if self.order_book_feed is not None:
+            return await self.order_book_feed.get_price_at_depth(
+                self.signer_client.api_client,
+                self.market_index,
+                depth,
+                is_bid=is_bid
+            )
+        return await get_orderbook_price_at_depth(
+            self.signer_client.api_client,
+            self.market_index,
+            depth,
+            is_bid=is_bid
+        )
+
     async def _get_order_by_client_index(self, client_order_index: int):
         """
         根据client_order_index查询订单信息
@@ -313,16 +328,18 @@ class AccountAManager:
             订单对象或None
         """
         try:
-            # 生成认证token
-            auth_token, auth_error = self.signer_client.create_auth_token_with_expiry()
+            # 获取认证token（缓存）
+            auth_token, auth_error = self.auth_token_cache.get_token()
             if auth_error:
                 logging.error(f"生成认证token失败: {auth_error}")
                 return None
 
-            order_api = lighter.OrderApi(self.signer_client.api_client)
+            order_api = self.gateway.order_api(self.signer_client.api_client)
             
             # 先查询活跃订单
-            orders = await order_api.account_active_orders(
+            orders = await self.gateway.request(
+                "account_active_orders",
+                order_api.account_active_orders,
                 account_index=self.account_index,
                 market_id=self.market_index,
                 auth=auth_token
@@ -333,14 +350,10 @@ class AccountAManager:
                     if order.client_order_index == client_order_index:
                         return order
             
-            # 如果活跃订单中没有，查询非活跃订单
-            # 重新生成认证token
-            auth_token, auth_error = self.signer_client.create_auth_token_with_expiry()
-            if auth_error:
-                logging.error(f"生成认证token失败: {auth_error}")
-                return None
-            
-            inactive_orders = await order_api.account_inactive_orders(
+            # 如果活跃订单中没有，查询非活跃订单（复用同一个token）
+            inactive_orders = await self.gateway.request(
+                "account_inactive_orders",
+                order_api.account_inactive_orders,
                 account_index=self.account_index,
                 market_id=self.market_index,
                 limit=10,
@@ -366,14 +379,16 @@ class AccountAManager:
             是否有活跃订单
         """
         try:
-            # 生成认证token
-            auth_token, auth_error = self.signer_client.create_auth_token_with_expiry()
+            # 获取认证token（缓存）
+            auth_token, auth_error = self.auth_token_cache.get_token()
             if auth_error:
                 logging.error(f"生成认证token失败: {auth_error}")
                 return False
 
-            order_api = lighter.OrderApi(self.signer_client.api_client)
-            orders = await order_api.account_active_orders(
+            order_api = self.gateway.order_api(self.signer_client.api_client)
+            orders = await self.gateway.request(
+                "account_active_orders",
+                order_api.account_active_orders,
                 account_index=self.account_index,
                 market_id=self.market_index,
                 auth=auth_token
@@ -396,18 +411,12 @@ class AccountAManager:
         self.monitoring = True
         logging.info(f"开始监控订单: client_order_index={self.current_client_order_index}")
 
-        order_api = lighter.OrderApi(self.signer_client.api_client)
+        order_api = self.gateway.order_api(self.signer_client.api_client)
 
         while self.monitoring:
             try:
-                # 生成认证token（增加重试机制）
-                auth_token = None
-                for auth_retry in range(3):
-                    auth_token, auth_error = self.signer_client.create_auth_token_with_expiry()
-                    if auth_error is None:
-                        break
-                    logging.warning(f"生成认证token失败 (尝试 {auth_retry + 1}/3): {auth_error}")
-                    await asyncio.sleep(0.5)
+                # 获取认证token（缓存复用，过期前后台刷新）
+                auth_token, auth_error = self.auth_token_cache.get_token()
 
                 if auth_token is None:
                     logging.error("无法生成认证token，跳过本次监控")
@@ -415,7 +424,9 @@ class AccountAManager:
                     continue
 
                 # 查询活跃订单
-                orders = await order_api.account_active_orders(
+                orders = await self.gateway.request(
+                    "account_active_orders",
+                    order_api.account_active_orders,
                     account_index=self.account_index,
                     market_id=self.market_index,
                     auth=auth_token
@@ -432,10 +443,13 @@ class AccountAManager:
                 # 如果订单不在活跃列表中，可能已经完全成交或取消
                 if current_order is None:
                     # 查询非活跃订单确认
-                    inactive_orders = await order_api.account_inactive_orders(
+                    inactive_orders = await self.gateway.request(
+                        "account_inactive_orders",
+                        order_api.account_inactive_orders,
                         account_index=self.account_index,
                         market_id=self.market_index,
-                        limit=10
+                        limit=10,
+                        auth=auth_token
                     )
 
                     if inactive_orders.orders:
@@ -527,6 +541,18 @@ class AccountAManager:
             self.pause_trading = True  # 暂停交易，等待人工处理
             logging.error("⚠️ 交易已暂停，请人工检查并处理B账户对冲失败问题！")
 
+    def resume_trading(self, reason: str = ""):
+        """
+        解除对冲失败导致的交易暂停（B账户重试对冲成功或对账确认A/B持仓平衡后调用）
+
+        Args:
+            reason: 恢复原因（日志用）
+        """
+        if self.pause_trading:
+            logging.warning(f"▶️ 交易已恢复: {reason}")
+        self.pause_trading = False
+        self.b_hedge_failed = False
+
     async def wait_for_b_filled(self, timeout: int = 300):
         """
         等待B账户成交消息（旧方法，保留兼容性）
@@ -586,6 +612,24 @@ class AccountAManager:
         if self.b_hedge_confirmed:
             logging.info("✅ B账户对冲确认成功，可以继续交易")
 
+    def add_account_listener(self, listener):
+        """
+        注册账户推送回调（在WebSocket线程中调用，回调内不要阻塞）
+        
+        Args:
+            listener: 回调函数，参数为 (account_id, account_data)
+        """
+        self.account_listeners.append(listener)
+    
+    def attach_account_stream(self, hub):
+        """
+        改用共享的账户推送订阅（多市场同进程运行，不再单独start_ws_monitoring）
+
+        Args:
+            hub: AccountStreamHub，只接收本市场的推送视图
+        """
+        hub.subscribe(self._on_account_update, market_index=self.market_index)
+
     def start_ws_monitoring(self):
         """启动WebSocket监听"""
         if self.ws_running:
@@ -640,6 +684,7 @@ class AccountAManager:
                 # 如果run()正常退出，说明连接被关闭
                 if self.ws_running:
                     consecutive_failures += 1
+                    WS_RECONNECTS.labels(account=self.account_index).inc()
                     
                     # 使用指数退避策略
                     if consecutive_failures > 1:
@@ -673,6 +718,7 @@ class AccountAManager:
             except Exception as e:
                 if self.ws_running:
                     consecutive_failures += 1
+                    WS_RECONNECTS.labels(account=self.account_index).inc()
                     
                     # 使用指数退避策略
                     if consecutive_failures > 1:
@@ -740,6 +786,16 @@ class AccountAManager:
             if not isinstance(account_data, dict):
                 return
             
+            for listener in self.account_listeners:
+                listener(account_id, account_data)
+            
+            # 用推送中的订单nonce确认在途交易
+            self.nonce_allocator.observe_account_update(account_data)
+            
+            # 已提交订单按client_order_index登记order_index（需在处理成交前完成）
+            if self.pending_client_orders:
+                self._register_pending_client_orders(account_data.get('orders'))
+            
             # 检查是否有交易记录（trades字段表示订单成交）
             trades = account_data.get('trades', {})
             if trades and str(self.market_index) in trades:
@@ -779,44 +835,225 @@ class AccountAManager:
                         continue  # 跳过市价单,不发送通知
                     
                     if order_index and is_limit_order:
-                        logging.info(f"✅ 限价单完全成交！order_index={order_index}")
+                        # 记录收到成交的单调时钟时间，用于统计成交→对冲下单延迟
+                        fill_received_ns = time.monotonic_ns()
+                        order_info = self.pending_orders[order_index]
+                        
+                        # 重连后推送可能重复，按trade_id去重
+                        trade_id = trade.get('trade_id')
+                        seen_trade_ids = order_info.setdefault('trade_ids', set())
+                        if trade_id is not None:
+                            if trade_id in seen_trade_ids:
+                                continue
+                            seen_trade_ids.add(trade_id)
                         
                         # 从交易记录中获取成交信息
                         size = trade.get('size', '0')
                         price = trade.get('price', '0')
                         usd_amount = trade.get('usd_amount', '0')
                         
+                        # 累计成交量，达到下单数量才算完全成交
+                        filled = order_info.get('filled', Decimal(0)) + Decimal(str(size))
+                        order_info['filled'] = filled
+                        is_final = filled >= Decimal(str(order_info['initial_amount']))
+                        
+                        if is_final:
+                            logging.info(f"✅ 限价单完全成交！order_index={order_index}, 累计={filled}")
+                        else:
+                            logging.info(f"限价单部分成交: order_index={order_index}, 累计={filled}/{order_info['initial_amount']}")
                         logging.info(f"成交详情: size={size}, price={price}, usd_amount={usd_amount}")
-                        logging.info(f"准备发送Redis通知: order_index={order_index}, side={side}, avg_price={price}")
                         
-                        # 只对限价单发送Redis通知
+                        # 先通知本地监听者（状态机），再通知B账户
+                        for listener in self.fill_listeners:
+                            listener({
+                                'order_index': order_index,
+                                'side': side,
+                                'size': size,
+                                'price': price,
+                                'is_final': is_final,
+                                'fill_received_ns': fill_received_ns
+                            })
+                        
+                        # 每笔成交都通知B账户，由B端按订单累计后合并对冲
                         self._notify_order_filled_ws_sync(
                             order_index=order_index,
                             filled_base_amount=size,
                             filled_quote_amount=usd_amount,
                             avg_price=price,
-                            side=side
+                            side=side,
+                            fill_received_ns=fill_received_ns,
+                            is_final=is_final
                         )
                         
-                        # 从待成交列表中移除
-                        if order_index in self.pending_orders:
+                        # 完全成交后从待成交列表中移除
+                        if is_final:
                             del self.pending_orders[order_index]
                             logging.info(f"订单{order_index}已从监控列表移除")
             else:
                 # 如果没有trades字段，记录调试信息
                 if 'orders' not in account_data and 'trades' not in account_data:
                     logging.debug(f"WebSocket消息不包含orders或trades字段")
+            
+            # 成交处理之后再处理撤单终态，同一推送中的成交不会被漏掉
+            if self.pending_orders:
+                self._retire_closed_orders(account_data.get('orders'))
                         
         except Exception as e:
             logging.error(f"处理账户更新异常: {e}", exc_info=True)
     
+    def _retire_closed_orders(self, orders):
+        """
+        订单收到撤销终态推送后标记，超过宽限期再移出pending_orders
+        
+        撤单（包括重挂）提交后订单仍留在pending_orders，直到交易所推送终态，撤单生效前的成交照常通知B对冲
+        
+        Args:
+            orders: 推送中的orders字段（{market_index: [order, ...]}）
+        """
+        now = time.time()
+        if orders:
+            groups = orders.values() if isinstance(orders, dict) else [orders]
+            for group in groups:
+                for order in group if isinstance(group, list) else [group]:
+                    if not isinstance(order, dict):
+                        continue
+                    order_info = self.pending_orders.get(order.get('order_index'))
+                    if order_info is not None and str(order.get('status', '')).startswith('canceled'):
+                        order_info.setdefault('closed_at', now)
+        self._drop_closed_orders(now)
+    
+    def prune_inactive_orders(self, active_order_indexes):
+        """
+        REST对账：pending_orders中不在交易所活跃订单列表里的订单按撤销处理，同样保留宽限期
+        
+        Args:
+            active_order_indexes: 交易所返回的活跃订单order_index集合
+        """
+        now = time.time()
+        for order_index, order_info in list(self.pending_orders.items()):
+            if order_index in active_order_indexes:
+                # 查询结果可能滞后于WebSocket推送，订单仍活跃时撤销标记作废
+                order_info.pop('closed_at', None)
+            else:
+                order_info.setdefault('closed_at', now)
+        self._drop_closed_orders(now)
+    
+    def _drop_closed_orders(self, now: float):
+        """
+        移除撤销超过宽限期的订单；已部分成交的订单通知B该订单结束，B端按最终成交结束累计
+        
+        Args:
+            now: 当前时间戳
+        """
+        for order_index, order_info in list(self.pending_orders.items()):
+            if now - order_info.get('closed_at', now) <= CLOSED_ORDER_GRACE:
+                continue
+            # WebSocket线程和事件循环都会清理，只有移除成功的一方发通知
+            if self.pending_orders.pop(order_index, None) is None:
+                continue
+            logging.info(f"订单{order_index}已撤销，从监控列表移除")
+            if order_info.get('filled'):
+                self._notify_order_filled_ws_sync(
+                    order_index=order_index,
+                    filled_base_amount='0',
+                    filled_quote_amount='0',
+                    avg_price=order_info['price'],
+                    side=order_info['side'],
+                    is_final=True
+                )
+    
+    def add_fill_listener(self, listener):
+        """
+        注册限价单成交回调（在WebSocket线程中调用，回调内不要阻塞）
+        
+        Args:
+            listener: 回调函数，参数为成交信息字典（order_index, side, size, price, is_final, fill_received_ns）
+        """
+        self.fill_listeners.append(listener)
+    
+    def track_client_order(self, client_order_index: int, side: str, initial_amount: str, price: str):
+        """
+        登记已提交但尚未拿到order_index的订单，收到WebSocket订单推送后转入pending_orders
+        
+        Args:
+            client_order_index: 客户端订单索引
+            side: 订单方向（buy/sell）
+            initial_amount: 下单数量
+            price: 下单价格
+        """
+        self.pending_client_orders[client_order_index] = {
+            'client_order_index': client_order_index,
+            'side': side,
+            'initial_amount': initial_amount,
+            'price': price
+        }
+    
+    def _register_pending_client_orders(self, orders):
+        """
+        从账户推送的订单中找到已登记的client_order_index，写入pending_orders
+        
+        Args:
+            orders: 推送中的orders字段（{market_index: [order, ...]}）
+        """
+        if not orders:
+            return
+        groups = orders.values() if isinstance(orders, dict) else [orders]
+        for group in groups:
+            for order in group if isinstance(group, list) else [group]:
+                if not isinstance(order, dict):
+                    continue
+                order_info = self.pending_client_orders.pop(order.get('client_order_index'), None)
+                if order_info is None or order.get('order_index') is None:
+                    continue
+                order_index = order['order_index']
+                self.pending_orders[order_index] = order_info
+                self.current_order_index = order_index
+                logging.info(f"订单已添加到监控列表: order_index={order_index}, client_order_index={order_info['client_order_index']}")
+    
+    def schedule_resolve_client_order(self, client_order_index: int):
+        """
+        后台补查已提交订单的order_index（必须在事件循环线程中调用），保留任务引用直到完成
+
+        Args:
+            client_order_index: 客户端订单索引
+        """
+        task = asyncio.get_running_loop().create_task(self.resolve_client_order(client_order_index))
+        self._resolve_tasks.add(task)
+        task.add_done_callback(self._resolve_tasks.discard)
+
+    async def resolve_client_order(self, client_order_index: int, delay: float = 1) -> Optional[int]:
+        """
+        WebSocket未及时推送时，用REST查询已提交订单的order_index
+        
+        Args:
+            client_order_index: 客户端订单索引
+            delay: 查询前等待订单上链的时间（秒）
+        
+        Returns:
+            order_index或None
+        """
+        await asyncio.sleep(delay)
+        if client_order_index not in self.pending_client_orders:
+            return None
+        order_info = await self._get_order_by_client_index(client_order_index)
+        order_info_pending = self.pending_client_orders.pop(client_order_index, None)
+        if order_info is None or order_info_pending is None:
+            return None
+        order_info_pending['initial_amount'] = order_info.initial_base_amount
+        self.pending_orders[order_info.order_index] = order_info_pending
+        self.current_order_index = order_info.order_index
+        logging.info(f"订单已添加到监控列表(REST): order_index={order_info.order_index}")
+        return order_info.order_index
+
     def _notify_order_filled_ws_sync(
         self,
         order_index: int,
         filled_base_amount: str,
         filled_quote_amount: str,
         avg_price: str,
-        side: str
+        side: str,
+        fill_received_ns: Optional[int] = None,
+        is_final: bool = True
     ):
         """
         通过WebSocket收到成交后发送Redis通知（同步版本）
@@ -827,6 +1064,8 @@ class AccountAManager:
             filled_quote_amount: 成交金额
             avg_price: 平均价格
             side: 订单方向
+            fill_received_ns: 收到成交的单调时钟时间（纳秒，可选）
+            is_final: 该订单是否已完全成交（部分成交为False）
         """
         try:
             # 创建消息
@@ -839,8 +1078,11 @@ class AccountAManager:
                 avg_price=avg_price,
                 side=side
             )
+            if fill_received_ns is not None:
+                message["fill_received_ns"] = fill_received_ns
+            message["is_final"] = is_final
             
-            # 发布到Redis（同步调用）
+            # 发布到Redis（同步调用），挂载进程内传输时直接投递到事件循环
             self.redis_messenger.publish_a_filled(message)
             logging.info(f"已通过WebSocket发送A账户成交通知到Redis: order_index={order_index}")
             
@@ -9,18 +9,31 @@ import asyncio
 import logging
 import time
 import threading
-from typing import Dict, Any
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Dict, Any, Optional
 
 # 添加temp_lighter到路径
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
 
 import lighter
+from lighter import WsClient
 from redis_messenger import RedisMessenger
+from rest_gateway import get_gateway
+from auth_token_cache import get_auth_token_cache
+from nonce_allocator import get_nonce_allocator
+from metrics import WS_RECONNECTS, HEDGE_ATTEMPTS, HEDGE_RESULTS
+from hedge_aggregator import HedgeAggregator
 from utils import calculate_avg_price
+from latency_tracker import LatencyTracker, extract_trace, stamp
+from emergency_flatten import flatten_account
+
+# A端平仓消息中的盘口快照超过该时长（秒）视为过期，重新取价
+CLOSE_SNAPSHOT_MAX_AGE = 5
 
 
 class AccountBManager:
-    """B账户管理器 - 做空账户"""
+    """B账户管理器 - 做空账户，支持WebSocket推送确认对冲成交"""
     
     def __init__(
         self,
@@ -29,7 +42,17 @@ class AccountBManager:
         account_index: int,
         base_amount_multiplier: int,
         price_multiplier: int,
-        retry_times: int = 3
+        retry_times: int = 3,
+        ws_url: Optional[str] = None,
+        hedge_confirm_timeout: float = 5,
+        order_book_feed=None,
+        min_base_amount=0,
+        hedge_batch_size=0,
+        hedge_max_delay: float = 0.5,
+        latency_export_interval: float = 60,
+        hedge_readiness=None,
+        market_index: Optional[int] = None,
+        hedge_template_amount=None
     ):
         """
         初始化B账户管理器
@@ -41,6 +64,16 @@ class AccountBManager:
             base_amount_multiplier: 基础资产数量乘数（精度）
             price_multiplier: 价格乘数（精度）
             retry_times: 对冲失败重试次数
+            ws_url: WebSocket服务器地址（可选，提供后通过推送确认对冲成交）
+            hedge_confirm_timeout: 等待WebSocket成交推送的截止时间（秒），超时后回退到REST轮询
+            order_book_feed: 本地订单簿订阅OrderBookFeed（可选，提供后平仓取价读内存）
+            min_base_amount: 市场最小下单量（A部分成交累计到该数量才单独对冲）
+            hedge_batch_size: 部分成交累计到该数量立即对冲（不足最小下单量时按最小下单量）
+            hedge_max_delay: 部分成交未达到触发数量时的最长等待（秒）
+            latency_export_interval: 对冲链路延迟统计输出到日志和Redis的间隔（秒）
+            hedge_readiness: 对冲就绪HedgeReadiness（可选，提供后预签名下一笔对冲单并保持连接）
+            market_index: 对冲市场索引（对冲就绪登记用）
+            hedge_template_amount: 预签名对冲单的数量（A挂单数量；None表示沿用上一笔对冲数量）
         """
         self.signer_client = signer_client
         self.redis_messenger = redis_messenger
@@ -50,6 +83,46 @@ class AccountBManager:
         self.retry_times = retry_times
         self.running = False
         self.event_loop = None
+        self.gateway = get_gateway()
+        self.auth_token_cache = get_auth_token_cache(signer_client)
+        self.nonce_allocator = get_nonce_allocator(signer_client)
+        
+        # 对冲就绪：预签名下一笔对冲单
+        self.hedge_readiness = hedge_readiness
+        self.market_index = market_index
+        if hedge_readiness is not None and market_index is not None:
+            hedge_readiness.register_market(
+                market_index, base_amount_multiplier, price_multiplier,
+                order_book_feed=order_book_feed, expected_base_amount=hedge_template_amount
+            )
+        
+        # 对冲链路分阶段延迟统计：A成交收到 → ... → B对冲单成交确认
+        self.latency_tracker = LatencyTracker("hedge_latency")
+        self.latency_export_interval = latency_export_interval
+        
+        # A部分成交按订单累计后合并对冲
+        self.hedge_aggregator = HedgeAggregator(
+            hedge_func=self._execute_hedge,
+            on_order_closed=self._notify_order_closed,
+            min_base_amount=Decimal(str(min_base_amount)),
+            batch_size=Decimal(str(hedge_batch_size)),
+            max_delay=hedge_max_delay,
+            on_hedged=self._ack_fills,
+            on_hedge_failed=self._notify_hedge_failed
+        )
+        
+        # WebSocket相关
+        self.ws_url = ws_url
+        self.hedge_confirm_timeout = hedge_confirm_timeout
+        self.order_book_feed = order_book_feed
+        self.ws_client: Optional[WsClient] = None
+        self.ws_thread: Optional[threading.Thread] = None
+        self.ws_running = False
+        self.last_ws_message_time = time.time()
+        # 等待成交确认的对冲单 {client_order_index: waiter}
+        self.order_waiters: Dict[int, Dict[str, Any]] = {}
+        self._waiters_lock = threading.Lock()
+        self.account_listeners = []  # 账户推送回调（在WebSocket线程中调用，如持仓簿）
         
         logging.info(f"B账户管理器初始化完成: account={account_index}, base_multiplier={base_amount_multiplier}, price_multiplier={price_multiplier}")
     
@@ -57,6 +130,36 @@ class AccountBManager:
         """设置事件循环"""
         self.event_loop = loop
     
+    async def handle_a_filled(self, message: Dict[str, Any]):
+        """
+        收到A账户成交消息的回调（事件循环版本）
+        
+        用于进程内传输和异步Redis订阅：回调已经在事件循环上执行，直接派发对冲，
+        不再经过run_coroutine_threadsafe
+        
+        Args:
+            message: 成交消息
+        """
+        stamp(message, "b_received_ns")
+        logging.info(f"收到A账户成交通知(进程内): {message}")
+        
+        if message.get("action") == "close_all":
+            logging.warning("⚠️ 收到紧急平仓信号！")
+            await self.execute_close_all(message)
+            self._ack_fills([message.get("stream_id")])
+            return
+        
+        await self.hedge_aggregator.add_fill(message)
+    
+    def _ack_fills(self, stream_ids):
+        """
+        确认A账户成交消息已处理（成交走Redis Stream时XACK，否则忽略）
+        
+        Args:
+            stream_ids: 消息的stream_id列表
+        """
+        self.redis_messenger.ack(self.redis_messenger.CHANNEL_A_FILLED, stream_ids)
+    
     def on_a_account_filled(self, message: Dict[str, Any]):
         """
         收到A账户成交消息的回调
@@ -64,6 +167,7 @@ class AccountBManager:
         Args:
             message: Redis消息
         """
+        stamp(message, "b_received_ns")
         logging.info(f"收到A账户成交通知: {message}")
         
         # 检查是否是平仓信号
@@ -72,7 +176,7 @@ class AccountBManager:
             # 使用线程安全的方式调度平仓任务
             if self.event_loop and self.event_loop.is_running():
                 asyncio.run_coroutine_threadsafe(
-                    self._execute_close_all(message),
+                    self.execute_close_all(message),
                     self.event_loop
                 )
             else:
@@ -83,96 +187,68 @@ class AccountBManager:
         # 使用线程安全的方式调度异步任务
         if self.event_loop and self.event_loop.is_running():
             asyncio.run_coroutine_threadsafe(
-                self._execute_hedge(message),
+                self.hedge_aggregator.add_fill(message),
                 self.event_loop
             )
         else:
             logging.error("事件循环未设置或未运行，无法执行对冲")
     
-    async def _execute_close_all(self, message: Dict[str, Any]):
+    async def execute_close_all(self, message: Dict[str, Any]) -> Dict[str, Any]:
         """
         执行全部平仓操作
         
+        消息带有A端的盘口快照（best_bid/best_ask）且未过期时直接用于滑点价格上限，不再重新取价；
+        B只下IOC市价单，没有挂单需要撤销
+        
         Args:
             message: 平仓消息
+        
+        Returns:
+            平仓结果（status: flat/submitted/failed）
         """
-        try:
-            logging.error("=" * 60)
-            logging.error("B账户开始执行紧急平仓")
-            logging.error("=" * 60)
-            
-            market = message.get("market", "")
-            market_index = message.get("market_index", 0)
-            logging.info(f"平仓市场: {market}, market_index: {market_index}")
-            
-            # 获取当前持仓
-            from utils import get_positions
-            position_size, sign = await get_positions(
-                self.signer_client.api_client,
-                self.account_index,
-                market_index
-            )
-            
-            if position_size == 0:
-                logging.info("B账户无持仓，无需平仓")
-                return
-            
-            logging.info(f"B账户当前持仓: size={position_size}, sign={sign}")
-            
-            # 获取当前市场价格
-            from utils import get_orderbook
-            from decimal import Decimal
-            orderbook = await get_orderbook(self.signer_client.api_client, market_index)
-            
-            # 根据持仓方向确定平仓方向和价格
-            # sign=1表示多头,需要卖出平仓(is_ask=True)
-            # sign=-1表示空头,需要买入平仓(is_ask=False)
-            if sign == 1:
-                # 平多头，卖出
-                is_ask = True
-                price_dec = Decimal(str(orderbook.bids[0].price))
-                base_price = int(price_dec * self.price_multiplier)
-                # 降低5%确保成交
-                avg_execution_price = int(base_price * Decimal('0.95'))
-                action = "卖出"
-            else:
-                # 平空头，买入
-                is_ask = False
-                price_dec = Decimal(str(orderbook.asks[0].price))
-                base_price = int(price_dec * self.price_multiplier)
-                # 提高5%确保成交
-                avg_execution_price = int(base_price * Decimal('1.05'))
-                action = "买入"
-            
-            logging.info(f"B账户平仓: {action}, 基准价={base_price}, 执行价={avg_execution_price}")
-            
-            # 生成client_order_index
-            import random
-            client_order_index = int(time.time() * 1000) + random.randint(1, 999)
-            
-            # 下市价单
-            tx, resp, err = await self.signer_client.create_market_order(
-                market_index=market_index,
-                client_order_index=client_order_index,
-                base_amount=int(position_size * self.base_amount_multiplier),
-                avg_execution_price=avg_execution_price,
-                is_ask=is_ask,
-                reduce_only=True  # 平仓单
-            )
-            
-            if err:
-                logging.error(f"B账户平仓订单创建失败: {err}")
-                return
-            
-            if resp and resp.code == 200:
-                logging.info(f"B账户平仓订单已提交: tx_hash={resp.tx_hash}")
-            else:
-                logging.error(f"B账户平仓订单提交失败: code={resp.code if resp else 'None'}")
-            
-            logging.error("=" * 60)
-            
-        except Exception as e:
-            logging.error(f"B账户执行平仓失败: {e}")
+        logging.error("=" * 60)
+        logging.error("B账户开始执行紧急平仓")
+        logging.error("=" * 60)
+        
+        market = message.get("market", "")
+        market_index = message.get("market_index", 0)
+        logging.info(f"平仓市场: {market}, market_index: {market_index}")
+        
+        best_bid, best_ask = message.get("best_bid"), message.get("best_ask")
+        if best_bid is None or best_ask is None or time.time() - message.get("timestamp", 0) > CLOSE_SNAPSHOT_MAX_AGE:
+            # 获取当前市场价格（优先读本地订单簿）
+            try:
+                from utils import get_orderbook
+                if self.order_book_feed is not None:
+                    best_bid, best_ask = await self.order_book_feed.get_best_prices(
+                        self.signer_client.api_client, market_index
+                    )
+                else:
+                    orderbook = await get_orderbook(self.signer_client.api_client, market_index)
+                    best_bid, best_ask = orderbook.bids[0].price, orderbook.asks[0].price
+            except Exception as e:
+                logging.error(f"B账户执行平仓失败: {e}")
+                return {"status": "failed", "error": str(e)}
+        
+        result = await flatten_account(
+            self.signer_client,
+            self.signer_client.api_client,
+            self.account_index,
+            market_index,
+            self.base_amount_multiplier,
+            self.price_multiplier,
+            best_bid,
+            best_ask,
+            cancel_orders=False,
+            label="B"
+        )
+        if "signal_ns" in message:
+            # monotonic时钟在同一主机的进程间可比较
+            elapsed_ms = (time.monotonic_ns() - message["signal_ns"]) / 1e6
+            logging.info(f"平仓信号→B平仓完成: {elapsed_ms:.1f}ms")
+        
+        logging.error("=" * 60)
+        return result
     
     async def _execute_hedge(self, a_order_info: Dict[str, Any]):
         """
@@ -186,21 +262,31 @@ class AccountBManager:
             filled_base_amount = a_order_info["filled_base_amount"]
             avg_price = a_order_info["avg_price"]
             a_side = a_order_info.get("side", "buy")  # A账户的订单方向
+            trace = extract_trace(a_order_info)
             
             logging.info(f"开始执行对冲: market={market_index}, amount={filled_base_amount}, avg_price={avg_price}, A方向={a_side}")
             
             # 重试机制
             for attempt in range(1, self.retry_times + 1):
+                HEDGE_ATTEMPTS.inc()
                 try:
                     success, order = await self._create_hedge_order(
                         market_index,
                         filled_base_amount,
                         avg_price,
-                        a_side
+                        a_side,
+                        trace=trace
                     )
                     
                     if success:
+                        trace["confirmed_ns"] = time.monotonic_ns()
+                        self.latency_tracker.record_trace(trace)
+                        HEDGE_RESULTS.labels(status="success").inc()
                         logging.info(f"对冲成功 (尝试 {attempt}/{self.retry_times})")
+                        await self._notify_hedge_completed(
+                            order, market_index, a_order_info.get("order_index"),
+                            a_order_final=a_order_info.get("is_final", True)
+                        )
                         return
                     else:
                         logging.warning(f"对冲失败 (尝试 {attempt}/{self.retry_times})")
@@ -212,15 +298,17 @@ class AccountBManager:
                     if attempt < self.retry_times:
                         await asyncio.sleep(1)
             
-            # 所有重试都失败
+            # 所有重试都失败，由聚合器记为残余并安排重试（首次失败时通知A账户暂停交易）
             logging.error("❌ 对冲失败，已达到最大重试次数！")
-            raise Exception("对冲失败")
+            HEDGE_RESULTS.labels(status="failed").inc()
+            raise Exception(f"对冲失败，已重试{self.retry_times}次")
         
         except Exception as e:
             logging.error(f"执行对冲失败: {e}")
             raise
     
-    async def _create_hedge_order(self, market_index: int, base_amount: str, avg_price: str, a_side: str) -> tuple:
+    async def _create_hedge_order(self, market_index: int, base_amount: str, avg_price: str, a_side: str,
+                                  trace: Optional[Dict[str, int]] = None) -> tuple:
         """
         创建对冲订单（市价单）
         
@@ -235,10 +323,12 @@ class AccountBManager:
             base_amount: 基础资产数量（字符串，如"0.00020"）
             avg_price: A账户平均成交价格（字符串，如"109400.0"）
             a_side: A账户订单方向（"buy"或"sell"）
+            trace: 延迟追踪时间戳（可选，记录提交和接受时间）
         
         Returns:
             (是否成功, 订单对象或None)
         """
+        client_order_index = None
         try:
             # 转换数量为整数，使用与A入口相同的方式
             amount_float = float(base_amount)
@@ -275,9 +365,21 @@ class AccountBManager:
             logging.info(f"价格转换: {avg_price} * {self.price_multiplier} = {avg_execution_price}")
             logging.info(f"对冲逻辑: A账户{'买入' if a_side == 'buy' else '卖出'} → B账户{b_action} (is_ask={is_ask})")
             
-            # 生成client_order_index（使用时间戳+随机数避免冲突）
-            import random
-            client_order_index = int(time.time() * 1000) + random.randint(1, 999)
+            # 对冲就绪：数量、方向与预签名模板一致且价格偏离在容忍范围内时直接发送已签名的交易
+            template = None
+            if self.hedge_readiness is not None:
+                template = self.hedge_readiness.claim(market_index, amount_int, is_ask, price_dec)
+            
+            if template is not None:
+                client_order_index = template["client_order_index"]
+                logging.info(f"使用预签名对冲单: nonce={template['nonce']}, price={template['price']}")
+            else:
+                # 生成client_order_index（使用时间戳+随机数避免冲突）
+                import random
+                client_order_index = int(time.time() * 1000) + random.randint(1, 999)
+            
+            # 下单前登记等待者，避免成交推送先于下单响应到达
+            confirm_future = self._register_order_waiter(client_order_index, market_index, base_amount, is_ask)
             
             # 使用lighter SDK的create_market_order方法
             logging.info(f"创建市价{b_action}单: amount={amount_int}, avg_execution_price={avg_execution_price}")
@@ -289,15 +391,21 @@ class AccountBManager:
                 try:
                     logging.info(f"准备创建市价订单: market={market_index}, amount={amount_int}, avg_price={avg_execution_price}, client_order_index={client_order_index}")
                     
-                    # 使用create_market_order方法
-                    tx, resp, err = await self.signer_client.create_market_order(
-                        market_index=market_index,
-                        client_order_index=client_order_index,
-                        base_amount=amount_int,
-                        avg_execution_price=avg_execution_price,
-                        is_ask=is_ask,  # 根据A的方向决定B的方向
-                        reduce_only=False
-                    )
+                    # 使用create_market_order方法（签名和发送都在SDK内完成）
+                    if trace is not None:
+                        trace["hedge_submit_ns"] = time.monotonic_ns()
+                    if template is not None:
+                        tx, resp, err = await self.hedge_readiness.send(template)
+                    else:
+                        # 预签名模板占用的nonce由nonce分配器在分配前收回
+                        tx, resp, err = await self.signer_client.create_market_order(
+                            market_index=market_index,
+                            client_order_index=client_order_index,
+                            base_amount=amount_int,
+                            avg_execution_price=avg_execution_price,
+                            is_ask=is_ask,  # 根据A的方向决定B的方向
+                            reduce_only=False
+                        )
                     
                     logging.info(f"创建订单返回: tx={tx}, resp={resp}, err={err}")
                 except Exception as create_err:
@@ -307,11 +415,12 @@ class AccountBManager:
                 if err:
                     # 检查是否是nonce错误
                     if "invalid nonce" in str(err).lower():
-                        logging.warning(f"Nonce错误，刷新nonce管理器后重试 (尝试 {retry_count + 1}/{max_retries})")
-                        # 强制刷新nonce
-                        self.signer_client.nonce_manager.hard_refresh_nonce(self.signer_client.api_key_index)
+                        logging.warning(f"Nonce错误，同步nonce后重试 (尝试 {retry_count + 1}/{max_retries})")
+                        # 等待（合并后的）nonce同步完成后立即重试
+                        await self.nonce_allocator.handle_invalid_nonce()
+                        # 预签名模板的nonce已失效，改为现签
+                        template = None
                         retry_count += 1
-                        await asyncio.sleep(1)  # 短暂等待
                         continue
                     else:
                         logging.error(f"创建市价{b_action}单失败: {err}")
@@ -324,8 +433,20 @@ class AccountBManager:
                 if resp.code != 200:
                     logging.error(f"创建市价{b_action}单失败: code={resp.code}, msg={resp.message}")
                     return False, None
+                if template is not None:
+                    self.nonce_allocator.confirm(template["api_key_index"], template["nonce"])
+                else:
+                    self.nonce_allocator.confirm_current()
+                if self.hedge_readiness is not None:
+                    self.hedge_readiness.on_hedge_sent(market_index, amount_int, is_ask, price_dec)
                 
-                # 成功创建订单，跳出重试循环
+                # 成功创建订单，记录接受时间后跳出重试循环
+                # monotonic时钟在同一主机的进程间可比较
+                if trace is not None:
+                    trace["accepted_ns"] = time.monotonic_ns()
+                    if "fill_received_ns" in trace:
+                        elapsed_ms = (trace["accepted_ns"] - trace["fill_received_ns"]) / 1e6
+                        logging.info(f"成交→对冲单接受: {elapsed_ms:.3f}ms")
                 break
             else:
                 # 重试次数用完
@@ -335,26 +456,36 @@ class AccountBManager:
             # 从tx_hash中提取order_index，或者使用client_order_index查询
             logging.info(f"市价{b_action}单创建成功: tx_hash={resp.tx_hash}, client_order_index={client_order_index}")
             
-            # 等待订单上链并成交（市价单通常立即成交，但需要更长时间上链）
-            # 使用重试机制查询订单状态
+            # 优先等待WebSocket推送的成交确认，超过截止时间再回退到REST轮询
+            if confirm_future is not None:
+                try:
+                    order = await asyncio.wait_for(asyncio.shield(confirm_future), timeout=self.hedge_confirm_timeout)
+                    return self._check_hedge_order_status(order, b_action)
+                except asyncio.TimeoutError:
+                    logging.warning(f"⚠️ {self.hedge_confirm_timeout}秒内未收到成交推送，回退到REST轮询")
+            
+            # REST轮询兜底（轮询间隔内推送到达同样立即返回）
             max_query_retries = 5  # 最多查询5次
             query_interval = 3  # 每次间隔3秒
             
             for query_attempt in range(1, max_query_retries + 1):
                 logging.info(f"等待{query_interval}秒后查询订单状态 (尝试 {query_attempt}/{max_query_retries})...")
-                await asyncio.sleep(query_interval)
+                if confirm_future is not None:
+                    try:
+                        order = await asyncio.wait_for(asyncio.shield(confirm_future), timeout=query_interval)
+                        return self._check_hedge_order_status(order, b_action)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(query_interval)
                 
                 # 使用client_order_index查询订单状态确认成交
                 logging.info(f"查询订单状态: client_order_index={client_order_index}")
                 order = await self._get_order_info_by_client_index(client_order_index, market_index)
                 
                 if order:
-                    if order.status == "filled":
-                        logging.info(f"✅ 市价{b_action}单已成交: filled_amount={order.filled_base_amount}")
-                        return True, order
-                    elif order.status.startswith("canceled"):
-                        logging.warning(f"❌ 市价{b_action}单被取消: status={order.status}")
-                        return False, order
+                    if order.status == "filled" or order.status.startswith("canceled"):
+                        return self._check_hedge_order_status(order, b_action)
                     else:
                         logging.info(f"⏳ 订单状态: {order.status}, 继续等待...")
                         # 继续下一次查询
@@ -369,6 +500,28 @@ class AccountBManager:
         except Exception as e:
             logging.error(f"创建市价对冲单异常: {e}")
             return False, None
+        
+        finally:
+            if client_order_index is not None:
+                self._discard_order_waiter(client_order_index)
+    
+    @staticmethod
+    def _check_hedge_order_status(order, b_action: str) -> tuple:
+        """
+        根据订单最终状态判断对冲是否成功
+        
+        Args:
+            order: 订单对象（REST返回或WebSocket推送构建）
+            b_action: B账户动作描述（用于日志）
+        
+        Returns:
+            (是否成功, 订单对象)
+        """
+        if order.status == "filled":
+            logging.info(f"✅ 市价{b_action}单已成交: filled_amount={order.filled_base_amount}")
+            return True, order
+        logging.warning(f"❌ 市价{b_action}单未成交: status={order.status}")
+        return False, order
     
     async def _get_order_info_by_client_index(self, client_order_index: int, market_index: int):
         """
@@ -382,16 +535,18 @@ class AccountBManager:
             订单对象或None
         """
         try:
-            order_api = lighter.OrderApi(self.signer_client.api_client)
+            order_api = self.gateway.order_api(self.signer_client.api_client)
             
-            # 生成认证token
-            auth_token, auth_error = self.signer_client.create_auth_token_with_expiry()
+            # 获取认证token（缓存）
+            auth_token, auth_error = self.auth_token_cache.get_token()
             if auth_error:
                 logging.error(f"生成认证token失败: {auth_error}")
                 return None
             
             # 先查询非活跃订单（市价单成交后会在这里）
-            inactive_orders = await order_api.account_inactive_orders(
+            inactive_orders = await self.gateway.request(
+                "account_inactive_orders",
+                order_api.account_inactive_orders,
                 account_index=self.account_index,
                 market_id=market_index,
                 limit=10,
@@ -404,14 +559,10 @@ class AccountBManager:
                         logging.info(f"在非活跃订单中找到订单: order_index={order.order_index}, status={order.status}")
                         return order
             
-            # 如果没找到，再查询活跃订单
-            # 生成认证token
-            auth_token, auth_error = self.signer_client.create_auth_token_with_expiry()
-            if auth_error:
-                logging.error(f"生成认证token失败: {auth_error}")
-                return None
-            
-            active_orders = await order_api.account_active_orders(
+            # 如果没找到，再查询活跃订单（复用同一个token）
+            active_orders = await self.gateway.request(
+                "account_active_orders",
+                order_api.account_active_orders,
                 account_index=self.account_index,
                 market_id=market_index,
                 auth=auth_token
@@ -430,13 +581,16 @@ class AccountBManager:
             logging.error(f"获取订单信息失败: {e}")
             return None
     
-    async def _notify_hedge_completed(self, order, market_index: int):
+    async def _notify_hedge_completed(self, order, market_index: int, a_order_index: int = None,
+                                      a_order_final: bool = True):
         """
         通知对冲成功
         
         Args:
             order: 订单对象
             market_index: 市场索引
+            a_order_index: 对应的A账户订单索引（可选，A账户状态机据此匹配）
+            a_order_final: A订单是否已全部成交并对冲完毕（部分成交的中间对冲为False）
         """
         try:
             # 计算平均价格
@@ -460,6 +614,9 @@ class AccountBManager:
             
             # 添加成功状态
             message["status"] = "success"
+            if a_order_index is not None:
+                message["a_order_index"] = a_order_index
+            message["a_order_final"] = a_order_final
             
             # 发布到Redis
             self.redis_messenger.publish_b_filled(message)
@@ -469,8 +626,42 @@ class AccountBManager:
             logging.error(f"发送对冲完成通知失败: {e}")
             raise
     
+    async def _notify_order_closed(self, market_index: int, a_order_index: int, residual: Decimal):
+        """
+        A订单已全部成交，但最后剩余数量低于最小下单量未单独下单时，通知A账户该订单对冲结束
+        
+        Args:
+            market_index: 市场索引
+            a_order_index: A账户订单索引
+            residual: 记为残余、并入下一次对冲的数量
+        """
+        message = {
+            "account_index": self.account_index,
+            "market_index": market_index,
+            "status": "success",
+            "a_order_index": a_order_index,
+            "a_order_final": True,
+            "residual": str(residual),
+            "timestamp": int(time.time())
+        }
+        self.redis_messenger.publish_b_filled(message)
+        logging.info(f"A订单{a_order_index}对冲结束，残余{residual}并入下一次对冲")
+    
+    async def _notify_hedge_failed(self, a_order_info: Dict[str, Any], retry_in: float):
+        """
+        聚合器对冲首次失败的回调：通知A账户暂停，残余重试成功后A收到该订单的对冲成功通知再恢复
+        
+        Args:
+            a_order_info: 失败的对冲消息（A订单成交格式）
+            retry_in: 距离残余重试的秒数
+        """
+        await self._notify_hedge_result(
+            a_order_info["market_index"], a_order_info, "failed",
+            reason=f"已重试{self.retry_times}次", retry_in=retry_in
+        )
+    
     async def _notify_hedge_result(self, market_index: int, a_order_info: Dict[str, Any],
-                                   status: str, reason: str = None, order=None):
+                                   status: str, reason: str = None, order=None, retry_in: float = None):
         """
         通知对冲结果（成功或失败）
         
@@ -480,6 +671,7 @@ class AccountBManager:
             status: 状态（"success"或"failed"）
             reason: 失败原因（仅失败时需要）
             order: 订单对象（仅成功时需要）
+            retry_in: 失败残余距离下次重试的秒数（仅失败时，可选）
         """
         try:
             import time
@@ -492,9 +684,13 @@ class AccountBManager:
                     "status": "failed",
                     "reason": reason,
                     "a_order_info": a_order_info,
+                    "a_order_index": a_order_info.get("order_index"),
+                    "a_order_final": a_order_info.get("is_final", True),
                     "timestamp": int(time.time()),
                     "retry_times": self.retry_times
                 }
+                if retry_in is not None:
+                    message["retry_in"] = retry_in
                 logging.error(f"❌ 发送B账户对冲失败通知: {message}")
             else:
                 # 成功消息（不应该走这个分支，应该用_notify_hedge_completed）
@@ -513,12 +709,296 @@ class AccountBManager:
             logging.error(f"发送对冲结果通知异常: {e}")
             raise
     
+    def _register_order_waiter(self, client_order_index: int, market_index: int,
+                               base_amount: str, is_ask: bool) -> Optional[asyncio.Future]:
+        """
+        登记等待成交确认的对冲单
+        
+        Args:
+            client_order_index: 客户端订单索引
+            market_index: 市场索引
+            base_amount: 下单数量（字符串）
+            is_ask: 是否卖单
+        
+        Returns:
+            成交确认future；WebSocket未运行时返回None
+        """
+        if not self.ws_running:
+            return None
+        
+        future = asyncio.get_running_loop().create_future()
+        with self._waiters_lock:
+            self.order_waiters[client_order_index] = {
+                "future": future,
+                "loop": future.get_loop(),
+                "market_index": market_index,
+                "is_ask": is_ask,
+                "expected": Decimal(str(base_amount)),
+                "filled": Decimal(0),
+                "quote": Decimal(0),
+                "order_index": None
+            }
+        return future
+    
+    def _discard_order_waiter(self, client_order_index: int):
+        """移除等待者"""
+        with self._waiters_lock:
+            self.order_waiters.pop(client_order_index, None)
+    
+    def _resolve_order_waiter(self, client_order_index: int, status: str):
+        """
+        以最终状态完成等待者（WebSocket线程中调用，线程安全）
+        
+        Args:
+            client_order_index: 客户端订单索引
+            status: 订单最终状态（"filled"或"canceled-*"）
+        """
+        with self._waiters_lock:
+            waiter = self.order_waiters.get(client_order_index)
+            if waiter is None:
+                return
+            order = SimpleNamespace(
+                client_order_index=client_order_index,
+                order_index=waiter["order_index"],
+                status=status,
+                is_ask=waiter["is_ask"],
+                filled_base_amount=str(waiter["filled"]),
+                filled_quote_amount=str(waiter["quote"])
+            )
+        
+        future = waiter["future"]
+        
+        def _set_result():
+            if not future.done():
+                future.set_result(order)
+        
+        waiter["loop"].call_soon_threadsafe(_set_result)
+    
+    def add_account_listener(self, listener):
+        """
+        注册账户推送回调（在WebSocket线程中调用，回调内不要阻塞）
+        
+        Args:
+            listener: 回调函数，参数为 (account_id, account_data)
+        """
+        self.account_listeners.append(listener)
+    
+    def attach_account_stream(self, hub, market_index: int):
+        """
+        改用共享的账户推送订阅确认对冲成交（多市场同进程运行，不再单独start_ws_monitoring）
+
+        Args:
+            hub: AccountStreamHub
+            market_index: 本管理器对冲的市场，只接收该市场的推送视图
+        """
+        hub.subscribe(self._on_account_update, market_index=market_index)
+        # 推送由共享订阅提供，对冲单按推送确认成交
+        self.ws_running = True
+
+    def start_ws_monitoring(self):
+        """启动WebSocket监听B账户订单/成交推送"""
+        if self.ws_running:
+            logging.warning("WebSocket监听已在运行")
+            return
+        
+        if not self.ws_url:
+            logging.warning("未配置ws_url，对冲成交确认使用REST轮询")
+            return
+        
+        try:
+            logging.info(f"启动WebSocket监听账户: {self.account_index}")
+            self.ws_client = WsClient(
+                host=self.ws_url,
+                account_ids=[self.account_index],
+                on_account_update=self._on_account_update
+            )
+            self.ws_running = True
+            self.last_ws_message_time = time.time()
+            self.ws_thread = threading.Thread(target=self._run_ws_client, daemon=True)
+            self.ws_thread.start()
+            logging.info("B账户WebSocket监听已启动")
+        except Exception as e:
+            logging.error(f"启动WebSocket监听失败: {e}")
+            self.ws_running = False
+    
+    def _run_ws_client(self):
+        """在线程中运行WebSocket客户端，支持断线重连和指数退避"""
+        base_retry_interval = 2  # 基础重试间隔（秒）
+        max_retry_interval = 60  # 最大重试间隔（秒）
+        consecutive_failures = 0
+        
+        while self.ws_running:
+            try:
+                logging.info("B账户WebSocket开始连接...")
+                self.ws_client.run()
+                if not self.ws_running:
+                    break
+                consecutive_failures += 1
+                WS_RECONNECTS.labels(account=self.account_index).inc()
+                logging.warning(f"B账户WebSocket连接断开（连续失败{consecutive_failures}次）")
+            except Exception as e:
+                if not self.ws_running:
+                    break
+                consecutive_failures += 1
+                WS_RECONNECTS.labels(account=self.account_index).inc()
+                logging.error(f"B账户WebSocket运行异常: {e}（连续失败{consecutive_failures}次）")
+            
+            retry_interval = min(base_retry_interval * (2 ** (consecutive_failures - 1)), max_retry_interval)
+            logging.info(f"{retry_interval}秒后重连B账户WebSocket...")
+            time.sleep(retry_interval)
+            
+            try:
+                self.ws_client = WsClient(
+                    host=self.ws_url,
+                    account_ids=[self.account_index],
+                    on_account_update=self._on_account_update
+                )
+            except Exception as create_error:
+                logging.error(f"重新创建WebSocket客户端失败: {create_error}")
+        
+        logging.info("B账户WebSocket监听线程退出")
+    
+    def _on_account_update(self, account_id: str, account_data: Dict[str, Any]):
+        """
+        WebSocket账户更新回调，用于确认对冲单成交
+        
+        - orders字段：按client_order_index匹配，终态（filled/canceled）直接完成等待者
+        - trades字段：taker成交按client_id匹配（缺失时按账户+方向匹配唯一等待者），
+          累计成交量达到下单数量即视为成交
+        
+        Args:
+            account_id: 账户ID
+            account_data: 账户数据
+        """
+        try:
+            self.last_ws_message_time = time.time()
+            
+            if isinstance(account_data, dict) and account_data.get('type') == 'ping':
+                try:
+                    if self.ws_client and self.ws_client.ws:
+                        import json
+                        self.ws_client.ws.send(json.dumps({"type": "pong"}))
+                except Exception as pong_err:
+                    logging.warning(f"发送pong响应失败: {pong_err}")
+                return
+            
+            if not isinstance(account_data, dict):
+                return
+            
+            for listener in self.account_listeners:
+                listener(account_id, account_data)
+            
+            # 用推送中的订单nonce确认在途交易
+            self.nonce_allocator.observe_account_update(account_data)
+            
+            if not self.order_waiters:
+                return
+            
+            for order in self._iter_market_items(account_data.get('orders')):
+                client_order_index = order.get('client_order_index')
+                if client_order_index is None or client_order_index not in self.order_waiters:
+                    continue
+                status = order.get('status', '')
+                with self._waiters_lock:
+                    waiter = self.order_waiters.get(client_order_index)
+                    if waiter is None:
+                        continue
+                    waiter["order_index"] = order.get('order_index', waiter["order_index"])
+                    if order.get('filled_base_amount') is not None:
+                        waiter["filled"] = Decimal(str(order['filled_base_amount']))
+                    if order.get('filled_quote_amount') is not None:
+                        waiter["quote"] = Decimal(str(order['filled_quote_amount']))
+                if status == "filled" or status.startswith("canceled"):
+                    self._resolve_order_waiter(client_order_index, status)
+            
+            for trade in self._iter_market_items(account_data.get('trades')):
+                self._match_trade_to_waiter(trade)
+        
+        except Exception as e:
+            logging.error(f"处理B账户WebSocket更新异常: {e}", exc_info=True)
+    
+    def _match_trade_to_waiter(self, trade: Dict[str, Any]):
+        """
+        把一笔成交记录累计到对应的等待者
+        
+        Args:
+            trade: 成交记录
+        """
+        is_ask = trade.get('ask_account_id') == self.account_index
+        if not is_ask and trade.get('bid_account_id') != self.account_index:
+            return
+        
+        client_id = trade.get('ask_client_id') if is_ask else trade.get('bid_client_id')
+        with self._waiters_lock:
+            if client_id is not None:
+                waiter = self.order_waiters.get(client_id)
+            else:
+                # 成交记录不带client_id时，只在该市场同方向仅有一个等待者时才归属
+                candidates = [
+                    (index, w) for index, w in self.order_waiters.items()
+                    if w["is_ask"] == is_ask and w["market_index"] == trade.get('market_id', w["market_index"])
+                ]
+                client_id, waiter = candidates[0] if len(candidates) == 1 else (None, None)
+            if waiter is None:
+                return
+            waiter["order_index"] = trade.get('ask_id') if is_ask else trade.get('bid_id')
+            waiter["filled"] += Decimal(str(trade.get('size', '0')))
+            waiter["quote"] += Decimal(str(trade.get('usd_amount', '0')))
+            fully_filled = waiter["filled"] >= waiter["expected"]
+        
+        if fully_filled:
+            self._resolve_order_waiter(client_id, "filled")
+    
+    @staticmethod
+    def _iter_market_items(field):
+        """
+        遍历按市场分组的推送字段（{market_id: [item, ...]}），同时兼容直接给出列表的情况
+        
+        Args:
+            field: WebSocket推送中的orders/trades字段
+        """
+        if not field:
+            return
+        groups = field.values() if isinstance(field, dict) else [field]
+        for items in groups:
+            if isinstance(items, dict):
+                items = [items]
+            for item in items or []:
+                if isinstance(item, dict):
+                    yield item
+    
+    def stop_ws_monitoring(self):
+        """停止WebSocket监听"""
+        if not self.ws_running:
+            return
+        
+        try:
+            self.ws_running = False
+            if self.ws_client and self.ws_client.ws:
+                self.ws_client.ws.close()
+            if self.ws_thread:
+                self.ws_thread.join(timeout=5)
+            logging.info("B账户WebSocket监听已停止")
+        except Exception as e:
+            logging.error(f"停止WebSocket监听失败: {e}")
+    
     def start_listening(self):
-        """开始监听A账户成交消息"""
+        """开始监听A账户成交消息（在事件循环线程中调用时同时启动延迟统计定期输出）"""
         self.running = True
+        try:
+            asyncio.get_running_loop()
+            self.latency_tracker.start_export(self.redis_messenger, self.latency_export_interval)
+        except RuntimeError:
+            pass
         logging.info("B账户开始监听A账户成交消息")
     
     def stop_listening(self):
         """停止监听"""
         self.running = False
+        self.latency_tracker.stop()
+        logging.info(self.latency_tracker.summary())
+        logging.info(self.hedge_aggregator.residual_summary())
+        self.hedge_aggregator.stop()
+        if self.hedge_readiness is not None and self.market_index is not None:
+            self.hedge_readiness.unregister_market(self.market_index)
         logging.info("B账户停止监听")
@@ -0,0 +1,199 @@
+"""
+共享账户推送订阅
+多市场同进程运行时，每个账户只保持一条account_all WebSocket订阅：
+- 推送中的orders/trades/positions按市场分组（{market_index: [...]}），
+  按订阅者的市场拆出只含该市场的视图再分发，各市场管理器互不可见对方的订单和成交
+- 断线指数退避重连，心跳线程检测长时间无消息时主动断开触发重连
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+from lighter import WsClient
+from metrics import WS_RECONNECTS
+
+# 按市场分组的推送字段
+MARKET_FIELDS = ("orders", "trades", "positions")
+
+AccountCallback = Callable[[str, Dict[str, Any]], None]
+
+
+def market_view(account_data: Dict[str, Any], market_index: int) -> Dict[str, Any]:
+    """
+    从账户推送中拆出单个市场的视图（其余字段原样保留）
+
+    Args:
+        account_data: 账户推送数据
+        market_index: 市场索引
+
+    Returns:
+        只含该市场orders/trades/positions的推送数据
+    """
+    view = dict(account_data)
+    key = str(market_index)
+    for field in MARKET_FIELDS:
+        value = account_data.get(field)
+        if isinstance(value, dict):
+            view[field] = {key: value[key]} if key in value else {}
+        elif isinstance(value, list):
+            view[field] = [
+                item for item in value
+                if isinstance(item, dict) and item.get("market_id", item.get("market_index")) == market_index
+            ]
+    return view
+
+
+class AccountStreamHub:
+    """单个账户的共享WebSocket推送订阅"""
+
+    def __init__(self, ws_url: str, account_index: int, heartbeat_interval: float = 30,
+                 timeout_threshold: float = 90):
+        """
+        初始化推送订阅
+
+        Args:
+            ws_url: WebSocket服务器地址
+            account_index: 账户索引
+            heartbeat_interval: 心跳检查间隔（秒）
+            timeout_threshold: 超过该时长没有消息时断开重连（秒）
+        """
+        self.ws_url = ws_url
+        self.account_index = account_index
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout_threshold = timeout_threshold
+
+        # [(回调, 市场索引)]，市场索引为None时收到完整推送
+        self.subscribers: List[Tuple[AccountCallback, Optional[int]]] = []
+        self.ws_client: Optional[WsClient] = None
+        self.ws_thread: Optional[threading.Thread] = None
+        self.heartbeat_thread: Optional[threading.Thread] = None
+        self.ws_running = False
+        self.last_message_time = time.time()
+        self._stop_event = threading.Event()
+
+        self.messages_received = 0
+        self.reconnect_count = 0
+
+    def subscribe(self, callback: AccountCallback, market_index: Optional[int] = None):
+        """
+        注册推送回调（在WebSocket线程中调用，回调内不要阻塞）
+
+        Args:
+            callback: 回调函数，参数为 (account_id, account_data)
+            market_index: 只接收该市场的orders/trades/positions（None表示完整推送）
+        """
+        self.subscribers.append((callback, market_index))
+
+    def start(self):
+        """启动WebSocket线程和心跳线程"""
+        if self.ws_running:
+            return
+        self.ws_running = True
+        self._stop_event.clear()
+        self.last_message_time = time.time()
+        self.ws_thread = threading.Thread(target=self._run_ws_client, daemon=True)
+        self.ws_thread.start()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_monitor, daemon=True)
+        self.heartbeat_thread.start()
+        markets = sorted({m for _, m in self.subscribers if m is not None})
+        logging.info(f"账户{self.account_index}共享推送订阅已启动: 订阅者={len(self.subscribers)}, markets={markets}")
+
+    def stop(self):
+        """停止订阅"""
+        if not self.ws_running:
+            return
+        self.ws_running = False
+        self._stop_event.set()
+        try:
+            if self.ws_client and self.ws_client.ws:
+                self.ws_client.ws.close()
+            for thread in (self.ws_thread, self.heartbeat_thread):
+                if thread:
+                    thread.join(timeout=5)
+        except Exception as e:
+            logging.error(f"停止账户{self.account_index}推送订阅失败: {e}")
+        logging.info(f"账户{self.account_index}共享推送订阅已停止: {self.stats()}")
+
+    def _run_ws_client(self):
+        """在线程中运行WebSocket客户端，断线后指数退避重连"""
+        base_retry_interval = 2
+        max_retry_interval = 60
+        consecutive_failures = 0
+
+        while self.ws_running:
+            try:
+                self.ws_client = WsClient(
+                    host=self.ws_url,
+                    account_ids=[self.account_index],
+                    on_account_update=self._on_account_update
+                )
+                self.ws_client.run()
+                if not self.ws_running:
+                    break
+                consecutive_failures += 1
+                logging.warning(f"账户{self.account_index}推送连接断开（连续失败{consecutive_failures}次）")
+            except Exception as e:
+                if not self.ws_running:
+                    break
+                consecutive_failures += 1
+                logging.error(f"账户{self.account_index}推送连接异常: {e}（连续失败{consecutive_failures}次）")
+
+            self.reconnect_count += 1
+            WS_RECONNECTS.labels(account=self.account_index).inc()
+            retry_interval = min(base_retry_interval * (2 ** (consecutive_failures - 1)), max_retry_interval)
+            if self._stop_event.wait(retry_interval):
+                break
+
+        logging.info(f"账户{self.account_index}推送线程退出")
+
+    def _heartbeat_monitor(self):
+        """长时间没有消息时关闭连接，触发重连"""
+        while not self._stop_event.wait(self.heartbeat_interval):
+            silence = time.time() - self.last_message_time
+            if silence <= self.timeout_threshold:
+                continue
+            logging.warning(f"账户{self.account_index}推送{silence:.1f}秒未收到消息，重新连接...")
+            try:
+                if self.ws_client and self.ws_client.ws:
+                    self.ws_client.ws.close()
+            except Exception as e:
+                logging.debug(f"关闭WebSocket连接时出错: {e}")
+
+    def _on_account_update(self, account_id: str, account_data: Dict[str, Any]):
+        """
+        WebSocket账户推送回调：回复ping，按市场拆分后分发
+
+        Args:
+            account_id: 账户ID
+            account_data: 账户数据
+        """
+        self.last_message_time = time.time()
+        if not isinstance(account_data, dict):
+            return
+        if account_data.get('type') == 'ping':
+            try:
+                if self.ws_client and self.ws_client.ws:
+                    self.ws_client.ws.send(json.dumps({"type": "pong"}))
+            except Exception as e:
+                logging.warning(f"发送pong响应失败: {e}")
+            return
+
+        self.messages_received += 1
+        for callback, market_index in self.subscribers:
+            try:
+                data = account_data if market_index is None else market_view(account_data, market_index)
+                callback(account_id, data)
+            except Exception as e:
+                logging.error(f"账户{self.account_index}推送分发异常(market={market_index}): {e}", exc_info=True)
+
+    def stats(self) -> str:
+        """返回统计"""
+        return f"消息={self.messages_received}, 重连={self.reconnect_count}, 订阅者={len(self.subscribers)}"
@@ -0,0 +1,150 @@
+"""
+认证token缓存
+每个SignerClient一个缓存，token在过期前复用，后台提前刷新，
+轮询循环里不再每次调用原生签名生成token
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+
+
+class AuthTokenCache:
+    """
+    认证token缓存
+
+    - get_token() 在token剩余有效期大于refresh_margin时直接返回缓存（命中）
+    - 后台任务在过期前refresh_margin秒，在线程池中重新签名，签名不占用事件循环
+    """
+
+    def __init__(self, signer_client: lighter.SignerClient, ttl: int = 600, refresh_margin: int = 60):
+        """
+        初始化token缓存
+
+        Args:
+            signer_client: lighter签名客户端
+            ttl: token有效期（秒），SDK默认生成10分钟有效的token
+            refresh_margin: 提前刷新的时间（秒）
+        """
+        self.signer_client = signer_client
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _is_fresh(self) -> bool:
+        return self.token is not None and time.time() < self.expires_at - self.refresh_margin
+
+    def _sign(self) -> Tuple[Optional[str], Optional[str]]:
+        """
+        调用SDK生成新token并写入缓存
+
+        Returns:
+            (token, error)
+        """
+        issued_at = time.time()
+        token, error = self.signer_client.create_auth_token_with_expiry()
+        if error is not None:
+            self.errors += 1
+            return None, error
+
+        with self._lock:
+            self.token = token
+            self.expires_at = issued_at + self.ttl
+        return token, None
+
+    def get_token(self) -> Tuple[Optional[str], Optional[str]]:
+        """
+        获取认证token，返回格式与 create_auth_token_with_expiry 一致
+
+        Returns:
+            (token, error)
+        """
+        with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return self.token, None
+            self.misses += 1
+
+        token, error = self._sign()
+        if error is not None:
+            # 签名失败但旧token仍未过期时继续使用
+            with self._lock:
+                if self.token is not None and time.time() < self.expires_at:
+                    return self.token, None
+            logging.warning(f"生成认证token失败: {error}")
+        return token, error
+
+    def start(self):
+        """启动后台刷新任务（必须在事件循环线程中调用）"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+            logging.info(f"认证token后台刷新已启动: account={self.signer_client.account_index}")
+
+    def stop(self):
+        """停止后台刷新任务"""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+
+    async def _refresh_loop(self):
+        """在token进入刷新窗口前重新签名"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                wait_time = max(self.expires_at - self.refresh_margin - time.time(), 0)
+                if wait_time > 0:
+                    await asyncio.sleep(wait_time)
+                token, error = await loop.run_in_executor(None, self._sign)
+                if error is None:
+                    self.refreshes += 1
+                    logging.debug(f"认证token已刷新，有效期至 {time.strftime('%H:%M:%S', time.localtime(self.expires_at))}")
+                else:
+                    logging.warning(f"后台刷新认证token失败: {error}，5秒后重试")
+                    await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.error(f"认证token刷新异常: {e}")
+                await asyncio.sleep(5)
+
+    def stats(self) -> str:
+        """返回命中统计"""
+        return f"认证token缓存: hits={self.hits}, misses={self.misses}, refreshes={self.refreshes}, errors={self.errors}"
+
+
+_caches: Dict[int, AuthTokenCache] = {}
+
+
+def get_auth_token_cache(signer_client: lighter.SignerClient) -> AuthTokenCache:
+    """
+    获取SignerClient对应的token缓存（同一进程内共享）
+
+    Args:
+        signer_client: lighter签名客户端
+
+    Returns:
+        token缓存
+    """
+    cache = _caches.get(id(signer_client))
+    if cache is None or cache.signer_client is not signer_client:
+        cache = AuthTokenCache(signer_client)
+        _caches[id(signer_client)] = cache
+    return cache
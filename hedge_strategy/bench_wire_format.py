@@ -0,0 +1,60 @@
+"""
+线路格式微基准
+对比JSON和紧凑二进制格式编码/解码成交消息的耗时和消息大小
+
+用法: python bench_wire_format.py [--iterations 100000]
+"""
+
+import argparse
+import json
+import time
+
+import wire_format
+from redis_messenger import RedisMessenger
+
+
+def build_messages():
+    """构造A成交消息和B对冲成功消息"""
+    a_filled = RedisMessenger.create_filled_message(
+        account_index=280459,
+        market_index=1,
+        order_index=281475565888461,
+        filled_base_amount="0.00020",
+        filled_quote_amount="22.123456",
+        avg_price="110617.28",
+        side="buy"
+    )
+    a_filled["fill_received_ns"] = time.monotonic_ns()
+    a_filled["is_final"] = True
+
+    b_filled = dict(a_filled, side="sell", status="success", a_order_index=281475565888461, a_order_final=True)
+    b_filled.pop("fill_received_ns")
+    b_filled.pop("is_final")
+    return {"A成交": a_filled, "B对冲成功": b_filled}
+
+
+def bench(func, arg, iterations: int) -> float:
+    """返回每次调用的平均耗时（纳秒）"""
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线路格式微基准")
+    parser.add_argument("--iterations", type=int, default=100000, help="每项测试的循环次数")
+    args = parser.parse_args()
+
+    print(f"{'消息':<10}{'格式':<8}{'大小(B)':>10}{'编码(ns)':>12}{'解码(ns)':>12}")
+    for name, message in build_messages().items():
+        for fmt in wire_format.FORMATS:
+            payload = wire_format.encode(message, fmt)
+            assert wire_format.decode(payload) == json.loads(json.dumps(message)), f"{name} {fmt} 往返不一致"
+            encode_ns = bench(lambda m: wire_format.encode(m, fmt), message, args.iterations)
+            decode_ns = bench(wire_format.decode, payload, args.iterations)
+            print(f"{name:<10}{fmt:<8}{len(payload):>10}{encode_ns:>12.0f}{decode_ns:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
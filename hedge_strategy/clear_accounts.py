@@ -20,6 +20,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tem
 
 import lighter
 from lighter import ApiClient, Configuration
+from nonce_allocator import get_nonce_allocator
 
 # 配置日志
 logging.basicConfig(
@@ -242,9 +243,8 @@ class AccountCleaner:
                 if err:
                     # 检查是否是nonce错误
                     if "invalid nonce" in str(err).lower():
-                        logging.warning(f"Nonce错误，刷新后重试 (尝试 {attempt}/{max_retries})")
-                        client.nonce_manager.hard_refresh_nonce(client.api_key_index)
-                        await asyncio.sleep(1)
+                        logging.warning(f"Nonce错误，同步nonce后重试 (尝试 {attempt}/{max_retries})")
+                        await get_nonce_allocator(client).handle_invalid_nonce(client.api_key_index)
                         continue
                     else:
                         logging.error(f"❌ 平仓失败: {err}")
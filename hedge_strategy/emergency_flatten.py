@@ -0,0 +1,187 @@
+"""
+紧急平仓协调器
+原流程串行：撤A挂单 → 查A持仓 → 取盘口 → 平A → 再发close_all给B，B收到后再取一次盘口、查持仓、平B，
+一条腿已平、另一条腿仍敞口的窗口是两段REST链路之和。这里：
+- 开始时取一份盘口快照（本地订单簿优先，失效时一次REST），两条腿共用它计算滑点价格上限，B端不再重新取价
+- 各腿用asyncio.gather并发执行：腿内撤单与查持仓并发，随后提交reduce_only市价单
+  （同一签名客户端的撤单和平仓单按顺序签名，避免nonce乱序）
+- 记录每条腿的完成耗时和两腿完成时间差
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from metrics import EMERGENCY_FLATTEN_LATENCY
+from utils import cancel_all_orders, get_orderbook, get_positions
+
+# 平仓市价单滑点容忍度
+SLIPPAGE_TOLERANCE = Decimal('0.05')
+
+
+async def flatten_account(
+        signer_client: lighter.SignerClient,
+        api_client: lighter.ApiClient,
+        account_index: int,
+        market_index: int,
+        base_amount_multiplier: int,
+        price_multiplier: int,
+        best_bid,
+        best_ask,
+        cancel_orders: bool = True,
+        label: str = ""
+) -> Dict[str, Any]:
+    """
+    撤单并以市价平掉账户在指定市场的持仓
+
+    Args:
+        signer_client: 账户签名客户端
+        api_client: 查询持仓用的API客户端
+        account_index: 账户索引
+        market_index: 市场索引
+        base_amount_multiplier: 数量乘数
+        price_multiplier: 价格乘数
+        best_bid: 盘口快照买一价
+        best_ask: 盘口快照卖一价
+        cancel_orders: 是否先撤销活跃订单
+        label: 日志中的账户名
+
+    Returns:
+        {status: flat/submitted/failed, size, sign, tx_hash, error}
+    """
+    result: Dict[str, Any] = {"status": "failed", "size": Decimal(0), "sign": 0, "tx_hash": None, "error": None}
+    try:
+        position_task = get_positions(api_client, account_index, market_index)
+        if cancel_orders:
+            _, (position_size, sign, _) = await asyncio.gather(
+                cancel_all_orders(signer_client, account_index, market_index),
+                position_task
+            )
+        else:
+            position_size, sign, _ = await position_task
+        result["size"], result["sign"] = position_size, sign
+
+        if position_size == 0:
+            logging.info(f"{label}账户无持仓，无需平仓")
+            result["status"] = "flat"
+            return result
+
+        # sign=1表示多头，卖出平仓（买一价下调5%）；sign=-1表示空头，买入平仓（卖一价上浮5%）
+        if sign == 1:
+            is_ask = True
+            base_price = int(Decimal(str(best_bid)) * price_multiplier)
+            avg_execution_price = int(base_price * (Decimal('1') - SLIPPAGE_TOLERANCE))
+        else:
+            is_ask = False
+            base_price = int(Decimal(str(best_ask)) * price_multiplier)
+            avg_execution_price = int(base_price * (Decimal('1') + SLIPPAGE_TOLERANCE))
+        logging.info(f"{label}账户平仓: size={position_size}, {'卖出' if is_ask else '买入'}, "
+                     f"基准价={base_price}, 执行价={avg_execution_price}")
+
+        client_order_index = int(time.time() * 1000) + random.randint(1, 999)
+        tx, resp, err = await signer_client.create_market_order(
+            market_index=market_index,
+            client_order_index=client_order_index,
+            base_amount=int(position_size * base_amount_multiplier),
+            avg_execution_price=avg_execution_price,
+            is_ask=is_ask,
+            reduce_only=True  # 平仓单
+        )
+        if err:
+            result["error"] = str(err)
+            logging.error(f"{label}账户平仓订单失败: {err}")
+        elif resp and resp.code == 200:
+            result["status"] = "submitted"
+            result["tx_hash"] = resp.tx_hash
+            logging.info(f"✅ {label}账户平仓订单已提交: tx_hash={resp.tx_hash}")
+        else:
+            result["error"] = f"code={resp.code if resp else 'None'}"
+            logging.error(f"{label}账户平仓订单失败: {result['error']}")
+
+    except Exception as e:
+        result["error"] = str(e)
+        logging.error(f"{label}账户平仓失败: {e}")
+    return result
+
+
+class EmergencyFlatten:
+    """紧急平仓协调器：共用一份盘口快照，各腿并发撤单+平仓"""
+
+    def __init__(self, market_index: int, api_client: lighter.ApiClient, order_book_feed=None):
+        """
+        初始化协调器
+
+        Args:
+            market_index: 市场索引
+            api_client: REST兜底取盘口用的API客户端
+            order_book_feed: 本地订单簿OrderBookFeed（可选）
+        """
+        self.market_index = market_index
+        self.api_client = api_client
+        self.order_book_feed = order_book_feed
+        self.legs: Dict[str, Callable[[Any, Any], Awaitable[Dict[str, Any]]]] = {}
+
+    def add_leg(self, name: str, close_func: Callable[[Any, Any], Awaitable[Dict[str, Any]]]):
+        """
+        添加一条腿
+
+        Args:
+            name: 腿名称（日志和指标标签）
+            close_func: async (best_bid, best_ask) -> 结果字典（至少包含status；只发出平仓信号时为signaled）
+        """
+        self.legs[name] = close_func
+
+    async def snapshot(self) -> Tuple[Any, Any]:
+        """取盘口快照（本地订单簿优先）"""
+        if self.order_book_feed is not None:
+            return await self.order_book_feed.get_best_prices(self.api_client, self.market_index)
+        orderbook = await get_orderbook(self.api_client, self.market_index)
+        best_bid = str(orderbook.bids[0].price) if orderbook.bids else None
+        best_ask = str(orderbook.asks[0].price) if orderbook.asks else None
+        return best_bid, best_ask
+
+    async def _run_leg(self, name: str, close_func, best_bid, best_ask, start: float) -> Dict[str, Any]:
+        try:
+            result = await close_func(best_bid, best_ask)
+        except Exception as e:
+            result = {"status": "failed", "error": str(e)}
+        result = dict(result or {})
+        result["elapsed"] = time.monotonic() - start
+        EMERGENCY_FLATTEN_LATENCY.labels(leg=name).observe(result["elapsed"])
+        return result
+
+    async def run(self) -> Dict[str, Dict[str, Any]]:
+        """
+        并发执行所有腿
+
+        Returns:
+            {腿名称: 结果字典（含elapsed，从开始到该腿完成的秒数）}
+        """
+        start = time.monotonic()
+        best_bid, best_ask = await self.snapshot()
+        snapshot_elapsed = time.monotonic() - start
+        logging.info(f"紧急平仓盘口快照: bid={best_bid}, ask={best_ask}（{snapshot_elapsed * 1000:.1f}ms）")
+
+        names = list(self.legs)
+        results = await asyncio.gather(
+            *(self._run_leg(name, self.legs[name], best_bid, best_ask, start) for name in names)
+        )
+        results = dict(zip(names, results))
+
+        for name, result in results.items():
+            logging.warning(f"紧急平仓[{name}]: status={result.get('status')}, 完成耗时={result['elapsed'] * 1000:.1f}ms"
+                            + (f", error={result['error']}" if result.get('error') else ""))
+        # 只发出信号的腿（B在另一个进程）完成时间由B端记录，不计入时间差
+        elapsed = [result["elapsed"] for result in results.values() if result.get("status") != "signaled"]
+        if len(elapsed) > 1:
+            logging.warning(f"紧急平仓各腿完成时间差: {(max(elapsed) - min(elapsed)) * 1000:.1f}ms")
+        return results
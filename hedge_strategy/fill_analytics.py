@@ -0,0 +1,415 @@
+"""
+挂单成交概率分析和自适应挂单档位
+基于market_recorder录制的订单簿/逐笔成交，用NumPy在整段历史上估算每个档位、每个挂单超时下的
+成交概率和预期成交耗时：
+- 按固定间隔在历史上取假想挂单时刻，记录各档价格和该价位已有数量（排队在前的量）
+- 挂单之后出现价格更优的成交（穿价）即整单成交；等于挂单价的成交先消耗排队，累计量超过排队+挂单量时成交
+- 不计排队在前的撤单，估算偏保守
+DepthSelector定期用最近的录制数据重新估算，A账户每次挂单时查询当前档位：
+在预期单腿耗时不超过上限的档位中，选 (挂单距中间价 - 对冲成本) / 预期单腿耗时 最大的档位
+
+离线报告: python fill_analytics.py --capture ./captures --market-index 0 --quantity 0.1 --depths 1,2,3,4,5 --timeouts 10,30,60
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 只有启用自适应档位或运行离线分析时才需要
+    np = None
+
+from market_recorder import KIND_TRADE
+from market_replay import MarketReplay, order_book_handler, parse_time
+from order_book import OrderBookFeed
+
+
+class MarketHistory:
+    """录制行情整理成的数组：按间隔采样的各档挂单条件 + 全部逐笔成交"""
+
+    def __init__(self, depths: List[int], samples: List[Tuple], trades: List[Tuple]):
+        """
+        初始化
+
+        Args:
+            depths: 采样的档位
+            samples: [(时间ns, 中间价, 买价[档位], 买价排队[档位], 卖价[档位], 卖价排队[档位])]
+            trades: [(时间ns, 价格, 数量, 是否maker为卖方)]
+        """
+        self.depths = list(depths)
+        width = len(self.depths)
+        self.sample_ts = np.array([s[0] for s in samples], dtype=np.int64)
+        self.mid = np.array([s[1] for s in samples], dtype=np.float64)
+        self.bid_price = np.array([s[2] for s in samples], dtype=np.float64).reshape(-1, width)
+        self.bid_queue = np.array([s[3] for s in samples], dtype=np.float64).reshape(-1, width)
+        self.ask_price = np.array([s[4] for s in samples], dtype=np.float64).reshape(-1, width)
+        self.ask_queue = np.array([s[5] for s in samples], dtype=np.float64).reshape(-1, width)
+        self.trade_ts = np.array([t[0] for t in trades], dtype=np.int64)
+        self.trade_price = np.array([t[1] for t in trades], dtype=np.float64)
+        self.trade_size = np.array([t[2] for t in trades], dtype=np.float64)
+        self.trade_maker_ask = np.array([t[3] for t in trades], dtype=bool)
+
+    @property
+    def sample_count(self) -> int:
+        return len(self.sample_ts)
+
+    @property
+    def trade_count(self) -> int:
+        return len(self.trade_ts)
+
+
+def load_history(directory: str, market_index: int, depths: List[int], sample_interval: float = 1.0,
+                 start_ns: Optional[int] = None, end_ns: Optional[int] = None) -> MarketHistory:
+    """
+    回放录制数据，按间隔采样各档价格和排队量，收集逐笔成交
+
+    Args:
+        directory: 录制根目录
+        market_index: 市场索引
+        depths: 采样的档位
+        sample_interval: 采样间隔（秒）
+        start_ns: 起始时间（UTC纳秒）
+        end_ns: 结束时间（UTC纳秒）
+
+    Returns:
+        行情数组
+    """
+    if np is None:
+        raise RuntimeError("挂单成交分析需要numpy: pip install numpy")
+
+    feed = OrderBookFeed("replay", [market_index])
+    book = feed.get_book(market_index)
+    handle_book = order_book_handler(feed)
+    interval_ns = int(sample_interval * 1e9)
+    next_sample_ns = 0
+    samples, trades = [], []
+    nan = float("nan")
+
+    for ts_ns, kind, payload in MarketReplay(directory, [market_index], start_ns, end_ns).records():
+        message = json.loads(payload)
+        if kind == KIND_TRADE:
+            for trade in message.get("trades") or []:
+                trades.append((ts_ns, float(trade["price"]), float(trade["size"]), bool(trade.get("is_maker_ask"))))
+            continue
+        handle_book(ts_ns, kind, message)
+        if ts_ns < next_sample_ns:
+            continue
+        best_bid, best_ask = book.best_bid(), book.best_ask()
+        if best_bid is None or best_ask is None:
+            continue
+        row = [ts_ns, (float(best_bid[0]) + float(best_ask[0])) / 2, [], [], [], []]
+        for depth in depths:
+            for is_bid, prices, queues in ((True, row[2], row[3]), (False, row[4], row[5])):
+                price = book.price_at_depth(depth, is_bid)
+                prices.append(float(price) if price is not None else nan)
+                queues.append(float(book.level_size(price, is_bid)) if price is not None else nan)
+        samples.append(tuple(row))
+        next_sample_ns = ts_ns + interval_ns
+
+    return MarketHistory(depths, samples, trades)
+
+
+def fill_times(history: MarketHistory, column: int, is_bid: bool, quantity: float) -> "np.ndarray":
+    """
+    每个采样时刻在指定档位挂单的成交耗时
+
+    Args:
+        history: 行情数组
+        column: 档位在history.depths中的下标
+        is_bid: True表示挂买单，False表示挂卖单
+        quantity: 挂单数量
+
+    Returns:
+        成交耗时（秒），不成交为inf，该时刻无此档位为nan
+    """
+    quote_price = (history.bid_price if is_bid else history.ask_price)[:, column]
+    queue = (history.bid_queue if is_bid else history.ask_queue)[:, column]
+    result = np.full(history.sample_count, np.nan)
+    valid = ~np.isnan(quote_price)
+    result[valid] = np.inf
+
+    # 买单只会被taker卖出（maker为买方）吃到，卖单反之
+    side = history.trade_maker_ask != is_bid
+    ts, price, size = history.trade_ts[side], history.trade_price[side], history.trade_size[side]
+    count = len(ts)
+    if count == 0:
+        return result
+    ts_tail = np.append(ts, 0)
+    positions = np.arange(count)
+    start = np.searchsorted(ts, history.sample_ts, side="right")  # 挂单之后的第一笔成交
+
+    for level in np.unique(quote_price[valid]):
+        rows = np.flatnonzero(valid & (quote_price == level))
+        row_start = start[rows]
+
+        # 穿价：挂单之后第一笔价格更优的成交
+        through = price < level if is_bid else price > level
+        next_through = np.minimum.accumulate(np.where(through, positions, count)[::-1])[::-1]
+        next_through = np.append(next_through, count)[row_start]
+        through_ts = np.where(next_through < count, ts_tail[next_through], np.inf)
+
+        # 同价成交：累计量超过排队+挂单量的那一笔
+        cumulative = np.concatenate(([0.0], np.cumsum(np.where(price == level, size, 0.0))))
+        need = cumulative[row_start] + queue[rows] + quantity
+        completing = np.searchsorted(cumulative, need, side="left")
+        level_ts = np.where(completing <= count, ts_tail[np.maximum(completing - 1, 0)], np.inf)
+
+        result[rows] = (np.minimum(through_ts, level_ts) - history.sample_ts[rows]) / 1e9
+    return result
+
+
+def estimate(history: MarketHistory, timeouts: List[float], quantity: float) -> Dict[Tuple[int, float], Dict]:
+    """
+    估算每个 (档位, 挂单超时) 的成交概率和预期耗时（买卖两侧合并，A开仓挂买、平仓挂卖）
+
+    Args:
+        history: 行情数组
+        timeouts: 挂单超时列表（秒）
+        quantity: 挂单数量
+
+    Returns:
+        {(档位, 超时): {samples, fill_probability, mean_time_to_fill, expected_leg_seconds, edge_bps}}
+        expected_leg_seconds按超时后重挂、每次独立计算：平均成交耗时 + 超时 * (1 - p) / p
+    """
+    results = {}
+    for column, depth in enumerate(history.depths):
+        times = np.concatenate((
+            fill_times(history, column, True, quantity),
+            fill_times(history, column, False, quantity)
+        ))
+        edge = np.concatenate((
+            (history.mid - history.bid_price[:, column]) / history.mid,
+            (history.ask_price[:, column] - history.mid) / history.mid
+        )) * 1e4
+        valid = ~np.isnan(times)
+        times, edge = times[valid], edge[valid]
+        for timeout in timeouts:
+            filled = times <= timeout
+            probability = float(filled.mean()) if len(times) else 0.0
+            mean_time = float(times[filled].mean()) if filled.any() else math.inf
+            expected_leg = mean_time + timeout * (1 - probability) / probability if probability > 0 else math.inf
+            results[(depth, timeout)] = {
+                "samples": int(len(times)),
+                "fill_probability": probability,
+                "mean_time_to_fill": mean_time,
+                "expected_leg_seconds": expected_leg,
+                "edge_bps": float(edge.mean()) if len(edge) else 0.0,
+            }
+    return results
+
+
+def choose_depth(estimates: Dict[Tuple[int, float], Dict], timeout: float, hedge_cost_bps: float,
+                 max_leg_seconds: float) -> Optional[int]:
+    """
+    选出单位时间净收益最高的档位
+
+    Args:
+        estimates: estimate()的结果
+        timeout: 当前使用的挂单超时
+        hedge_cost_bps: 对冲成本（基点）
+        max_leg_seconds: 预期单腿耗时上限（秒）
+
+    Returns:
+        档位；没有满足条件的档位时返回None
+    """
+    best_depth, best_score = None, -math.inf
+    for (depth, candidate_timeout), stats in estimates.items():
+        if candidate_timeout != timeout or stats["expected_leg_seconds"] > max_leg_seconds:
+            continue
+        score = (stats["edge_bps"] - hedge_cost_bps) / stats["expected_leg_seconds"]
+        if score > best_score:
+            best_depth, best_score = depth, score
+    return best_depth
+
+
+class DepthSelector:
+    """自适应挂单档位：后台定期用最近的录制数据重新估算，查询只读内存"""
+
+    def __init__(self, capture_dir: str, market_index: int, default_depth: int, depths: List[int],
+                 maker_order_time_out: float, quantity: float, lookback_hours: float = 24,
+                 refresh_interval: float = 600, sample_interval: float = 1.0,
+                 hedge_cost_bps: float = 2.0, max_leg_seconds: float = 120):
+        """
+        初始化档位选择器
+
+        Args:
+            capture_dir: 录制根目录
+            market_index: 市场索引
+            default_depth: 估算结果不可用时使用的档位（命令行--depth）
+            depths: 候选档位
+            maker_order_time_out: 挂单超时（秒）
+            quantity: 挂单数量
+            lookback_hours: 估算使用的历史时长（小时）
+            refresh_interval: 重新估算间隔（秒）
+            sample_interval: 采样间隔（秒）
+            hedge_cost_bps: 对冲成本（B市价单手续费+滑点，基点）
+            max_leg_seconds: 预期单腿耗时上限（秒）
+        """
+        self.capture_dir = capture_dir
+        self.market_index = market_index
+        self.default_depth = default_depth
+        self.depths = list(depths)
+        self.maker_order_time_out = maker_order_time_out
+        self.quantity = quantity
+        self.lookback_hours = lookback_hours
+        self.refresh_interval = refresh_interval
+        self.sample_interval = sample_interval
+        self.hedge_cost_bps = hedge_cost_bps
+        self.max_leg_seconds = max_leg_seconds
+
+        self.depth = default_depth
+        self.estimates: Dict[Tuple[int, float], Dict] = {}
+        self.refreshed_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def select(self) -> int:
+        """当前挂单档位"""
+        return self.depth
+
+    def refresh(self):
+        """用最近lookback_hours的录制数据重新估算（同步，耗时操作，在线程中调用）"""
+        end_ns = time.time_ns()
+        start_ns = end_ns - int(self.lookback_hours * 3600 * 1e9)
+        history = load_history(
+            self.capture_dir, self.market_index, self.depths, self.sample_interval, start_ns, end_ns
+        )
+        estimates = estimate(history, [self.maker_order_time_out], self.quantity)
+        depth = choose_depth(estimates, self.maker_order_time_out, self.hedge_cost_bps, self.max_leg_seconds)
+        self.estimates = estimates
+        self.refreshed_at = time.time()
+
+        if depth is None:
+            logging.warning(
+                f"📐 没有满足条件的挂单档位（样本{history.sample_count}，成交{history.trade_count}），"
+                f"使用默认档位{self.default_depth}"
+            )
+            depth = self.default_depth
+        elif depth != self.depth:
+            logging.info(f"📐 挂单档位调整: {self.depth} -> {depth}")
+        self.depth = depth
+        for line in self.summary().splitlines():
+            logging.info(line)
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logging.error(f"挂单档位估算失败: {e}", exc_info=True)
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """启动后台估算任务（必须在事件循环线程中调用）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    def stop(self):
+        """停止后台估算任务"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def summary(self) -> str:
+        """返回各档位估算摘要"""
+        lines = [f"挂单档位估算（timeout={self.maker_order_time_out}s, 当前档位={self.depth}）:"]
+        for (depth, _), stats in sorted(self.estimates.items()):
+            lines.append(
+                f"  档位{depth}: 成交概率={stats['fill_probability']:.1%}, "
+                f"平均成交耗时={stats['mean_time_to_fill']:.1f}s, 预期单腿耗时={stats['expected_leg_seconds']:.1f}s, "
+                f"距中间价={stats['edge_bps']:.2f}bps, 样本={stats['samples']}"
+            )
+        return "\n".join(lines)
+
+
+def start_depth_selector(config: Optional[Dict], market_index: int, default_depth: int,
+                         maker_order_time_out: float, quantity: float) -> Optional[DepthSelector]:
+    """
+    按配置启动自适应挂单档位（未配置或enabled为false时返回None；必须在事件循环线程中调用）
+
+    Args:
+        config: 配置中的depth_selector段
+        market_index: 市场索引
+        default_depth: 默认档位（命令行--depth）
+        maker_order_time_out: 挂单超时（秒）
+        quantity: 挂单数量
+
+    Returns:
+        档位选择器
+    """
+    config = config or {}
+    if not config.get("enabled", False):
+        return None
+    if np is None:
+        logging.error("自适应挂单档位需要numpy（pip install numpy），使用固定档位")
+        return None
+    selector = DepthSelector(
+        capture_dir=config.get("capture_dir", "captures"),
+        market_index=market_index,
+        default_depth=default_depth,
+        depths=config.get("depths", [1, 2, 3, 4, 5]),
+        maker_order_time_out=maker_order_time_out,
+        quantity=float(quantity),
+        lookback_hours=config.get("lookback_hours", 24),
+        refresh_interval=config.get("refresh_interval", 600),
+        sample_interval=config.get("sample_interval", 1.0),
+        hedge_cost_bps=config.get("hedge_cost_bps", 2.0),
+        max_leg_seconds=config.get("max_leg_seconds", 120)
+    )
+    selector.start()
+    logging.info(f"📐 自适应挂单档位已启用: 候选档位={selector.depths}, 默认档位={default_depth}")
+    return selector
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="挂单成交概率分析")
+    parser.add_argument("--capture", type=str, default="captures", help="录制根目录")
+    parser.add_argument("--market-index", type=int, required=True, help="市场索引（录制目录名）")
+    parser.add_argument("--quantity", type=float, required=True, help="挂单数量")
+    parser.add_argument("--depths", type=str, default="1,2,3,4,5", help="分析的档位，逗号分隔")
+    parser.add_argument("--timeouts", type=str, default="10,30,60", help="分析的挂单超时（秒），逗号分隔")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="采样间隔（秒）")
+    parser.add_argument("--hedge-cost-bps", type=float, default=2.0, help="对冲成本（基点）")
+    parser.add_argument("--max-leg-seconds", type=float, default=120, help="预期单腿耗时上限（秒）")
+    parser.add_argument("--start", type=str, help="起始时间（ISO格式，UTC）")
+    parser.add_argument("--end", type=str, help="结束时间（ISO格式，UTC）")
+    args = parser.parse_args()
+
+    depths = [int(d) for d in args.depths.split(",")]
+    timeouts = [float(t) for t in args.timeouts.split(",")]
+    started = time.monotonic()
+    history = load_history(
+        args.capture, args.market_index, depths, args.sample_interval,
+        parse_time(args.start), parse_time(args.end)
+    )
+    loaded = time.monotonic()
+    estimates = estimate(history, timeouts, args.quantity)
+    elapsed = time.monotonic() - loaded
+
+    print("=" * 60)
+    print(f"样本{history.sample_count}个，成交{history.trade_count}笔，"
+          f"加载{loaded - started:.1f}秒，估算{elapsed:.2f}秒")
+    for timeout in timeouts:
+        best = choose_depth(estimates, timeout, args.hedge_cost_bps, args.max_leg_seconds)
+        print(f"timeout={timeout}s（推荐档位: {best}）")
+        for depth in depths:
+            stats = estimates[(depth, timeout)]
+            print(
+                f"  档位{depth}: 成交概率={stats['fill_probability']:.1%}, "
+                f"平均成交耗时={stats['mean_time_to_fill']:.1f}s, 预期单腿耗时={stats['expected_leg_seconds']:.1f}s, "
+                f"距中间价={stats['edge_bps']:.2f}bps"
+            )
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    main()
@@ -0,0 +1,305 @@
+"""
+B账户对冲聚合器
+A账户的限价单可能分多笔成交，每笔都会发来成交通知。聚合器按A的order_index累计部分成交：
+- 累计数量达到触发阈值（不低于市场最小下单量）时立即对冲
+- 未达到阈值时最多等待max_delay秒，届时只要不低于最小下单量就对冲
+- 低于最小下单量、无法单独下单的数量记为残余，按(市场, 方向)并入下一次对冲
+- 成交消息带stream_id（Redis Stream传输）时，只有包含该成交的对冲成功后才回调确认
+- 对冲失败的数量记为残余后按指数退避定时重试，连续失败超过阈值时告警；
+  只在首次失败时通知一次（带重试计划），之后重试成功的对冲照常通知，A账户据此解除暂停
+"""
+
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from latency_tracker import extract_trace
+from metrics import HEDGE_RESIDUAL_RETRIES
+
+
+class HedgeAggregator:
+    """按A订单累计部分成交并合并对冲"""
+
+    def __init__(
+            self,
+            hedge_func: Callable[[Dict[str, Any]], Awaitable[None]],
+            on_order_closed: Callable[[int, int, Decimal], Awaitable[None]],
+            min_base_amount: Decimal = Decimal(0),
+            batch_size: Decimal = Decimal(0),
+            max_delay: float = 0.5,
+            on_hedged: Optional[Callable[[List[str]], None]] = None,
+            retry_delay: float = 1.0,
+            max_retry_delay: float = 60.0,
+            alert_after: int = 3,
+            on_hedge_failed: Optional[Callable[[Dict[str, Any], float], Awaitable[None]]] = None
+    ):
+        """
+        初始化聚合器
+
+        Args:
+            hedge_func: 执行对冲的协程函数，参数为成交消息格式的字典（失败时抛异常）
+            on_order_closed: A订单全部成交但剩余数量低于最小下单量、未下单时的回调
+                             (market_index, a_order_index, 残余数量)
+            min_base_amount: 市场最小下单量
+            batch_size: 触发对冲的累计数量（小于min_base_amount时按min_base_amount）
+            max_delay: 未达到触发数量时的最长等待（秒）
+            on_hedged: 成交已对冲（或无需对冲）时的回调，参数为这些成交消息的stream_id列表
+            retry_delay: 对冲失败残余的首次重试等待（秒），连续失败时翻倍
+            max_retry_delay: 残余重试等待上限（秒）
+            alert_after: 残余连续重试失败达到该次数后告警
+            on_hedge_failed: 对冲首次失败时的回调 (失败的对冲消息, 下次重试等待秒数)；
+                             重试期间再次失败不重复回调
+        """
+        self.hedge_func = hedge_func
+        self.on_order_closed = on_order_closed
+        self.min_base_amount = Decimal(str(min_base_amount))
+        self.threshold = max(self.min_base_amount, Decimal(str(batch_size)))
+        self.max_delay = max_delay
+        self.on_hedged = on_hedged
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.alert_after = alert_after
+        self.on_hedge_failed = on_hedge_failed
+
+        # A order_index -> 累计中的成交
+        self.buckets: Dict[int, Dict[str, Any]] = {}
+        # (market_index, side) -> [残余数量, 残余成交额, 残余对应成交的stream_id]
+        self.residual: Dict[Tuple[int, str], list] = {}
+        self._locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+        # (market_index, side) -> 对冲失败残余的重试状态 {message, attempts, timer}
+        self._retries: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        self._tasks = set()  # 定时器触发的对冲任务
+
+        self.fills_received = 0
+        self.hedges_sent = 0
+
+    async def add_fill(self, message: Dict[str, Any]):
+        """
+        接收一笔A账户成交通知
+
+        Args:
+            message: A账户成交消息（filled_base_amount为本笔成交量，is_final表示A订单已全部成交；
+                     不带is_final的消息视为独立完整成交）
+        """
+        order_index = message.get("order_index")
+        size = Decimal(str(message["filled_base_amount"]))
+        price = Decimal(str(message["avg_price"]))
+        is_final = message.get("is_final", True)
+        self.fills_received += 1
+
+        bucket = self.buckets.get(order_index)
+        if bucket is None:
+            bucket = {
+                "order_index": order_index,
+                "market_index": message["market_index"],
+                "side": message.get("side", "buy"),
+                "size": Decimal(0),
+                "quote": Decimal(0),
+                "trace": extract_trace(message),  # 延迟追踪以第一笔成交为准
+                "message": message,
+                "ack_ids": [],
+                "timer": None,
+            }
+            self.buckets[order_index] = bucket
+        bucket["size"] += size
+        bucket["quote"] += size * price
+        bucket["message"] = message
+        if message.get("stream_id"):
+            bucket["ack_ids"].append(message["stream_id"])
+        if not bucket["trace"]:
+            bucket["trace"] = extract_trace(message)
+
+        logging.info(
+            f"累计A订单{order_index}成交: 本笔={size}, 待对冲={bucket['size']}, "
+            f"阈值={self.threshold}, 最终={is_final}"
+        )
+
+        if is_final:
+            await self._flush(order_index, final=True)
+        elif bucket["size"] + self._residual_size(bucket) >= self.threshold:
+            await self._flush(order_index)
+        elif bucket["timer"] is None:
+            bucket["timer"] = asyncio.get_running_loop().call_later(
+                self.max_delay, lambda: self._spawn(self._flush(order_index, timed_out=True))
+            )
+
+    def _spawn(self, coro):
+        """在事件循环上启动任务并保留引用，完成后移除"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _residual_size(self, bucket: Dict[str, Any]) -> Decimal:
+        return self.residual.get((bucket["market_index"], bucket["side"]), [Decimal(0)])[0]
+
+    async def _flush(self, order_index: int, final: bool = False, timed_out: bool = False):
+        """
+        对冲某个A订单累计的成交
+
+        Args:
+            order_index: A订单索引
+            final: A订单已全部成交，对冲后关闭
+            timed_out: 等待超时触发
+        """
+        bucket = self.buckets.get(order_index)
+        if bucket is None:
+            return
+        key = (bucket["market_index"], bucket["side"])
+        lock = self._locks.setdefault(key, asyncio.Lock())
+
+        async with lock:
+            bucket = self.buckets.get(order_index)
+            if bucket is None:
+                return
+            if bucket["timer"] is not None:
+                bucket["timer"].cancel()
+                bucket["timer"] = None
+
+            # 取出累计量后移除，对冲期间到达的新成交会重新累计
+            del self.buckets[order_index]
+            residual_size, residual_quote, residual_ids = self.residual.pop(key, [Decimal(0), Decimal(0), []])
+            size = bucket["size"] + residual_size
+            quote = bucket["quote"] + residual_quote
+            ack_ids = residual_ids + bucket["ack_ids"]
+            trace = bucket["trace"]
+
+            if size == 0:
+                self._ack(ack_ids)
+                if final:
+                    await self.on_order_closed(bucket["market_index"], order_index, Decimal(0))
+                return
+
+            if size < self.min_base_amount:
+                # 低于最小下单量，记为残余，等同方向的下一笔成交一起对冲
+                self.residual[key] = [size, quote, ack_ids]
+                logging.info(f"A订单{order_index}待对冲{size}低于最小下单量{self.min_base_amount}，记为残余")
+                if final:
+                    await self.on_order_closed(bucket["market_index"], order_index, size)
+                return
+
+            hedge_message = dict(bucket["message"])
+            hedge_message.update({
+                "order_index": order_index,
+                "filled_base_amount": str(size),
+                "filled_quote_amount": str(quote),
+                "avg_price": str(quote / size),
+                "is_final": final,
+            })
+            hedge_message.update(trace)
+            reason = "订单完成" if final else ("等待超时" if timed_out else "达到阈值")
+            logging.info(f"🔀 合并对冲A订单{order_index}: 数量={size}（含残余{residual_size}），原因={reason}")
+
+            hedge_message.pop("stream_id", None)
+            await self._hedge(key, hedge_message, size, quote, ack_ids)
+
+    async def _hedge(self, key: Tuple[int, str], hedge_message: Dict[str, Any],
+                     size: Decimal, quote: Decimal, ack_ids: List[str]) -> bool:
+        """
+        发出对冲（调用方持有该(市场, 方向)的锁），失败时数量记为残余并安排重试
+
+        Returns:
+            是否对冲成功
+        """
+        try:
+            self.hedges_sent += 1
+            await self.hedge_func(hedge_message)
+        except Exception as e:
+            # 对冲失败（B已通知A暂停），数量记为残余，成交保持未确认
+            residual = self.residual.setdefault(key, [Decimal(0), Decimal(0), []])
+            residual[0] += size
+            residual[1] += quote
+            residual[2].extend(ack_ids)
+            logging.error(f"合并对冲失败，{size}记为未对冲残余: {e}")
+            retry_in = self._schedule_retry(key, hedge_message)
+            if self._retries[key]["attempts"] == 1 and self.on_hedge_failed is not None:
+                try:
+                    await self.on_hedge_failed(hedge_message, retry_in)
+                except Exception as notify_error:
+                    logging.error(f"对冲失败通知发送失败: {notify_error}")
+            return False
+        self._ack(ack_ids)
+        # 残余已随本次对冲发出，取消待执行的重试
+        retry = self._retries.pop(key, None)
+        if retry is not None and retry["timer"] is not None:
+            retry["timer"].cancel()
+        return True
+
+    def _schedule_retry(self, key: Tuple[int, str], hedge_message: Dict[str, Any]) -> float:
+        """
+        对冲失败后按指数退避安排残余重试
+
+        Args:
+            key: (market_index, side)
+            hedge_message: 失败的对冲消息（重试时沿用订单、方向等字段）
+
+        Returns:
+            距离下次重试的秒数
+        """
+        retry = self._retries.setdefault(key, {"message": None, "attempts": 0, "timer": None})
+        if retry["timer"] is not None:
+            retry["timer"].cancel()
+        retry["message"] = hedge_message
+        retry["attempts"] += 1
+        delay = min(self.retry_delay * 2 ** (retry["attempts"] - 1), self.max_retry_delay)
+        if retry["attempts"] >= self.alert_after:
+            logging.critical(
+                f"🚨 market={key[0]} {key[1]}方向对冲已连续失败{retry['attempts']}次，"
+                f"未对冲残余={self.residual[key][0]}，{delay:.0f}秒后重试，请检查B账户"
+            )
+        retry["timer"] = asyncio.get_running_loop().call_later(
+            delay, lambda: self._spawn(self._retry_residual(key))
+        )
+        return delay
+
+    async def _retry_residual(self, key: Tuple[int, str]):
+        """重试对冲失败的残余（期间已被新成交合并对冲时跳过）"""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            retry = self._retries.get(key)
+            if retry is None:
+                return
+            retry["timer"] = None
+            size = self.residual.get(key, [Decimal(0)])[0]
+            if not size or size < self.min_base_amount:
+                # 残余已被合并对冲，或不足最小下单量等待下一笔成交
+                self._retries.pop(key, None)
+                return
+
+            size, quote, ack_ids = self.residual.pop(key)
+            hedge_message = dict(retry["message"])
+            hedge_message.update({
+                "filled_base_amount": str(size),
+                "filled_quote_amount": str(quote),
+                "avg_price": str(quote / size),
+            })
+            logging.warning(f"🔁 重试对冲失败残余: market={key[0]} {key[1]} 数量={size}（第{retry['attempts']}次重试）")
+            success = await self._hedge(key, hedge_message, size, quote, ack_ids)
+            HEDGE_RESIDUAL_RETRIES.labels(result="success" if success else "failed").inc()
+
+    def _ack(self, ack_ids: List[str]):
+        """确认已对冲成交的stream_id"""
+        if ack_ids and self.on_hedged is not None:
+            self.on_hedged(ack_ids)
+
+    def residual_summary(self) -> str:
+        """返回未对冲残余和统计"""
+        residual = ", ".join(
+            f"market={m} {side}={size}" for (m, side), (size, *_) in self.residual.items() if size
+        ) or "无"
+        pending = sum((b["size"] for b in self.buckets.values()), Decimal(0))
+        return (
+            f"对冲聚合: 收到成交={self.fills_received}, 发出对冲={self.hedges_sent}, "
+            f"累计中={pending}, 残余: {residual}, 待重试={len(self._retries)}"
+        )
+
+    def stop(self):
+        """取消累计定时器和残余重试定时器"""
+        for bucket in self.buckets.values():
+            if bucket["timer"] is not None:
+                bucket["timer"].cancel()
+                bucket["timer"] = None
+        for retry in self._retries.values():
+            if retry["timer"] is not None:
+                retry["timer"].cancel()
+                retry["timer"] = None
@@ -0,0 +1,371 @@
+"""
+B账户对冲就绪
+收到A成交时，B原本要现算价格、生成client_order_index、签名市价单，连接也可能已经空闲变冷。就绪模式下：
+- 预先为"下一笔对冲"签好市价单模板：市场、方向（与上一笔对冲相反）、数量（A挂单数量或上一笔对冲数量）、
+  按参考价（本地订单簿中间价）加滑点算出的价格上限、client_order_index、nonce全部提前确定
+- 成交到达时数量和方向一致、A成交价与参考价偏离不超过price_tolerance，直接发送已签名的交易；否则释放模板
+  （nonce回退）按原流程现签
+- 空闲时定期发一次nextNonce（权重最低的端点）保持HTTP长连接，同时用作nonce对账；账户WebSocket由心跳线程保活
+
+模板占用的是签名客户端的下一个nonce，同一签名客户端只保留一个模板；模板的release()登记为nonce分配器的
+预留释放回调，该客户端任何其他交易（对冲现签、撤单、平仓）分配nonce前都会先收回模板的nonce，不留空洞
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+import weakref
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from rest_gateway import get_gateway
+from nonce_allocator import get_nonce_allocator
+from metrics import HEDGE_TEMPLATES
+
+# 与AccountBManager现签市价单相同的滑点容忍度
+SLIPPAGE_TOLERANCE = 0.05
+
+
+class HedgeReadiness:
+    """单个签名客户端的对冲就绪状态（预签名模板 + 连接保活）"""
+
+    def __init__(self, signer_client: lighter.SignerClient, keepalive_interval: float = 10,
+                 template_ttl: float = 30, price_tolerance: float = 0.002):
+        """
+        初始化对冲就绪
+
+        Args:
+            signer_client: B账户签名客户端
+            keepalive_interval: 空闲超过该时长发一次保活请求（秒）
+            template_ttl: 模板有效期，过期后重新签名（秒）
+            price_tolerance: A成交价与模板参考价的最大相对偏离
+        """
+        self.signer_client = signer_client
+        self.keepalive_interval = keepalive_interval
+        self.template_ttl = template_ttl
+        self.price_tolerance = Decimal(str(price_tolerance))
+        self.gateway = get_gateway()
+        self.nonce_allocator = get_nonce_allocator(signer_client)
+        self.nonce_allocator.add_reservation_hook(self.release)
+
+        # market_index -> 市场参数和下一笔对冲的预期
+        self.markets: Dict[int, Dict[str, Any]] = {}
+        self.active_market: Optional[int] = None
+        self.template: Optional[Dict[str, Any]] = None
+        self.last_activity = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+        self.prepared = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.keepalives = 0
+
+    def register_market(self, market_index: int, base_amount_multiplier: int, price_multiplier: int,
+                        order_book_feed=None, expected_base_amount=None):
+        """
+        登记需要预签名的市场
+
+        Args:
+            market_index: 市场索引
+            base_amount_multiplier: 数量乘数
+            price_multiplier: 价格乘数
+            order_book_feed: 本地订单簿（提供参考价，可选）
+            expected_base_amount: 预期对冲数量（A挂单数量；None表示沿用上一笔对冲数量）
+        """
+        expected_amount = None
+        if expected_base_amount is not None:
+            expected_amount = int(float(expected_base_amount) * base_amount_multiplier)
+        self.markets[market_index] = {
+            "base_amount_multiplier": base_amount_multiplier,
+            "price_multiplier": price_multiplier,
+            "order_book_feed": order_book_feed,
+            "fixed_amount": expected_amount is not None,
+            "expected_amount": expected_amount,
+            # A先买开仓，B先卖
+            "expected_is_ask": True,
+            "last_price": None,
+        }
+        if self.active_market is None:
+            self.active_market = market_index
+        logging.info(f"对冲就绪已登记市场: market={market_index}, 预期数量={expected_amount}")
+
+    def unregister_market(self, market_index: int):
+        """注销市场，全部注销后停止"""
+        self.markets.pop(market_index, None)
+        if self.template is not None and self.template["market_index"] == market_index:
+            self.release()
+        if self.active_market == market_index:
+            self.active_market = next(iter(self.markets), None)
+        if not self.markets:
+            self.stop()
+
+    def start(self):
+        """启动模板维护和保活任务（必须在事件循环线程中调用）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logging.info(f"对冲就绪已启动: account={self.signer_client.account_index}, "
+                         f"保活间隔={self.keepalive_interval}s, 模板有效期={self.template_ttl}s")
+
+    def stop(self):
+        """停止任务并释放模板"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self.release()
+        logging.info(self.stats())
+
+    # ---------- 模板 ----------
+
+    def _reference_price(self, market: Dict[str, Any], market_index: int) -> Optional[Decimal]:
+        """参考价：本地订单簿中间价，没有时用上一笔A成交价"""
+        feed = market["order_book_feed"]
+        book = feed.get_book(market_index) if feed is not None else None
+        if book is not None:
+            best_bid, best_ask = book.best_bid(), book.best_ask()
+            if best_bid and best_ask:
+                return (Decimal(best_bid[0]) + Decimal(best_ask[0])) / 2
+        return market["last_price"]
+
+    def prepare(self) -> bool:
+        """
+        为活跃市场的下一笔对冲签名模板（同步执行，签名期间不会插入其他交易）
+
+        Returns:
+            是否生成了新模板
+        """
+        if self.template is not None or self.active_market is None:
+            return False
+        market_index = self.active_market
+        market = self.markets.get(market_index)
+        if market is None or not market["expected_amount"]:
+            return False
+        # 有在途交易时不占用nonce，等确认后再签
+        if self.nonce_allocator.in_flight_count() > 0:
+            return False
+        reference_price = self._reference_price(market, market_index)
+        if reference_price is None:
+            return False
+
+        is_ask = market["expected_is_ask"]
+        base_price = int(reference_price * market["price_multiplier"])
+        if is_ask:
+            price = int(base_price * (1 - SLIPPAGE_TOLERANCE))
+        else:
+            price = int(base_price * (1 + SLIPPAGE_TOLERANCE))
+        client_order_index = int(time.time() * 1000) + random.randint(1, 999)
+
+        api_key_index, nonce = self.nonce_allocator.next_nonce(reserve=True)
+        try:
+            tx_info, error = self.signer_client.sign_create_order(
+                market_index=market_index,
+                client_order_index=client_order_index,
+                base_amount=market["expected_amount"],
+                price=price,
+                is_ask=is_ask,
+                order_type=lighter.SignerClient.ORDER_TYPE_MARKET,
+                time_in_force=lighter.SignerClient.ORDER_TIME_IN_FORCE_IMMEDIATE_OR_CANCEL,
+                reduce_only=False,
+                trigger_price=0,
+                order_expiry=getattr(lighter.SignerClient, "DEFAULT_IOC_EXPIRY", 0),
+                nonce=nonce
+            )
+        except Exception as e:
+            error = str(e)
+        if error is not None:
+            self.nonce_allocator.release(api_key_index, nonce)
+            logging.warning(f"预签名对冲单失败: {error}")
+            return False
+
+        self.template = {
+            "market_index": market_index,
+            "client_order_index": client_order_index,
+            "base_amount": market["expected_amount"],
+            "price": price,
+            "is_ask": is_ask,
+            "reference_price": reference_price,
+            "api_key_index": api_key_index,
+            "nonce": nonce,
+            "tx_type": lighter.SignerClient.TX_TYPE_CREATE_ORDER,
+            "tx_info": tx_info,
+            "signed_at": time.monotonic(),
+        }
+        self.prepared += 1
+        logging.debug(f"已预签名对冲单: market={market_index}, is_ask={is_ask}, amount={market['expected_amount']}, "
+                      f"price={price}, nonce={nonce}")
+        return True
+
+    def claim(self, market_index: int, base_amount: int, is_ask: bool,
+              avg_price: Decimal) -> Optional[Dict[str, Any]]:
+        """
+        取出可直接发送的模板；不匹配时释放模板（nonce回退），调用方随后现签
+
+        Args:
+            market_index: 市场索引
+            base_amount: 对冲数量（整数）
+            is_ask: B下单方向
+            avg_price: A成交均价
+
+        Returns:
+            模板；没有可用模板时返回None
+        """
+        template = self.template
+        if template is None:
+            return None
+        self.template = None
+        usable = (
+            template["market_index"] == market_index
+            and template["base_amount"] == base_amount
+            and template["is_ask"] == is_ask
+            and time.monotonic() - template["signed_at"] < self.template_ttl
+            and avg_price > 0
+            and abs(avg_price - template["reference_price"]) / avg_price <= self.price_tolerance
+            and self.nonce_allocator.is_latest(template["api_key_index"], template["nonce"])
+        )
+        if usable:
+            self.hits += 1
+            HEDGE_TEMPLATES.labels(result="hit").inc()
+            return template
+        self.misses += 1
+        HEDGE_TEMPLATES.labels(result="miss").inc()
+        self.nonce_allocator.release(template["api_key_index"], template["nonce"])
+        logging.info(f"预签名对冲单不匹配，现签: 模板(market={template['market_index']}, amount={template['base_amount']}, "
+                     f"is_ask={template['is_ask']}, 参考价={template['reference_price']}) "
+                     f"实际(market={market_index}, amount={base_amount}, is_ask={is_ask}, 均价={avg_price})")
+        return None
+
+    def release(self):
+        """释放模板占用的nonce（现签交易之前调用）"""
+        template = self.template
+        if template is None:
+            return
+        self.template = None
+        self.nonce_allocator.release(template["api_key_index"], template["nonce"])
+
+    async def send(self, template: Dict[str, Any]) -> Tuple[Optional[str], Any, Optional[str]]:
+        """
+        发送预签名交易
+
+        Args:
+            template: claim()取出的模板
+
+        Returns:
+            (tx_info, 响应, 错误信息)，与SDK create_market_order的返回一致
+        """
+        self.last_activity = time.monotonic()
+        transaction_api = self.gateway.transaction_api(self.signer_client.api_client)
+        try:
+            resp = await self.gateway.request(
+                "send_tx",
+                transaction_api.send_tx,
+                coalesce=False,
+                tx_type=template["tx_type"],
+                tx_info=template["tx_info"]
+            )
+        except Exception as e:
+            # 发送失败（包括invalid nonce，由调用方再同步）时nonce未被消耗
+            self.nonce_allocator.release(template["api_key_index"], template["nonce"])
+            return None, None, str(e)
+        if getattr(resp, "code", 200) != 200:
+            self.nonce_allocator.release(template["api_key_index"], template["nonce"])
+        return template["tx_info"], resp, None
+
+    def on_hedge_sent(self, market_index: int, base_amount: int, is_ask: bool, avg_price: Decimal):
+        """
+        对冲单被接受后更新预期并尽快签下一笔模板
+
+        Args:
+            market_index: 市场索引
+            base_amount: 本次对冲数量（整数）
+            is_ask: 本次B下单方向
+            avg_price: 本次A成交均价
+        """
+        self.last_activity = time.monotonic()
+        market = self.markets.get(market_index)
+        if market is None:
+            return
+        market["expected_is_ask"] = not is_ask
+        market["last_price"] = avg_price
+        if not market["fixed_amount"]:
+            market["expected_amount"] = base_amount
+        self.active_market = market_index
+        if self._task is not None and not self._task.done():
+            # call_soon在独立的上下文副本中执行，不影响当前协程记录的nonce
+            asyncio.get_running_loop().call_soon(self.prepare)
+
+    # ---------- 后台维护 ----------
+
+    async def _run(self):
+        """模板过期重签、空闲保活"""
+        while True:
+            try:
+                await asyncio.sleep(1)
+                template = self.template
+                if template is not None and time.monotonic() - template["signed_at"] >= self.template_ttl:
+                    self.expired += 1
+                    HEDGE_TEMPLATES.labels(result="expired").inc()
+                    self.release()
+                if self.template is None:
+                    self.prepare()
+                if time.monotonic() - self.last_activity >= self.keepalive_interval:
+                    await self._keepalive()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.warning(f"对冲就绪维护失败: {e}")
+
+    async def _keepalive(self):
+        """nextNonce保活（同时对账nonce）"""
+        self.last_activity = time.monotonic()
+        api_key_index = self.signer_client.api_key_index
+        transaction_api = self.gateway.transaction_api(self.signer_client.api_client)
+        result = await self.gateway.request(
+            "next_nonce",
+            transaction_api.next_nonce,
+            account_index=self.signer_client.account_index,
+            api_key_index=api_key_index
+        )
+        self.nonce_allocator.observe_server_nonce(api_key_index, int(result.nonce))
+        self.keepalives += 1
+
+    def stats(self) -> str:
+        """返回统计"""
+        return (f"对冲就绪: 预签名={self.prepared}, 命中={self.hits}, 未命中={self.misses}, "
+                f"过期={self.expired}, 保活={self.keepalives}")
+
+
+_readiness: "weakref.WeakKeyDictionary[Any, HedgeReadiness]" = weakref.WeakKeyDictionary()
+
+
+def start_hedge_readiness(config: Optional[Dict], signer_client: lighter.SignerClient) -> Optional[HedgeReadiness]:
+    """
+    按配置启动签名客户端的对冲就绪（未配置或enabled为false时返回None；同一客户端重复调用返回同一个实例；
+    必须在事件循环线程中调用）
+
+    Args:
+        config: 配置中的hedge_readiness段（enabled, keepalive_interval, template_ttl, price_tolerance）
+        signer_client: B账户签名客户端
+
+    Returns:
+        对冲就绪
+    """
+    config = config or {}
+    if not config.get("enabled", False):
+        return None
+    readiness = _readiness.get(signer_client)
+    if readiness is None:
+        readiness = HedgeReadiness(
+            signer_client,
+            keepalive_interval=config.get("keepalive_interval", 10),
+            template_ttl=config.get("template_ttl", 30),
+            price_tolerance=config.get("price_tolerance", 0.002)
+        )
+        _readiness[signer_client] = readiness
+    readiness.start()
+    return readiness
@@ -0,0 +1,236 @@
+"""
+进程内共享的HTTP连接池
+lighter SDK的每个ApiClient（包括SignerClient内部的）各自创建aiohttp会话和连接器，同一host的连接互不复用，
+对冲路径上的请求经常要重新做TCP+TLS握手。这里统一：
+- 一个调优过的TCPConnector（keep-alive、DNS缓存、总连接数和单host并发连接上限），所有ApiClient的会话都建在它上面，
+  A/B两个SignerClient和只读查询共用同一批长连接；SSL按ApiClient的Configuration（verify_ssl、ssl_ca_cert、
+  cert_file/key_file）构建，与SDK自带的rest客户端一致，SSL配置不同的客户端各用一个连接器
+- 按host缓存只读查询用的ApiClient（不再每个进程为同一host单独new一个）
+- TraceConfig统计新建/复用连接次数、建连耗时（TCP+TLS）、DNS缓存命中，同时导出为Prometheus指标
+aiohttp不做HTTP pipelining，单host并发由limit_per_host限制；TCP_NODELAY由aiohttp在连接建立时默认开启
+"""
+
+import asyncio
+import logging
+import os
+import ssl
+import sys
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from metrics import HTTP_CONNECTIONS, HTTP_CONNECT_LATENCY, HTTP_DNS_CACHE
+
+
+class HttpPool:
+    """共享连接器 + 按host缓存的ApiClient（进程内共享）"""
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 32, keepalive_timeout: float = 60,
+                 dns_cache_ttl: int = 300):
+        """
+        初始化连接池
+
+        Args:
+            limit: 总连接数上限
+            limit_per_host: 单host并发连接上限
+            keepalive_timeout: 空闲连接保持时长（秒）
+            dns_cache_ttl: DNS缓存有效期（秒）
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+
+        # SSL配置 -> 连接器（通常所有客户端配置相同，只有一个）
+        self.connectors: Dict[Tuple, aiohttp.TCPConnector] = {}
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_connection_create_start.append(self._on_connection_create_start)
+        self.trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        self.trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        self.trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        self.trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+
+        self._api_clients: Dict[str, lighter.ApiClient] = {}
+        self._attached: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.connect_seconds = 0.0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    @staticmethod
+    def _ssl_key(configuration: Any) -> Tuple:
+        """ApiClient配置中决定SSL行为的字段"""
+        return (
+            getattr(configuration, "verify_ssl", True),
+            getattr(configuration, "ssl_ca_cert", None),
+            getattr(configuration, "ca_cert_data", None),
+            getattr(configuration, "cert_file", None),
+            getattr(configuration, "key_file", None),
+        )
+
+    @staticmethod
+    def _ssl_context(configuration: Any) -> ssl.SSLContext:
+        """
+        按ApiClient配置构建SSL上下文（与SDK rest客户端的构建方式一致）
+
+        Args:
+            configuration: lighter.Configuration（None时使用默认校验）
+        """
+        verify_ssl, ca_cert, ca_cert_data, cert_file, key_file = HttpPool._ssl_key(configuration)
+        ssl_context = ssl.create_default_context(cafile=ca_cert, cadata=ca_cert_data)
+        if cert_file:
+            ssl_context.load_cert_chain(cert_file, keyfile=key_file)
+        if not verify_ssl:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        return ssl_context
+
+    def _get_connector(self, configuration: Any = None) -> aiohttp.TCPConnector:
+        """
+        获取SSL配置对应的共享连接器（首次调用时创建，必须在事件循环中调用）
+
+        Args:
+            configuration: ApiClient的配置
+        """
+        key = self._ssl_key(configuration)
+        connector = self.connectors.get(key)
+        if connector is None or connector.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                enable_cleanup_closed=True,
+                ssl=self._ssl_context(configuration)
+            )
+            self.connectors[key] = connector
+        return connector
+
+    async def attach(self, api_client: Any):
+        """
+        把ApiClient的会话换成建在共享连接器上的会话（SDK自建的会话和连接器随即关闭）
+
+        Args:
+            api_client: lighter.ApiClient（SignerClient.api_client 或 ApiClient）
+        """
+        rest_client = getattr(api_client, "rest_client", None)
+        if rest_client is None or not hasattr(rest_client, "pool_manager") or api_client in self._attached:
+            return
+        if getattr(rest_client, "retry_client", None) is not None:
+            # 开启了SDK重试的客户端内部引用原会话，保持原样
+            logging.debug("ApiClient启用了retries，不接入共享连接池")
+            return
+
+        old_session = rest_client.pool_manager
+        rest_client.pool_manager = aiohttp.ClientSession(
+            connector=self._get_connector(getattr(api_client, "configuration", None)),
+            connector_owner=False,
+            trust_env=True,
+            trace_configs=[self.trace_config]
+        )
+        self._attached.add(api_client)
+        if old_session is not None and not old_session.closed:
+            await old_session.close()
+
+    async def api_client(self, host: str) -> lighter.ApiClient:
+        """
+        获取host对应的共享ApiClient（只读查询用，由连接池负责关闭）
+
+        Args:
+            host: REST地址
+
+        Returns:
+            ApiClient
+        """
+        api_client = self._api_clients.get(host)
+        if api_client is None:
+            api_client = lighter.ApiClient(configuration=lighter.Configuration(host=host))
+            self._api_clients[host] = api_client
+            await self.attach(api_client)
+        return api_client
+
+    async def close(self):
+        """关闭缓存的ApiClient和共享连接器"""
+        for api_client in self._api_clients.values():
+            try:
+                await api_client.close()
+            except Exception as e:
+                logging.debug(f"关闭ApiClient失败: {e}")
+        self._api_clients.clear()
+        for connector in self.connectors.values():
+            if not connector.closed:
+                await connector.close()
+        self.connectors.clear()
+
+    async def _on_connection_create_start(self, session, context, params):
+        context.connect_start = asyncio.get_running_loop().time()
+
+    async def _on_connection_create_end(self, session, context, params):
+        elapsed = asyncio.get_running_loop().time() - getattr(context, "connect_start", 0.0)
+        self.connections_created += 1
+        self.connect_seconds += elapsed
+        HTTP_CONNECTIONS.labels(event="created").inc()
+        HTTP_CONNECT_LATENCY.observe(elapsed)
+
+    async def _on_connection_reuseconn(self, session, context, params):
+        self.connections_reused += 1
+        HTTP_CONNECTIONS.labels(event="reused").inc()
+
+    async def _on_dns_cache_hit(self, session, context, params):
+        self.dns_cache_hits += 1
+        HTTP_DNS_CACHE.labels(result="hit").inc()
+
+    async def _on_dns_cache_miss(self, session, context, params):
+        self.dns_cache_misses += 1
+        HTTP_DNS_CACHE.labels(result="miss").inc()
+
+    def stats(self) -> str:
+        """返回连接复用统计"""
+        total = self.connections_created + self.connections_reused
+        reuse_ratio = self.connections_reused / total if total else 0.0
+        avg_connect_ms = self.connect_seconds / self.connections_created * 1000 if self.connections_created else 0.0
+        return (f"HTTP连接池: 新建={self.connections_created}, 复用={self.connections_reused}, "
+                f"复用率={reuse_ratio:.1%}, 平均建连={avg_connect_ms:.1f}ms, "
+                f"DNS缓存 hit={self.dns_cache_hits}/miss={self.dns_cache_misses}, 会话={len(self._attached)}")
+
+
+_pool: Optional[HttpPool] = None
+
+
+def get_http_pool() -> HttpPool:
+    """获取进程内共享的HTTP连接池"""
+    global _pool
+    if _pool is None:
+        _pool = HttpPool()
+    return _pool
+
+
+def configure_http_pool(config: Optional[Dict[str, Any]]) -> HttpPool:
+    """
+    按配置初始化进程内共享的HTTP连接池
+
+    Args:
+        config: 配置中的http_pool段（可选）
+
+    Returns:
+        HTTP连接池
+    """
+    global _pool
+    config = config or {}
+    _pool = HttpPool(
+        limit=config.get('limit', 100),
+        limit_per_host=config.get('limit_per_host', 32),
+        keepalive_timeout=config.get('keepalive_timeout', 60),
+        dns_cache_ttl=config.get('dns_cache_ttl', 300)
+    )
+    logging.info(f"HTTP连接池已配置: limit={_pool.limit}, limit_per_host={_pool.limit_per_host}, "
+                 f"keepalive={_pool.keepalive_timeout}s")
+    return _pool
@@ -0,0 +1,245 @@
+"""
+对冲链路延迟追踪
+成交消息沿途携带各阶段的单调时钟时间戳（纳秒，同一主机上的进程间可比较）：
+  fill_received_ns  A账户WebSocket收到成交
+  published_ns      A账户把成交消息交给Redis/进程内传输
+  b_received_ns     B账户收到成交消息
+  hedge_submit_ns   B账户开始签名并提交对冲单
+  accepted_ns       对冲单被交易所接受（code=200）
+  confirmed_ns      对冲单成交确认
+B账户按相邻阶段记录到HDR风格的对数分桶直方图，定期输出到日志和Redis Hash
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import HEDGE_LATENCY
+
+# 追踪阶段（按链路顺序）
+STAGES: Tuple[str, ...] = (
+    "fill_received_ns",
+    "published_ns",
+    "b_received_ns",
+    "hedge_submit_ns",
+    "accepted_ns",
+    "confirmed_ns",
+)
+# 随成交消息跨进程传递的阶段
+MESSAGE_STAGES: Tuple[str, ...] = STAGES[:3]
+
+
+def stamp(message: Dict[str, Any], stage: str):
+    """
+    在消息上记录阶段时间戳（已存在时不覆盖）
+
+    Args:
+        message: 成交消息
+        stage: 阶段字段名
+    """
+    if stage not in message:
+        message[stage] = time.monotonic_ns()
+
+
+def extract_trace(message: Dict[str, Any]) -> Dict[str, int]:
+    """从成交消息中取出已记录的阶段时间戳"""
+    return {stage: message[stage] for stage in MESSAGE_STAGES if message.get(stage) is not None}
+
+
+def _stage_label(stage: str) -> str:
+    return stage[:-3] if stage.endswith("_ns") else stage
+
+
+class LatencyHistogram:
+    """
+    HDR风格的延迟直方图（线程安全）
+
+    按2的幂分段，每段再线性分成 2**sub_bucket_bits 个子桶，
+    任意取值的相对误差不超过 1/2**sub_bucket_bits，内存只与取值的数量级有关
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7):
+        """
+        初始化直方图
+
+        Args:
+            sub_bucket_bits: 每个2的幂区间内的子桶位数（7位约0.8%精度）
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.max_ns = 0
+        self._lock = threading.Lock()
+
+    def _index(self, value: int) -> int:
+        """取值 -> 桶编号（小于子桶数的值按原值精确计数）"""
+        shift = max(value.bit_length() - self.sub_bucket_bits - 1, 0)
+        return (shift << (self.sub_bucket_bits + 1)) | (value >> shift)
+
+    def _lowest(self, index: int) -> int:
+        """桶编号 -> 桶内最小取值"""
+        shift = index >> (self.sub_bucket_bits + 1)
+        return (index & ((1 << (self.sub_bucket_bits + 1)) - 1)) << shift
+
+    def record(self, value_ns: int):
+        """
+        记录一次耗时
+
+        Args:
+            value_ns: 耗时（纳秒，负值按0计）
+        """
+        value_ns = max(int(value_ns), 0)
+        index = self._index(value_ns)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            if value_ns > self.max_ns:
+                self.max_ns = value_ns
+
+    def percentiles(self, quantiles: Tuple[float, ...] = (0.5, 0.9, 0.99)) -> List[int]:
+        """
+        计算分位数（纳秒，取所在桶的下界）
+
+        Args:
+            quantiles: 分位点（0~1）
+
+        Returns:
+            与quantiles一一对应的取值
+        """
+        with self._lock:
+            items = sorted(self.counts.items())
+            total = self.count
+        if total == 0:
+            return [0 for _ in quantiles]
+        results = []
+        for q in quantiles:
+            target = max(1, int(total * q + 0.5))
+            seen = 0
+            for index, count in items:
+                seen += count
+                if seen >= target:
+                    results.append(self._lowest(index))
+                    break
+        return results
+
+    def snapshot(self) -> Dict[str, float]:
+        """返回统计快照（毫秒）"""
+        p50, p90, p99 = self.percentiles((0.5, 0.9, 0.99))
+        return {
+            "count": self.count,
+            "p50_ms": round(p50 / 1e6, 3),
+            "p90_ms": round(p90 / 1e6, 3),
+            "p99_ms": round(p99 / 1e6, 3),
+            "max_ms": round(self.max_ns / 1e6, 3),
+        }
+
+
+class LatencyTracker:
+    """按阶段统计对冲链路延迟"""
+
+    def __init__(self, name: str):
+        """
+        初始化追踪器
+
+        Args:
+            name: 名称（Redis Hash中的字段前缀）
+        """
+        self.name = name
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._export_task: Optional[asyncio.Task] = None
+
+    def _histogram(self, label: str) -> LatencyHistogram:
+        histogram = self.histograms.get(label)
+        if histogram is None:
+            histogram = self.histograms.setdefault(label, LatencyHistogram())
+        return histogram
+
+    def record(self, label: str, value_ns: int):
+        """
+        记录一个阶段的耗时
+
+        Args:
+            label: 阶段名称
+            value_ns: 耗时（纳秒）
+        """
+        self._histogram(label).record(value_ns)
+        HEDGE_LATENCY.labels(stage=label).observe(value_ns / 1e9)
+
+    def record_trace(self, trace: Dict[str, int]):
+        """
+        记录一次完整链路：相邻的已记录阶段之间各算一段，首尾再算一次总耗时
+
+        Args:
+            trace: 阶段字段名 -> 单调时钟时间（纳秒）
+        """
+        present = [stage for stage in STAGES if trace.get(stage) is not None]
+        for previous, current in zip(present, present[1:]):
+            self.record(f"{_stage_label(previous)}→{_stage_label(current)}", trace[current] - trace[previous])
+        if len(present) >= 2:
+            self.record(
+                f"total({_stage_label(present[0])}→{_stage_label(present[-1])})",
+                trace[present[-1]] - trace[present[0]]
+            )
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """返回各阶段的统计快照"""
+        return {label: histogram.snapshot() for label, histogram in list(self.histograms.items())}
+
+    def summary(self) -> str:
+        """返回多行统计摘要"""
+        snapshot = self.snapshot()
+        if not snapshot:
+            return f"{self.name}: 无数据"
+        lines = [f"{self.name}:"]
+        for label, stats in snapshot.items():
+            lines.append(
+                f"  {label}: count={stats['count']}, p50={stats['p50_ms']}ms, p90={stats['p90_ms']}ms, "
+                f"p99={stats['p99_ms']}ms, max={stats['max_ms']}ms"
+            )
+        return "\n".join(lines)
+
+    def start_export(self, redis_messenger, interval: float = 60):
+        """
+        启动定期导出（日志 + Redis Hash，必须在事件循环线程中调用）
+
+        Args:
+            redis_messenger: Redis消息管理器
+            interval: 导出间隔（秒）
+        """
+        if self._export_task is None or self._export_task.done():
+            self._export_task = asyncio.get_running_loop().create_task(
+                self._export_loop(redis_messenger, interval)
+            )
+
+    def stop(self):
+        """停止定期导出"""
+        if self._export_task and not self._export_task.done():
+            self._export_task.cancel()
+
+    def export(self, redis_messenger):
+        """
+        输出一次统计到日志和Redis
+
+        Args:
+            redis_messenger: Redis消息管理器
+        """
+        snapshot = self.snapshot()
+        if not snapshot:
+            return
+        logging.info(self.summary())
+        redis_messenger.update_latency_stats(
+            {f"{self.name}:{label}": json.dumps(stats) for label, stats in snapshot.items()}
+        )
+
+    async def _export_loop(self, redis_messenger, interval: float):
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                self.export(redis_messenger)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.warning(f"导出延迟统计失败: {e}")
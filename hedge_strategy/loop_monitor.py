@@ -0,0 +1,206 @@
+"""
+事件循环阻塞检测
+- 心跳协程按固定间隔sleep，实际唤醒时间超出预期的部分即调度延迟（导出到指标和直方图）
+- 看门狗线程检查心跳是否过期：事件循环被同步调用卡住超过阈值时，
+  周期性采样事件循环线程的调用栈，阻塞结束后按"阻塞点"（最内层的本项目代码行）汇总上报
+用于定位同步Redis写入、签名、JSON序列化等阻塞事件循环的调用，按累计阻塞时间排优先级
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from latency_tracker import LatencyHistogram
+from metrics import LOOP_LAG, LOOP_LAG_HISTOGRAM, LOOP_BLOCKS, LOOP_BLOCKED_SECONDS
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (文件名, 行号, 函数名, 源码)
+StackKey = Tuple[Tuple[str, int, str, str], ...]
+
+
+def _blocking_site(stack: StackKey) -> str:
+    """调用栈 -> 阻塞点（最内层的本项目代码，找不到时取最内层帧）"""
+    for filename, lineno, name, _ in reversed(stack):
+        if os.path.abspath(filename).startswith(_PROJECT_DIR):
+            return f"{os.path.basename(filename)}:{lineno} {name}"
+    filename, lineno, name, _ = stack[-1]
+    return f"{os.path.basename(filename)}:{lineno} {name}"
+
+
+class LoopMonitor:
+    """事件循环延迟监控和阻塞调用栈采样"""
+
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.1,
+                 sample_interval: float = 0.02, stack_depth: int = 15):
+        """
+        初始化监控
+
+        Args:
+            interval: 心跳间隔（秒）
+            block_threshold: 心跳过期超过该时长视为阻塞并开始采样调用栈（秒）
+            sample_interval: 看门狗检查/采样间隔（秒）
+            stack_depth: 每次采样保留的调用栈深度（最内层起）
+        """
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.sample_interval = sample_interval
+        self.stack_depth = stack_depth
+
+        self.lag_histogram = LatencyHistogram()
+        # 阻塞点 -> {count, total_seconds, max_seconds, stack}
+        self.blocking_sites: Dict[str, Dict[str, Any]] = {}
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动心跳协程和看门狗线程（必须在事件循环线程中调用）"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop_event.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat_loop())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logging.info(
+            f"🩺 事件循环监控已启动: 心跳间隔={self.interval}s, 阻塞阈值={self.block_threshold}s"
+        )
+
+    def stop(self):
+        """停止监控"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._stop_event.set()
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _heartbeat_loop(self):
+        """sleep实际耗时超出预期的部分即事件循环调度延迟"""
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(now - expected, 0.0)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
+            self.lag_histogram.record(int(lag * 1e9))
+
+    def _capture(self) -> Optional[StackKey]:
+        """采样事件循环线程当前的调用栈"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        return tuple(
+            (entry.filename, entry.lineno, entry.name, entry.line or "")
+            for entry in traceback.extract_stack(frame, limit=self.stack_depth)
+        )
+
+    def _watch(self):
+        """看门狗线程：心跳过期超过阈值时采样调用栈，心跳恢复后上报本次阻塞"""
+        samples: Counter = Counter()
+        blocked_for = 0.0
+        while not self._stop_event.wait(self.sample_interval):
+            stale = time.monotonic() - self._heartbeat - self.interval
+            if stale >= self.block_threshold:
+                stack = self._capture()
+                if stack:
+                    samples[stack] += 1
+                blocked_for = stale
+            elif samples:
+                self._report(samples, blocked_for)
+                samples = Counter()
+                blocked_for = 0.0
+
+    def _report(self, samples: Counter, blocked_for: float):
+        """
+        汇总并上报一次阻塞（按采样次数最多的调用栈归因）
+
+        Args:
+            samples: 调用栈 -> 采样次数
+            blocked_for: 观测到的阻塞时长（秒，精度为采样间隔）
+        """
+        stack, hits = samples.most_common(1)[0]
+        site = _blocking_site(stack)
+        LOOP_BLOCKS.labels(site=site).inc()
+        LOOP_BLOCKED_SECONDS.labels(site=site).inc(blocked_for)
+        with self._lock:
+            stats = self.blocking_sites.setdefault(
+                site, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "stack": stack}
+            )
+            stats["count"] += 1
+            stats["total_seconds"] += blocked_for
+            if blocked_for >= stats["max_seconds"]:
+                stats["max_seconds"] = blocked_for
+                stats["stack"] = stack
+
+        formatted = "".join(traceback.format_list(
+            [traceback.FrameSummary(filename, lineno, name, line=line) for filename, lineno, name, line in stack]
+        ))
+        logging.warning(
+            f"🐢 事件循环阻塞约{blocked_for * 1000:.0f}ms，阻塞点: {site} "
+            f"(采样{hits}/{sum(samples.values())})\n{formatted.rstrip()}"
+        )
+
+    def top_sites(self, limit: int = 10) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        按累计阻塞时间排序的阻塞点
+
+        Args:
+            limit: 返回数量
+
+        Returns:
+            [(阻塞点, {count, total_seconds, max_seconds, stack})]
+        """
+        with self._lock:
+            items = list(self.blocking_sites.items())
+        items.sort(key=lambda item: item[1]["total_seconds"], reverse=True)
+        return items[:limit]
+
+    def summary(self) -> str:
+        """返回多行统计摘要"""
+        lag = self.lag_histogram.snapshot()
+        lines = [
+            f"事件循环延迟: count={lag['count']}, p50={lag['p50_ms']}ms, p99={lag['p99_ms']}ms, max={lag['max_ms']}ms"
+        ]
+        for site, stats in self.top_sites():
+            lines.append(
+                f"  阻塞点 {site}: 次数={stats['count']}, 累计={stats['total_seconds'] * 1000:.0f}ms, "
+                f"最长={stats['max_seconds'] * 1000:.0f}ms"
+            )
+        return "\n".join(lines)
+
+
+def start_loop_monitor(config: Optional[Dict]) -> Optional[LoopMonitor]:
+    """
+    按配置启动事件循环监控（未配置时使用默认参数，enabled为false时返回None；必须在事件循环线程中调用）
+
+    Args:
+        config: 配置中的loop_monitor段（enabled, interval, block_threshold, sample_interval）
+
+    Returns:
+        事件循环监控
+    """
+    config = config or {}
+    if not config.get("enabled", True):
+        return None
+    monitor = LoopMonitor(
+        interval=config.get("interval", 0.1),
+        block_threshold=config.get("block_threshold", 0.1),
+        sample_interval=config.get("sample_interval", 0.02)
+    )
+    monitor.start()
+    return monitor
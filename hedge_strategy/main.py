@@ -1,6 +1,6 @@
 """
-跨账户对冲策略主程序
-A账户挂限价单，完全成交后通过Redis通知B账户市价对冲
+跨账户对冲策略主程序（单进程模式）
+A账户挂限价单，完全成交后通过进程内传输直接通知B账户市价对冲，Redis仅作为审计镜像
 """
 
 import sys
@@ -15,9 +15,17 @@ from decimal import Decimal
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
 
 import lighter
-from redis_messenger import RedisMessenger
+from redis_messenger import RedisMessenger, InProcessTransport
 from account_a_manager import AccountAManager
 from account_b_manager import AccountBManager
+from rest_gateway import configure_gateway, get_gateway
+from http_pool import configure_http_pool, get_http_pool
+from hedge_readiness import start_hedge_readiness
+from fill_analytics import start_depth_selector
+from loop_monitor import start_loop_monitor
+from metrics import start_metrics_server
+from auth_token_cache import get_auth_token_cache
+from nonce_allocator import get_nonce_allocator
 from utils import (
     load_config,
     get_market_index_by_name,
@@ -47,12 +55,17 @@ class HedgeStrategy:
         self.market_index = None
 
         self.redis_messenger = None
+        self.metrics_server = None
+        self.loop_monitor = None
+        self.depth_selector = None
+        self.transport = None
         self.client_a = None
         self.client_b = None
         self.account_a_manager = None
         self.account_b_manager = None
         self.base_amount_multiplier = None
         self.price_multiplier = None
+        self.min_base_amount = 0
 
         self.running = False
 
@@ -75,15 +88,31 @@ class HedgeStrategy:
             logging.info("加载配置文件...")
             self.config = load_config(self.config_path)
 
-            # 2. 初始化Redis
+            # 事件循环延迟/阻塞监控（阻塞超过阈值时采样调用栈）
+            self.loop_monitor = start_loop_monitor(self.config.get('loop_monitor'))
+
+            # 按配置初始化进程内共享的REST网关（限流、请求合并）
+            configure_gateway(self.config.get('rate_limit'))
+
+            # 进程内共享的HTTP连接池（所有ApiClient复用同一批长连接）
+            configure_http_pool(self.config.get('http_pool'))
+
+            # 指标端点（可选，运行在事件循环上）
+            self.metrics_server = await start_metrics_server(self.config.get('metrics'))
+
+            # 2. 初始化Redis（单进程模式下A/B消息走进程内传输，Redis只做审计镜像）
             logging.info("初始化Redis连接...")
             redis_config = self.config['redis']
+            self.transport = InProcessTransport()
+            self.transport.bind_loop(asyncio.get_running_loop())
             self.redis_messenger = RedisMessenger(
                 host=redis_config['host'],
                 port=redis_config['port'],
-                db=redis_config['db']
+                db=redis_config['db'],
+                transport=self.transport
             )
             self.redis_messenger.connect()
+            self.redis_messenger.configure_wire_format(redis_config.get('wire_format'))
 
             # 3. 初始化A账户客户端
             logging.info("初始化A账户...")
@@ -104,6 +133,16 @@ class HedgeStrategy:
                 account_index=account_b_config['account_index'],
                 api_key_index=account_b_config['api_key_index']
             )
+            await get_http_pool().attach(self.client_a.api_client)
+            await get_http_pool().attach(self.client_b.api_client)
+
+            # 启动认证token后台刷新（轮询时复用缓存token，不再每次签名）
+            get_auth_token_cache(self.client_a).start()
+            get_auth_token_cache(self.client_b).start()
+
+            # 接管nonce分配（本地递增，连续下单不必等待确认）
+            get_nonce_allocator(self.client_a).start()
+            get_nonce_allocator(self.client_b).start()
 
             # 5. 查询市场索引
             logging.info(f"查询市场索引: {self.market_name}...")
@@ -114,6 +153,7 @@ class HedgeStrategy:
             self.market_index = orderBook.market_id
             self.base_amount_multiplier = pow(10, orderBook.supported_size_decimals)
             self.price_multiplier = pow(10, orderBook.supported_price_decimals)
+            self.min_base_amount = orderBook.min_base_amount
 
             if self.market_index is None:
                 raise Exception(f"未找到市场: {self.market_name}")
@@ -131,6 +171,15 @@ class HedgeStrategy:
                 self.market_index
             )
 
+            # 按录制行情自适应挂单档位（未启用时固定使用--depth）
+            self.depth_selector = start_depth_selector(
+                self.config.get('depth_selector'),
+                self.market_index,
+                default_depth=self.depth,
+                maker_order_time_out=self.config['lighter']['maker_order_time_out'],
+                quantity=self.quantity
+            )
+
             # 7. 初始化A账户管理器
             logging.info("初始化A账户管理器...")
             self.account_a_manager = AccountAManager(
@@ -140,7 +189,8 @@ class HedgeStrategy:
                 market_index=self.market_index,
                 base_amount=self.quantity,
                 depth=self.depth,
-                poll_interval=self.config['strategy']['poll_interval']
+                poll_interval=self.config['strategy']['poll_interval'],
+                depth_selector=self.depth_selector
             )
 
             # 8. 初始化B账户管理器
@@ -149,17 +199,27 @@ class HedgeStrategy:
                 signer_client=self.client_b,
                 redis_messenger=self.redis_messenger,
                 account_index=account_b_config['account_index'],
-                retry_times=self.config['strategy']['retry_times']
+                base_amount_multiplier=self.base_amount_multiplier,
+                price_multiplier=self.price_multiplier,
+                retry_times=self.config['strategy']['retry_times'],
+                min_base_amount=self.min_base_amount,
+                hedge_batch_size=self.config['strategy'].get('hedge_batch_size', 0),
+                hedge_max_delay=self.config['strategy'].get('hedge_max_delay', 0.5),
+                latency_export_interval=self.config['strategy'].get('latency_export_interval', 60),
+                hedge_readiness=start_hedge_readiness(self.config.get('hedge_readiness'), self.client_b),
+                market_index=self.market_index,
+                hedge_template_amount=self.quantity
             )
+            self.account_b_manager.set_event_loop(asyncio.get_running_loop())
 
-            # 9. 设置Redis订阅
-            logging.info("设置Redis订阅...")
+            # 9. 设置进程内订阅（对冲直接在事件循环上派发）
+            logging.info("设置进程内订阅...")
             self.redis_messenger.subscribe(
-                RedisMessenger.CHANNEL_A_FILLED,
-                self.account_b_manager.on_a_account_filled
+                self.redis_messenger.CHANNEL_A_FILLED,
+                self.account_b_manager.handle_a_filled
             )
             self.redis_messenger.subscribe(
-                RedisMessenger.CHANNEL_B_FILLED,
+                self.redis_messenger.CHANNEL_B_FILLED,
                 self.account_a_manager.on_b_account_filled
             )
             self.redis_messenger.start_listening()
@@ -247,6 +307,16 @@ class HedgeStrategy:
             if self.redis_messenger:
                 self.redis_messenger.close()
 
+            # 停止认证token刷新
+            for client in (self.client_a, self.client_b):
+                if client:
+                    token_cache = get_auth_token_cache(client)
+                    token_cache.stop()
+                    logging.info(token_cache.stats())
+                    nonce_allocator = get_nonce_allocator(client)
+                    nonce_allocator.stop()
+                    logging.info(nonce_allocator.stats())
+
             # 关闭API客户端
             if self.client_a:
                 await self.client_a.close()
@@ -254,6 +324,21 @@ class HedgeStrategy:
             if self.client_b:
                 await self.client_b.close()
 
+            http_pool = get_http_pool()
+            logging.info(http_pool.stats())
+            await http_pool.close()
+
+            logging.info(f"REST网关统计: {get_gateway().metrics_summary()}")
+            if self.metrics_server:
+                await self.metrics_server.stop()
+
+            if self.depth_selector:
+                self.depth_selector.stop()
+
+            if self.loop_monitor:
+                self.loop_monitor.stop()
+                logging.info(self.loop_monitor.summary())
+
             logging.info("清理完成")
 
         except Exception as e:
@@ -271,7 +356,7 @@ async def main():
     parser = argparse.ArgumentParser(description='跨账户对冲策略')
     parser.add_argument('--market', type=str, required=True, help='市场名称（如 ETH, BTC, ENA）')
     parser.add_argument('--quantity', type=Decimal, required=True, help='挂单数量（base_amount）')
-    parser.add_argument('--depth', type=int, required=True, help='挂单档位（1表示买1/卖1）')
+    parser.add_argument('--depth', type=int, required=True, help='挂单档位（按价格档位计，同价多笔挂单算一档；1表示买1/卖1）')
     parser.add_argument('--config', type=str,
                         default='/Users/liujian/Documents/workspances/Lighter-hedge/hedge_strategy/config.yaml',
                         help='配置文件路径')
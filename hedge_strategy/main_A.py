@@ -12,19 +12,29 @@ import signal
 import time
 from decimal import Decimal
 
-from lighter import ApiClient, Configuration
-
 # 添加temp_lighter到路径
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
 
 import lighter
-from redis_messenger import RedisMessenger
+from redis_messenger import AsyncRedisMessenger
 from account_a_manager import AccountAManager
 from account_b_manager import AccountBManager
+from order_book import OrderBookFeed
+from position_book import PositionBook
+from rest_gateway import configure_gateway, get_gateway
+from http_pool import configure_http_pool, get_http_pool
+from fill_analytics import start_depth_selector
+from loop_monitor import start_loop_monitor
+from metrics import start_metrics_server, POSITION_IMBALANCE
+from auth_token_cache import get_auth_token_cache
+from nonce_allocator import get_nonce_allocator
+from requote_engine import RequoteEngine
+from a_state_machine import AStateMachine
+from emergency_flatten import EmergencyFlatten, flatten_account
 from utils import (
     load_config,
     get_market_index_by_name,
-    cancel_all_orders, get_account_active_orders, get_positions
+    cancel_all_orders, get_account_active_orders
 )
 
 
@@ -50,12 +60,19 @@ class HedgeStrategy:
         self.market_index = None
 
         self.redis_messenger = None
+        self.metrics_server = None
+        self.loop_monitor = None
+        self.depth_selector = None
         self.client_a = None
         self.api_client_a = None
         self.client_b = None
         self.api_client_b = None
         self.account_a_manager = None
         self.account_b_manager = None
+        self.order_book_feed = None
+        self.requote_engine = None
+        self.state_machine = None
+        self.position_book = None
         self.base_amount_multiplier = None
         self.price_multiplier = None
 
@@ -80,19 +97,33 @@ class HedgeStrategy:
             logging.info("加载配置文件...")
             self.config = load_config(self.config_path)
 
+            # 事件循环延迟/阻塞监控（阻塞超过阈值时采样调用栈）
+            self.loop_monitor = start_loop_monitor(self.config.get('loop_monitor'))
+
+            # 按配置初始化进程内共享的REST网关（限流、请求合并）
+            configure_gateway(self.config.get('rate_limit'))
+
+            # 进程内共享的HTTP连接池（所有ApiClient复用同一批长连接）
+            configure_http_pool(self.config.get('http_pool'))
+
+            # 指标端点（可选，运行在事件循环上）
+            self.metrics_server = await start_metrics_server(self.config.get('metrics'))
+
             # 2. 初始化Redis
             logging.info("初始化Redis连接...")
             redis_config = self.config['redis']
             account_a_name = self.config['accounts']['account_a'].get('account_name', 'account_a')
             account_b_name = self.config['accounts']['account_b'].get('account_name', 'account_b')
-            self.redis_messenger = RedisMessenger(
+            self.redis_messenger = AsyncRedisMessenger(
                 host=redis_config['host'],
                 port=redis_config['port'],
                 db=redis_config['db'],
                 account_a_name=account_a_name,
                 account_b_name=account_b_name
             )
-            self.redis_messenger.connect()
+            await self.redis_messenger.connect()
+            self.redis_messenger.configure_wire_format(redis_config.get('wire_format'))
+            self.redis_messenger.configure_stream(redis_config.get('stream'), consumer=account_a_name)
 
             # 3. 初始化A账户客户端
             logging.info("初始化A账户...")
@@ -103,7 +134,14 @@ class HedgeStrategy:
                 account_index=account_a_config['account_index'],
                 api_key_index=account_a_config['api_key_index']
             )
-            self.api_client_a = ApiClient(configuration=Configuration(host=self.config['lighter']['base_url']))
+            await get_http_pool().attach(self.client_a.api_client)
+            self.api_client_a = await get_http_pool().api_client(self.config['lighter']['base_url'])
+
+            # 启动认证token后台刷新（轮询时复用缓存token，不再每次签名）
+            get_auth_token_cache(self.client_a).start()
+
+            # 接管nonce分配（本地递增，连续下单不必等待确认）
+            get_nonce_allocator(self.client_a).start()
 
             # 4. 查询市场索引
             logging.info(f"查询市场索引: {self.market_name}...")
@@ -126,7 +164,23 @@ class HedgeStrategy:
                 self.market_index
             )
 
-            # 6. 初始化A账户管理器
+            # 6. 启动本地订单簿订阅（挂单/平仓取价读内存）
+            ws_url = self.config['lighter'].get('ws_url')
+            if ws_url:
+                logging.info("启动订单簿WebSocket订阅...")
+                self.order_book_feed = OrderBookFeed(ws_url, [self.market_index])
+                self.order_book_feed.start()
+
+            # 按录制行情自适应挂单档位（未启用时固定使用--depth）
+            self.depth_selector = start_depth_selector(
+                self.config.get('depth_selector'),
+                self.market_index,
+                default_depth=self.depth,
+                maker_order_time_out=self.config['lighter']['maker_order_time_out'],
+                quantity=self.quantity
+            )
+
+            # 7. 初始化A账户管理器
             logging.info("初始化A账户管理器...")
             self.account_a_manager = AccountAManager(
                 signer_client=self.client_a,
@@ -136,10 +190,32 @@ class HedgeStrategy:
                 base_amount=self.quantity,
                 depth=self.depth,
                 poll_interval=self.config['strategy']['poll_interval'],
-                ws_url=self.config['lighter'].get('ws_url')
+                ws_url=ws_url,
+                order_book_feed=self.order_book_feed,
+                depth_selector=self.depth_selector
             )
 
-            # 7. 启动WebSocket监听A账户订单成交
+            # 超时挂单撤单+重挂一次提交
+            self.requote_engine = RequoteEngine(
+                signer_client=self.client_a,
+                account_a_manager=self.account_a_manager,
+                market_index=self.market_index,
+                base_amount_multiplier=self.base_amount_multiplier,
+                price_multiplier=self.price_multiplier
+            )
+
+            # 持仓簿：由A账户WebSocket推送维护，变化时写Redis；B账户持仓从Redis读取
+            account_a_name = account_a_config.get('account_name', 'account_a')
+            self.position_book = PositionBook(self.redis_messenger, self.market_name, self.market_index)
+            self.position_book.register_account(account_a_name, account_a_config['account_index'])
+            self.account_a_manager.add_account_listener(self.position_book.on_account_update)
+            await self.position_book.refresh(self.api_client_a, account_a_name)
+            self.position_book.start_reconcile(
+                {account_a_name: self.api_client_a},
+                interval=self.config['strategy'].get('reconcile_interval', 60)
+            )
+
+            # 8. 启动WebSocket监听A账户订单成交
             logging.info("启动WebSocket监听A账户订单成交...")
             self.account_a_manager.start_ws_monitoring()
             
@@ -152,141 +228,37 @@ class HedgeStrategy:
             logging.error(f"初始化失败: {e}")
             raise
 
+    def _create_state_machine(self) -> AStateMachine:
+        """创建A账户状态机（成交事件和对冲结果的订阅由调用方接入）"""
+        strategy_config = self.config['strategy']
+        return AStateMachine(
+            account_a_manager=self.account_a_manager,
+            requote_engine=self.requote_engine,
+            base_amount_multiplier=self.base_amount_multiplier,
+            price_multiplier=self.price_multiplier,
+            reconcile=self._reconcile_snapshot,
+            fetch_active_orders=self._fetch_active_orders,
+            on_hedge_timeout=self._emergency_close_all_positions,
+            maker_order_time_out=self.config['lighter']['maker_order_time_out'],
+            hedge_timeout=strategy_config.get('force_close_timeout', 30),
+            reconcile_interval=strategy_config.get('reconcile_interval', 60)
+        )
+
     async def run(self):
-        """运行策略主循环"""
+        """运行策略：事件驱动状态机，REST只做低频兜底对账"""
         self.running = True
+        self.state_machine = self._create_state_machine()
 
-        cycle_count = 0
+        # 成交事件来自A账户WebSocket，对冲结果来自B账户的Redis通知
+        self.account_a_manager.add_fill_listener(self.state_machine.on_order_filled)
+        self.redis_messenger.subscribe(
+            self.redis_messenger.CHANNEL_B_FILLED,
+            self.state_machine.on_hedge_message
+        )
+        self.redis_messenger.start_listening()
 
         try:
-            while self.running:
-                cycle_count += 1
-                logging.info("")
-                logging.info("=" * 60)
-                logging.info(f"开始第 {cycle_count} 轮循环")
-                logging.info("=" * 60)
-
-                # 检查是否需要暂停交易
-                if self.account_a_manager.pause_trading:
-                    logging.error("⚠️ 交易已暂停（B账户对冲失败），等待人工处理...")
-                    await asyncio.sleep(10)
-                    continue
-
-                # 第一步 查询出活跃订单
-                logging.info("第一步 查询出活跃订单")
-                active_orders = await get_account_active_orders(
-                    self.client_a,
-                    self.config['accounts']['account_a']['account_index'],
-                    self.market_index
-                )
-                # print(active_orders)
-                json_str = json.dumps(active_orders, default=obj_to_dict, ensure_ascii=False)
-                print(json_str)
-
-                # 第二步 查询持仓情况（如果活跃单超过1分钟不成交，则取消活跃单）
-                logging.info("第二步 查询持仓情况")
-                position_size, sign, available_balance = await get_positions(
-                    self.api_client_a,
-                    self.config['accounts']['account_a']['account_index'],
-                    self.market_index
-                )
-                logging.info(f"持仓情况: size={position_size}, sign={sign}")
-                
-                # 同步持仓到Redis
-                account_a_name = self.config['accounts']['account_a'].get('account_name', 'account_a')
-                account_a_index = self.config['accounts']['account_a']['account_index']
-                self.redis_messenger.update_position(
-                    account_name=account_a_name,
-                    account_index=account_a_index,
-                    market=self.market_name,
-                    position_size=position_size,
-                    sign=sign,
-                    available_balance=available_balance
-                )
-                
-                # 验证对冲状态：检查A和B账户持仓是否正确对冲
-                hedge_valid, hedge_message = self._check_hedge_status()
-                if not hedge_valid:
-                    logging.warning(f"⚠️ 对冲状态异常: {hedge_message}")
-                    # 如果持仓超过配置的超时时间未对冲，执行全部平仓
-                    force_close_timeout = self.config['strategy'].get('force_close_timeout', 30)
-                    if f"超过{force_close_timeout}秒" in hedge_message:
-                        logging.error(f"❌ 持仓超过{force_close_timeout}秒未对冲，执行全部平仓！")
-                        await self._emergency_close_all_positions()
-                        await asyncio.sleep(10)
-                        continue
-                    # 如果对冲不匹配但未超时，等待下一轮检查
-                    await asyncio.sleep(5)
-                    continue
-
-                # 第三步 核心逻辑处理
-                # |- 如果持仓不存在，活跃单不存在，则限价开多
-                # |- 如果持仓存在，活跃单不存在，则限价平多
-                # |- 如果持仓不存在，活跃单存在，则不做任何处理
-                # |- 如果持仓存在，活跃单存在，则不做任何处理
-
-                if position_size == 0 and not active_orders:
-                    """
-                        如果持仓不存在，活跃单不存在，则限价开多
-                    """
-                    # 步骤1: A账户创建限价买单
-                    logging.info("[第三步] 如果持仓不存在，活跃单不存在，则限价开多...")
-                    success = await self.account_a_manager.create_limit_buy_order(
-                        self.base_amount_multiplier,
-                        self.price_multiplier,
-                        active_orders  # 传递已查询的活跃订单
-                    )
-                    if not success:
-                        logging.warning("创建订单失败，5秒后重试...")
-                        await asyncio.sleep(5)
-                        continue
-                    
-                elif position_size > 0 and sign == 1 and not active_orders:
-                    """
-                       如果持仓存在且是多头，活跃单不存在，则限价平多
-                    """
-                    logging.info("[第三步] 如果持仓存在且是多头，活跃单不存在，则限价平多...")
-                    success = await self.account_a_manager.create_limit_sell_order(
-                        self.base_amount_multiplier,
-                        self.price_multiplier,
-                        active_orders  # 传递已查询的活跃订单
-                    )
-                    if not success:
-                        logging.warning("创建订单失败，5秒后重试...")
-                        await asyncio.sleep(5)
-                        continue
-                    
-                elif position_size > 0 and sign == -1:
-                    """
-                       如果持仓是空头，这是异常情况，记录错误
-                    """
-                    logging.error(f"⚠️ 异常：A账户出现空头持仓！size={position_size}, sign={sign}")
-                    logging.error("A账户只应该有多头持仓，请人工检查并清空持仓！")
-                    await asyncio.sleep(10)
-                    continue
-                else:
-                    """
-                        情况1：如果持仓不存在，活跃单存在，则不做任何处理
-                        情况2：如果持仓存在，活跃单存在，则不做任何处理
-                        补偿逻辑：如果活跃单超过1分钟，则取消该订单
-                    """
-                    for active_order in active_orders:
-                        created_at = active_order.additional_properties["created_at"]
-                        if int(time.time()) - created_at > self.config['lighter']['maker_order_time_out']:
-                            # 取消订单
-                            try:
-                                await self.client_a.cancel_order(
-                                    market_index=self.market_index,
-                                    order_index=active_order.order_index
-                                )
-                                logging.info(f"已取消订单: {active_order.order_index}")
-                            except Exception as e:
-                                logging.error(f"取消订单{active_order.order_index}失败: {e}")
-                        else:
-                            logging.info("不做任何处理，没有超时活跃单")
-
-
-                await asyncio.sleep(5)  # 短暂休息
+            await self.state_machine.run()
 
         except Exception as e:
             logging.error(f"策略运行异常: {e}")
@@ -295,6 +267,51 @@ class HedgeStrategy:
         finally:
             await self.cleanup()
 
+    async def _fetch_active_orders(self):
+        """查询A账户活跃订单"""
+        return await get_account_active_orders(
+            self.client_a,
+            self.config['accounts']['account_a']['account_index'],
+            self.market_index
+        )
+
+    async def _reconcile_snapshot(self) -> dict:
+        """
+        兜底对账：查询活跃订单，读取持仓簿并检查对冲状态
+
+        Returns:
+            {active_orders, position_size, sign, hedge_valid, hedge_message, hedge_balanced}
+        """
+        # 查询失败时返回None，没有活跃订单时返回空列表
+        active_orders = await self._fetch_active_orders()
+        if active_orders is not None:
+            # 已不在交易所活跃订单中的监控订单按撤销处理（部分成交的通知B结束累计）
+            self.account_a_manager.prune_inactive_orders({order.order_index for order in active_orders})
+        active_orders = active_orders or []
+        logging.debug(json.dumps(active_orders, default=obj_to_dict, ensure_ascii=False))
+
+        # 持仓读持仓簿内存（WebSocket推送维护，变化时已写Redis）
+        account_a_name = self.config['accounts']['account_a'].get('account_name', 'account_a')
+        position_size, sign, _ = self.position_book.get_position(account_a_name)
+        logging.info(f"对账: 活跃订单={len(active_orders)}, 持仓 size={position_size}, sign={sign}")
+
+        # 验证对冲状态：持仓超过配置的超时时间未对冲，执行全部平仓
+        hedge_valid, hedge_message, hedge_balanced = await self._check_hedge_status()
+        if not hedge_valid:
+            force_close_timeout = self.config['strategy'].get('force_close_timeout', 30)
+            if f"超过{force_close_timeout}秒" in hedge_message:
+                logging.error(f"❌ 持仓超过{force_close_timeout}秒未对冲，执行全部平仓！")
+                await self._emergency_close_all_positions()
+
+        return {
+            "active_orders": active_orders,
+            "position_size": position_size,
+            "sign": sign,
+            "hedge_valid": hedge_valid,
+            "hedge_message": hedge_message,
+            "hedge_balanced": hedge_balanced
+        }
+
     async def cleanup(self):
         """清理资源"""
         logging.info("清理资源...")
@@ -308,6 +325,13 @@ class HedgeStrategy:
             if self.account_b_manager:
                 self.account_b_manager.stop_listening()
 
+            if self.order_book_feed:
+                self.order_book_feed.stop()
+
+            if self.position_book:
+                self.position_book.stop()
+                logging.info(self.position_book.stats())
+
             # 取消所有挂单
             if self.client_a and self.market_index:
                 logging.info("取消A账户挂单...")
@@ -327,7 +351,22 @@ class HedgeStrategy:
 
             # 关闭Redis连接
             if self.redis_messenger:
-                self.redis_messenger.close()
+                await self.redis_messenger.close()
+
+            # 停止认证token刷新
+            if self.client_a:
+                token_cache = get_auth_token_cache(self.client_a)
+                token_cache.stop()
+                logging.info(token_cache.stats())
+                nonce_allocator = get_nonce_allocator(self.client_a)
+                nonce_allocator.stop()
+                logging.info(nonce_allocator.stats())
+
+            if self.requote_engine:
+                logging.info(self.requote_engine.stats())
+
+            if self.state_machine:
+                logging.info(self.state_machine.stats())
 
             # 关闭API客户端
             if self.client_a:
@@ -336,29 +375,44 @@ class HedgeStrategy:
             if self.client_b:
                 await self.client_b.close()
 
+            http_pool = get_http_pool()
+            logging.info(http_pool.stats())
+            await http_pool.close()
+
+            logging.info(f"REST网关统计: {get_gateway().metrics_summary()}")
+            if self.metrics_server:
+                await self.metrics_server.stop()
+
+            if self.depth_selector:
+                self.depth_selector.stop()
+
+            if self.loop_monitor:
+                self.loop_monitor.stop()
+                logging.info(self.loop_monitor.summary())
+
             logging.info("清理完成")
 
         except Exception as e:
             logging.error(f"清理资源失败: {e}")
 
-    def _check_hedge_status(self) -> tuple[bool, str]:
+    async def _check_hedge_status(self) -> tuple[bool, str, bool]:
         """
         检查A和B账户的对冲状态
         
         Returns:
-            (是否对冲正常, 状态消息)
+            (是否对冲正常, 状态消息, 是否已核对A/B持仓平衡)；持仓未同步或检查异常时视为正常但未核对
         """
         try:
             import time
             
-            # 从Redis获取A和B账户持仓
+            # A账户持仓读内存，B账户持仓读Redis（B进程的持仓簿变化即写入）
             account_a_name = self.config['accounts']['account_a'].get('account_name', 'account_a')
             account_b_name = self.config['accounts']['account_b'].get('account_name', 'account_b')
-            pos_a = self.redis_messenger.get_position_by_account_name(account_a_name, self.market_name)
-            pos_b = self.redis_messenger.get_position_by_account_name(account_b_name, self.market_name)
+            pos_a = await self.position_book.fetch(account_a_name)
+            pos_b = await self.position_book.fetch(account_b_name)
             
             if not pos_a or not pos_b:
-                return True, "持仓信息未同步到Redis，跳过检查"
+                return True, "持仓信息未同步到Redis，跳过检查", False
             
             size_a = pos_a.get("size", 0)
             sign_a = pos_a.get("sign", 0)
@@ -368,9 +422,11 @@ class HedgeStrategy:
             sign_b = pos_b.get("sign", 0)
             timestamp_b = pos_b.get("timestamp", 0)
             
+            POSITION_IMBALANCE.labels(market=self.market_name).set(size_a * sign_a + size_b * sign_b)
+            
             # 如果两个账户都没有持仓，认为对冲正常
             if size_a == 0 and size_b == 0:
-                return True, "两个账户都无持仓"
+                return True, "两个账户都无持仓", True
             
             # 获取强制平仓超时配置
             force_close_timeout = self.config['strategy'].get('force_close_timeout', 30)
@@ -381,8 +437,8 @@ class HedgeStrategy:
                 current_time = time.time()
                 max_timestamp = max(timestamp_a, timestamp_b)
                 if current_time - max_timestamp > force_close_timeout:
-                    return False, f"持仓大小不匹配且超过{force_close_timeout}秒: A={size_a}, B={size_b}"
-                return False, f"持仓大小不匹配: A={size_a}, B={size_b}"
+                    return False, f"持仓大小不匹配且超过{force_close_timeout}秒: A={size_a}, B={size_b}", False
+                return False, f"持仓大小不匹配: A={size_a}, B={size_b}", False
             
             # 检查持仓方向是否相反
             if sign_a != 0 and sign_b != 0 and sign_a == sign_b:
@@ -390,23 +446,24 @@ class HedgeStrategy:
                 current_time = time.time()
                 max_timestamp = max(timestamp_a, timestamp_b)
                 if current_time - max_timestamp > force_close_timeout:
-                    return False, f"持仓方向相同且超过{force_close_timeout}秒: A={sign_a}, B={sign_b}"
-                return False, f"持仓方向相同（应该相反）: A={sign_a}, B={sign_b}"
+                    return False, f"持仓方向相同且超过{force_close_timeout}秒: A={sign_a}, B={sign_b}", False
+                return False, f"持仓方向相同（应该相反）: A={sign_a}, B={sign_b}", False
             
             # 对冲正常
-            return True, f"对冲正常: A={size_a}({sign_a}), B={size_b}({sign_b})"
+            return True, f"对冲正常: A={size_a}({sign_a}), B={size_b}({sign_b})", True
             
         except Exception as e:
             logging.error(f"检查对冲状态异常: {e}")
-            return True, f"检查异常，跳过: {e}"
+            return True, f"检查异常，跳过: {e}", False
     
     async def _emergency_close_all_positions(self):
         """
-        紧急平仓：智能决定平仓策略
+        紧急平仓：A、B两条腿并发执行，共用一份盘口快照
         
         策略：
         1. 只有A有仓位: 取消A的活动单 + 平A的仓位
-        2. A和B都有仓位: 取消A的活动单 + 平A的仓位 + 平B的仓位
+        2. A和B都有仓位: 取消A的活动单 + 平A的仓位，同时平B的仓位
+        3. 只有B有仓位: 取消A的活动单，同时平B的仓位
         """
         try:
             logging.error("=" * 60)
@@ -416,8 +473,10 @@ class HedgeStrategy:
             # 获取A和B账户持仓
             account_a_name = self.config['accounts']['account_a'].get('account_name', 'account_a')
             account_b_name = self.config['accounts']['account_b'].get('account_name', 'account_b')
-            pos_a = self.redis_messenger.get_position_by_account_name(account_a_name, self.market_name)
-            pos_b = self.redis_messenger.get_position_by_account_name(account_b_name, self.market_name)
+            pos_a, pos_b = await asyncio.gather(
+                self.position_book.fetch(account_a_name),
+                self.position_book.fetch(account_b_name)
+            )
             
             if not pos_a or not pos_b:
                 logging.error("无法获取持仓信息，请手动执行清仓脚本")
@@ -429,114 +488,56 @@ class HedgeStrategy:
             
             logging.info(f"A账户持仓: {size_a}, B账户持仓: {size_b}")
             
-            # 第一步：取消A账户所有活跃订单
-            logging.info("取消A账户所有活跃订单...")
-            await cancel_all_orders(
-                self.client_a,
-                self.config['accounts']['account_a']['account_index'],
-                self.market_index
-            )
-            logging.info("A账户活跃订单已取消")
-            
-            # 第二步：判断平仓策略
-            if size_a > 0 and size_b == 0:
-                # 情况1: 只有A有仓位，直接平A
-                logging.info(f"只有A账户有仓位({size_a})，平A账户")
-                await self._close_account_a_position()
-            elif size_a > 0 and size_b > 0:
-                # 情况2: A和B都有仓位，两边都平
-                logging.info(f"A和B都有仓位(A={size_a}, B={size_b})，两边都平")
-                await self._close_account_a_position()
-                await self._send_close_signal_to_b()
-            elif size_a == 0 and size_b > 0:
-                # 情况3: 只有B有仓位，只平B
-                logging.info(f"只有B账户有仓位({size_b})，平B账户")
-                await self._send_close_signal_to_b()
+            # A腿总是撤单（无持仓时只撤单），B有仓位时B腿同时平仓
+            flatten = EmergencyFlatten(self.market_index, self.api_client_a, self.order_book_feed)
+            flatten.add_leg("A", self._flatten_account_a)
+            if size_b > 0:
+                flatten.add_leg("B", self._flatten_account_b)
+            await flatten.run()
             
             logging.error("=" * 60)
             
         except Exception as e:
             logging.error(f"紧急平仓失败: {e}")
     
-    async def _close_account_a_position(self):
-        """平掉A账户持仓"""
-        try:
-            from utils import get_positions, get_orderbook
-            from decimal import Decimal
-            import random
-            
-            position_size, sign, _ = await get_positions(
-                self.api_client_a,
-                self.config['accounts']['account_a']['account_index'],
-                self.market_index
-            )
-            
-            if position_size == 0:
-                logging.info("A账户无持仓，无需平仓")
-                return
-            
-            logging.info(f"开始平A账户持仓: size={position_size}, sign={sign}")
-            
-            # 获取当前市场价格
-            orderbook = await get_orderbook(self.api_client_a, self.market_index)
-            
-            # 根据持仓方向确定平仓方向和价格
-            # 参考B账户的逻辑,使用5%滑点容忍度确保市价单成交
-            slippage_tolerance = Decimal('0.05')
-            
-            if sign == 1:
-                # 平多头，需要卖出，使用买一价并下调5%
-                is_ask = True
-                price_dec = Decimal(str(orderbook.bids[0].price))
-                base_price = int(price_dec * self.price_multiplier)
-                avg_execution_price = int(base_price * (Decimal('1') - slippage_tolerance))
-                logging.info(f"平多头: 卖出, 基准价={price_dec}, 执行价={avg_execution_price}")
-            else:
-                # 平空头，需要买入，使用卖一价并上浮5%
-                is_ask = False
-                price_dec = Decimal(str(orderbook.asks[0].price))
-                base_price = int(price_dec * self.price_multiplier)
-                avg_execution_price = int(base_price * (Decimal('1') + slippage_tolerance))
-                logging.info(f"平空头: 买入, 基准价={price_dec}, 执行价={avg_execution_price}")
-            
-            # 生成client_order_index
-            client_order_index = int(time.time() * 1000) + random.randint(1, 999)
-            
-            # 使用create_market_order方法下市价单
-            tx, resp, err = await self.client_a.create_market_order(
-                market_index=self.market_index,
-                client_order_index=client_order_index,
-                base_amount=int(position_size * self.base_amount_multiplier),
-                avg_execution_price=avg_execution_price,
-                is_ask=is_ask,
-                reduce_only=True  # 平仓单
-            )
-            
-            if err:
-                logging.error(f"A账户平仓订单失败: {err}")
-                return
-            
-            if resp and resp.code == 200:
-                logging.info(f"✅ A账户平仓订单已提交: tx_hash={resp.tx_hash}")
-            else:
-                logging.error(f"A账户平仓订单失败: code={resp.code if resp else 'None'}")
-            
-        except Exception as e:
-            logging.error(f"平A账户持仓失败: {e}")
+    async def _flatten_account_a(self, best_bid, best_ask) -> dict:
+        """A腿：撤销A账户活跃订单并平掉持仓（撤单与查持仓并发）"""
+        return await flatten_account(
+            self.client_a,
+            self.api_client_a,
+            self.config['accounts']['account_a']['account_index'],
+            self.market_index,
+            self.base_amount_multiplier,
+            self.price_multiplier,
+            best_bid,
+            best_ask,
+            label="A"
+        )
+    
+    async def _flatten_account_b(self, best_bid, best_ask) -> dict:
+        """B腿：B账户在另一个进程，通过Redis发送平仓信号（带盘口快照，B端不再重新取价）"""
+        await self._send_close_signal_to_b(best_bid, best_ask)
+        return {"status": "signaled"}
     
-    async def _send_close_signal_to_b(self):
+    def _close_all_message(self, best_bid=None, best_ask=None) -> dict:
+        """构建B账户平仓消息"""
+        return {
+            "action": "close_all",
+            "market": self.market_name,
+            "market_index": self.market_index,
+            "best_bid": best_bid,
+            "best_ask": best_ask,
+            "timestamp": int(time.time()),
+            "signal_ns": time.monotonic_ns()
+        }
+    
+    async def _send_close_signal_to_b(self, best_bid=None, best_ask=None):
         """通过Redis发送平仓信号给B账户"""
         try:
             logging.info("发送平仓信号给B账户...")
             
             # 发布平仓信号到Redis
-            close_message = {
-                "action": "close_all",
-                "market": self.market_name,
-                "market_index": self.market_index,
-                "timestamp": int(time.time())
-            }
-            
+            close_message = self._close_all_message(best_bid, best_ask)
             self.redis_messenger.publish_a_filled(close_message)
             logging.info(f"已发送平仓信号: {close_message}")
             
@@ -547,6 +548,8 @@ class HedgeStrategy:
         """停止策略"""
         logging.info("收到停止信号...")
         self.running = False
+        if self.state_machine:
+            self.state_machine.stop()
 
 
 # 方式1：使用 default 参数
@@ -560,7 +563,7 @@ async def main():
     parser = argparse.ArgumentParser(description='跨账户对冲策略')
     parser.add_argument('--market', type=str, required=True, help='市场名称（如 ETH, BTC, ENA）')
     parser.add_argument('--quantity', type=Decimal, required=True, help='挂单数量（base_amount）')
-    parser.add_argument('--depth', type=int, required=True, help='挂单档位（1表示买1/卖1）')
+    parser.add_argument('--depth', type=int, required=True, help='挂单档位（按价格档位计，同价多笔挂单算一档；1表示买1/卖1）')
     parser.add_argument('--config', type=str,
                         default='/Users/liujian/Documents/workspances/Lighter-hedge/hedge_strategy/config.yaml',
                         help='配置文件路径')
@@ -11,14 +11,21 @@ import logging
 import signal
 from decimal import Decimal
 
-from lighter import ApiClient, Configuration
-
 # 添加temp_lighter到路径
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
 
 import lighter
-from redis_messenger import RedisMessenger
+from redis_messenger import AsyncRedisMessenger
 from account_b_manager import AccountBManager
+from order_book import OrderBookFeed
+from position_book import PositionBook
+from rest_gateway import configure_gateway, get_gateway
+from http_pool import configure_http_pool, get_http_pool
+from hedge_readiness import start_hedge_readiness
+from loop_monitor import start_loop_monitor
+from metrics import start_metrics_server
+from auth_token_cache import get_auth_token_cache
+from nonce_allocator import get_nonce_allocator
 from utils import (
     load_config,
     get_market_index_by_name,
@@ -44,15 +51,18 @@ class HedgeStrategyB:
         self.market_index = None
 
         self.redis_messenger = None
+        self.metrics_server = None
+        self.loop_monitor = None
         self.client_b = None
         self.api_client_b = None
         self.account_b_manager = None
+        self.order_book_feed = None
         self.base_amount_multiplier = None
         self.price_multiplier = None
+        self.min_base_amount = 0
 
         self.running = False
-        self._position_sync_running = False  # 持仓同步线程标志位
-        self.position_sync_thread = None  # 持仓同步线程
+        self.position_book = None  # 持仓簿（WebSocket推送维护）
 
         # 设置日志
         logging.basicConfig(
@@ -73,19 +83,33 @@ class HedgeStrategyB:
             logging.info("加载配置文件...")
             self.config = load_config(self.config_path)
 
+            # 事件循环延迟/阻塞监控（阻塞超过阈值时采样调用栈）
+            self.loop_monitor = start_loop_monitor(self.config.get('loop_monitor'))
+
+            # 按配置初始化进程内共享的REST网关（限流、请求合并）
+            configure_gateway(self.config.get('rate_limit'))
+
+            # 进程内共享的HTTP连接池（所有ApiClient复用同一批长连接）
+            configure_http_pool(self.config.get('http_pool'))
+
+            # 指标端点（可选，运行在事件循环上）
+            self.metrics_server = await start_metrics_server(self.config.get('metrics'), port_offset=1)
+
             # 2. 初始化Redis
             logging.info("初始化Redis连接...")
             redis_config = self.config['redis']
             account_a_name = self.config['accounts']['account_a'].get('account_name', 'account_a')
             account_b_name = self.config['accounts']['account_b'].get('account_name', 'account_b')
-            self.redis_messenger = RedisMessenger(
+            self.redis_messenger = AsyncRedisMessenger(
                 host=redis_config['host'],
                 port=redis_config['port'],
                 db=redis_config['db'],
                 account_a_name=account_a_name,
                 account_b_name=account_b_name
             )
-            self.redis_messenger.connect()
+            await self.redis_messenger.connect()
+            self.redis_messenger.configure_wire_format(redis_config.get('wire_format'))
+            self.redis_messenger.configure_stream(redis_config.get('stream'), consumer=account_b_name)
 
             # 3. 初始化B账户客户端
             logging.info("初始化B账户...")
@@ -96,7 +120,14 @@ class HedgeStrategyB:
                 account_index=account_b_config['account_index'],
                 api_key_index=account_b_config['api_key_index']
             )
-            self.api_client_b = ApiClient(configuration=Configuration(host=self.config['lighter']['base_url']))
+            await get_http_pool().attach(self.client_b.api_client)
+            self.api_client_b = await get_http_pool().api_client(self.config['lighter']['base_url'])
+
+            # 启动认证token后台刷新（轮询时复用缓存token，不再每次签名）
+            get_auth_token_cache(self.client_b).start()
+
+            # 接管nonce分配（本地递增，连续下单不必等待确认）
+            get_nonce_allocator(self.client_b).start()
 
             # 4. 查询市场索引
             logging.info(f"查询市场索引: {self.market_name}...")
@@ -107,6 +138,7 @@ class HedgeStrategyB:
             self.market_index = orderBook.market_id
             self.base_amount_multiplier = pow(10, orderBook.supported_size_decimals)
             self.price_multiplier = pow(10, orderBook.supported_price_decimals)
+            self.min_base_amount = orderBook.min_base_amount
 
             if self.market_index is None:
                 raise Exception(f"未找到市场: {self.market_name}")
@@ -119,7 +151,14 @@ class HedgeStrategyB:
                 self.market_index
             )
 
-            # 6. 初始化B账户管理器
+            # 6. 启动本地订单簿订阅（平仓取价读内存）
+            ws_url = self.config['lighter'].get('ws_url')
+            if ws_url:
+                logging.info("启动订单簿WebSocket订阅...")
+                self.order_book_feed = OrderBookFeed(ws_url, [self.market_index])
+                self.order_book_feed.start()
+
+            # 7. 初始化B账户管理器
             logging.info("初始化B账户管理器...")
             self.account_b_manager = AccountBManager(
                 signer_client=self.client_b,
@@ -127,24 +166,48 @@ class HedgeStrategyB:
                 account_index=account_b_config['account_index'],
                 base_amount_multiplier=self.base_amount_multiplier,
                 price_multiplier=self.price_multiplier,
-                retry_times=self.config['strategy']['retry_times']
+                retry_times=self.config['strategy']['retry_times'],
+                ws_url=ws_url,
+                hedge_confirm_timeout=self.config['strategy'].get('hedge_confirm_timeout', 5),
+                order_book_feed=self.order_book_feed,
+                min_base_amount=self.min_base_amount,
+                hedge_batch_size=self.config['strategy'].get('hedge_batch_size', 0),
+                hedge_max_delay=self.config['strategy'].get('hedge_max_delay', 0.5),
+                latency_export_interval=self.config['strategy'].get('latency_export_interval', 60),
+                hedge_readiness=start_hedge_readiness(self.config.get('hedge_readiness'), self.client_b),
+                market_index=self.market_index
             )
             
             # 设置事件循环
             self.account_b_manager.set_event_loop(asyncio.get_event_loop())
+            
+            # 持仓簿：由B账户WebSocket推送维护，变化时写Redis
+            account_b_name = account_b_config.get('account_name', 'account_b')
+            self.position_book = PositionBook(self.redis_messenger, self.market_name, self.market_index)
+            self.position_book.register_account(account_b_name, account_b_config['account_index'])
+            self.account_b_manager.add_account_listener(self.position_book.on_account_update)
+            
+            # 启动WebSocket监听B账户订单成交（对冲单成交确认走推送）
+            logging.info("启动WebSocket监听B账户订单成交...")
+            self.account_b_manager.start_ws_monitoring()
 
-            # 7. 设置Redis订阅 - B入口只订阅A账户的成交消息
+            # 8. 设置Redis订阅 - B入口只订阅A账户的成交消息
             logging.info("设置Redis订阅...")
             # 使用实例的channel,而不是类变量
+            # 订阅回调直接在事件循环上执行，使用事件循环版本的回调
             self.redis_messenger.subscribe(
                 self.redis_messenger.CHANNEL_A_FILLED,
-                self.account_b_manager.on_a_account_filled
+                self.account_b_manager.handle_a_filled
             )
             self.redis_messenger.start_listening()
 
-            # 8. 启动持仓同步定时任务
-            logging.info("启动B账户持仓同步定时任务...")
-            self._start_position_sync()
+            # 9. 初始化持仓（REST一次），之后由推送更新，REST只做低频兜底对账
+            logging.info("初始化B账户持仓...")
+            await self.position_book.refresh(self.api_client_b, account_b_name)
+            self.position_book.start_reconcile(
+                {account_b_name: self.api_client_b},
+                interval=self.config['strategy'].get('reconcile_interval', 60)
+            )
             
             logging.info("初始化完成！B账户开始监听A账户成交消息...")
 
@@ -188,6 +251,14 @@ class HedgeStrategyB:
             # 停止监控
             if self.account_b_manager:
                 self.account_b_manager.stop_listening()
+                self.account_b_manager.stop_ws_monitoring()
+
+            if self.order_book_feed:
+                self.order_book_feed.stop()
+
+            if self.position_book:
+                self.position_book.stop()
+                logging.info(self.position_book.stats())
 
             # 取消所有挂单
             if self.client_b and self.market_index:
@@ -200,12 +271,33 @@ class HedgeStrategyB:
 
             # 关闭Redis连接
             if self.redis_messenger:
-                self.redis_messenger.close()
+                await self.redis_messenger.close()
+
+            # 停止认证token刷新
+            if self.client_b:
+                token_cache = get_auth_token_cache(self.client_b)
+                token_cache.stop()
+                logging.info(token_cache.stats())
+                nonce_allocator = get_nonce_allocator(self.client_b)
+                nonce_allocator.stop()
+                logging.info(nonce_allocator.stats())
 
             # 关闭API客户端
             if self.client_b:
                 await self.client_b.close()
 
+            http_pool = get_http_pool()
+            logging.info(http_pool.stats())
+            await http_pool.close()
+
+            logging.info(f"REST网关统计: {get_gateway().metrics_summary()}")
+            if self.metrics_server:
+                await self.metrics_server.stop()
+
+            if self.loop_monitor:
+                self.loop_monitor.stop()
+                logging.info(self.loop_monitor.summary())
+
             logging.info("清理完成")
 
         except Exception as e:
@@ -215,61 +307,6 @@ class HedgeStrategyB:
         """停止策略"""
         logging.info("收到停止信号...")
         self.running = False
-        self._position_sync_running = False  # 停止持仓同步线程
-    
-    def _start_position_sync(self):
-        """启动B账户持仓同步定时任务"""
-        import threading
-        import time
-        from utils import get_positions
-        
-        # 设置标志位,让持仓同步线程可以运行
-        self._position_sync_running = True
-        
-        # 保存主事件循环的引用
-        main_loop = asyncio.get_event_loop()
-        
-        def sync_positions():
-            """定时同步B账户持仓到Redis"""
-            # 持仓同步线程使用独立的标志位
-            while self._position_sync_running:
-                try:
-                    # 使用asyncio.run_coroutine_threadsafe将协程提交到主事件循环
-                    future = asyncio.run_coroutine_threadsafe(
-                        get_positions(
-                            self.api_client_b,
-                            self.config['accounts']['account_b']['account_index'],
-                            self.market_index
-                        ),
-                        main_loop
-                    )
-                    
-                    # 等待结果(最多10秒超时)
-                    position_size, sign, available_balance = future.result(timeout=10)
-                    
-                    # 更新到Redis
-                    account_b_name = self.config['accounts']['account_b'].get('account_name', 'account_b')
-                    account_b_index = self.config['accounts']['account_b']['account_index']
-                    
-                    logging.info(f"同步B账户持仓: size={position_size}, sign={sign}")
-                    self.redis_messenger.update_position(
-                        account_name=account_b_name,
-                        account_index=account_b_index,
-                        market=self.market_name,
-                        position_size=position_size,
-                        sign=sign,
-                        available_balance=available_balance
-                    )
-                    
-                except Exception as e:
-                    logging.error(f"同步B账户持仓失败: {e}")
-                
-                # 等待5秒
-                time.sleep(5)
-        
-        self.position_sync_thread = threading.Thread(target=sync_positions, daemon=True)
-        self.position_sync_thread.start()
-        logging.info("B账户持仓同步线程已启动（每5秒同步一次）")
 
 
 async def main():
@@ -0,0 +1,468 @@
+"""
+跨账户对冲策略主程序（多市场单进程）
+一个事件循环上运行N个市场的A挂单 + B对冲，所有市场共享：
+- A/B各一个SignerClient（认证token、nonce分配器、REST限流网关随之共享），所有ApiClient共用进程内HTTP连接池
+- A/B各一条账户WebSocket订阅（AccountStreamHub按市场拆分推送后分发给各市场的管理器）
+- 一条订单簿WebSocket订阅（OrderBookFeed同时维护所有市场）
+- 一个Redis连接；A/B成交消息走进程内传输，按market_index路由到对应市场
+每个市场独立维护AccountAManager/AccountBManager、状态机、重挂引擎和持仓簿
+
+用法: python main_multi.py --market ETH:0.1:2 --market BTC:0.002:1 [--config config.yaml]
+     市场参数格式为 名称:挂单数量:挂单档位
+"""
+
+import sys
+import os
+import asyncio
+import argparse
+import logging
+import signal
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from main_A import HedgeStrategy
+from redis_messenger import AsyncRedisMessenger, InProcessTransport
+from account_a_manager import AccountAManager
+from account_b_manager import AccountBManager
+from account_stream_hub import AccountStreamHub
+from order_book import OrderBookFeed
+from position_book import PositionBook
+from requote_engine import RequoteEngine
+from rest_gateway import configure_gateway, get_gateway
+from http_pool import configure_http_pool, get_http_pool
+from hedge_readiness import start_hedge_readiness
+from fill_analytics import start_depth_selector
+from loop_monitor import start_loop_monitor
+from metrics import start_metrics_server
+from auth_token_cache import get_auth_token_cache
+from nonce_allocator import get_nonce_allocator
+from utils import (
+    load_config,
+    get_market_index_by_name,
+    cancel_all_orders
+)
+
+
+class MarketWorker(HedgeStrategy):
+    """
+    单个市场的对冲状态（A挂单 + B对冲）
+
+    复用main_A的对账、对冲检查和紧急平仓逻辑；客户端、Redis、推送订阅由MultiMarketHedge共享提供
+    """
+
+    def __init__(self, runner: "MultiMarketHedge", market_name: str, quantity: Decimal, depth: int):
+        """
+        初始化市场
+
+        Args:
+            runner: 多市场运行器（提供共享组件）
+            market_name: 市场名称
+            quantity: 挂单数量
+            depth: 挂单档位
+        """
+        super().__init__(runner.config_path, market_name, quantity, depth)
+        self.runner = runner
+        self.min_base_amount = 0
+
+    async def resolve_market(self):
+        """查询市场索引和精度"""
+        self.config = self.runner.config
+        orderBook = await get_market_index_by_name(self.runner.client_a.api_client, self.market_name)
+        if orderBook is None or orderBook.market_id is None:
+            raise Exception(f"未找到市场: {self.market_name}")
+        self.market_index = orderBook.market_id
+        self.base_amount_multiplier = pow(10, orderBook.supported_size_decimals)
+        self.price_multiplier = pow(10, orderBook.supported_price_decimals)
+        self.min_base_amount = orderBook.min_base_amount
+
+    async def setup(self):
+        """用共享组件初始化本市场的管理器、持仓簿和推送订阅"""
+        runner = self.runner
+        self.redis_messenger = runner.redis_messenger
+        self.client_a, self.api_client_a = runner.client_a, runner.api_client_a
+        self.client_b, self.api_client_b = runner.client_b, runner.api_client_b
+        self.order_book_feed = runner.order_book_feed
+        account_a_config = self.config['accounts']['account_a']
+        account_b_config = self.config['accounts']['account_b']
+        strategy_config = self.config['strategy']
+        ws_url = self.config['lighter'].get('ws_url')
+
+        logging.info(f"[{self.market_name}] 清理历史挂单...")
+        await cancel_all_orders(self.client_a, account_a_config['account_index'], self.market_index)
+        await cancel_all_orders(self.client_b, account_b_config['account_index'], self.market_index)
+
+        self.depth_selector = start_depth_selector(
+            self.config.get('depth_selector'),
+            self.market_index,
+            default_depth=self.depth,
+            maker_order_time_out=self.config['lighter']['maker_order_time_out'],
+            quantity=self.quantity
+        )
+
+        self.account_a_manager = AccountAManager(
+            signer_client=self.client_a,
+            redis_messenger=self.redis_messenger,
+            account_index=account_a_config['account_index'],
+            market_index=self.market_index,
+            base_amount=self.quantity,
+            depth=self.depth,
+            poll_interval=strategy_config['poll_interval'],
+            ws_url=ws_url,
+            order_book_feed=self.order_book_feed,
+            depth_selector=self.depth_selector
+        )
+        self.requote_engine = RequoteEngine(
+            signer_client=self.client_a,
+            account_a_manager=self.account_a_manager,
+            market_index=self.market_index,
+            base_amount_multiplier=self.base_amount_multiplier,
+            price_multiplier=self.price_multiplier
+        )
+        self.account_b_manager = AccountBManager(
+            signer_client=self.client_b,
+            redis_messenger=self.redis_messenger,
+            account_index=account_b_config['account_index'],
+            base_amount_multiplier=self.base_amount_multiplier,
+            price_multiplier=self.price_multiplier,
+            retry_times=strategy_config['retry_times'],
+            ws_url=ws_url,
+            hedge_confirm_timeout=strategy_config.get('hedge_confirm_timeout', 5),
+            order_book_feed=self.order_book_feed,
+            min_base_amount=self.min_base_amount,
+            hedge_batch_size=strategy_config.get('hedge_batch_size', 0),
+            hedge_max_delay=strategy_config.get('hedge_max_delay', 0.5),
+            latency_export_interval=strategy_config.get('latency_export_interval', 60),
+            hedge_readiness=start_hedge_readiness(self.config.get('hedge_readiness'), self.client_b),
+            market_index=self.market_index,
+            hedge_template_amount=self.quantity
+        )
+        self.account_b_manager.set_event_loop(asyncio.get_running_loop())
+
+        # 同进程内同时跟踪A/B两个账户的持仓，对冲检查全部读内存
+        account_a_name = account_a_config.get('account_name', 'account_a')
+        account_b_name = account_b_config.get('account_name', 'account_b')
+        self.position_book = PositionBook(self.redis_messenger, self.market_name, self.market_index)
+        self.position_book.register_account(account_a_name, account_a_config['account_index'])
+        self.position_book.register_account(account_b_name, account_b_config['account_index'])
+        self.account_a_manager.add_account_listener(self.position_book.on_account_update)
+        self.account_b_manager.add_account_listener(self.position_book.on_account_update)
+        await self.position_book.refresh(self.api_client_a, account_a_name)
+        await self.position_book.refresh(self.api_client_b, account_b_name)
+        self.position_book.start_reconcile(
+            {account_a_name: self.api_client_a, account_b_name: self.api_client_b},
+            interval=strategy_config.get('reconcile_interval', 60)
+        )
+
+        if runner.hub_a is not None:
+            self.account_a_manager.attach_account_stream(runner.hub_a)
+            self.account_b_manager.attach_account_stream(runner.hub_b, self.market_index)
+
+        self.state_machine = self._create_state_machine()
+        self.account_a_manager.add_fill_listener(self.state_machine.on_order_filled)
+        logging.info(f"[{self.market_name}] 初始化完成: market_index={self.market_index}")
+
+    async def run(self):
+        """运行本市场的状态机（对冲消息由运行器路由）"""
+        self.running = True
+        self.account_b_manager.start_listening()
+        try:
+            await self.state_machine.run()
+        except Exception as e:
+            logging.error(f"[{self.market_name}] 策略运行异常: {e}")
+            raise
+        finally:
+            await self.cleanup()
+
+    async def _flatten_account_b(self, best_bid, best_ask) -> dict:
+        """B腿：B账户在同一进程内，直接执行平仓（不经Redis），完成时间计入紧急平仓统计"""
+        return await self.account_b_manager.execute_close_all(self._close_all_message(best_bid, best_ask))
+
+    async def cleanup(self):
+        """清理本市场的资源（共享组件由运行器清理）"""
+        try:
+            if self.account_a_manager:
+                self.account_a_manager.stop_monitoring()
+            if self.account_b_manager:
+                self.account_b_manager.stop_listening()
+            if self.position_book:
+                self.position_book.stop()
+                logging.info(f"[{self.market_name}] {self.position_book.stats()}")
+            if self.depth_selector:
+                self.depth_selector.stop()
+
+            if self.market_index is not None:
+                logging.info(f"[{self.market_name}] 取消A/B账户挂单...")
+                await cancel_all_orders(
+                    self.client_a, self.config['accounts']['account_a']['account_index'], self.market_index
+                )
+                await cancel_all_orders(
+                    self.client_b, self.config['accounts']['account_b']['account_index'], self.market_index
+                )
+
+            if self.requote_engine:
+                logging.info(f"[{self.market_name}] {self.requote_engine.stats()}")
+            if self.state_machine:
+                logging.info(f"[{self.market_name}] {self.state_machine.stats()}")
+        except Exception as e:
+            logging.error(f"[{self.market_name}] 清理资源失败: {e}")
+
+
+class MultiMarketHedge:
+    """多市场对冲运行器"""
+
+    def __init__(self, config_path: str, markets: List[Tuple[str, Decimal, int]],
+                 config: Optional[Dict[str, Any]] = None, standalone: bool = True):
+        """
+        初始化运行器
+
+        Args:
+            config_path: 配置文件路径
+            markets: [(市场名称, 挂单数量, 挂单档位)]
+            config: 已加载的配置（提供时不再读取config_path，supervisor按账户对生成）
+            standalone: 是否由本运行器启动进程级组件（事件循环监控、REST网关、指标端点）；
+                同一进程运行多个账户对时由调用方统一启动
+        """
+        self.config_path = config_path
+        self.config = config
+        self.standalone = standalone
+
+        self.redis_messenger = None
+        self.transport = None
+        self.metrics_server = None
+        self.loop_monitor = None
+        self.client_a = None
+        self.api_client_a = None
+        self.client_b = None
+        self.api_client_b = None
+        self.order_book_feed = None
+        self.hub_a = None
+        self.hub_b = None
+
+        self.workers = [MarketWorker(self, name, quantity, depth) for name, quantity, depth in markets]
+        self.workers_by_index: Dict[int, MarketWorker] = {}
+        self.running = False
+
+    async def initialize(self):
+        """初始化共享组件和所有市场"""
+        try:
+            if self.config is None:
+                logging.info("加载配置文件...")
+                self.config = load_config(self.config_path)
+
+            if self.standalone:
+                self.loop_monitor = start_loop_monitor(self.config.get('loop_monitor'))
+                configure_gateway(self.config.get('rate_limit'))
+                configure_http_pool(self.config.get('http_pool'))
+                self.metrics_server = await start_metrics_server(self.config.get('metrics'))
+
+            # Redis：A/B消息走进程内传输，Redis只做审计镜像和持仓存储
+            logging.info("初始化Redis连接...")
+            redis_config = self.config['redis']
+            account_a_config = self.config['accounts']['account_a']
+            account_b_config = self.config['accounts']['account_b']
+            self.transport = InProcessTransport()
+            self.transport.bind_loop(asyncio.get_running_loop())
+            self.redis_messenger = AsyncRedisMessenger(
+                host=redis_config['host'],
+                port=redis_config['port'],
+                db=redis_config['db'],
+                account_a_name=account_a_config.get('account_name', 'account_a'),
+                account_b_name=account_b_config.get('account_name', 'account_b'),
+                transport=self.transport
+            )
+            await self.redis_messenger.connect()
+            self.redis_messenger.configure_wire_format(redis_config.get('wire_format'))
+
+            # A/B客户端各一个，所有市场共用
+            logging.info("初始化A/B账户...")
+            base_url = self.config['lighter']['base_url']
+            self.client_a = lighter.SignerClient(
+                url=base_url,
+                private_key=account_a_config['api_key_private_key'],
+                account_index=account_a_config['account_index'],
+                api_key_index=account_a_config['api_key_index']
+            )
+            self.client_b = lighter.SignerClient(
+                url=base_url,
+                private_key=account_b_config['api_key_private_key'],
+                account_index=account_b_config['account_index'],
+                api_key_index=account_b_config['api_key_index']
+            )
+            # 只读查询走连接池按host缓存的ApiClient（A/B同一host时为同一个）
+            http_pool = get_http_pool()
+            self.api_client_a = await http_pool.api_client(base_url)
+            self.api_client_b = await http_pool.api_client(base_url)
+            for client in (self.client_a, self.client_b):
+                await http_pool.attach(client.api_client)
+                get_auth_token_cache(client).start()
+                get_nonce_allocator(client).start()
+
+            for worker in self.workers:
+                await worker.resolve_market()
+                if worker.market_index in self.workers_by_index:
+                    raise Exception(f"市场重复: {worker.market_name}")
+                self.workers_by_index[worker.market_index] = worker
+            market_indexes = list(self.workers_by_index)
+
+            ws_url = self.config['lighter'].get('ws_url')
+            if ws_url:
+                logging.info(f"启动订单簿WebSocket订阅: markets={market_indexes}")
+                self.order_book_feed = OrderBookFeed(ws_url, market_indexes)
+                self.order_book_feed.start()
+                self.hub_a = AccountStreamHub(ws_url, account_a_config['account_index'])
+                self.hub_b = AccountStreamHub(ws_url, account_b_config['account_index'])
+
+            for worker in self.workers:
+                await worker.setup()
+
+            # 成交/对冲消息按market_index路由到对应市场
+            self.redis_messenger.subscribe(self.redis_messenger.CHANNEL_A_FILLED, self._route_a_filled)
+            self.redis_messenger.subscribe(self.redis_messenger.CHANNEL_B_FILLED, self._route_b_filled)
+            self.redis_messenger.start_listening()
+
+            if self.hub_a is not None:
+                self.hub_a.start()
+                self.hub_b.start()
+                # 等待WebSocket连接建立
+                await asyncio.sleep(2)
+
+            logging.info(f"初始化完成！共{len(self.workers)}个市场: {[w.market_name for w in self.workers]}")
+
+        except Exception as e:
+            logging.error(f"初始化失败: {e}")
+            raise
+
+    def _worker_for(self, message: Dict) -> MarketWorker:
+        """按消息中的market_index找到对应市场"""
+        worker = self.workers_by_index.get(message.get("market_index"))
+        if worker is None:
+            logging.warning(f"消息的market_index不属于本进程的市场，丢弃: {message}")
+        return worker
+
+    def _route_a_filled(self, message: Dict):
+        """A成交/平仓信号 -> 对应市场的B账户管理器"""
+        worker = self._worker_for(message)
+        if worker is not None:
+            return worker.account_b_manager.handle_a_filled(message)
+
+    def _route_b_filled(self, message: Dict):
+        """B对冲结果 -> 对应市场的A账户状态机"""
+        worker = self._worker_for(message)
+        if worker is not None and worker.state_machine is not None:
+            worker.state_machine.on_hedge_message(message)
+
+    async def run(self):
+        """并发运行所有市场，全部结束后清理共享组件"""
+        self.running = True
+        try:
+            results = await asyncio.gather(*(worker.run() for worker in self.workers), return_exceptions=True)
+            for worker, result in zip(self.workers, results):
+                if isinstance(result, Exception):
+                    logging.error(f"[{worker.market_name}] 异常退出: {result}")
+        finally:
+            await self.cleanup()
+
+    async def cleanup(self):
+        """清理共享组件"""
+        logging.info("清理共享资源...")
+        try:
+            for hub in (self.hub_a, self.hub_b):
+                if hub:
+                    hub.stop()
+
+            if self.order_book_feed:
+                self.order_book_feed.stop()
+
+            if self.redis_messenger:
+                await self.redis_messenger.close()
+
+            for client in (self.client_a, self.client_b):
+                if client:
+                    token_cache = get_auth_token_cache(client)
+                    token_cache.stop()
+                    logging.info(token_cache.stats())
+                    nonce_allocator = get_nonce_allocator(client)
+                    nonce_allocator.stop()
+                    logging.info(nonce_allocator.stats())
+                    await client.close()
+
+            # 连接池和其中的ApiClient由进程级清理关闭
+            if self.standalone:
+                http_pool = get_http_pool()
+                logging.info(http_pool.stats())
+                await http_pool.close()
+                logging.info(f"REST网关统计: {get_gateway().metrics_summary()}")
+            if self.metrics_server:
+                await self.metrics_server.stop()
+
+            if self.loop_monitor:
+                self.loop_monitor.stop()
+                logging.info(self.loop_monitor.summary())
+
+            logging.info("清理完成")
+
+        except Exception as e:
+            logging.error(f"清理资源失败: {e}")
+
+    def stop(self):
+        """停止所有市场"""
+        logging.info("收到停止信号...")
+        self.running = False
+        for worker in self.workers:
+            worker.stop()
+
+
+def parse_market(value: str) -> Tuple[str, Decimal, int]:
+    """
+    解析市场参数
+
+    Args:
+        value: 名称:挂单数量:挂单档位，例如 ETH:0.1:2
+
+    Returns:
+        (市场名称, 挂单数量, 挂单档位)
+    """
+    try:
+        name, quantity, depth = value.split(":")
+        return name, Decimal(quantity), int(depth)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"市场参数格式应为 名称:挂单数量:挂单档位，收到: {value}")
+
+
+async def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='跨账户对冲策略（多市场单进程）')
+    parser.add_argument('--market', type=parse_market, action='append', required=True,
+                        help='市场参数 名称:挂单数量:挂单档位（可重复，如 --market ETH:0.1:2 --market BTC:0.002:1）')
+    parser.add_argument('--config', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml'),
+                        help='配置文件路径')
+    args = parser.parse_args()
+
+    runner = MultiMarketHedge(config_path=args.config, markets=args.market)
+
+    def signal_handler(signum, frame):
+        logging.info(f"收到信号 {signum}")
+        runner.stop()
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    try:
+        await runner.initialize()
+        await runner.run()
+    except KeyboardInterrupt:
+        logging.info("用户中断")
+    except Exception as e:
+        logging.error(f"程序异常退出: {e}")
+        raise
+    finally:
+        logging.info("程序退出")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
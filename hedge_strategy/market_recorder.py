@@ -0,0 +1,332 @@
+"""
+行情录制
+订阅WebSocket订单簿和逐笔成交，写入压缩、只追加、带时间索引的分段文件，供market_replay回放：
+- 每个市场一个目录，按时间滚动分段（{市场}/{UTC时间}.seg），同时写 .idx 时间索引
+- 记录按块压缩（zlib），每块带头部（记录数、首末时间戳），进程崩溃最多丢失未落盘的一块
+- 记录内容为原始WebSocket消息，回放时与实盘走同一套解析代码
+
+用法: python market_recorder.py --market ETH --out ./captures [--segment-minutes 60]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from lighter import WsClient
+from utils import load_config, get_market_index_by_name
+
+# 记录类型
+KIND_BOOK_SNAPSHOT = 1
+KIND_BOOK_DELTA = 2
+KIND_TRADE = 3
+
+# 块头: magic, 压缩后长度, 记录数, 首条时间(ns), 末条时间(ns)
+BLOCK_MAGIC = b"HRB1"
+BLOCK_HEADER = struct.Struct("<4sIIqq")
+# 记录头: 接收时间(ns, UTC), 类型, 消息长度
+RECORD_HEADER = struct.Struct("<qBI")
+# 索引项: 首条时间(ns), 末条时间(ns), 块在分段文件中的偏移
+INDEX_ENTRY = struct.Struct("<qqQ")
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+
+
+class SegmentWriter:
+    """单个市场的分段文件写入器（线程安全）"""
+
+    def __init__(self, directory: str, market_index: int, segment_seconds: int = 3600,
+                 block_records: int = 1024, block_seconds: float = 1.0, level: int = 6):
+        """
+        初始化写入器
+
+        Args:
+            directory: 录制根目录
+            market_index: 市场索引
+            segment_seconds: 分段滚动间隔（秒）
+            block_records: 每块最多记录数
+            block_seconds: 每块最长缓冲时间（秒）
+            level: zlib压缩级别
+        """
+        self.directory = os.path.join(directory, str(market_index))
+        self.segment_seconds = segment_seconds
+        self.block_records = block_records
+        self.block_seconds = block_seconds
+        self.level = level
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._records: List[bytes] = []
+        self._first_ns = 0
+        self._last_ns = 0
+        self._block_started = 0.0
+        self._segment_start = 0
+        self._segment = None
+        self._index = None
+        self._lock = threading.Lock()
+
+        self.records_written = 0
+        self.bytes_raw = 0
+        self.bytes_written = 0
+
+    def append(self, ts_ns: int, kind: int, payload: bytes):
+        """
+        追加一条记录
+
+        Args:
+            ts_ns: 接收时间（UTC纳秒）
+            kind: 记录类型
+            payload: 原始消息（JSON字节串）
+        """
+        with self._lock:
+            if not self._records:
+                self._first_ns = ts_ns
+                self._block_started = time.monotonic()
+            self._records.append(RECORD_HEADER.pack(ts_ns, kind, len(payload)) + payload)
+            self._last_ns = ts_ns
+            if (len(self._records) >= self.block_records
+                    or time.monotonic() - self._block_started >= self.block_seconds):
+                self._flush_block()
+
+    def flush(self):
+        """把缓冲的记录写成一块"""
+        with self._lock:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._records:
+            return
+        self._rotate(self._first_ns)
+        raw = b"".join(self._records)
+        compressed = zlib.compress(raw, self.level)
+        offset = self._segment.tell()
+        self._segment.write(
+            BLOCK_HEADER.pack(BLOCK_MAGIC, len(compressed), len(self._records), self._first_ns, self._last_ns)
+        )
+        self._segment.write(compressed)
+        self._segment.flush()
+        self._index.write(INDEX_ENTRY.pack(self._first_ns, self._last_ns, offset))
+        self._index.flush()
+
+        self.records_written += len(self._records)
+        self.bytes_raw += len(raw)
+        self.bytes_written += BLOCK_HEADER.size + len(compressed)
+        self._records = []
+
+    def _rotate(self, ts_ns: int):
+        """按块首条时间滚动分段文件（文件名为分段起始的UTC时间，按名称排序即时间顺序）"""
+        segment_start = ts_ns // 1_000_000_000 // self.segment_seconds * self.segment_seconds
+        if self._segment is not None and segment_start == self._segment_start:
+            return
+        self._close_files()
+        name = time.strftime("%Y%m%d-%H%M%S", time.gmtime(segment_start))
+        path = os.path.join(self.directory, name)
+        self._segment = open(path + SEGMENT_SUFFIX, "ab")
+        self._index = open(path + INDEX_SUFFIX, "ab")
+        self._segment_start = segment_start
+        logging.info(f"📼 写入行情分段: {path}{SEGMENT_SUFFIX}")
+
+    def _close_files(self):
+        for f in (self._segment, self._index):
+            if f is not None:
+                f.close()
+        self._segment = self._index = None
+
+    def close(self):
+        """落盘剩余记录并关闭文件"""
+        with self._lock:
+            self._flush_block()
+            self._close_files()
+
+    def stats(self) -> str:
+        """返回统计"""
+        ratio = self.bytes_raw / self.bytes_written if self.bytes_written else 0
+        return f"记录={self.records_written}, 原始={self.bytes_raw}B, 压缩后={self.bytes_written}B, 压缩比={ratio:.1f}"
+
+
+class RecorderWsClient(WsClient):
+    """
+    录制用WebSocket客户端
+
+    订单簿沿用SDK的订阅，额外订阅trade频道；原始消息直接交给录制器，不在客户端维护订单簿
+    """
+
+    def __init__(self, recorder: "MarketRecorder", host: str, market_indexes: List[int]):
+        super().__init__(
+            host=host,
+            order_book_ids=market_indexes,
+            account_ids=[],
+            on_order_book_update=lambda market_id, order_book: None,
+            on_account_update=lambda account_id, account: None
+        )
+        self.recorder = recorder
+        self.market_indexes = market_indexes
+
+    def handle_connected(self, ws):
+        super().handle_connected(ws)
+        for market_index in self.market_indexes:
+            ws.send(json.dumps({"type": "subscribe", "channel": f"trade/{market_index}"}))
+
+    def handle_subscribed_order_book(self, message):
+        self.recorder.on_message(message, KIND_BOOK_SNAPSHOT)
+
+    def handle_update_order_book(self, message):
+        self.recorder.on_message(message, KIND_BOOK_DELTA)
+
+    def handle_unhandled_message(self, message):
+        message_type = message.get("type", "")
+        if message_type in ("subscribed/trade", "update/trade"):
+            self.recorder.on_message(message, KIND_TRADE)
+        elif message_type == "ping" and self.ws:
+            self.ws.send(json.dumps({"type": "pong"}))
+
+
+class MarketRecorder:
+    """行情录制器（WebSocket线程写入，断档或断线后重连，重新订阅时录下新快照）"""
+
+    def __init__(self, ws_url: str, market_indexes: List[int], directory: str, segment_seconds: int = 3600):
+        """
+        初始化录制器
+
+        Args:
+            ws_url: WebSocket服务器地址
+            market_indexes: 录制的市场索引
+            directory: 录制根目录
+            segment_seconds: 分段滚动间隔（秒）
+        """
+        self.ws_url = ws_url
+        self.market_indexes = list(market_indexes)
+        self.writers: Dict[int, SegmentWriter] = {
+            index: SegmentWriter(directory, index, segment_seconds) for index in self.market_indexes
+        }
+        self._book_nonces: Dict[int, Optional[int]] = {}
+        self.ws_client: Optional[RecorderWsClient] = None
+        self.ws_thread: Optional[threading.Thread] = None
+        self.ws_running = False
+        self.resync_count = 0
+
+    def on_message(self, message: Dict, kind: int):
+        """
+        录制一条消息（WebSocket线程中调用）
+
+        Args:
+            message: 原始消息
+            kind: 记录类型
+        """
+        ts_ns = time.time_ns()
+        try:
+            market_index = int(message.get("channel", "").replace("/", ":").split(":")[1])
+        except (IndexError, ValueError):
+            return
+        writer = self.writers.get(market_index)
+        if writer is None:
+            return
+        writer.append(ts_ns, kind, json.dumps(message, separators=(",", ":")).encode())
+
+        # 订单簿序列断档时重连，让回放数据里有新的快照
+        if kind == KIND_BOOK_SNAPSHOT:
+            self._book_nonces[market_index] = message.get("order_book", {}).get("nonce")
+        elif kind == KIND_BOOK_DELTA:
+            order_book = message.get("order_book", {})
+            begin_nonce, previous = order_book.get("begin_nonce"), self._book_nonces.get(market_index)
+            self._book_nonces[market_index] = order_book.get("nonce")
+            if begin_nonce is not None and previous is not None and begin_nonce != previous:
+                self.resync_count += 1
+                logging.warning(f"市场{market_index}订单簿序列断档，重连以录制新快照")
+                if self.ws_client and self.ws_client.ws:
+                    self.ws_client.ws.close()
+
+    def start(self):
+        """启动录制线程"""
+        if self.ws_running:
+            return
+        self.ws_running = True
+        self.ws_thread = threading.Thread(target=self._run_ws_client, daemon=True)
+        self.ws_thread.start()
+        logging.info(f"行情录制已启动: markets={self.market_indexes}")
+
+    def stop(self):
+        """停止录制并落盘"""
+        self.ws_running = False
+        try:
+            if self.ws_client and self.ws_client.ws:
+                self.ws_client.ws.close()
+            if self.ws_thread:
+                self.ws_thread.join(timeout=5)
+        except Exception as e:
+            logging.error(f"停止行情录制失败: {e}")
+        for market_index, writer in self.writers.items():
+            writer.close()
+            logging.info(f"市场{market_index}录制统计: {writer.stats()}")
+
+    def _run_ws_client(self):
+        """在线程中运行WebSocket客户端，断线后指数退避重连"""
+        consecutive_failures = 0
+        while self.ws_running:
+            try:
+                self._book_nonces.clear()
+                self.ws_client = RecorderWsClient(self, self.ws_url, self.market_indexes)
+                self.ws_client.run()
+                consecutive_failures = 0
+            except Exception as e:
+                consecutive_failures += 1
+                logging.error(f"行情录制WebSocket异常: {e}（连续失败{consecutive_failures}次）")
+            for writer in self.writers.values():
+                writer.flush()
+            if not self.ws_running:
+                break
+            time.sleep(min(2 ** consecutive_failures, 30))
+        logging.info("行情录制线程退出")
+
+
+async def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="行情录制")
+    parser.add_argument("--market", type=str, required=True, help="市场名称（如 ETH, BTC, ENA）")
+    parser.add_argument("--out", type=str, default="captures", help="录制根目录")
+    parser.add_argument("--segment-minutes", type=int, default=60, help="分段滚动间隔（分钟）")
+    parser.add_argument("--config", type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml"),
+                        help="配置文件路径")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    api_client = lighter.ApiClient(configuration=lighter.Configuration(host=config['lighter']['base_url']))
+    order_book = await get_market_index_by_name(api_client, args.market)
+    await api_client.close()
+    if order_book is None:
+        raise Exception(f"未找到市场: {args.market}")
+
+    recorder = MarketRecorder(
+        config['lighter']['ws_url'], [order_book.market_id], args.out, args.segment_minutes * 60
+    )
+    recorder.start()
+    try:
+        while True:
+            await asyncio.sleep(60)
+            for market_index, writer in recorder.writers.items():
+                logging.info(f"市场{market_index}录制统计: {writer.stats()}")
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logging.info("用户中断")
+    finally:
+        recorder.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    asyncio.run(main())
@@ -0,0 +1,455 @@
+"""
+行情回放
+读取market_recorder录制的分段文件，按原始时间节奏（speed=1）或尽快（speed=0）回放：
+- 分段文件用mmap读取，按 .idx 时间索引二分定位起始块，只解压需要的块；索引缺失或不完整时扫描块头重建
+- 写入中断留下的半截块直接截止，不影响前面的数据
+- 订单簿消息交给OrderBookFeed.on_order_book_message，与实盘取价走同一套代码
+- QuoteSimulator按A的挂单逻辑（空仓挂买N档开多、持多挂卖N档平多、超时重挂）在回放行情上模拟挂单，
+  用逐笔成交和排队位置估算成交，一次回放同时评估多组（depth, maker_order_time_out）
+
+用法:
+  python market_replay.py --capture ./captures --market-index 0 --quantity 0.1 --depths 1,2,3 --timeouts 10,30,60
+  python market_replay.py --capture ./captures --market-index 0 --quantity 0.1 --start 2026-10-01T00:00 --end 2026-10-02T00:00
+"""
+
+import argparse
+import bisect
+import glob
+import heapq
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from latency_tracker import LatencyHistogram
+from market_recorder import (
+    KIND_BOOK_SNAPSHOT, KIND_BOOK_DELTA, KIND_TRADE, BLOCK_MAGIC, BLOCK_HEADER, RECORD_HEADER,
+    INDEX_ENTRY, SEGMENT_SUFFIX, INDEX_SUFFIX
+)
+from order_book import OrderBookFeed, LocalOrderBook
+
+# (接收时间ns, 类型, 原始消息字节)
+Record = Tuple[int, int, bytes]
+# (接收时间ns, 类型, 消息)
+RecordHandler = Callable[[int, int, Dict], None]
+
+
+class SegmentReader:
+    """单个分段文件的只读访问（mmap）"""
+
+    def __init__(self, path: str):
+        """
+        打开分段文件并加载时间索引
+
+        Args:
+            path: .seg 文件路径
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        # [(首条时间ns, 末条时间ns, 块偏移)]
+        self.index: List[Tuple[int, int, int]] = self._load_index()
+        self._last_ts = [entry[1] for entry in self.index]
+
+    def _load_index(self) -> List[Tuple[int, int, int]]:
+        """读取 .idx，丢弃指向不完整块的索引项，再从最后一个已索引块之后扫描补齐"""
+        entries = []
+        index_path = self.path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for first_ns, last_ns, offset in INDEX_ENTRY.iter_unpack(data[:usable]):
+                if self._block_end(offset) is None:
+                    break
+                entries.append((first_ns, last_ns, offset))
+        else:
+            logging.warning(f"缺少索引文件，扫描块头重建: {self.path}")
+
+        offset = self._block_end(entries[-1][2]) if entries else 0
+        while offset is not None and offset < self.size:
+            end = self._block_end(offset)
+            if end is None:
+                logging.warning(f"分段文件尾部不完整，截止于偏移{offset}: {self.path}")
+                break
+            _, _, _, first_ns, last_ns = BLOCK_HEADER.unpack_from(self._mmap, offset)
+            entries.append((first_ns, last_ns, offset))
+            offset = end
+        return entries
+
+    def _block_end(self, offset: int) -> Optional[int]:
+        """块的结束偏移；块头无效或块不完整时返回None"""
+        if self._mmap is None or offset + BLOCK_HEADER.size > self.size:
+            return None
+        magic, length, _, _, _ = BLOCK_HEADER.unpack_from(self._mmap, offset)
+        end = offset + BLOCK_HEADER.size + length
+        if magic != BLOCK_MAGIC or end > self.size:
+            return None
+        return end
+
+    @property
+    def first_ns(self) -> Optional[int]:
+        return self.index[0][0] if self.index else None
+
+    @property
+    def last_ns(self) -> Optional[int]:
+        return self.index[-1][1] if self.index else None
+
+    def records(self, start_ns: Optional[int] = None, end_ns: Optional[int] = None) -> Iterator[Record]:
+        """
+        按时间顺序读取记录
+
+        Args:
+            start_ns: 起始时间（含，None表示从头）
+            end_ns: 结束时间（含，None表示到尾）
+
+        Yields:
+            (接收时间ns, 类型, 原始消息字节)
+        """
+        start = bisect.bisect_left(self._last_ts, start_ns) if start_ns is not None else 0
+        view = memoryview(self._mmap) if self._mmap is not None else None
+        try:
+            for first_ns, _, offset in self.index[start:]:
+                if end_ns is not None and first_ns > end_ns:
+                    return
+                _, length, _, _, _ = BLOCK_HEADER.unpack_from(self._mmap, offset)
+                body = offset + BLOCK_HEADER.size
+                raw = zlib.decompress(view[body:body + length])
+                position = 0
+                while position < len(raw):
+                    ts_ns, kind, size = RECORD_HEADER.unpack_from(raw, position)
+                    position += RECORD_HEADER.size
+                    payload = raw[position:position + size]
+                    position += size
+                    if start_ns is not None and ts_ns < start_ns:
+                        continue
+                    if end_ns is not None and ts_ns > end_ns:
+                        return
+                    yield ts_ns, kind, payload
+        finally:
+            if view is not None:
+                view.release()
+
+    def close(self):
+        """关闭文件"""
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+class MarketReplay:
+    """按时间顺序回放一个或多个市场的录制数据（多个市场按接收时间归并）"""
+
+    def __init__(self, directory: str, market_indexes: List[int],
+                 start_ns: Optional[int] = None, end_ns: Optional[int] = None):
+        """
+        初始化回放
+
+        Args:
+            directory: 录制根目录
+            market_indexes: 回放的市场索引
+            start_ns: 起始时间（UTC纳秒，None表示从头）
+            end_ns: 结束时间（UTC纳秒，None表示到尾）
+        """
+        self.directory = directory
+        self.market_indexes = list(market_indexes)
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.records_replayed = 0
+
+    def _market_records(self, market_index: int) -> Iterator[Record]:
+        """单个市场的记录（分段文件名即起始时间，按名称排序）"""
+        paths = sorted(glob.glob(os.path.join(self.directory, str(market_index), "*" + SEGMENT_SUFFIX)))
+        if not paths:
+            logging.warning(f"市场{market_index}没有录制数据: {self.directory}")
+        for path in paths:
+            reader = SegmentReader(path)
+            try:
+                if not reader.index:
+                    continue
+                if self.start_ns is not None and reader.last_ns < self.start_ns:
+                    continue
+                if self.end_ns is not None and reader.first_ns > self.end_ns:
+                    break
+                yield from reader.records(self.start_ns, self.end_ns)
+            finally:
+                reader.close()
+
+    def records(self) -> Iterator[Record]:
+        """所有市场按接收时间归并后的记录"""
+        streams = [self._market_records(index) for index in self.market_indexes]
+        if len(streams) == 1:
+            return streams[0]
+        return heapq.merge(*streams, key=lambda record: record[0])
+
+    def run(self, handlers: List[RecordHandler], speed: float = 0.0,
+            stop_event: Optional[threading.Event] = None) -> int:
+        """
+        回放记录，依次交给各处理函数
+
+        Args:
+            handlers: 处理函数列表 (接收时间ns, 类型, 消息)，按顺序调用（订单簿应放在最前）
+            speed: 回放倍速（1为原始节奏，0为尽快）
+            stop_event: 置位时提前结束
+
+        Returns:
+            回放的记录数
+        """
+        wall_start = time.monotonic()
+        first_ns = None
+        count = 0
+        for ts_ns, kind, payload in self.records():
+            if stop_event is not None and stop_event.is_set():
+                break
+            if speed > 0:
+                if first_ns is None:
+                    first_ns = ts_ns
+                delay = wall_start + (ts_ns - first_ns) / 1e9 / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            message = json.loads(payload)
+            for handler in handlers:
+                handler(ts_ns, kind, message)
+            count += 1
+        self.records_replayed += count
+        return count
+
+
+def order_book_handler(feed: OrderBookFeed) -> RecordHandler:
+    """
+    生成把订单簿记录交给OrderBookFeed的处理函数
+
+    Args:
+        feed: 订单簿订阅（不需要start，回放代替WebSocket线程写入）
+
+    Returns:
+        处理函数
+    """
+    def handle(ts_ns: int, kind: int, message: Dict):
+        if kind == KIND_BOOK_SNAPSHOT:
+            feed.on_order_book_message(message, is_snapshot=True)
+        elif kind == KIND_BOOK_DELTA:
+            feed.on_order_book_message(message, is_snapshot=False)
+    return handle
+
+
+class ReplayOrderBookFeed(OrderBookFeed):
+    """用录制数据代替WebSocket的订单簿订阅（默认按原始节奏回放），可直接替换OrderBookFeed给策略取价"""
+
+    def __init__(self, directory: str, market_indexes: List[int], speed: float = 1.0,
+                 start_ns: Optional[int] = None, end_ns: Optional[int] = None):
+        """
+        初始化回放订阅
+
+        Args:
+            directory: 录制根目录
+            market_indexes: 市场索引列表
+            speed: 回放倍速（1为原始节奏，0为尽快）
+            start_ns: 起始时间（UTC纳秒）
+            end_ns: 结束时间（UTC纳秒）
+        """
+        super().__init__("replay", market_indexes)
+        self.replay = MarketReplay(directory, market_indexes, start_ns, end_ns)
+        self.speed = speed
+        self.extra_handlers: List[RecordHandler] = []
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """停止回放"""
+        self._stop_event.set()
+        super().stop()
+
+    def _run_ws_client(self):
+        """在线程中回放录制数据"""
+        handlers = [order_book_handler(self)] + self.extra_handlers
+        count = self.replay.run(handlers, speed=self.speed, stop_event=self._stop_event)
+        logging.info(f"行情回放结束: {count}条记录")
+
+
+class VirtualOrder:
+    """模拟挂单"""
+
+    __slots__ = ("is_ask", "price", "remaining", "queue_ahead", "placed_ns")
+
+    def __init__(self, is_ask: bool, price: Decimal, remaining: Decimal, queue_ahead: Decimal, placed_ns: int):
+        self.is_ask = is_ask
+        self.price = price
+        self.remaining = remaining
+        self.queue_ahead = queue_ahead
+        self.placed_ns = placed_ns
+
+
+class QuoteSimulator:
+    """
+    在回放行情上模拟A的挂单（不下真实订单）
+
+    成交估算：
+    - 挂单时排在该价位已有数量之后（queue_ahead），该价位数量减少时视为前面的单撤单，排队同步缩短
+    - 逐笔成交价格优于挂单价（买单时成交价更低）时整单成交；等于挂单价时先消耗排队，剩余部分成交
+    - 挂单超过maker_order_time_out未完全成交时撤单按当前N档价格重挂，排队重新计算
+    不模拟B对冲延迟：一腿完全成交后下一条行情即挂下一腿
+    """
+
+    def __init__(self, book: LocalOrderBook, depth: int, maker_order_time_out: float, quantity: Decimal):
+        """
+        初始化模拟器
+
+        Args:
+            book: 回放维护的本地订单簿
+            depth: 挂单档位
+            maker_order_time_out: 挂单超时（秒）
+            quantity: 每腿数量
+        """
+        self.book = book
+        self.depth = depth
+        self.timeout_ns = int(maker_order_time_out * 1e9)
+        self.maker_order_time_out = maker_order_time_out
+        self.quantity = quantity
+
+        self.order: Optional[VirtualOrder] = None
+        self.long = False  # 当前是否持多（决定下一腿方向）
+        self.leg_started_ns: Optional[int] = None
+        self.leg_cost = Decimal(0)  # 当前腿累计成交金额
+        self.open_cost: Optional[Decimal] = None  # 开多腿成交金额
+
+        self.legs_filled = 0
+        self.round_trips = 0
+        self.requotes = 0
+        self.realized_pnl = Decimal(0)
+        self.time_to_fill = LatencyHistogram()
+
+    def on_record(self, ts_ns: int, kind: int, message: Dict):
+        """处理一条回放记录（订单簿已先行更新）"""
+        order = self.order
+        if order is None:
+            self._place(ts_ns)
+            return
+
+        if kind == KIND_TRADE:
+            for trade in message.get("trades") or []:
+                self._match(order, trade)
+                if order.remaining <= 0:
+                    self._on_leg_filled(ts_ns)
+                    return
+        elif kind == KIND_BOOK_DELTA:
+            order.queue_ahead = min(order.queue_ahead, self.book.level_size(str(order.price), not order.is_ask))
+
+        if ts_ns - order.placed_ns >= self.timeout_ns:
+            self.requotes += 1
+            self._place(ts_ns)
+
+    def _place(self, ts_ns: int):
+        """按当前N档价格挂单（空仓买N档，持多卖N档；订单簿不可用时保留原挂单）"""
+        is_ask = self.long
+        price = self.book.price_at_depth(self.depth, is_bid=not is_ask)
+        if price is None:
+            return
+        remaining = self.order.remaining if self.order is not None else self.quantity
+        self.order = VirtualOrder(
+            is_ask, Decimal(price), remaining, self.book.level_size(price, not is_ask), ts_ns
+        )
+        if self.leg_started_ns is None:
+            self.leg_started_ns = ts_ns
+
+    def _match(self, order: VirtualOrder, trade: Dict):
+        """用一笔公开成交撮合模拟挂单"""
+        # 挂单在卖方时，只有taker买入（maker为卖方）的成交能吃到它，反之亦然
+        if bool(trade.get("is_maker_ask")) != order.is_ask:
+            return
+        price, size = Decimal(str(trade["price"])), Decimal(str(trade["size"]))
+        through = price > order.price if order.is_ask else price < order.price
+        if through:
+            filled = order.remaining
+        elif price == order.price:
+            consumed = min(order.queue_ahead, size)
+            order.queue_ahead -= consumed
+            filled = min(order.remaining, size - consumed)
+        else:
+            return
+        if filled > 0:
+            order.remaining -= filled
+            self.leg_cost += filled * order.price
+
+    def _on_leg_filled(self, ts_ns: int):
+        """一腿完全成交：记录耗时和盈亏，翻转方向"""
+        self.legs_filled += 1
+        self.time_to_fill.record(ts_ns - self.leg_started_ns)
+        if self.long:
+            self.round_trips += 1
+            self.realized_pnl += self.leg_cost - self.open_cost
+        else:
+            self.open_cost = self.leg_cost
+        self.long = not self.long
+        self.order = None
+        self.leg_started_ns = None
+        self.leg_cost = Decimal(0)
+
+    def summary(self) -> str:
+        """返回统计摘要"""
+        stats = self.time_to_fill.snapshot()
+        return (
+            f"depth={self.depth}, timeout={self.maker_order_time_out}s: "
+            f"成交腿数={self.legs_filled}, 往返={self.round_trips}, 重挂={self.requotes}, "
+            f"成交耗时p50={stats['p50_ms'] / 1000:.1f}s, p99={stats['p99_ms'] / 1000:.1f}s, "
+            f"已实现价差={self.realized_pnl}"
+        )
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """ISO时间（按UTC）-> 纳秒"""
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1e9)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="行情回放与挂单参数评估")
+    parser.add_argument("--capture", type=str, default="captures", help="录制根目录")
+    parser.add_argument("--market-index", type=int, required=True, help="市场索引（录制目录名）")
+    parser.add_argument("--quantity", type=Decimal, required=True, help="挂单数量（base_amount）")
+    parser.add_argument("--depths", type=str, default="1,2,3", help="评估的挂单档位，逗号分隔")
+    parser.add_argument("--timeouts", type=str, default="30", help="评估的maker_order_time_out（秒），逗号分隔")
+    parser.add_argument("--start", type=str, help="起始时间（ISO格式，UTC）")
+    parser.add_argument("--end", type=str, help="结束时间（ISO格式，UTC）")
+    parser.add_argument("--speed", type=float, default=0.0, help="回放倍速（1为原始节奏，0为尽快）")
+    args = parser.parse_args()
+
+    feed = OrderBookFeed("replay", [args.market_index])
+    book = feed.get_book(args.market_index)
+    simulators = [
+        QuoteSimulator(book, depth, timeout, args.quantity)
+        for depth in (int(d) for d in args.depths.split(","))
+        for timeout in (float(t) for t in args.timeouts.split(","))
+    ]
+    replay = MarketReplay(args.capture, [args.market_index], parse_time(args.start), parse_time(args.end))
+    handlers = [order_book_handler(feed)] + [simulator.on_record for simulator in simulators]
+
+    started = time.monotonic()
+    count = replay.run(handlers, speed=args.speed)
+    elapsed = time.monotonic() - started
+
+    print("=" * 60)
+    print(f"回放{count}条记录，耗时{elapsed:.1f}秒，订单簿重新同步{feed.resync_count}次")
+    for simulator in simulators:
+        print(simulator.summary())
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    main()
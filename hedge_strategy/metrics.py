@@ -0,0 +1,364 @@
+"""
+Prometheus指标
+进程内的计数器/仪表/直方图注册表，以Prometheus文本格式（0.0.4）导出：
+- 指标对象线程安全，WebSocket线程和事件循环都可以直接更新
+- 可选的HTTP端点基于asyncio.start_server，运行在策略自己的事件循环上，不额外起线程
+- 事件循环延迟/阻塞指标由loop_monitor更新
+"""
+
+import asyncio
+import logging
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 样本: (样本名, ((标签名, 标签值), ...), 值)
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+# 延迟类直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_sample(name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> str:
+    pairs = ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+    return f"{name}{{{pairs}}} {_format_value(value)}" if pairs else f"{name} {_format_value(value)}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """指标基类：按标签值保存子指标"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        """按标签取子指标（不存在时创建）"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[Tuple[Tuple[str, ...], "_Metric"]]:
+        if not self.labelnames:
+            return [((), self)]
+        with self._lock:
+            return list(self._children.items())
+
+    def collect(self) -> List[Sample]:
+        """取所有样本"""
+        samples = []
+        for labelvalues, child in self._samples():
+            samples.extend(child._collect_child(self.name, tuple(zip(self.labelnames, labelvalues))))
+        return samples
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(_format_sample(*sample) for sample in self.collect())
+        return lines
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1):
+        """增加计数"""
+        with self._lock:
+            self.value += amount
+
+    def _collect_child(self, name, labels) -> List[Sample]:
+        return [(name, labels, self.value)]
+
+
+class Gauge(_Metric):
+    """可增可减的仪表；也可以设置回调在导出时取值"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+        self._callback: Optional[Callable[[], float]] = None
+
+    def _new_child(self):
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float):
+        """设置当前值"""
+        self.value = float(value)
+
+    def inc(self, amount: float = 1):
+        """增加"""
+        with self._lock:
+            self.value += amount
+
+    def set_function(self, callback: Callable[[], float]):
+        """导出时调用callback取值"""
+        self._callback = callback
+
+    def _collect_child(self, name, labels) -> List[Sample]:
+        value = self.value
+        if self._callback is not None:
+            try:
+                value = float(self._callback())
+            except Exception as e:
+                logging.debug(f"指标{name}取值失败: {e}")
+                return []
+        return [(name, labels, value)]
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets[:-1])
+
+    def observe(self, value: float):
+        """记录一次观测值"""
+        with self._lock:
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def _collect_child(self, name, labels) -> List[Sample]:
+        with self._lock:
+            counts = list(self.counts)
+            total_sum = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", labels + (("le", _format_value(float(bound))),), cumulative))
+        samples.append((f"{name}_sum", labels, total_sum))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """指标注册表（同名指标只注册一次）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, documentation: str, labelnames: Iterable[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标{name}已注册为{metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        """注册（或取已注册的）计数器"""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        """注册（或取已注册的）仪表"""
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        """注册（或取已注册的）直方图"""
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """导出Prometheus文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> List[Tuple[str, str, str, List[Sample]]]:
+        """
+        导出可pickle的快照（工作进程上报给supervisor汇总）
+
+        Returns:
+            [(指标名, 类型, 说明, 样本列表)]
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [(metric.name, metric.kind, metric.documentation, metric.collect()) for metric in metrics]
+
+
+def render_snapshots(snapshots: Dict[str, List[Tuple[str, str, str, List[Sample]]]], label: str) -> str:
+    """
+    合并多个进程的快照为Prometheus文本格式，每个样本加上来源标签
+
+    Args:
+        snapshots: {来源: MetricsRegistry.snapshot()}
+        label: 来源标签名（如 shard）
+
+    Returns:
+        Prometheus文本格式
+    """
+    merged: Dict[str, Tuple[str, str, List[Sample]]] = {}
+    for source, snapshot in snapshots.items():
+        for name, kind, documentation, samples in snapshot:
+            entry = merged.setdefault(name, (kind, documentation, []))
+            entry[2].extend(
+                (sample_name, ((label, str(source)),) + labels, value) for sample_name, labels, value in samples
+            )
+    lines = []
+    for name, (kind, documentation, samples) in merged.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(_format_sample(*sample) for sample in samples)
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+REGISTRY = MetricsRegistry()
+
+# ---------- 策略指标 ----------
+REST_REQUESTS = REGISTRY.counter("hedge_rest_requests_total", "REST请求数", ("endpoint", "status"))
+REST_LATENCY = REGISTRY.histogram("hedge_rest_request_seconds", "REST请求耗时（不含限流排队）", ("endpoint",))
+REST_BACKOFFS = REGISTRY.counter("hedge_rest_429_backoffs_total", "收到429后的退避次数", ("endpoint",))
+REST_THROTTLED_SECONDS = REGISTRY.counter("hedge_rest_throttled_seconds_total", "本地令牌桶限流排队总耗时", ("endpoint",))
+HTTP_CONNECTIONS = REGISTRY.counter("hedge_http_connections_total", "HTTP连接获取次数（created新建/reused复用）", ("event",))
+HTTP_CONNECT_LATENCY = REGISTRY.histogram("hedge_http_connect_seconds", "新建HTTP连接耗时（TCP+TLS握手）")
+HTTP_DNS_CACHE = REGISTRY.counter("hedge_http_dns_cache_total", "DNS缓存查询（hit/miss）", ("result",))
+NONCE_RESYNCS = REGISTRY.counter("hedge_nonce_resyncs_total", "nonce与服务端重新同步次数", ("account",))
+WS_RECONNECTS = REGISTRY.counter("hedge_ws_reconnects_total", "账户WebSocket断线重连次数", ("account",))
+HEDGE_ATTEMPTS = REGISTRY.counter("hedge_attempts_total", "B账户对冲下单尝试次数")
+HEDGE_RESULTS = REGISTRY.counter("hedge_results_total", "B账户对冲结果（重试用完才算failed）", ("status",))
+HEDGE_RESIDUAL_RETRIES = REGISTRY.counter("hedge_residual_retries_total", "对冲失败残余的重试结果（success/failed）", ("result",))
+HEDGE_TEMPLATES = REGISTRY.counter("hedge_templates_total", "B预签名对冲单（hit命中/miss现签/expired过期重签）", ("result",))
+HEDGE_LATENCY = REGISTRY.histogram("hedge_latency_seconds", "对冲链路分阶段延迟", ("stage",))
+EMERGENCY_FLATTEN_LATENCY = REGISTRY.histogram("hedge_emergency_flatten_seconds", "紧急平仓从开始到各腿完成的耗时", ("leg",))
+POSITION = REGISTRY.gauge("hedge_position", "账户持仓（带方向）", ("account", "market"))
+POSITION_IMBALANCE = REGISTRY.gauge("hedge_position_imbalance", "A、B持仓之和（完全对冲时为0）", ("market",))
+LOOP_LAG = REGISTRY.gauge("hedge_event_loop_lag_seconds", "最近一次事件循环调度延迟")
+LOOP_LAG_HISTOGRAM = REGISTRY.histogram(
+    "hedge_event_loop_lag_distribution_seconds", "事件循环调度延迟分布",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+LOOP_BLOCKS = REGISTRY.counter("hedge_event_loop_blocks_total", "事件循环阻塞次数（按阻塞点）", ("site",))
+LOOP_BLOCKED_SECONDS = REGISTRY.counter(
+    "hedge_event_loop_blocked_seconds_total", "事件循环累计阻塞时长（按阻塞点）", ("site",)
+)
+
+
+class MetricsServer:
+    """HTTP指标端点（GET /metrics），运行在事件循环上"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = "127.0.0.1", port: int = 9100):
+        """
+        初始化指标端点
+
+        Args:
+            registry: 指标注册表
+            host: 监听地址
+            port: 监听端口
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """启动HTTP端点"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logging.info(f"📈 指标端点已启动: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        """停止HTTP端点"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            logging.info("指标端点已停止")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一次HTTP请求（只支持GET /metrics）"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # 读掉请求头
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                body = self.registry.render().encode()
+                status = "200 OK"
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body = b"not found\n"
+                status = "404 Not Found"
+                content_type = "text/plain"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logging.debug(f"指标请求异常: {e}")
+        finally:
+            writer.close()
+
+
+async def start_metrics_server(config: Optional[Dict], port_offset: int = 0) -> Optional[MetricsServer]:
+    """
+    按配置启动指标端点（未启用时返回None）
+
+    Args:
+        config: 配置中的metrics段（enabled, host, port）
+        port_offset: 端口偏移（A/B两个进程同机部署时B使用port+1）
+
+    Returns:
+        指标端点
+    """
+    if not config or not config.get("enabled"):
+        return None
+    server = MetricsServer(
+        host=config.get("host", "127.0.0.1"),
+        port=config.get("port", 9100) + port_offset
+    )
+    try:
+        await server.start()
+    except OSError as e:
+        logging.error(f"指标端点启动失败: {e}")
+        return None
+    return server
@@ -0,0 +1,387 @@
+"""
+本地nonce分配器
+替换SignerClient自带的nonce管理器：
+- 按api_key_index在本地递增分配nonce，多笔签名交易可以连续发出，不必等上一笔确认
+- 记录在途nonce，由下单响应、账户WebSocket推送和REST nextNonce对账确认
+- 只有服务端nonce与本地真正不一致时才重新同步，并发的同步请求合并为一次；同步在事件循环上异步执行，
+  分配nonce从不发起阻塞请求，同步时仍在途的nonce不会被重新分配
+- 预留nonce（预签名交易）登记释放回调，其他交易分配nonce前先释放预留，不会在预留之后签出空洞
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from rest_gateway import get_gateway
+from metrics import NONCE_RESYNCS
+
+# 当前协程最近一次分配的 (api_key_index, nonce)，SDK回调acknowledge_failure时据此定位失败的nonce
+_current_nonce: contextvars.ContextVar[Optional[Tuple[int, int]]] = contextvars.ContextVar(
+    "current_nonce", default=None
+)
+
+
+class NonceAllocator:
+    """
+    nonce分配器（实现SDK nonce管理器的 next_nonce / acknowledge_failure / hard_refresh_nonce 接口）
+
+    - 首次分配时从SDK原管理器取初始值，之后完全在本地递增
+    - 发送失败且失败的是最后一个分配的nonce时直接回退，不触发同步
+    - 收到"invalid nonce"时通过REST nextNonce重新同步，同一api_key并发的同步共享一个任务
+    """
+
+    def __init__(self, signer_client: lighter.SignerClient, reconcile_interval: int = 30):
+        """
+        初始化分配器并替换signer_client.nonce_manager
+
+        Args:
+            signer_client: lighter签名客户端
+            reconcile_interval: 后台对账间隔（秒）
+        """
+        self.signer_client = signer_client
+        self.account_index = signer_client.account_index
+        self.reconcile_interval = reconcile_interval
+        self.gateway = get_gateway()
+
+        self._inner = signer_client.nonce_manager
+        self._lock = threading.Lock()
+        self._next: Dict[int, int] = {}  # api_key_index -> 下一个可用nonce
+        self._in_flight: Dict[int, Set[int]] = {}  # api_key_index -> 已分配未确认的nonce
+        self._max_confirmed: Dict[int, int] = {}  # api_key_index -> 已确认的最大nonce
+        self._stale: Set[int] = set()  # 需要从服务端重新同步的api_key_index
+        self._resync_tasks: Dict[int, asyncio.Task] = {}
+        self._last_resync: Dict[int, int] = {}  # api_key_index -> 上次同步时的服务端nonce
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._reservation_hooks: List[Callable[[], None]] = []
+
+        self.issued = 0
+        self.rollbacks = 0
+        self.confirmed = 0
+        self.resyncs = 0
+
+        signer_client.nonce_manager = self
+
+    # ---------- SDK nonce管理器接口 ----------
+
+    def next_nonce(self, reserve: bool = False) -> Tuple[int, int]:
+        """
+        分配下一个nonce（非预留分配前先调用释放回调，收回预签名交易占用的nonce）
+
+        Args:
+            reserve: 是否为预留（预签名交易）分配
+
+        Returns:
+            (api_key_index, nonce)
+        """
+        if not reserve:
+            for hook in self._reservation_hooks:
+                hook()
+        api_key_index = self.signer_client.api_key_index
+        with self._lock:
+            if api_key_index not in self._next:
+                # 首次分配：SDK原管理器构造时已取得初始值，本地取值，之后接管本地计数
+                api_key_index, nonce = self._inner.next_nonce()
+            else:
+                nonce = self._next[api_key_index]
+            self._next[api_key_index] = nonce + 1
+            self._in_flight.setdefault(api_key_index, set()).add(nonce)
+            self.issued += 1
+            stale = api_key_index in self._stale
+
+        if stale:
+            # 待同步时先按本地计数继续分配，同步在事件循环上进行，不在这里阻塞请求
+            self._request_resync(api_key_index)
+        _current_nonce.set((api_key_index, nonce))
+        return api_key_index, nonce
+
+    def acknowledge_failure(self, api_key_index: int):
+        """
+        交易发送失败（nonce未被服务端消耗）
+
+        Args:
+            api_key_index: API key索引
+        """
+        current = _current_nonce.get()
+        if current is None or current[0] != api_key_index:
+            # 无法确定是哪个nonce失败，交给对账处理
+            with self._lock:
+                self._stale.add(api_key_index)
+            return
+        self.release(api_key_index, current[1])
+        _current_nonce.set(None)
+
+    def release(self, api_key_index: int, nonce: int):
+        """
+        释放一个未被服务端消耗的nonce（自行签名的交易发送失败时调用）
+
+        Args:
+            api_key_index: API key索引
+            nonce: 发送失败的nonce
+        """
+        with self._lock:
+            self._in_flight.get(api_key_index, set()).discard(nonce)
+            if self._next.get(api_key_index) == nonce + 1:
+                # 失败的是最后一个分配的nonce，回退即可
+                self._next[api_key_index] = nonce
+                self.rollbacks += 1
+            # 否则中间留下空洞，后续在途交易若报invalid nonce再同步
+
+    def hard_refresh_nonce(self, api_key_index: int):
+        """
+        SDK在收到invalid nonce时调用：在事件循环上异步同步，不阻塞当前协程
+
+        Args:
+            api_key_index: API key索引
+        """
+        self._release_current(api_key_index)
+        self._request_resync(api_key_index)
+
+    def _release_current(self, api_key_index: int):
+        """收到invalid nonce的交易未消耗nonce，释放当前协程最近一次分配的nonce"""
+        current = _current_nonce.get()
+        if current is not None and current[0] == api_key_index:
+            self.release(*current)
+            _current_nonce.set(None)
+
+    def add_reservation_hook(self, release: Callable[[], None]):
+        """
+        登记预留nonce的释放回调：任何非预留的nonce分配之前都会调用（在事件循环线程中同步执行，
+        回调内调用release()回退预留的nonce）
+
+        Args:
+            release: 释放预留的回调
+        """
+        if release not in self._reservation_hooks:
+            self._reservation_hooks.append(release)
+
+    # ---------- 同步与对账 ----------
+
+    def _request_resync(self, api_key_index: int):
+        """
+        安排一次异步同步（可在任意线程调用）：在分配器的事件循环上合并为一个同步任务，
+        没有可用的事件循环时标记为待同步，由下一次分配或后台对账触发
+
+        Args:
+            api_key_index: API key索引
+        """
+        with self._lock:
+            self._stale.add(api_key_index)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None and (self._loop is None or loop is self._loop):
+            self._schedule_resync(api_key_index)
+        elif self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._schedule_resync, api_key_index)
+
+    def _schedule_resync(self, api_key_index: int) -> asyncio.Task:
+        """为api_key创建（或复用进行中的）同步任务"""
+        task = self._resync_tasks.get(api_key_index)
+        if task is None or task.done():
+            task = asyncio.get_running_loop().create_task(self._resync(api_key_index))
+            self._resync_tasks[api_key_index] = task
+        return task
+
+    async def _fetch_server_nonce(self, api_key_index: int) -> int:
+        """通过REST查询服务端的下一个nonce"""
+        transaction_api = self.gateway.transaction_api(self.signer_client.api_client)
+        result = await self.gateway.request(
+            "next_nonce",
+            transaction_api.next_nonce,
+            account_index=self.account_index,
+            api_key_index=api_key_index
+        )
+        return int(result.nonce)
+
+    async def _resync(self, api_key_index: int):
+        """
+        以服务端nonce为准同步本地计数
+
+        - 小于服务端nonce的在途nonce视为已确认
+        - 仍在途的nonce可能正在上链，从 max(服务端nonce, 最大在途nonce + 1) 继续分配，不重复使用
+        - 连续两次同步服务端nonce没有前进且该nonce仍在途时，视为在途交易已丢失，清空后从服务端nonce分配
+        """
+        try:
+            server_nonce = await self._fetch_server_nonce(api_key_index)
+        except Exception as e:
+            logging.error(f"同步nonce失败，下次分配或后台对账时重试: {e}")
+            with self._lock:
+                self._stale.add(api_key_index)
+            return
+
+        with self._lock:
+            local = self._next.get(api_key_index)
+            in_flight = self._in_flight.setdefault(api_key_index, set())
+            done = {n for n in in_flight if n < server_nonce}
+            in_flight -= done
+            self.confirmed += len(done)
+            if server_nonce in in_flight and self._last_resync.get(api_key_index) == server_nonce:
+                # 服务端一直停在这个nonce上，在途交易没有上链
+                lost = len(in_flight)
+                in_flight.clear()
+                logging.warning(f"nonce同步: api_key={api_key_index} 服务端未前进，丢弃{lost}个在途nonce")
+            self._next[api_key_index] = max([server_nonce] + [n + 1 for n in in_flight])
+            self._max_confirmed[api_key_index] = max(self._max_confirmed.get(api_key_index, -1), server_nonce - 1)
+            self._last_resync[api_key_index] = server_nonce
+            self._stale.discard(api_key_index)
+            self.resyncs += 1
+            NONCE_RESYNCS.labels(account=self.account_index).inc()
+            next_nonce, pending = self._next[api_key_index], len(in_flight)
+        logging.warning(f"nonce已重新同步: api_key={api_key_index}, 本地={local}, 服务端={server_nonce}, "
+                        f"在途={pending}, 下一个={next_nonce}")
+
+    async def handle_invalid_nonce(self, api_key_index: Optional[int] = None):
+        """
+        下单返回invalid nonce时调用：等待（合并后的）同步完成后即可立即重试
+
+        Args:
+            api_key_index: API key索引，默认使用签名客户端当前的key
+        """
+        if api_key_index is None:
+            api_key_index = self.signer_client.api_key_index
+        self._release_current(api_key_index)
+        with self._lock:
+            self._stale.add(api_key_index)
+        await asyncio.shield(self._schedule_resync(api_key_index))
+
+    def observe_server_nonce(self, api_key_index: int, server_nonce: int):
+        """
+        用服务端nonce对账
+
+        - 小于server_nonce的在途nonce视为已确认
+        - 服务端领先本地（其他进程用了同一个key）时跟进
+        - 本地领先但已无在途交易（发出的交易没有上链）时回退到服务端值
+
+        Args:
+            api_key_index: API key索引
+            server_nonce: 服务端的下一个nonce
+        """
+        with self._lock:
+            in_flight = self._in_flight.setdefault(api_key_index, set())
+            done = {n for n in in_flight if n < server_nonce}
+            in_flight -= done
+            self.confirmed += len(done)
+
+            local = self._next.get(api_key_index)
+            if local is None:
+                return
+            # 查询结果可能早于WebSocket确认，不回退到已确认的nonce之前
+            floor = self._max_confirmed.get(api_key_index, -1) + 1
+            if server_nonce > local or (floor <= server_nonce < local and not in_flight):
+                self._next[api_key_index] = server_nonce
+                self.resyncs += 1
+                NONCE_RESYNCS.labels(account=self.account_index).inc()
+                logging.warning(f"nonce对账不一致，已对齐: api_key={api_key_index}, 本地={local}, 服务端={server_nonce}")
+
+    def confirm(self, api_key_index: int, nonce: int):
+        """
+        确认某个nonce已被服务端接受
+
+        Args:
+            api_key_index: API key索引
+            nonce: 已确认的nonce
+        """
+        with self._lock:
+            in_flight = self._in_flight.get(api_key_index)
+            if in_flight and nonce in in_flight:
+                in_flight.discard(nonce)
+                self.confirmed += 1
+                if nonce > self._max_confirmed.get(api_key_index, -1):
+                    self._max_confirmed[api_key_index] = nonce
+
+    def confirm_current(self):
+        """确认当前协程最近一次分配的nonce（下单返回code=200后调用）"""
+        current = _current_nonce.get()
+        if current is not None:
+            self.confirm(*current)
+            _current_nonce.set(None)
+
+    def observe_account_update(self, account_data: Dict[str, Any]):
+        """
+        从账户WebSocket推送的订单中确认nonce（可在WebSocket线程中调用）
+
+        Args:
+            account_data: 账户推送数据
+        """
+        orders = account_data.get('orders') if isinstance(account_data, dict) else None
+        if not orders:
+            return
+        groups = orders.values() if isinstance(orders, dict) else [orders]
+        api_key_index = self.signer_client.api_key_index
+        for group in groups:
+            for order in group if isinstance(group, list) else [group]:
+                nonce = order.get('nonce') if isinstance(order, dict) else None
+                if nonce is not None:
+                    self.confirm(api_key_index, int(nonce))
+
+    def is_latest(self, api_key_index: int, nonce: int) -> bool:
+        """nonce仍在途且是最后一个分配的（预签名交易发送前校验，期间未被同步或跳号）"""
+        with self._lock:
+            return nonce in self._in_flight.get(api_key_index, ()) and self._next.get(api_key_index) == nonce + 1
+
+    def in_flight_count(self, api_key_index: Optional[int] = None) -> int:
+        """在途（未确认）的nonce数量"""
+        if api_key_index is None:
+            api_key_index = self.signer_client.api_key_index
+        with self._lock:
+            return len(self._in_flight.get(api_key_index, ()))
+
+    def start(self):
+        """启动后台对账任务（必须在事件循环线程中调用）"""
+        self._loop = asyncio.get_running_loop()
+        if self._reconcile_task is None or self._reconcile_task.done():
+            self._reconcile_task = self._loop.create_task(self._reconcile_loop())
+            logging.info(f"nonce分配器已启动: account={self.account_index}")
+
+    def stop(self):
+        """停止后台对账任务"""
+        if self._reconcile_task and not self._reconcile_task.done():
+            self._reconcile_task.cancel()
+
+    async def _reconcile_loop(self):
+        """定期用REST nextNonce对账（权重很低），清理已上链的在途nonce"""
+        while True:
+            try:
+                await asyncio.sleep(self.reconcile_interval)
+                for api_key_index in list(self._stale):
+                    # 之前同步失败或在其他线程标记的待同步
+                    await self._schedule_resync(api_key_index)
+                for api_key_index in list(self._next.keys()):
+                    server_nonce = await self._fetch_server_nonce(api_key_index)
+                    self.observe_server_nonce(api_key_index, server_nonce)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.warning(f"nonce对账失败: {e}")
+
+    def stats(self) -> str:
+        """返回分配统计"""
+        return (
+            f"nonce分配器: issued={self.issued}, confirmed={self.confirmed}, "
+            f"rollbacks={self.rollbacks}, resyncs={self.resyncs}, in_flight={self.in_flight_count()}"
+        )
+
+
+def get_nonce_allocator(signer_client: lighter.SignerClient) -> NonceAllocator:
+    """
+    获取SignerClient对应的nonce分配器（首次调用时安装到signer_client上）
+
+    Args:
+        signer_client: lighter签名客户端
+
+    Returns:
+        nonce分配器
+    """
+    if isinstance(signer_client.nonce_manager, NonceAllocator):
+        return signer_client.nonce_manager
+    return NonceAllocator(signer_client)
@@ -0,0 +1,429 @@
+"""
+本地订单簿镜像
+通过WebSocket订单簿频道（快照 + 增量）维护每个市场的有序价格档位，
+挂单/平仓取价直接读内存，REST只在重新同步期间兜底
+"""
+
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, Any, Optional, List, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from lighter import WsClient
+from utils import get_orderbook_price_at_depth, get_orderbook
+
+
+def _level_fields(level) -> Tuple[str, str]:
+    """
+    读取档位的价格和数量，兼容WebSocket推送（dict）和REST返回（对象）
+
+    Args:
+        level: 档位数据
+
+    Returns:
+        (价格字符串, 数量字符串)
+    """
+    if isinstance(level, dict):
+        return str(level["price"]), str(level.get("size", level.get("remaining_base_amount", "0")))
+    return str(level.price), str(getattr(level, "size", getattr(level, "remaining_base_amount", "0")))
+
+
+class LocalOrderBook:
+    """
+    单个市场的本地订单簿
+
+    买卖盘各自用升序价格列表 + {价格: (价格字符串, 数量字符串)} 字典维护：
+    - 最优价：买盘取列表末尾、卖盘取列表开头，O(1)
+    - 第N档：直接按下标读取，O(1)；增量更新用bisect定位，O(log n)查找
+    """
+
+    def __init__(self, market_index: int):
+        """
+        初始化本地订单簿
+
+        Args:
+            market_index: 市场索引
+        """
+        self.market_index = market_index
+        self.valid = False  # 收到快照前/序列号断档后为False
+        self.offset: Optional[int] = None
+        self.nonce: Optional[int] = None
+        self.last_update_time = 0.0
+        self.update_count = 0
+
+        self._bid_prices: List[Decimal] = []  # 升序
+        self._ask_prices: List[Decimal] = []  # 升序
+        self._bid_levels: Dict[Decimal, Tuple[str, str]] = {}
+        self._ask_levels: Dict[Decimal, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def apply_snapshot(self, bids, asks, offset: Optional[int] = None, nonce: Optional[int] = None):
+        """
+        用快照重建订单簿
+
+        Args:
+            bids: 买盘档位列表
+            asks: 卖盘档位列表
+            offset: 快照的offset（可选）
+            nonce: 快照的nonce（可选）
+        """
+        with self._lock:
+            self._bid_prices, self._bid_levels = [], {}
+            self._ask_prices, self._ask_levels = [], {}
+            for level in bids or []:
+                self._set_level(True, *_level_fields(level))
+            for level in asks or []:
+                self._set_level(False, *_level_fields(level))
+            self.offset = offset
+            self.nonce = nonce
+            self.valid = True
+            self.last_update_time = time.time()
+            self.update_count += 1
+        logging.info(
+            f"市场{self.market_index}订单簿快照已加载: 买盘{len(self._bid_prices)}档, 卖盘{len(self._ask_prices)}档"
+        )
+
+    def apply_delta(self, bids, asks, offset: Optional[int] = None,
+                    begin_nonce: Optional[int] = None, nonce: Optional[int] = None) -> bool:
+        """
+        应用增量更新（数量为0表示删除该档）
+
+        序列检查：
+        - 带begin_nonce时必须等于上一次的nonce，否则视为断档
+        - 只带offset时必须单调递增，回退的增量视为重复消息直接丢弃
+
+        Args:
+            bids: 买盘变化档位
+            asks: 卖盘变化档位
+            offset: 增量的offset（可选）
+            begin_nonce: 增量起始nonce（可选）
+            nonce: 增量结束nonce（可选）
+
+        Returns:
+            是否与本地订单簿连续（False表示需要重新同步）
+        """
+        with self._lock:
+            if not self.valid:
+                return False
+            if begin_nonce is not None and self.nonce is not None and begin_nonce != self.nonce:
+                self.valid = False
+                logging.warning(
+                    f"市场{self.market_index}订单簿序列断档: 本地nonce={self.nonce}, 增量begin_nonce={begin_nonce}"
+                )
+                return False
+            if offset is not None and self.offset is not None and offset <= self.offset:
+                logging.debug(f"市场{self.market_index}丢弃过期增量: offset={offset} <= {self.offset}")
+                return True
+
+            for level in bids or []:
+                self._set_level(True, *_level_fields(level))
+            for level in asks or []:
+                self._set_level(False, *_level_fields(level))
+            if offset is not None:
+                self.offset = offset
+            if nonce is not None:
+                self.nonce = nonce
+            self.last_update_time = time.time()
+            self.update_count += 1
+            return True
+
+    def _set_level(self, is_bid: bool, price_str: str, size_str: str):
+        """
+        更新单个档位（调用方持有锁）
+
+        Args:
+            is_bid: 是否买盘
+            price_str: 价格字符串
+            size_str: 数量字符串
+        """
+        prices = self._bid_prices if is_bid else self._ask_prices
+        levels = self._bid_levels if is_bid else self._ask_levels
+        price = Decimal(price_str)
+        exists = price in levels
+
+        if Decimal(size_str) == 0:
+            if exists:
+                del levels[price]
+                del prices[bisect.bisect_left(prices, price)]
+            return
+
+        if not exists:
+            bisect.insort(prices, price)
+        levels[price] = (price_str, size_str)
+
+    def invalidate(self, reason: str = ""):
+        """标记订单簿失效，等待重新同步"""
+        with self._lock:
+            self.valid = False
+        logging.warning(f"市场{self.market_index}本地订单簿失效: {reason}")
+
+    def price_at_depth(self, depth: int, is_bid: bool = True) -> Optional[str]:
+        """
+        获取第N档价格
+
+        Args:
+            depth: 档位（1表示第一档）
+            is_bid: True表示买盘，False表示卖盘
+
+        Returns:
+            价格字符串；订单簿失效或档位不足时返回None
+        """
+        with self._lock:
+            if not self.valid or depth < 1:
+                return None
+            if is_bid:
+                if len(self._bid_prices) < depth:
+                    return None
+                return self._bid_levels[self._bid_prices[-depth]][0]
+            if len(self._ask_prices) < depth:
+                return None
+            return self._ask_levels[self._ask_prices[depth - 1]][0]
+
+    def best_bid(self) -> Optional[Tuple[str, str]]:
+        """最优买价 (价格, 数量)"""
+        with self._lock:
+            if not self.valid or not self._bid_prices:
+                return None
+            return self._bid_levels[self._bid_prices[-1]]
+
+    def best_ask(self) -> Optional[Tuple[str, str]]:
+        """最优卖价 (价格, 数量)"""
+        with self._lock:
+            if not self.valid or not self._ask_prices:
+                return None
+            return self._ask_levels[self._ask_prices[0]]
+
+    def level_size(self, price: str, is_bid: bool = True) -> Decimal:
+        """
+        获取指定价格档位的挂单数量
+
+        Args:
+            price: 价格字符串
+            is_bid: True表示买盘，False表示卖盘
+
+        Returns:
+            挂单数量；没有该档位时为0
+        """
+        with self._lock:
+            level = (self._bid_levels if is_bid else self._ask_levels).get(Decimal(price))
+            return Decimal(level[1]) if level else Decimal(0)
+
+    def depth_size(self) -> Tuple[int, int]:
+        """当前 (买盘档数, 卖盘档数)"""
+        with self._lock:
+            return len(self._bid_prices), len(self._ask_prices)
+
+
+class OrderBookWsClient(WsClient):
+    """
+    订单簿专用WebSocket客户端
+
+    覆盖SDK的订单簿处理：SDK会把增量合并到列表（逐档线性查找）后回调整本订单簿，
+    这里直接把原始快照/增量交给OrderBookFeed维护有序档位
+    """
+
+    def __init__(self, feed: "OrderBookFeed", host: str, order_book_ids: List[int]):
+        super().__init__(
+            host=host,
+            order_book_ids=order_book_ids,
+            account_ids=[],
+            on_order_book_update=lambda market_id, order_book: None,
+            on_account_update=lambda account_id, account: None
+        )
+        self.feed = feed
+
+    def handle_subscribed_order_book(self, message):
+        self.feed.on_order_book_message(message, is_snapshot=True)
+
+    def handle_update_order_book(self, message):
+        self.feed.on_order_book_message(message, is_snapshot=False)
+
+
+class OrderBookFeed:
+    """
+    订单簿WebSocket订阅 + 本地订单簿管理
+
+    - 每个市场一个LocalOrderBook，由WebSocket线程写入
+    - 序列断档或连接断开时标记失效并重连（重新订阅会收到新快照）
+    - 失效期间取价回退到REST
+    """
+
+    def __init__(self, ws_url: str, market_indexes: List[int]):
+        """
+        初始化订单簿订阅
+
+        Args:
+            ws_url: WebSocket服务器地址
+            market_indexes: 订阅的市场索引列表
+        """
+        self.ws_url = ws_url
+        self.market_indexes = list(market_indexes)
+        self.books: Dict[int, LocalOrderBook] = {index: LocalOrderBook(index) for index in self.market_indexes}
+        self.ws_client: Optional[OrderBookWsClient] = None
+        self.ws_thread: Optional[threading.Thread] = None
+        self.ws_running = False
+        self.resync_count = 0
+        self.rest_fallback_count = 0
+
+    def get_book(self, market_index: int) -> Optional[LocalOrderBook]:
+        """获取指定市场的本地订单簿"""
+        return self.books.get(market_index)
+
+    def start(self):
+        """启动订单簿订阅线程"""
+        if self.ws_running:
+            return
+        self.ws_running = True
+        self.ws_thread = threading.Thread(target=self._run_ws_client, daemon=True)
+        self.ws_thread.start()
+        logging.info(f"订单簿WebSocket订阅已启动: markets={self.market_indexes}")
+
+    def stop(self):
+        """停止订单簿订阅"""
+        if not self.ws_running:
+            return
+        self.ws_running = False
+        try:
+            if self.ws_client and self.ws_client.ws:
+                self.ws_client.ws.close()
+            if self.ws_thread:
+                self.ws_thread.join(timeout=5)
+        except Exception as e:
+            logging.error(f"停止订单簿订阅失败: {e}")
+        logging.info("订单簿WebSocket订阅已停止")
+
+    def _run_ws_client(self):
+        """在线程中运行WebSocket客户端，支持断线重连和指数退避"""
+        base_retry_interval = 1
+        max_retry_interval = 30
+        consecutive_failures = 0
+
+        while self.ws_running:
+            try:
+                self.ws_client = OrderBookWsClient(self, self.ws_url, self.market_indexes)
+                self.ws_client.run()
+                consecutive_failures = 0
+            except Exception as e:
+                consecutive_failures += 1
+                logging.error(f"订单簿WebSocket运行异常: {e}（连续失败{consecutive_failures}次）")
+
+            # 连接断开后本地订单簿不再可信，等待重连后的新快照
+            for book in self.books.values():
+                book.invalidate("WebSocket连接断开")
+            if not self.ws_running:
+                break
+
+            retry_interval = min(base_retry_interval * (2 ** consecutive_failures), max_retry_interval)
+            logging.warning(f"订单簿WebSocket连接断开，{retry_interval}秒后重连...")
+            time.sleep(retry_interval)
+
+        logging.info("订单簿WebSocket线程退出")
+
+    def on_order_book_message(self, message: Dict[str, Any], is_snapshot: bool):
+        """
+        处理订单簿快照/增量消息（WebSocket线程中调用）
+
+        Args:
+            message: 原始消息
+            is_snapshot: 是否为订阅快照
+        """
+        try:
+            channel = message.get("channel", "")
+            market_index = int(channel.replace("/", ":").split(":")[1])
+            book = self.books.get(market_index)
+            if book is None:
+                return
+
+            order_book = message.get("order_book", {})
+            offset = order_book.get("offset", message.get("offset"))
+            nonce = order_book.get("nonce")
+
+            if is_snapshot:
+                book.apply_snapshot(order_book.get("bids"), order_book.get("asks"), offset=offset, nonce=nonce)
+                return
+
+            in_sequence = book.apply_delta(
+                order_book.get("bids"),
+                order_book.get("asks"),
+                offset=offset,
+                begin_nonce=order_book.get("begin_nonce"),
+                nonce=nonce
+            )
+            if not in_sequence:
+                self._request_resync(book)
+        except Exception as e:
+            logging.error(f"处理订单簿消息异常: {e}", exc_info=True)
+
+    def _request_resync(self, book: LocalOrderBook):
+        """
+        断档后重新同步：关闭连接触发重连，重新订阅时会收到完整快照
+
+        Args:
+            book: 失效的本地订单簿
+        """
+        if book.valid:
+            book.invalidate("序列断档")
+        self.resync_count += 1
+        logging.warning(f"市场{book.market_index}订单簿重新同步 (第{self.resync_count}次)")
+        try:
+            if self.ws_client and self.ws_client.ws:
+                self.ws_client.ws.close()
+        except Exception as e:
+            logging.debug(f"关闭订单簿WebSocket连接时出错: {e}")
+
+    async def get_price_at_depth(self, api_client: lighter.ApiClient, market_index: int,
+                                 depth: int, is_bid: bool = True) -> Optional[str]:
+        """
+        获取第N档价格：优先读本地订单簿，失效或档位不足时回退REST
+
+        Args:
+            api_client: lighter API客户端（REST兜底用）
+            market_index: 市场索引
+            depth: 档位
+            is_bid: True表示买盘，False表示卖盘
+
+        Returns:
+            价格字符串或None
+        """
+        book = self.books.get(market_index)
+        price = book.price_at_depth(depth, is_bid) if book else None
+        if price is not None:
+            logging.info(f"市场{market_index} {'买' if is_bid else '卖'}{depth}档价格(本地订单簿): {price}")
+            return price
+
+        self.rest_fallback_count += 1
+        logging.info(f"本地订单簿不可用，回退REST获取市场{market_index}第{depth}档价格")
+        return await get_orderbook_price_at_depth(api_client, market_index, depth, is_bid=is_bid)
+
+    async def get_best_prices(self, api_client: lighter.ApiClient,
+                              market_index: int) -> Tuple[Optional[str], Optional[str]]:
+        """
+        获取最优买价和最优卖价：优先读本地订单簿，失效时回退REST
+
+        Args:
+            api_client: lighter API客户端（REST兜底用）
+            market_index: 市场索引
+
+        Returns:
+            (最优买价, 最优卖价)
+        """
+        book = self.books.get(market_index)
+        if book is not None:
+            best_bid, best_ask = book.best_bid(), book.best_ask()
+            if best_bid is not None and best_ask is not None:
+                return best_bid[0], best_ask[0]
+
+        self.rest_fallback_count += 1
+        logging.info(f"本地订单簿不可用，回退REST获取市场{market_index}最优价")
+        orderbook = await get_orderbook(api_client, market_index)
+        best_bid = str(orderbook.bids[0].price) if orderbook.bids else None
+        best_ask = str(orderbook.asks[0].price) if orderbook.asks else None
+        return best_bid, best_ask
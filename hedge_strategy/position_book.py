@@ -0,0 +1,245 @@
+"""
+持仓簿
+由账户WebSocket推送维护持仓和可用余额，读取直接走内存：
+- 推送到达即更新内存，只有持仓真正变化时才写Redis
+- 启动时用REST初始化一次，之后只做低频REST兜底对账（替代每5秒轮询的线程）
+- 本进程未跟踪的账户（如另一进程的B账户）从Redis读取
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import POSITION
+from redis_messenger import RedisMessenger
+from utils import get_positions
+
+
+class PositionBook:
+    """持仓簿（线程安全，WebSocket线程写、事件循环读）"""
+
+    def __init__(self, redis_messenger: RedisMessenger, market_name: str, market_index: int):
+        """
+        初始化持仓簿
+
+        Args:
+            redis_messenger: Redis消息管理器（持仓写入Redis Hash）
+            market_name: 市场名称（Redis key使用）
+            market_index: 市场索引
+        """
+        self.redis_messenger = redis_messenger
+        self.market_name = market_name
+        self.market_index = market_index
+
+        # account_name -> {account_index, size, sign, available_balance, updated_at}
+        self.positions: Dict[str, Dict[str, Any]] = {}
+        self._names_by_index: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._reconcile_task: Optional[asyncio.Task] = None
+
+        self.ws_updates = 0
+        self.redis_writes = 0
+
+    def register_account(self, account_name: str, account_index: int):
+        """
+        登记本进程跟踪的账户
+
+        Args:
+            account_name: 账户名称
+            account_index: 账户索引
+        """
+        with self._lock:
+            self._names_by_index[int(account_index)] = account_name
+            self.positions.setdefault(account_name, {
+                "account_index": account_index,
+                "size": None,
+                "sign": 0,
+                "available_balance": None,
+                "updated_at": 0.0,
+                "changed_at": 0.0
+            })
+
+    def _apply(self, account_name: str, size: Decimal, sign: int, available_balance=None) -> bool:
+        """
+        更新内存持仓，变化时写Redis
+
+        Returns:
+            持仓是否变化
+        """
+        with self._lock:
+            position = self.positions[account_name]
+            changed = position["size"] != size or position["sign"] != sign
+            balance_changed = available_balance is not None and available_balance != position["available_balance"]
+            position["size"] = size
+            position["sign"] = sign
+            if changed:
+                position["changed_at"] = time.time()
+            if available_balance is not None:
+                position["available_balance"] = available_balance
+            position["updated_at"] = time.time()
+            account_index = position["account_index"]
+            balance = position["available_balance"]
+        POSITION.labels(account=account_name, market=self.market_name).set(float(size) * (sign or 1))
+
+        if changed or balance_changed:
+            self.redis_messenger.update_position(
+                account_name=account_name,
+                account_index=account_index,
+                market=self.market_name,
+                position_size=size,
+                sign=sign,
+                available_balance=balance
+            )
+            self.redis_writes += 1
+            if changed:
+                logging.info(f"📊 持仓变化: {account_name} size={size}, sign={sign}")
+        return changed
+
+    def on_account_update(self, account_id, account_data: Dict[str, Any]):
+        """
+        账户WebSocket推送回调（在WebSocket线程中调用）
+
+        Args:
+            account_id: 账户ID
+            account_data: 推送数据（positions字段按market_index组织）
+        """
+        if not isinstance(account_data, dict):
+            return
+        try:
+            account_name = self._names_by_index.get(int(account_id))
+        except (TypeError, ValueError):
+            account_name = None
+        if account_name is None:
+            return
+
+        available_balance = account_data.get("available_balance")
+        positions = account_data.get("positions") or {}
+        position = positions.get(str(self.market_index)) if isinstance(positions, dict) else None
+        if position is None and isinstance(positions, list):
+            position = next((p for p in positions if p.get("market_id") == self.market_index), None)
+
+        if position is None:
+            if available_balance is not None:
+                with self._lock:
+                    current = self.positions[account_name]
+                    size, sign = current["size"], current["sign"]
+                if size is not None:
+                    self._apply(account_name, size, sign, available_balance)
+            return
+
+        self.ws_updates += 1
+        size = abs(Decimal(str(position.get("position", "0"))))
+        sign = int(position.get("sign", 0)) if size != 0 else 0
+        self._apply(account_name, size, sign, available_balance)
+
+    async def refresh(self, api_client, account_name: str) -> Tuple[Decimal, int, Optional[str]]:
+        """
+        用REST查询一次持仓（启动初始化和兜底对账）
+
+        Args:
+            api_client: lighter API客户端
+            account_name: 账户名称
+
+        Returns:
+            (position_size, sign, available_balance)
+        """
+        account_index = self.positions[account_name]["account_index"]
+        position_size, sign, available_balance = await get_positions(api_client, account_index, self.market_index)
+        if available_balance is None:
+            # get_positions出错时返回(0, 0, None)，不能当作空仓写入
+            logging.warning(f"查询{account_name}持仓失败，保留内存中的持仓")
+            return self.get_position(account_name)
+        self._apply(account_name, Decimal(position_size), sign, available_balance)
+        return position_size, sign, available_balance
+
+    def _snapshot(self, account_name: str) -> Optional[Dict[str, Any]]:
+        """本进程跟踪账户的内存持仓（未跟踪或未初始化时返回None）"""
+        with self._lock:
+            position = self.positions.get(account_name)
+            if position is None or position["size"] is None:
+                return None
+            return {
+                "size": float(position["size"]),
+                "sign": position["sign"],
+                "available_balance": position["available_balance"],
+                "updated_at": position["updated_at"],
+                "timestamp": position["changed_at"],
+            }
+
+    def get(self, account_name: str) -> Optional[Dict[str, Any]]:
+        """
+        读取持仓：本进程跟踪的账户读内存，其他账户读Redis（同步Redis客户端）
+
+        Args:
+            account_name: 账户名称
+
+        Returns:
+            持仓字典（size, sign, available_balance, timestamp=最近一次变化时间）或None
+        """
+        position = self._snapshot(account_name)
+        if position is not None:
+            return position
+        return self.redis_messenger.get_position_by_account_name(account_name, self.market_name)
+
+    async def fetch(self, account_name: str) -> Optional[Dict[str, Any]]:
+        """
+        在协程中读取持仓：本进程跟踪的账户读内存，其他账户读Redis（不阻塞事件循环）
+
+        Args:
+            account_name: 账户名称
+
+        Returns:
+            同get
+        """
+        position = self._snapshot(account_name)
+        if position is not None:
+            return position
+        return await self.redis_messenger.fetch_position(account_name, self.market_name)
+
+    def get_position(self, account_name: str) -> Tuple[Decimal, int, Optional[str]]:
+        """
+        读取本进程跟踪账户的持仓（内存）
+
+        Returns:
+            (position_size, sign, available_balance)，与utils.get_positions格式一致
+        """
+        with self._lock:
+            position = self.positions[account_name]
+            size = position["size"] if position["size"] is not None else Decimal(0)
+            return size, position["sign"], position["available_balance"]
+
+    def start_reconcile(self, api_clients: Dict[str, Any], interval: float = 60):
+        """
+        启动低频REST兜底对账（必须在事件循环线程中调用）
+
+        Args:
+            api_clients: account_name -> lighter API客户端
+            interval: 对账间隔（秒）
+        """
+        if self._reconcile_task is None or self._reconcile_task.done():
+            self._reconcile_task = asyncio.get_running_loop().create_task(
+                self._reconcile_loop(api_clients, interval)
+            )
+
+    async def _reconcile_loop(self, api_clients: Dict[str, Any], interval: float):
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                for account_name, api_client in api_clients.items():
+                    await self.refresh(api_client, account_name)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.warning(f"持仓对账失败: {e}")
+
+    def stop(self):
+        """停止兜底对账"""
+        if self._reconcile_task and not self._reconcile_task.done():
+            self._reconcile_task.cancel()
+
+    def stats(self) -> str:
+        """返回统计"""
+        return f"持仓簿: WebSocket更新={self.ws_updates}, Redis写入={self.redis_writes}"
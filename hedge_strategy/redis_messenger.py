@@ -1,14 +1,337 @@
 """
 Redis消息管理器
 使用Pub/Sub模式实现A/B账户之间的消息通信
+单进程部署时可挂载进程内传输（InProcessTransport），Redis仅作为审计镜像
+AsyncRedisMessenger基于redis.asyncio，所有Redis I/O都在事件循环上异步执行
+消息线路格式可按channel选择JSON或紧凑二进制（见wire_format），接收端自动识别
+成交消息可改走Redis Streams（RedisStreamTransport），订阅方重启期间的消息不会丢失
 """
 
+import asyncio
 import json
 import logging
+import struct
+import time
 import redis
-from typing import Callable, Optional, Dict, Any
+import redis.asyncio as aioredis
+from typing import Callable, Optional, Dict, Any, AsyncIterator, Iterable, List, Tuple
 import threading
 
+import wire_format
+from latency_tracker import stamp
+
+
+class InProcessTransport:
+    """
+    进程内消息传输，基于asyncio.Queue
+
+    A/B运行在同一进程时，成交消息不再经过 JSON序列化 → Redis → 订阅线程 → run_coroutine_threadsafe
+    这条链路，而是直接投递到事件循环上的队列，由消费任务调用订阅回调。
+    publish可以在任意线程调用（例如WebSocket线程），内部通过call_soon_threadsafe投递。
+    """
+
+    def __init__(self, maxsize: int = 0):
+        """
+        初始化进程内传输
+
+        Args:
+            maxsize: 队列最大长度（0表示不限制）
+        """
+        self.maxsize = maxsize
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._consumer_task: Optional[asyncio.Task] = None
+        self._handler_tasks = set()  # 执行中的协程回调
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """
+        绑定事件循环并创建队列（必须在事件循环线程中调用）
+
+        Args:
+            loop: 运行订阅回调的事件循环
+        """
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+
+    def has_subscriber(self, channel: str) -> bool:
+        """指定channel是否有进程内订阅者"""
+        return channel in self.handlers
+
+    def subscribe(self, channel: str, callback: Callable[[Dict[str, Any]], Any]):
+        """
+        订阅指定channel，回调可以是普通函数或协程函数
+
+        Args:
+            channel: channel名称
+            callback: 收到消息时的回调函数
+        """
+        self.handlers[channel] = callback
+        logging.info(f"进程内订阅channel: {channel}")
+
+    def publish(self, channel: str, message_data: Dict[str, Any]):
+        """
+        投递消息（线程安全）
+
+        Args:
+            channel: channel名称
+            message_data: 消息数据
+        """
+        if self.loop is None or self.queue is None:
+            raise RuntimeError("进程内传输未绑定事件循环")
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (channel, message_data))
+
+    def start(self):
+        """启动消费任务（必须在事件循环线程中调用）"""
+        if self.queue is None:
+            self.bind_loop(asyncio.get_event_loop())
+        if self._consumer_task is None or self._consumer_task.done():
+            self._consumer_task = self.loop.create_task(self._consume())
+            logging.info("进程内消息消费任务已启动")
+
+    def stop(self):
+        """停止消费任务"""
+        if self._consumer_task and not self._consumer_task.done():
+            self._consumer_task.cancel()
+            logging.info("进程内消息消费任务已停止")
+
+    async def _consume(self):
+        """在事件循环上依次派发消息"""
+        while True:
+            channel, message_data = await self.queue.get()
+            callback = self.handlers.get(channel)
+            if callback is None:
+                continue
+            try:
+                result = callback(message_data)
+                if asyncio.iscoroutine(result):
+                    # 不阻塞后续消息的派发，保留任务引用直到完成
+                    task = self.loop.create_task(result)
+                    self._handler_tasks.add(task)
+                    task.add_done_callback(self._handler_tasks.discard)
+            except Exception as e:
+                logging.error(f"处理进程内消息失败: {e}")
+
+
+class RedisStreamTransport:
+    """
+    基于Redis Streams的持久化消息传输（asyncio，供AsyncRedisMessenger使用）
+
+    pub/sub在订阅方重启或卡住时会直接丢消息，成交消息改走Stream：
+    - 发布: XADD，按MAXLEN近似裁剪
+    - 消费: 消费组XREADGROUP阻塞读取（不轮询），处理方确认对冲后XACK
+    - 重启: 先重放本消费者未确认的消息，再用XAUTOCLAIM接管其他消费者闲置过久的消息
+    - 超过max_replay_age的积压消息不再处理（A端此时可能已超时平仓），确认后跳过
+    """
+
+    STREAM_SUFFIX = ":stream"
+
+    def __init__(self, redis_client, group: str, consumer: str, maxlen: int = 10000,
+                 block_ms: int = 5000, claim_idle_ms: int = 30000, max_replay_age: float = 60):
+        """
+        初始化Stream传输
+
+        Args:
+            redis_client: redis.asyncio客户端（不做utf-8解码）
+            group: 消费组名称
+            consumer: 消费者名称（重启后保持不变，才能重放自己未确认的消息）
+            maxlen: Stream保留的最大消息数（近似裁剪）
+            block_ms: XREADGROUP阻塞等待时间（毫秒）
+            claim_idle_ms: 其他消费者的消息闲置超过该时间后接管（毫秒）
+            max_replay_age: 重放消息的最大年龄（秒）
+        """
+        self.redis_client = redis_client
+        self.group = group
+        self.consumer = consumer
+        self.maxlen = maxlen
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_replay_age = max_replay_age
+
+        self.channels = set()
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._handler_tasks = set()  # 执行中的协程回调
+
+        self.published = 0
+        self.delivered = 0
+        self.replayed = 0
+        self.skipped = 0
+        self.acked = 0
+
+    def stream_key(self, channel: str) -> str:
+        """channel对应的Stream key"""
+        return f"{channel}{self.STREAM_SUFFIX}"
+
+    def add_channel(self, channel: str):
+        """指定channel改走Stream"""
+        self.channels.add(channel)
+        logging.info(f"channel {channel} 使用Redis Stream: {self.stream_key(channel)}")
+
+    def has_channel(self, channel: str) -> bool:
+        """指定channel是否走Stream"""
+        return channel in self.channels
+
+    async def publish(self, channel: str, payload: bytes) -> str:
+        """
+        追加消息到Stream
+
+        Args:
+            channel: channel名称
+            payload: 编码后的消息
+
+        Returns:
+            消息ID
+        """
+        entry_id = await self.redis_client.xadd(
+            self.stream_key(channel), {"d": payload}, maxlen=self.maxlen, approximate=True
+        )
+        self.published += 1
+        return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+    def subscribe(self, channel: str, callback: Callable[[Dict[str, Any]], Any]):
+        """
+        订阅channel，回调在事件循环上执行（可以是协程函数）
+
+        消息字典中附带stream_id，处理完成后需调用ack确认，否则重启后会重放
+
+        Args:
+            channel: channel名称
+            callback: 回调函数
+        """
+        self.handlers[channel] = callback
+        logging.info(f"订阅Stream: {self.stream_key(channel)} (group={self.group}, consumer={self.consumer})")
+
+    async def ack(self, channel: str, entry_ids):
+        """
+        确认消息已处理
+
+        Args:
+            channel: channel名称
+            entry_ids: 消息ID列表
+        """
+        if entry_ids:
+            self.acked += await self.redis_client.xack(self.stream_key(channel), self.group, *entry_ids)
+
+    def start(self):
+        """启动各channel的消费任务（必须在事件循环线程中调用）"""
+        loop = asyncio.get_running_loop()
+        for channel in self.handlers:
+            task = self._tasks.get(channel)
+            if task is None or task.done():
+                self._tasks[channel] = loop.create_task(self._consume(channel))
+
+    def stop(self):
+        """停止消费任务"""
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+    async def wait_stopped(self):
+        """等待消费任务退出"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _ensure_group(self, key: str):
+        """创建消费组（已存在时忽略）"""
+        try:
+            await self.redis_client.xgroup_create(key, self.group, id="$", mkstream=True)
+            logging.info(f"创建Stream消费组: {key} {self.group}")
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _consume(self, channel: str):
+        """重放未确认消息后阻塞读取新消息"""
+        key = self.stream_key(channel)
+        while True:
+            try:
+                await self._ensure_group(key)
+                await self._replay(channel, key)
+                while True:
+                    response = await self.redis_client.xreadgroup(
+                        self.group, self.consumer, {key: ">"}, count=100, block=self.block_ms
+                    )
+                    for _, entries in response or []:
+                        for entry_id, fields in entries:
+                            await self._deliver(channel, entry_id, fields)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.error(f"Stream消费中断，1秒后重连: {e}")
+                await asyncio.sleep(1)
+
+    async def _replay(self, channel: str, key: str):
+        """重放本消费者未确认的消息，并接管其他消费者闲置过久的消息"""
+        last_id = "0"
+        while True:
+            response = await self.redis_client.xreadgroup(self.group, self.consumer, {key: last_id}, count=100)
+            entries = response[0][1] if response else []
+            if not entries:
+                break
+            for entry_id, fields in entries:
+                await self._deliver(channel, entry_id, fields, replay=True)
+                last_id = entry_id
+
+        start_id = "0-0"
+        while True:
+            result = await self.redis_client.xautoclaim(
+                key, self.group, self.consumer, self.claim_idle_ms, start_id=start_id, count=100
+            )
+            start_id, entries = result[0], result[1]
+            for entry_id, fields in entries:
+                await self._deliver(channel, entry_id, fields, replay=True)
+            if start_id in (b"0-0", "0-0"):
+                break
+
+    async def _deliver(self, channel: str, entry_id, fields, replay: bool = False):
+        """解码消息并交给回调"""
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        if not fields:
+            # 消息已被裁剪，只剩未确认记录
+            await self.ack(channel, [entry_id])
+            return
+
+        payload = fields.get(b"d", fields.get("d"))
+        try:
+            data = wire_format.decode(payload)
+        except Exception as e:
+            logging.error(f"解析Stream消息{entry_id}失败，跳过: {e}")
+            await self.ack(channel, [entry_id])
+            return
+
+        if replay:
+            age = time.time() - int(entry_id.split("-")[0]) / 1000
+            if age > self.max_replay_age:
+                logging.warning(f"⚠️ 跳过过期的未确认消息 {entry_id}（{age:.0f}秒前）: {data}")
+                self.skipped += 1
+                await self.ack(channel, [entry_id])
+                return
+            self.replayed += 1
+            logging.warning(f"重放未确认消息 {entry_id}: {data}")
+
+        callback = self.handlers.get(channel)
+        if callback is None:
+            return
+        data["stream_id"] = entry_id
+        self.delivered += 1
+        try:
+            result = callback(data)
+            if asyncio.iscoroutine(result):
+                # 不阻塞后续消息的读取，保留任务引用直到完成
+                task = asyncio.get_running_loop().create_task(result)
+                self._handler_tasks.add(task)
+                task.add_done_callback(self._handler_tasks.discard)
+        except Exception as e:
+            logging.error(f"处理Stream消息失败: {e}")
+
+    def stats(self) -> str:
+        """返回统计"""
+        return (
+            f"Redis Stream: 发布={self.published}, 投递={self.delivered}, 重放={self.replayed}, "
+            f"跳过过期={self.skipped}, 确认={self.acked}"
+        )
+
 
 class RedisMessenger:
     """Redis消息管理器，基于Pub/Sub模式"""
@@ -16,9 +339,33 @@ class RedisMessenger:
     CHANNEL_A_FILLED = "hedge:account_a_filled"  # 默认值，将被动态设置
     CHANNEL_B_FILLED = "hedge:account_b_filled"
     POSITIONS_KEY_PREFIX = "hedge:positions"  # 持仓key前缀
+    AUDIT_CHANNEL_SUFFIX = ":audit"  # 进程内传输时Redis审计镜像channel后缀
+    LATENCY_KEY_PREFIX = "hedge:latency"  # 延迟统计Hash key前缀
+    
+    # 持仓upsert脚本（EVALSHA，一次往返，服务端原子执行）
+    # KEYS[1]=持仓Hash key, ARGV=[account_name, 不含timestamp的持仓JSON, size, sign, 当前时间戳]
+    # 持仓大小和方向都没变时保留原时间戳，否则写入当前时间戳；返回1表示持仓发生变化
+    UPSERT_POSITION_LUA = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+local timestamp = ARGV[5]
+local changed = 1
+if current then
+    local ok, existing = pcall(cjson.decode, current)
+    if ok and existing.timestamp
+            and tonumber(existing.size) == tonumber(ARGV[3])
+            and tonumber(existing.sign) == tonumber(ARGV[4]) then
+        timestamp = string.format('%d', existing.timestamp)
+        changed = 0
+    end
+end
+local body = string.sub(ARGV[2], 1, -2)
+redis.call('HSET', KEYS[1], ARGV[1], body .. ', "timestamp": ' .. timestamp .. '}')
+return changed
+"""
     
     def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
-                 account_a_name: str = None, account_b_name: str = None):
+                 account_a_name: str = None, account_b_name: str = None,
+                 transport: Optional[InProcessTransport] = None):
         """
         初始化Redis连接
         
@@ -28,14 +375,19 @@ class RedisMessenger:
             db: Redis数据库编号
             account_a_name: A账户名称（用于构建channel和key名称）
             account_b_name: B账户名称（用于构建channel和key名称）
+            transport: 进程内传输（可选，单进程部署时使用）
         """
         self.host = host
         self.port = port
         self.db = db
         self.redis_client = None
+        self.raw_client = None  # 不做utf-8解码的连接，用于发布/订阅（二进制消息）
         self.pubsub = None
+        self.wire_formats: Dict[str, str] = {}  # channel -> 线路格式，未设置为JSON
         self.subscriber_thread = None
         self._running = False
+        self.transport = transport
+        self._upsert_position_script = None
         
         # 保存账户名称用于构建key
         self.account_a_name = account_a_name
@@ -59,13 +411,53 @@ class RedisMessenger:
                 db=self.db,
                 decode_responses=True
             )
+            self.raw_client = redis.Redis(
+                host=self.host,
+                port=self.port,
+                db=self.db
+            )
             # 测试连接
             self.redis_client.ping()
+            self._upsert_position_script = self.redis_client.register_script(self.UPSERT_POSITION_LUA)
             logging.info("Redis连接成功")
         except Exception as e:
             logging.error(f"Redis连接失败: {e}")
             raise
     
+    def set_wire_format(self, channel: str, fmt: str):
+        """
+        设置channel的线路格式（只影响发送，接收端自动识别格式）
+        
+        Args:
+            channel: channel名称
+            fmt: "json" 或 "binary"
+        """
+        if fmt not in wire_format.FORMATS:
+            raise ValueError(f"未知的线路格式: {fmt}")
+        self.wire_formats[channel] = fmt
+        logging.info(f"channel {channel} 使用{fmt}格式")
+    
+    def configure_wire_format(self, setting):
+        """
+        按配置设置成交/对冲channel的线路格式
+        
+        Args:
+            setting: "json"/"binary"（两个channel相同），
+                     或 {"a_filled": ..., "b_filled": ...}（按channel分别设置）
+        """
+        if not setting:
+            return
+        if isinstance(setting, str):
+            setting = {"a_filled": setting, "b_filled": setting}
+        if "a_filled" in setting:
+            self.set_wire_format(self.CHANNEL_A_FILLED, setting["a_filled"])
+        if "b_filled" in setting:
+            self.set_wire_format(self.CHANNEL_B_FILLED, setting["b_filled"])
+    
+    def _encode(self, channel: str, message_data: Dict[str, Any]) -> bytes:
+        """按channel的线路格式编码消息"""
+        return wire_format.encode(message_data, self.wire_formats.get(channel, wire_format.FORMAT_JSON))
+    
     def publish_a_filled(self, message_data: Dict[str, Any]):
         """
         发布A账户成交消息
@@ -88,32 +480,72 @@ class RedisMessenger:
         """
         发布消息到指定channel
         
+        如果进程内传输有该channel的订阅者，消息直接投递到事件循环，
+        Redis只镜像到审计channel（不会被其他进程的对冲订阅者消费）
+        
         Args:
             channel: Redis channel名称
             message_data: 消息数据
         """
+        if "fill_received_ns" in message_data:
+            # 带延迟追踪的成交消息，记录交给传输层的时间
+            stamp(message_data, "published_ns")
+        if self.transport is not None and self.transport.has_subscriber(channel):
+            self.transport.publish(channel, message_data)
+            self._publish_audit(channel, message_data)
+            return
+        
         try:
-            message_json = json.dumps(message_data)
-            self.redis_client.publish(channel, message_json)
-            logging.info(f"发布消息到 {channel}: {message_json}")
+            self.raw_client.publish(channel, self._encode(channel, message_data))
+            logging.info(f"发布消息到 {channel}: {message_data}")
         except Exception as e:
             logging.error(f"发布消息失败: {e}")
             raise
     
+    def _publish_audit(self, channel: str, message_data: Dict[str, Any]):
+        """
+        镜像消息到Redis审计channel（失败只记录日志，不影响进程内派发）
+        
+        Args:
+            channel: 原channel名称
+            message_data: 消息数据
+        """
+        try:
+            audit_channel = f"{channel}{self.AUDIT_CHANNEL_SUFFIX}"
+            self.redis_client.publish(audit_channel, json.dumps(message_data))
+            logging.debug(f"镜像消息到 {audit_channel}")
+        except Exception as e:
+            logging.warning(f"镜像消息到Redis审计channel失败: {e}")
+    
     def subscribe(self, channel: str, callback: Callable[[Dict[str, Any]], None]):
         """
         订阅指定channel并设置回调函数
         
+        挂载了进程内传输时，订阅注册到进程内传输，回调在事件循环上执行
+        
         Args:
             channel: Redis channel名称
-            callback: 收到消息时的回调函数
+            callback: 收到消息时的回调函数（进程内传输时可以是协程函数）
         """
+        if self.transport is not None:
+            self.transport.subscribe(channel, callback)
+            return
+        
         if self.pubsub is None:
-            self.pubsub = self.redis_client.pubsub()
+            self.pubsub = self.raw_client.pubsub()
         
         self.pubsub.subscribe(**{channel: self._create_message_handler(callback)})
         logging.info(f"订阅channel: {channel}")
     
+    def ack(self, channel: str, entry_ids):
+        """
+        确认Stream消息已处理（同步消息管理器只走pub/sub，无需确认）
+        
+        Args:
+            channel: channel名称
+            entry_ids: 消息ID列表
+        """
+    
     def _create_message_handler(self, callback: Callable[[Dict[str, Any]], None]):
         """
         创建消息处理器
@@ -127,7 +559,7 @@ class RedisMessenger:
         def handler(message):
             try:
                 if message['type'] == 'message':
-                    data = json.loads(message['data'])
+                    data = wire_format.decode(message['data'])
                     logging.info(f"收到消息: {data}")
                     callback(data)
             except Exception as e:
@@ -137,6 +569,11 @@ class RedisMessenger:
     
     def start_listening(self):
         """启动监听线程"""
+        if self.transport is not None:
+            self.transport.start()
+            self._running = True
+            return
+        
         if self.pubsub is None:
             logging.warning("未订阅任何channel，无法启动监听")
             return
@@ -148,6 +585,8 @@ class RedisMessenger:
     def stop_listening(self):
         """停止监听"""
         self._running = False
+        if self.transport is not None:
+            self.transport.stop()
         if self.subscriber_thread:
             self.subscriber_thread.stop()
             logging.info("Redis监听线程已停止")
@@ -159,6 +598,8 @@ class RedisMessenger:
             self.pubsub.close()
         if self.redis_client:
             self.redis_client.close()
+        if self.raw_client:
+            self.raw_client.close()
         logging.info("Redis连接已关闭")
     
     @staticmethod
@@ -222,7 +663,7 @@ class RedisMessenger:
           "available_balance": "25.631906"
         }
         
-        智能时间戳逻辑：
+        智能时间戳逻辑（Lua脚本在服务端原子执行，一次往返，A/B进程并发写入不会覆盖时间戳）：
         - 如果持仓大小和方向都没变，保留原时间戳（仓位创建时间）
         - 如果持仓发生变化，更新时间戳为当前时间
         
@@ -233,63 +674,101 @@ class RedisMessenger:
             position_size: 持仓大小
             sign: 持仓方向 (1=多头, -1=空头)
             available_balance: 可用余额 (可选)
+        
+        Returns:
+            持仓是否发生变化（写入失败时返回False）
         """
         try:
-            import time
-            from decimal import Decimal
-            
-            # 转换Decimal为float
-            if isinstance(position_size, Decimal):
-                position_size = float(position_size)
-            
-            # 构建Redis key: hedge:positions:account_4_account_5:BTC
-            if self.account_a_name and self.account_b_name:
-                redis_key = f"{self.POSITIONS_KEY_PREFIX}:{self.account_a_name}_{self.account_b_name}:{market.upper()}"
-            else:
-                # 向后兼容
-                redis_key = f"{self.POSITIONS_KEY_PREFIX}:{market.upper()}"
-            
-            # 获取现有持仓数据
-            existing_position = self.get_position_by_account_name(account_name, market)
-            
-            # 判断持仓是否发生变化
-            if existing_position:
-                existing_size = existing_position.get("size", 0)
-                existing_sign = existing_position.get("sign", 0)
-                existing_timestamp = existing_position.get("timestamp", int(time.time()))
-                
-                # 如果持仓大小和方向都没变，保留原时间戳
-                if existing_size == position_size and existing_sign == sign:
-                    timestamp = existing_timestamp
-                else:
-                    # 持仓发生变化，更新时间戳
-                    timestamp = int(time.time())
-            else:
-                # 首次创建持仓记录
-                timestamp = int(time.time())
-            
-            # 构建持仓数据
-            position_dict = {
-                "account_name": account_name,
-                "account_index": account_index,
-                "size": position_size,
-                "sign": sign,
-                "direction": "long" if sign == 1 else "short" if sign == -1 else "none",
-                "timestamp": timestamp,
-                "market": market.upper()
-            }
-            
-            # 如果提供了可用余额,添加到数据中
-            if available_balance is not None:
-                position_dict["available_balance"] = available_balance
-            
-            position_data = json.dumps(position_dict)
+            redis_key = self._positions_key(market)
+            args = self._upsert_position_args(
+                account_name, account_index, market, position_size, sign, available_balance
+            )
             
-            # 使用Hash结构存储: HSET hedge:positions:BTC account_4 {...}
-            self.redis_client.hset(redis_key, account_name, position_data)
-            logging.debug(f"更新持仓到Redis: HSET {redis_key} {account_name} = {position_data}")
+            # EVALSHA（脚本缓存失效时redis-py自动回退到EVAL并重新缓存）
+            changed = self._upsert_position_script(keys=[redis_key], args=args)
+            logging.debug(f"更新持仓到Redis: {redis_key} {account_name} = {args[1]}, changed={changed}")
+            return bool(changed)
         except Exception as e:
             logging.error(f"更新持仓到Redis失败: {e}")
+            return False
+    
+    def _latency_key(self) -> str:
+        """延迟统计Hash的key: hedge:latency:account_4_account_5"""
+        if self.account_a_name and self.account_b_name:
+            return f"{self.LATENCY_KEY_PREFIX}:{self.account_a_name}_{self.account_b_name}"
+        return self.LATENCY_KEY_PREFIX
+    
+    def update_latency_stats(self, stats: Dict[str, str]):
+        """
+        写入延迟统计（失败只记录日志）
+        
+        Args:
+            stats: 字段 -> JSON字符串（各阶段的count/p50/p90/p99/max）
+        """
+        try:
+            self.redis_client.hset(self._latency_key(), mapping=stats)
+        except Exception as e:
+            logging.warning(f"写入延迟统计失败: {e}")
+    
+    def _positions_key(self, market: str) -> str:
+        """
+        构建持仓Hash的key: hedge:positions:account_4_account_5:BTC
+        
+        Args:
+            market: 市场名称
+        
+        Returns:
+            Redis key
+        """
+        if self.account_a_name and self.account_b_name:
+            return f"{self.POSITIONS_KEY_PREFIX}:{self.account_a_name}_{self.account_b_name}:{market.upper()}"
+        # 向后兼容
+        return f"{self.POSITIONS_KEY_PREFIX}:{market.upper()}"
+    
+    @staticmethod
+    def _upsert_position_args(account_name: str, account_index: int, market: str,
+                              position_size, sign: int, available_balance: str = None) -> List[Any]:
+        """
+        构建持仓upsert脚本的参数（时间戳由脚本决定）
+        
+        Returns:
+            [account_name, 不含timestamp的持仓JSON, size, sign, 当前时间戳]
+        """
+        import time
+        from decimal import Decimal
+        
+        # 转换Decimal为float
+        if isinstance(position_size, Decimal):
+            position_size = float(position_size)
+        
+        # 构建持仓数据
+        position_dict = {
+            "account_name": account_name,
+            "account_index": account_index,
+            "size": position_size,
+            "sign": sign,
+            "direction": "long" if sign == 1 else "short" if sign == -1 else "none",
+            "market": market.upper()
+        }
+        
+        # 如果提供了可用余额,添加到数据中
+        if available_balance is not None:
+            position_dict["available_balance"] = available_balance
+        
+        return [account_name, json.dumps(position_dict), json.dumps(position_size), sign, int(time.time())]
+    
+    async def fetch_position(self, account_name: str, market: str) -> Optional[Dict[str, Any]]:
+        """
+        在协程中读取持仓（同步客户端直接查询；异步消息管理器覆盖为不阻塞事件循环的实现）
+        
+        Args:
+            account_name: 账户名称
+            market: 市场名称
+        
+        Returns:
+            持仓数据字典或None
+        """
+        return self.get_position_by_account_name(account_name, market)
     
     def get_position_by_account_name(self, account_name: str, market: str) -> Optional[Dict[str, Any]]:
         """
@@ -303,12 +782,7 @@ class RedisMessenger:
             持仓数据字典或None
         """
         try:
-            # 构建Redis key: hedge:positions:account_4_account_5:BTC
-            if self.account_a_name and self.account_b_name:
-                redis_key = f"{self.POSITIONS_KEY_PREFIX}:{self.account_a_name}_{self.account_b_name}:{market.upper()}"
-            else:
-                # 向后兼容
-                redis_key = f"{self.POSITIONS_KEY_PREFIX}:{market.upper()}"
+            redis_key = self._positions_key(market)
             
             position_json = self.redis_client.hget(redis_key, account_name)
             if position_json:
@@ -345,12 +819,7 @@ class RedisMessenger:
             所有持仓数据字典,key为account_name
         """
         try:
-            # 构建Redis key: hedge:positions:account_4_account_5:BTC
-            if self.account_a_name and self.account_b_name:
-                redis_key = f"{self.POSITIONS_KEY_PREFIX}:{self.account_a_name}_{self.account_b_name}:{market.upper()}"
-            else:
-                # 向后兼容
-                redis_key = f"{self.POSITIONS_KEY_PREFIX}:{market.upper()}"
+            redis_key = self._positions_key(market)
             
             # 获取Hash中的所有字段
             all_positions = self.redis_client.hgetall(redis_key)
@@ -362,3 +831,430 @@ class RedisMessenger:
             logging.error(f"从Redis获取所有持仓失败: {e}")
             return {}
 
+
+class AsyncRedisMessenger(RedisMessenger):
+    """
+    基于redis.asyncio的消息管理器
+
+    - publish_a_filled / publish_b_filled / update_position 保持原签名，但不再阻塞：
+      在任意线程（包括WebSocket线程）调用都只是把Redis写入投递到事件循环
+    - 多条命令的写入走pipeline，一次往返；写入由单个写入任务按投递顺序执行
+    - 订阅不再用run_in_thread的10ms轮询线程，而是事件循环上的原生异步迭代器，
+      回调直接在事件循环上执行（可以是协程函数）；订阅连接中断后自动退避重连并重新订阅
+    - 读取持仓请使用 await fetch_position / fetch_all_positions
+    """
+
+    # 订阅连接中断后的重连等待（秒），连续失败时指数翻倍到上限
+    LISTEN_RECONNECT_DELAY = 0.5
+    LISTEN_RECONNECT_MAX_DELAY = 30
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 account_a_name: str = None, account_b_name: str = None,
+                 transport: Optional[InProcessTransport] = None):
+        super().__init__(host, port, db, account_a_name, account_b_name, transport)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._listen_task: Optional[asyncio.Task] = None
+        self._write_queue: Optional[asyncio.Queue] = None  # 按投递顺序排队的写入协程
+        self._writer_task: Optional[asyncio.Task] = None
+        self._handler_tasks = set()  # 执行中的协程回调
+        self.streams: Optional[RedisStreamTransport] = None
+
+        self.writes_submitted = 0
+        self.write_errors = 0
+
+    async def connect(self):
+        """连接到Redis服务器（必须在事件循环线程中调用）"""
+        try:
+            self.loop = asyncio.get_running_loop()
+            self.redis_client = aioredis.Redis(
+                host=self.host,
+                port=self.port,
+                db=self.db,
+                decode_responses=True
+            )
+            self.raw_client = aioredis.Redis(
+                host=self.host,
+                port=self.port,
+                db=self.db
+            )
+            await self.redis_client.ping()
+            self._upsert_position_script = self.redis_client.register_script(self.UPSERT_POSITION_LUA)
+            self._write_queue = asyncio.Queue()
+            self._writer_task = self.loop.create_task(self._writer())
+            logging.info("Redis连接成功（asyncio）")
+        except Exception as e:
+            logging.error(f"Redis连接失败: {e}")
+            raise
+
+    def configure_stream(self, stream_config: Optional[Dict[str, Any]], consumer: str):
+        """
+        按配置让A成交channel改走Redis Stream（必须在connect之后调用，A/B两端配置需一致）
+
+        Args:
+            stream_config: 配置（enabled, group, maxlen, block_ms, claim_idle_ms, max_replay_age）
+            consumer: 消费者名称（使用固定的账户名，重启后可重放未确认消息）
+        """
+        if not stream_config or not stream_config.get("enabled"):
+            return
+        self.streams = RedisStreamTransport(
+            self.raw_client,
+            group=stream_config.get("group", "hedge"),
+            consumer=consumer,
+            maxlen=stream_config.get("maxlen", 10000),
+            block_ms=stream_config.get("block_ms", 5000),
+            claim_idle_ms=stream_config.get("claim_idle_ms", 30000),
+            max_replay_age=stream_config.get("max_replay_age", 60)
+        )
+        self.streams.add_channel(self.CHANNEL_A_FILLED)
+
+    def ack(self, channel: str, entry_ids):
+        """
+        确认Stream消息已处理（不阻塞；channel未走Stream时忽略）
+
+        Args:
+            channel: channel名称
+            entry_ids: 消息ID列表（消息字典中的stream_id）
+        """
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id]
+        if self.streams is not None and self.streams.has_channel(channel) and entry_ids:
+            self._submit(self.streams.ack(channel, entry_ids))
+
+    # ---------- 非阻塞写入 ----------
+
+    def _submit(self, coro):
+        """
+        把Redis写入投递到事件循环（线程安全，不等待结果）
+
+        写入进入同一个队列，由单个写入任务按投递顺序逐条执行，
+        同一线程先后投递的发布/持仓更新不会乱序到达Redis
+
+        Args:
+            coro: 写入协程
+        """
+        if self._write_queue is None or self.loop.is_closed():
+            coro.close()
+            logging.error("异步Redis未连接，丢弃写入")
+            return
+        self.writes_submitted += 1
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+
+        if in_loop:
+            self._write_queue.put_nowait(coro)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._write_queue.put_nowait, coro)
+        except RuntimeError:
+            # 事件循环已关闭
+            coro.close()
+            logging.error("异步Redis事件循环已关闭，丢弃写入")
+
+    async def _writer(self):
+        """写入任务：按队列顺序逐条执行写入，只记录失败"""
+        while True:
+            coro = await self._write_queue.get()
+            try:
+                await coro
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.write_errors += 1
+                logging.error(f"异步Redis写入失败: {e}")
+            finally:
+                self._write_queue.task_done()
+
+    def _publish(self, channel: str, message_data: Dict[str, Any]):
+        """
+        发布消息到指定channel（不阻塞，进程内传输的处理同父类）
+
+        Args:
+            channel: Redis channel名称
+            message_data: 消息数据
+        """
+        if "fill_received_ns" in message_data:
+            # 带延迟追踪的成交消息，记录交给传输层的时间
+            stamp(message_data, "published_ns")
+        if self.transport is not None and self.transport.has_subscriber(channel):
+            self.transport.publish(channel, message_data)
+            self._publish_audit(channel, message_data)
+            return
+        if self.streams is not None and self.streams.has_channel(channel):
+            self._submit(self.streams.publish(channel, self._encode(channel, message_data)))
+            return
+        self._submit(self.publish(channel, message_data))
+
+    def _publish_audit(self, channel: str, message_data: Dict[str, Any]):
+        """镜像消息到Redis审计channel（不阻塞，审计channel始终为JSON）"""
+        self._submit(self.redis_client.publish(f"{channel}{self.AUDIT_CHANNEL_SUFFIX}", json.dumps(message_data)))
+
+    async def publish(self, channel: str, message_data: Dict[str, Any]):
+        """
+        发布消息
+
+        Args:
+            channel: Redis channel名称
+            message_data: 消息数据
+        """
+        await self.raw_client.publish(channel, self._encode(channel, message_data))
+        logging.info(f"发布消息到 {channel}: {message_data}")
+
+    async def publish_many(self, messages: Iterable[Tuple[str, Dict[str, Any]]]):
+        """
+        用一个pipeline发布多条消息
+
+        Args:
+            messages: (channel, 消息数据) 列表
+        """
+        async with self.raw_client.pipeline(transaction=False) as pipe:
+            for channel, message_data in messages:
+                pipe.publish(channel, self._encode(channel, message_data))
+            await pipe.execute()
+
+    def update_position(self, account_name: str, account_index: int, market: str,
+                        position_size: float, sign: int, available_balance: str = None):
+        """
+        更新账户持仓到Redis（不阻塞，参数同RedisMessenger.update_position）
+        """
+        self._submit(self.update_positions([{
+            "account_name": account_name,
+            "account_index": account_index,
+            "market": market,
+            "position_size": position_size,
+            "sign": sign,
+            "available_balance": available_balance
+        }]))
+
+    async def update_positions(self, updates: List[Dict[str, Any]]) -> List[bool]:
+        """
+        批量更新持仓：每条持仓一次upsert脚本调用（单条直接EVALSHA，多条合并为一个pipeline）
+
+        Args:
+            updates: 持仓列表，字段同update_position的参数
+
+        Returns:
+            每条持仓是否发生变化
+        """
+        if not updates:
+            return []
+        calls = [
+            (
+                self._positions_key(u["market"]),
+                self._upsert_position_args(
+                    u["account_name"], u["account_index"], u["market"],
+                    u["position_size"], u["sign"], u.get("available_balance")
+                )
+            )
+            for u in updates
+        ]
+
+        if len(calls) == 1:
+            redis_key, args = calls[0]
+            results = [await self._upsert_position_script(keys=[redis_key], args=args)]
+        else:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for redis_key, args in calls:
+                    await self._upsert_position_script(keys=[redis_key], args=args, client=pipe)
+                results = await pipe.execute()
+        logging.debug(f"更新持仓到Redis: {len(updates)}条")
+        return [bool(changed) for changed in results]
+
+    def update_latency_stats(self, stats: Dict[str, str]):
+        """写入延迟统计（不阻塞）"""
+        self._submit(self.redis_client.hset(self._latency_key(), mapping=stats))
+
+    # ---------- 异步读取 ----------
+
+    def get_position_by_account_name(self, account_name: str, market: str) -> Optional[Dict[str, Any]]:
+        """异步客户端不支持同步读取，请使用 await fetch_position"""
+        raise RuntimeError("AsyncRedisMessenger请使用 await fetch_position")
+
+    def get_all_positions(self, market: str) -> Dict[str, Any]:
+        """异步客户端不支持同步读取，请使用 await fetch_all_positions"""
+        raise RuntimeError("AsyncRedisMessenger请使用 await fetch_all_positions")
+
+    async def fetch_position(self, account_name: str, market: str) -> Optional[Dict[str, Any]]:
+        """
+        从Redis获取指定账户的持仓
+
+        Args:
+            account_name: 账户名称
+            market: 市场名称
+
+        Returns:
+            持仓数据字典或None
+        """
+        try:
+            position_json = await self.redis_client.hget(self._positions_key(market), account_name)
+            return json.loads(position_json) if position_json else None
+        except Exception as e:
+            logging.error(f"从Redis获取持仓失败: {e}")
+            return None
+
+    async def fetch_all_positions(self, market: str) -> Dict[str, Any]:
+        """
+        获取指定市场的所有账户持仓
+
+        Args:
+            market: 市场名称
+
+        Returns:
+            所有持仓数据字典,key为account_name
+        """
+        try:
+            all_positions = await self.redis_client.hgetall(self._positions_key(market))
+            return {name: json.loads(data) for name, data in all_positions.items()}
+        except Exception as e:
+            logging.error(f"从Redis获取所有持仓失败: {e}")
+            return {}
+
+    # ---------- 订阅 ----------
+
+    def subscribe(self, channel: str, callback: Callable[[Dict[str, Any]], Any]):
+        """
+        订阅指定channel，回调在事件循环上执行（可以是协程函数）
+
+        Args:
+            channel: Redis channel名称
+            callback: 收到消息时的回调函数
+        """
+        if self.transport is not None:
+            self.transport.subscribe(channel, callback)
+            return
+        if self.streams is not None and self.streams.has_channel(channel):
+            self.streams.subscribe(channel, callback)
+            return
+        self.handlers[channel] = callback
+        if self.pubsub is not None:
+            # 已在监听，追加订阅
+            self._submit(self.pubsub.subscribe(channel))
+        logging.info(f"订阅channel: {channel}")
+
+    async def listen(self) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        异步消息迭代器，订阅已注册的channel并逐条产出 (channel, 消息数据)
+
+        消息到达即返回，不经过轮询间隔
+        """
+        if self.pubsub is None:
+            self.pubsub = self.raw_client.pubsub()
+            await self.pubsub.subscribe(*self.handlers.keys())
+        async for message in self.pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            try:
+                data = wire_format.decode(message["data"])
+            except (TypeError, ValueError, struct.error) as e:
+                logging.error(f"解析消息失败: {e}")
+                continue
+            channel = message["channel"]
+            yield channel.decode() if isinstance(channel, bytes) else channel, data
+
+    def start_listening(self):
+        """启动事件循环上的订阅任务"""
+        if self.transport is not None:
+            self.transport.start()
+            self._running = True
+            return
+
+        if self.streams is not None and self.streams.handlers:
+            self.streams.start()
+            self._running = True
+            logging.info("Redis Stream消费已启动")
+
+        if not self.handlers:
+            if not self._running:
+                logging.warning("未订阅任何channel，无法启动监听")
+            return
+        if self._listen_task is None or self._listen_task.done():
+            self._running = True
+            self._listen_task = self.loop.create_task(self._dispatch())
+            logging.info("Redis异步订阅已启动")
+
+    async def _dispatch(self):
+        """把订阅消息派发给回调，订阅连接中断后按指数退避重连并重新订阅"""
+        delay = self.LISTEN_RECONNECT_DELAY
+        try:
+            while self._running:
+                try:
+                    async for channel, data in self.listen():
+                        delay = self.LISTEN_RECONNECT_DELAY
+                        callback = self.handlers.get(channel)
+                        if callback is None:
+                            continue
+                        logging.info(f"收到消息: {data}")
+                        try:
+                            result = callback(data)
+                            if asyncio.iscoroutine(result):
+                                # 不阻塞后续消息的派发，保留任务引用直到完成
+                                task = self.loop.create_task(result)
+                                self._handler_tasks.add(task)
+                                task.add_done_callback(self._handler_tasks.discard)
+                        except Exception as e:
+                            logging.error(f"处理消息失败: {e}")
+                    logging.warning("Redis订阅连接已结束")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error(f"Redis订阅中断，{delay:.1f}秒后重新订阅: {e}")
+                # 丢弃失效的订阅连接，下一轮listen重新建立并订阅全部channel
+                await self._reset_pubsub()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.LISTEN_RECONNECT_MAX_DELAY)
+        finally:
+            self._running = False
+            await self._reset_pubsub()
+
+    async def _reset_pubsub(self):
+        """关闭并丢弃当前订阅连接"""
+        pubsub, self.pubsub = self.pubsub, None
+        if pubsub is not None:
+            try:
+                await pubsub.reset()
+            except Exception as e:
+                logging.debug(f"关闭订阅连接失败: {e}")
+
+    def stop_listening(self):
+        """停止订阅"""
+        self._running = False
+        if self.transport is not None:
+            self.transport.stop()
+        if self._listen_task and not self._listen_task.done():
+            self._listen_task.cancel()
+            logging.info("Redis异步订阅已停止")
+        if self.streams is not None:
+            self.streams.stop()
+
+    async def close(self, timeout: float = 2.0):
+        """
+        停止订阅，等待投递中的写入完成后关闭连接
+
+        Args:
+            timeout: 等待写入完成的最长时间（秒）
+        """
+        self.stop_listening()
+        if self._listen_task is not None:
+            await asyncio.gather(self._listen_task, return_exceptions=True)
+        if self.streams is not None:
+            await self.streams.wait_stopped()
+            logging.info(self.streams.stats())
+        if self._writer_task is not None:
+            try:
+                await asyncio.wait_for(self._write_queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"等待Redis写入超时，丢弃{self._write_queue.qsize()}条未完成写入")
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            while not self._write_queue.empty():
+                self._write_queue.get_nowait().close()
+            self._writer_task = self._write_queue = None
+        for client in (self.redis_client, self.raw_client):
+            if client is None:
+                continue
+            if hasattr(client, "aclose"):
+                await client.aclose()
+            else:
+                await client.close()
+        logging.info(f"Redis连接已关闭（写入={self.writes_submitted}, 失败={self.write_errors}）")
@@ -0,0 +1,275 @@
+"""
+超时挂单重挂引擎
+超时的maker单不再"先撤单、等下一轮循环再挂"，而是撤单和新单一起提交：
+- SDK支持离线签名时，撤单+新单签名后通过sendTxBatch一次发送
+- 否则用本地nonce分配器连续发送撤单和新单，中间不等待
+- 在内存中跟踪订单生命周期，并统计每次重挂的无挂单时间
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+from decimal import Decimal
+from typing import Dict, Any, Optional, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from rest_gateway import get_gateway
+from nonce_allocator import get_nonce_allocator
+from latency_tracker import LatencyTracker
+
+# 订单生命周期状态
+STATE_PENDING_NEW = "pending_new"
+STATE_OPEN = "open"
+STATE_PENDING_CANCEL = "pending_cancel"
+STATE_CANCELED = "canceled"
+STATE_REJECTED = "rejected"
+TERMINAL_STATES = (STATE_CANCELED, STATE_REJECTED)
+
+# 内存中保留的终态订单数量上限
+MAX_TERMINAL_ORDERS = 100
+
+# 重挂无挂单时间的统计阶段名（hedge_latency_seconds{stage=...}）
+NO_QUOTE_STAGE = "requote_no_quote"
+
+
+class RequoteEngine:
+    """超时挂单重挂引擎"""
+
+    def __init__(self, signer_client: lighter.SignerClient, account_a_manager, market_index: int,
+                 base_amount_multiplier: int, price_multiplier: int):
+        """
+        初始化重挂引擎
+
+        Args:
+            signer_client: lighter签名客户端
+            account_a_manager: A账户管理器（取价、登记待成交订单）
+            market_index: 市场索引
+            base_amount_multiplier: 基础数量乘数
+            price_multiplier: 价格乘数
+        """
+        self.signer_client = signer_client
+        self.account_a_manager = account_a_manager
+        self.market_index = market_index
+        self.base_amount_multiplier = base_amount_multiplier
+        self.price_multiplier = price_multiplier
+        self.gateway = get_gateway()
+        self.nonce_allocator = get_nonce_allocator(signer_client)
+
+        # 是否支持离线签名+批量发送
+        self.batch_supported = all(
+            hasattr(signer_client, name) for name in ("sign_cancel_order", "sign_create_order")
+        )
+
+        self.orders: Dict[int, Dict[str, Any]] = {}  # client_order_index -> 生命周期记录
+        self.latency_tracker = LatencyTracker("requote_latency")
+        self.requotes = 0
+        self.failures = 0
+
+    def _set_state(self, client_order_index: int, state: str, **fields):
+        """更新订单生命周期状态"""
+        record = self.orders.setdefault(client_order_index, {"client_order_index": client_order_index})
+        record.update(fields)
+        record["state"] = state
+        record[f"{state}_at"] = time.time()
+
+        terminal = [coi for coi, r in self.orders.items() if r["state"] in TERMINAL_STATES]
+        for coi in terminal[:-MAX_TERMINAL_ORDERS]:
+            del self.orders[coi]
+
+    def open_orders(self) -> Dict[int, Dict[str, Any]]:
+        """返回未终结的订单（client_order_index -> 生命周期记录）"""
+        return {coi: r for coi, r in self.orders.items() if r["state"] not in TERMINAL_STATES}
+
+    async def requote(self, stale_order) -> bool:
+        """
+        撤掉超时挂单，并在同一次提交中按最新档位价格挂出剩余数量
+
+        Args:
+            stale_order: 超时的活跃订单（OrderApi返回的订单对象）
+
+        Returns:
+            新订单是否提交成功
+        """
+        is_ask = bool(stale_order.is_ask)
+        side = "sell" if is_ask else "buy"
+        old_order_index = stale_order.order_index
+        old_client_order_index = getattr(stale_order, "client_order_index", None) or old_order_index
+
+        price_str = await self.account_a_manager._get_price_at_depth(is_bid=not is_ask)
+        if price_str is None:
+            logging.error("无法获取订单簿价格，仅撤单")
+            await self._cancel_only(old_order_index)
+            return False
+
+        amount = Decimal(str(stale_order.remaining_base_amount))
+        base_amount = int(amount * self.base_amount_multiplier)
+        price = int(Decimal(price_str) * self.price_multiplier)
+        client_order_index = int(time.time() * 1000)
+
+        self._set_state(old_client_order_index, STATE_PENDING_CANCEL, order_index=old_order_index)
+        self._set_state(client_order_index, STATE_PENDING_NEW, side=side, price=price_str, amount=str(amount))
+        # 先登记，WebSocket推送可能早于下单响应
+        self.account_a_manager.track_client_order(client_order_index, side, str(amount), price_str)
+
+        logging.info(
+            f"🔁 重挂超时订单: order_index={old_order_index} → {side} {amount} @ {price_str} "
+            f"(client_order_index={client_order_index}, {'批量' if self.batch_supported else '连续'}提交)"
+        )
+
+        started_ns = time.monotonic_ns()
+        if self.batch_supported:
+            ok, error, canceled = await self._send_batch(old_order_index, client_order_index, base_amount, price, is_ask)
+        else:
+            ok, error, canceled = await self._send_back_to_back(old_order_index, client_order_index, base_amount, price, is_ask)
+        elapsed_ns = time.monotonic_ns() - started_ns
+
+        if not ok:
+            self.failures += 1
+            self.account_a_manager.pending_client_orders.pop(client_order_index, None)
+            self._set_state(client_order_index, STATE_REJECTED, error=str(error))
+            if not canceled:
+                # 撤单未生效，原订单仍在挂
+                self._set_state(old_client_order_index, STATE_OPEN)
+            logging.error(f"重挂失败: {error}")
+            return False
+
+        self.requotes += 1
+        # 原订单保留在pending_orders中，直到交易所推送撤销终态（撤单生效前的成交仍需对冲）
+        self._set_state(old_client_order_index, STATE_CANCELED)
+        self._set_state(client_order_index, STATE_OPEN)
+        self.account_a_manager.current_client_order_index = client_order_index
+        self.latency_tracker.record(NO_QUOTE_STAGE, elapsed_ns)
+        stats = self.latency_tracker.snapshot()[NO_QUOTE_STAGE]
+        logging.info(f"✅ 重挂完成，本次无挂单时间 {elapsed_ns / 1e6:.1f}ms"
+                     f"（count={stats['count']}, p50={stats['p50_ms']}ms, p99={stats['p99_ms']}ms）")
+
+        # WebSocket未及时推送时用REST补登记order_index
+        self.account_a_manager.schedule_resolve_client_order(client_order_index)
+        return True
+
+    async def _send_batch(self, old_order_index: int, client_order_index: int, base_amount: int,
+                          price: int, is_ask: bool) -> Tuple[bool, Optional[str], bool]:
+        """
+        签名撤单和新单，通过sendTxBatch一次发送
+
+        Returns:
+            (新单是否提交成功, 错误信息, 撤单是否已提交)
+        """
+        nonce_manager = self.signer_client.nonce_manager
+        api_key_index, cancel_nonce = nonce_manager.next_nonce()
+        _, create_nonce = nonce_manager.next_nonce()
+        nonces = (cancel_nonce, create_nonce)
+
+        try:
+            cancel_info, error = self.signer_client.sign_cancel_order(
+                market_index=self.market_index,
+                order_index=old_order_index,
+                nonce=cancel_nonce
+            )
+            if error is None:
+                create_info, error = self.signer_client.sign_create_order(
+                    market_index=self.market_index,
+                    client_order_index=client_order_index,
+                    base_amount=base_amount,
+                    price=price,
+                    is_ask=is_ask,
+                    order_type=lighter.SignerClient.ORDER_TYPE_LIMIT,
+                    time_in_force=lighter.SignerClient.ORDER_TIME_IN_FORCE_GOOD_TILL_TIME,
+                    reduce_only=False,
+                    trigger_price=0,
+                    nonce=create_nonce
+                )
+            if error is not None:
+                self._release(api_key_index, nonces)
+                return False, f"签名失败: {error}", False
+
+            transaction_api = self.gateway.transaction_api(self.signer_client.api_client)
+            resp = await self.gateway.request(
+                "send_tx_batch",
+                transaction_api.send_tx_batch,
+                coalesce=False,
+                tx_types=json.dumps([lighter.SignerClient.TX_TYPE_CANCEL_ORDER, lighter.SignerClient.TX_TYPE_CREATE_ORDER]),
+                tx_infos=json.dumps([cancel_info, create_info])
+            )
+        except Exception as e:
+            self._release(api_key_index, nonces)
+            if "invalid nonce" in str(e).lower():
+                await self.nonce_allocator.handle_invalid_nonce(api_key_index)
+            return False, str(e), False
+
+        if getattr(resp, "code", 200) != 200:
+            self._release(api_key_index, nonces)
+            return False, f"code={resp.code}, msg={getattr(resp, 'message', '')}", False
+
+        for nonce in nonces:
+            self.nonce_allocator.confirm(api_key_index, nonce)
+        return True, None, True
+
+    async def _send_back_to_back(self, old_order_index: int, client_order_index: int, base_amount: int,
+                                 price: int, is_ask: bool) -> Tuple[bool, Optional[str], bool]:
+        """
+        连续发送撤单和新单（nonce本地分配，中间不等待订单状态）；撤单失败时不挂新单，避免两笔订单同时在挂
+
+        Returns:
+            (新单是否提交成功, 错误信息, 撤单是否已提交)
+        """
+        try:
+            _, resp, err = await self.signer_client.cancel_order(
+                market_index=self.market_index,
+                order_index=old_order_index
+            )
+        except Exception as e:
+            return False, f"撤单异常: {e}", False
+        if err or (resp is not None and getattr(resp, "code", 200) != 200):
+            if err and "invalid nonce" in str(err).lower():
+                await self.nonce_allocator.handle_invalid_nonce()
+            return False, f"撤销订单{old_order_index}失败（可能已成交），放弃挂新单: {err or resp.code}", False
+        self.nonce_allocator.confirm_current()
+
+        try:
+            _, resp, err = await self.signer_client.create_order(
+                market_index=self.market_index,
+                client_order_index=client_order_index,
+                base_amount=base_amount,
+                price=price,
+                is_ask=is_ask,
+                order_type=lighter.SignerClient.ORDER_TYPE_LIMIT,
+                time_in_force=lighter.SignerClient.ORDER_TIME_IN_FORCE_GOOD_TILL_TIME,
+                reduce_only=False,
+                trigger_price=0
+            )
+        except Exception as e:
+            return False, str(e), True
+
+        if err:
+            if "invalid nonce" in str(err).lower():
+                await self.nonce_allocator.handle_invalid_nonce()
+            return False, str(err), True
+        if resp is None or resp.code != 200:
+            return False, f"code={getattr(resp, 'code', None)}, msg={getattr(resp, 'message', '')}", True
+
+        self.nonce_allocator.confirm_current()
+        return True, None, True
+
+    async def _cancel_only(self, order_index: int):
+        """只撤单（取价失败时的退路）"""
+        try:
+            # 原订单保留在pending_orders中，收到撤销终态推送后移除
+            await self.signer_client.cancel_order(market_index=self.market_index, order_index=order_index)
+            logging.info(f"已提交撤单: {order_index}")
+        except Exception as e:
+            logging.error(f"取消订单{order_index}失败: {e}")
+
+    def _release(self, api_key_index: int, nonces: Tuple[int, ...]):
+        """批量发送失败时按倒序释放nonce，使本地计数可以回退"""
+        for nonce in reversed(nonces):
+            self.nonce_allocator.release(api_key_index, nonce)
+
+    def stats(self) -> str:
+        """返回重挂统计"""
+        return f"重挂: 成功={self.requotes}, 失败={self.failures}; {self.latency_tracker.summary()}"
@@ -0,0 +1,284 @@
+"""
+REST请求网关
+统一封装lighter OrderApi/AccountApi调用：
+- 按交易所端点权重的令牌桶限流（请求前排队，而不是撞到429再盲等）
+- 相同的只读请求在途时合并（single-flight），避免重复消耗限流额度
+- 429统一指数退避重试
+- 记录每个端点的调用、合并、排队耗时和限流次数（同时导出为Prometheus指标）
+- OrderApi/AccountApi/TransactionApi按ApiClient缓存，不再每次调用新建
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+import weakref
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
+
+# 添加temp_lighter到路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
+
+import lighter
+from metrics import REST_REQUESTS, REST_LATENCY, REST_BACKOFFS, REST_THROTTLED_SECONDS
+
+
+# 端点权重（按交易所文档：sendTx/nextNonce 6，accountInactiveOrders 100，其他端点 300）
+ENDPOINT_WEIGHTS = {
+    "send_tx": 6,
+    "send_tx_batch": 6,
+    "next_nonce": 6,
+    "account_inactive_orders": 100,
+    "order_books": 300,
+    "order_book_orders": 300,
+    "account_active_orders": 300,
+    "account": 300,
+}
+DEFAULT_ENDPOINT_WEIGHT = 300
+
+# 不参与合并判断的参数（每次调用都不同，但不影响返回结果）
+COALESCE_IGNORED_KWARGS = ("auth",)
+
+
+class RateLimitExceeded(Exception):
+    """429重试次数用完"""
+
+
+def is_rate_limited_error(error: Exception) -> bool:
+    """判断异常是否为交易所限流（429）"""
+    if getattr(error, "status", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "Too Many Requests" in message
+
+
+class TokenBucket:
+    """
+    令牌桶（协程安全）
+
+    容量即一分钟的权重额度，按秒匀速补充；额度不足时排队等待。
+    令牌在锁内预扣（余额可以为负，表示已被排队请求预订的额度），等待在锁外进行，
+    排队中的请求不会挡住其他请求计算自己的等待时间
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        """
+        初始化令牌桶
+
+        Args:
+            capacity: 桶容量（权重）
+            refill_per_second: 每秒补充的权重
+        """
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_per_second)
+        self.last_refill = now
+
+    async def acquire(self, weight: float) -> float:
+        """
+        获取指定权重的令牌
+
+        Args:
+            weight: 请求权重
+
+        Returns:
+            排队等待的秒数
+        """
+        weight = min(weight, self.capacity)
+        async with self._lock:
+            self._refill()
+            # 预扣令牌，不足部分按补充速度折算成等待时间
+            self.tokens -= weight
+            wait_time = -self.tokens / self.refill_per_second if self.tokens < 0 else 0.0
+        if wait_time > 0:
+            try:
+                await asyncio.sleep(wait_time)
+            except asyncio.CancelledError:
+                # 请求被取消，归还预扣的令牌
+                self.tokens += weight
+                raise
+        return wait_time
+
+    def drain(self):
+        """收到429时清空令牌，让后续请求排队等待补充（保留已预订的负余额）"""
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+
+class EndpointMetrics:
+    """单个端点的统计"""
+
+    def __init__(self):
+        self.calls = 0  # 实际发出的请求数
+        self.coalesced = 0  # 合并到在途请求的次数
+        self.throttled = 0  # 因令牌不足排队的次数
+        self.throttled_seconds = 0.0  # 排队总耗时
+        self.rate_limited = 0  # 收到429的次数
+        self.errors = 0  # 其他错误次数
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class RestGateway:
+    """REST请求网关（进程内共享）"""
+
+    def __init__(self, weight_per_minute: int = 24000, max_retries: int = 5, max_backoff: float = 30):
+        """
+        初始化网关
+
+        Args:
+            weight_per_minute: 每分钟权重额度
+            max_retries: 429最大重试次数
+            max_backoff: 429退避最大等待（秒）
+        """
+        self.weight_per_minute = weight_per_minute
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(weight_per_minute, weight_per_minute / 60)
+        self.metrics: Dict[str, EndpointMetrics] = {}
+        self._in_flight: Dict[Tuple, asyncio.Task] = {}
+        # ApiClient -> {API类: 实例}，ApiClient释放后自动清除
+        self._apis: "weakref.WeakKeyDictionary[Any, Dict[type, Any]]" = weakref.WeakKeyDictionary()
+
+    def _api(self, api_cls: type, api_client: lighter.ApiClient) -> Any:
+        apis = self._apis.get(api_client)
+        if apis is None:
+            apis = self._apis[api_client] = {}
+        api = apis.get(api_cls)
+        if api is None:
+            api = apis[api_cls] = api_cls(api_client)
+        return api
+
+    def order_api(self, api_client: lighter.ApiClient) -> lighter.OrderApi:
+        """获取OrderApi（按ApiClient缓存）"""
+        return self._api(lighter.OrderApi, api_client)
+
+    def account_api(self, api_client: lighter.ApiClient) -> lighter.AccountApi:
+        """获取AccountApi（按ApiClient缓存）"""
+        return self._api(lighter.AccountApi, api_client)
+
+    def transaction_api(self, api_client: lighter.ApiClient) -> lighter.TransactionApi:
+        """获取TransactionApi（按ApiClient缓存）"""
+        return self._api(lighter.TransactionApi, api_client)
+
+    def _metrics(self, endpoint: str) -> EndpointMetrics:
+        if endpoint not in self.metrics:
+            self.metrics[endpoint] = EndpointMetrics()
+        return self.metrics[endpoint]
+
+    async def request(self, endpoint: str, func: Callable[..., Awaitable[Any]],
+                      coalesce: bool = True, **kwargs) -> Any:
+        """
+        发起REST请求
+
+        Args:
+            endpoint: 端点名称（决定权重，并作为统计和合并的key）
+            func: 实际的API方法，如 order_api.order_book_orders
+            coalesce: 相同参数的在途请求是否合并（只读请求才应开启）
+            **kwargs: API方法参数
+
+        Returns:
+            API返回结果
+        """
+        if not coalesce:
+            return await self._execute(endpoint, func, kwargs)
+
+        # 返回结果只取决于端点和参数（账户类端点的参数里带account_index）
+        key = (endpoint, tuple(sorted(
+            (k, repr(v)) for k, v in kwargs.items() if k not in COALESCE_IGNORED_KWARGS
+        )))
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._metrics(endpoint).coalesced += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.get_running_loop().create_task(self._execute(endpoint, func, kwargs))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _execute(self, endpoint: str, func: Callable[..., Awaitable[Any]], kwargs: Dict[str, Any]) -> Any:
+        """排队获取令牌后执行请求，429时退避重试"""
+        metrics = self._metrics(endpoint)
+        weight = ENDPOINT_WEIGHTS.get(endpoint, DEFAULT_ENDPOINT_WEIGHT)
+
+        for attempt in range(1, self.max_retries + 1):
+            waited = await self.bucket.acquire(weight)
+            if waited > 0:
+                metrics.throttled += 1
+                metrics.throttled_seconds += waited
+                REST_THROTTLED_SECONDS.labels(endpoint=endpoint).inc(waited)
+                logging.debug(f"{endpoint} 限流排队 {waited:.3f}秒")
+
+            metrics.calls += 1
+            started = time.monotonic()
+            try:
+                result = await func(**kwargs)
+            except Exception as e:
+                REST_LATENCY.labels(endpoint=endpoint).observe(time.monotonic() - started)
+                if not is_rate_limited_error(e):
+                    metrics.errors += 1
+                    REST_REQUESTS.labels(endpoint=endpoint, status="error").inc()
+                    raise
+                metrics.rate_limited += 1
+                REST_REQUESTS.labels(endpoint=endpoint, status="429").inc()
+                REST_BACKOFFS.labels(endpoint=endpoint).inc()
+                self.bucket.drain()
+                wait_time = min(2 ** attempt, self.max_backoff)
+                logging.warning(f"{endpoint} API限流，等待{wait_time}秒后重试 (尝试 {attempt}/{self.max_retries})")
+                await asyncio.sleep(wait_time)
+                continue
+            REST_LATENCY.labels(endpoint=endpoint).observe(time.monotonic() - started)
+            REST_REQUESTS.labels(endpoint=endpoint, status="ok").inc()
+            return result
+
+        raise RateLimitExceeded(f"{endpoint} API限流严重，已重试{self.max_retries}次")
+
+    def metrics_summary(self) -> str:
+        """返回各端点统计摘要"""
+        parts = []
+        for endpoint, m in sorted(self.metrics.items()):
+            parts.append(
+                f"{endpoint}: calls={m.calls}, coalesced={m.coalesced}, throttled={m.throttled}"
+                f"({m.throttled_seconds:.2f}s), 429={m.rate_limited}, errors={m.errors}"
+            )
+        return "; ".join(parts) if parts else "无REST请求"
+
+
+_gateway: Optional[RestGateway] = None
+
+
+def get_gateway() -> RestGateway:
+    """获取进程内共享的REST网关"""
+    global _gateway
+    if _gateway is None:
+        _gateway = RestGateway()
+    return _gateway
+
+
+def configure_gateway(config: Optional[Dict[str, Any]]) -> RestGateway:
+    """
+    按配置初始化进程内共享的REST网关
+
+    Args:
+        config: 配置中的rate_limit段（可选）
+
+    Returns:
+        REST网关
+    """
+    global _gateway
+    config = config or {}
+    _gateway = RestGateway(
+        weight_per_minute=config.get('weight_per_minute', 24000),
+        max_retries=config.get('max_retries', 5),
+        max_backoff=config.get('max_backoff', 30)
+    )
+    logging.info(f"REST网关已配置: 每分钟权重额度={_gateway.weight_per_minute}")
+    return _gateway
@@ -0,0 +1,1011 @@
+"""
+模拟Lighter交易所（离线回放/压测用）
+在进程内替换策略用到的SDK接口，不连主网：
+- REST：OrderApi(order_books, order_book_orders, account_active_orders, account_inactive_orders)、
+  AccountApi(account)、TransactionApi(next_nonce, send_tx, send_tx_batch)
+- SignerClient：create_order/create_market_order/cancel_order、sign_*、认证token、nonce管理器
+- WebSocket：账户推送（orders/trades/positions）和订单簿快照/增量
+撮合引擎按价格-时间优先撮合，外部流动性按随机游走的中间价挂单、随机吃单，
+REST/下单延迟和429可配置注入；同一seed下行情和故障序列一致
+"""
+
+import asyncio
+import bisect
+import importlib
+import itertools
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+# 外部流动性（做市/吃单）使用的账户，不推送、不统计持仓
+EXTERNAL_ACCOUNT = 0
+
+ORDER_TYPE_LIMIT = 0
+ORDER_TYPE_MARKET = 1
+TIME_IN_FORCE_IOC = 0
+TIME_IN_FORCE_GTT = 1
+TIME_IN_FORCE_POST_ONLY = 2
+TX_TYPE_CREATE_ORDER = 14
+TX_TYPE_CANCEL_ORDER = 15
+
+SEND_TX_ENDPOINTS = ("send_tx", "send_tx_batch")
+
+_active_exchange: Optional["SimExchange"] = None
+
+
+class SimApiError(Exception):
+    """模拟的API异常（status与SDK的ApiException一致）"""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(f"({status}) {reason}")
+        self.status = status
+        self.reason = reason
+
+
+def get_exchange() -> "SimExchange":
+    """获取当前安装的模拟交易所"""
+    if _active_exchange is None:
+        raise RuntimeError("模拟交易所未安装，先调用SimExchange.install()")
+    return _active_exchange
+
+
+class FaultInjector:
+    """REST/下单延迟、WebSocket推送延迟和429注入"""
+
+    def __init__(self, seed: int = 0, rest_latency_ms: float = 20, tx_latency_ms: float = 30,
+                 jitter_ms: float = 10, ws_latency_ms: float = 5, rate_limit_rate: float = 0.0):
+        """
+        初始化故障注入
+
+        Args:
+            seed: 随机种子
+            rest_latency_ms: 查询类REST请求的基础延迟（毫秒）
+            tx_latency_ms: sendTx/sendTxBatch的基础延迟（毫秒）
+            jitter_ms: 延迟抖动上限（毫秒，均匀分布）
+            ws_latency_ms: WebSocket推送延迟（毫秒）
+            rate_limit_rate: 每个REST请求返回429的概率
+        """
+        self.rng = random.Random(seed)
+        self.rest_latency = rest_latency_ms / 1000
+        self.tx_latency = tx_latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.ws_latency = ws_latency_ms / 1000
+        self.rate_limit_rate = rate_limit_rate
+        self.requests = 0
+        self.rate_limited = 0
+
+    async def before_request(self, endpoint: str):
+        """
+        模拟一次REST往返：等待延迟，按概率返回429
+
+        Args:
+            endpoint: 端点名称
+        """
+        self.requests += 1
+        base = self.tx_latency if endpoint in SEND_TX_ENDPOINTS else self.rest_latency
+        delay = base + self.rng.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.rate_limit_rate and self.rng.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            raise SimApiError(429, "Too Many Requests")
+
+    def ws_delay(self) -> float:
+        """WebSocket推送延迟（秒）"""
+        return self.ws_latency + self.rng.uniform(0, self.jitter) if self.ws_latency else 0.0
+
+
+class SimMarket:
+    """单个市场的参数和订单簿（价格 -> 按时间排序的挂单队列）"""
+
+    def __init__(self, market_id: int, symbol: str, mid_price: Decimal, tick: Decimal,
+                 size_decimals: int = 4, price_decimals: int = 2, min_base_amount: str = "0.0010"):
+        self.market_id = market_id
+        self.symbol = symbol
+        self.mid_price = mid_price
+        self.tick = tick
+        self.size_decimals = size_decimals
+        self.price_decimals = price_decimals
+        self.min_base_amount = min_base_amount
+        self.levels: Dict[bool, Dict[Decimal, deque]] = {True: {}, False: {}}  # is_ask -> price -> orders
+        self.prices: Dict[bool, List[Decimal]] = {True: [], False: []}  # 升序
+        self.book_nonce = 0
+
+    def to_size(self, base_amount: int) -> Decimal:
+        return Decimal(base_amount).scaleb(-self.size_decimals)
+
+    def to_price(self, price: int) -> Decimal:
+        return Decimal(price).scaleb(-self.price_decimals)
+
+    def best(self, is_ask: bool) -> Optional[Decimal]:
+        prices = self.prices[is_ask]
+        if not prices:
+            return None
+        return prices[0] if is_ask else prices[-1]
+
+    def level_size(self, is_ask: bool, price: Decimal) -> Decimal:
+        return sum((order["remaining"] for order in self.levels[is_ask].get(price, ())), Decimal(0))
+
+    def iter_levels(self, is_ask: bool):
+        """从最优价开始遍历 (价格, 挂单队列)"""
+        prices = self.prices[is_ask] if is_ask else reversed(self.prices[is_ask])
+        for price in list(prices):
+            yield price, self.levels[is_ask][price]
+
+
+class SimExchange:
+    """模拟交易所：撮合引擎 + 账户 + 推送（状态由一把锁保护，REST在事件循环中调用，推送在WebSocket线程中消费）"""
+
+    def __init__(self, markets: List[SimMarket], seed: int = 0, faults: Optional[FaultInjector] = None,
+                 collateral: str = "10000", book_levels: int = 10, level_size: str = "0.5",
+                 flow_interval: float = 0.5, taker_probability: float = 0.3, max_sweep: int = 3):
+        """
+        初始化模拟交易所
+
+        Args:
+            markets: 市场列表
+            seed: 行情随机种子
+            faults: 故障注入（默认无延迟、无429）
+            collateral: 账户初始保证金
+            book_levels: 外部流动性每侧挂单档数
+            level_size: 外部流动性每档数量
+            flow_interval: 行情步进间隔（秒）
+            taker_probability: 每步出现外部吃单的概率
+            max_sweep: 外部吃单最多扫过的档数
+        """
+        self.markets: Dict[int, SimMarket] = {market.market_id: market for market in markets}
+        self.rng = random.Random(seed)
+        self.faults = faults or FaultInjector(seed, 0, 0, 0, 0)
+        self.collateral = Decimal(collateral)
+        self.book_levels = book_levels
+        self.level_size = Decimal(level_size)
+        self.flow_interval = flow_interval
+        self.taker_probability = taker_probability
+        self.max_sweep = max_sweep
+
+        self.accounts: Dict[int, Dict[str, Any]] = {}
+        self.orders: Dict[int, Dict[str, Any]] = {}  # order_index -> 活跃订单
+        self._order_ids = itertools.count(281475000000000)
+        self._trade_ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._account_subscribers: Dict[int, List[queue.Queue]] = {}
+        self._book_subscribers: Dict[int, List[queue.Queue]] = {}
+        self._pending_pushes: Dict[int, Dict[str, Any]] = {}
+        self._touched_levels: Dict[int, set] = {}
+        self._flow_task: Optional[asyncio.Task] = None
+        self._patches: List[Tuple[Any, str, Any]] = []
+
+        self.trades: List[Dict[str, Any]] = []
+        self.tx_count = 0
+        self.rejected_txs = 0
+
+        for market in self.markets.values():
+            self._replenish(market)
+            self._touched_levels.clear()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]], symbol: str) -> "SimExchange":
+        """
+        按配置创建（配置中的sim段）
+
+        Args:
+            config: sim配置（seed, mid_price, tick, 延迟/429参数等）
+            symbol: 市场名称（多个市场用逗号分隔，market_id从market_id配置起依次递增）
+
+        Returns:
+            模拟交易所
+        """
+        config = config or {}
+        seed = config.get("seed", 42)
+        markets = [
+            SimMarket(
+                market_id=config.get("market_id", 1) + offset,
+                symbol=name,
+                mid_price=Decimal(str(config.get("mid_price", 3000))),
+                tick=Decimal(str(config.get("tick", "0.5"))),
+                size_decimals=config.get("size_decimals", 4),
+                price_decimals=config.get("price_decimals", 2),
+                min_base_amount=str(config.get("min_base_amount", "0.0010"))
+            )
+            for offset, name in enumerate(symbol.split(","))
+        ]
+        faults = FaultInjector(
+            seed=seed + 1,
+            rest_latency_ms=config.get("rest_latency_ms", 20),
+            tx_latency_ms=config.get("tx_latency_ms", 30),
+            jitter_ms=config.get("jitter_ms", 10),
+            ws_latency_ms=config.get("ws_latency_ms", 5),
+            rate_limit_rate=config.get("rate_limit_rate", 0.0)
+        )
+        return cls(
+            markets,
+            seed=seed,
+            faults=faults,
+            collateral=str(config.get("collateral", "10000")),
+            book_levels=config.get("book_levels", 10),
+            level_size=str(config.get("level_size", "0.5")),
+            flow_interval=config.get("flow_interval", 0.5),
+            taker_probability=config.get("taker_probability", 0.3),
+            max_sweep=config.get("max_sweep", 3)
+        )
+
+    # ---------- 安装到SDK ----------
+
+    def install(self):
+        """用模拟实现替换lighter SDK和策略模块中的客户端类（在导入策略模块之后、创建策略之前调用）"""
+        global _active_exchange
+        _active_exchange = self
+        replacements = {
+            "SignerClient": SimSignerClient,
+            "ApiClient": SimApiClient,
+            "Configuration": SimConfiguration,
+            "OrderApi": SimOrderApi,
+            "AccountApi": SimAccountApi,
+            "TransactionApi": SimTransactionApi,
+            "WsClient": SimWsClient,
+            "OrderBookWsClient": SimOrderBookWsClient,
+        }
+        for module_name in ("lighter", "account_a_manager", "account_b_manager", "order_book",
+                            "account_stream_hub", "main", "main_A", "main_B", "main_multi"):
+            module = importlib.import_module(module_name)
+            for name, replacement in replacements.items():
+                if hasattr(module, name):
+                    self._patches.append((module, name, getattr(module, name)))
+                    setattr(module, name, replacement)
+        logging.info(f"🧪 模拟交易所已安装: markets={[m.symbol for m in self.markets.values()]}")
+
+    def uninstall(self):
+        """恢复被替换的SDK类"""
+        global _active_exchange
+        for module, name, original in reversed(self._patches):
+            setattr(module, name, original)
+        self._patches.clear()
+        if _active_exchange is self:
+            _active_exchange = None
+
+    # ---------- 账户 ----------
+
+    def _account(self, account_index: int) -> Dict[str, Any]:
+        account = self.accounts.get(account_index)
+        if account is None:
+            account = self.accounts[account_index] = {
+                "index": account_index,
+                "cash": Decimal(0),
+                "positions": {},  # market_id -> 带方向的持仓
+                "nonces": {},  # api_key_index -> 下一个nonce
+                "inactive": deque(maxlen=200),
+                "fills": 0,
+            }
+        return account
+
+    def next_nonce(self, account_index: int, api_key_index: int) -> int:
+        """服务端的下一个nonce"""
+        with self._lock:
+            return self._account(account_index)["nonces"].get(api_key_index, 1)
+
+    def _check_nonce(self, account_index: int, api_key_index: int, nonce: int):
+        expected = self._account(account_index)["nonces"].get(api_key_index, 1)
+        if nonce != expected:
+            self.rejected_txs += 1
+            raise SimApiError(400, f"invalid nonce: expected {expected}, got {nonce}")
+
+    def position(self, account_index: int, market_id: int) -> Decimal:
+        """带方向的持仓"""
+        with self._lock:
+            return self._account(account_index)["positions"].get(market_id, Decimal(0))
+
+    def _available_balance(self, account: Dict[str, Any]) -> Decimal:
+        equity = self.collateral + account["cash"]
+        for market_id, size in account["positions"].items():
+            equity += size * self.markets[market_id].mid_price
+        return equity
+
+    # ---------- 交易 ----------
+
+    def submit_tx(self, tx_type: int, tx_info: Dict[str, Any]) -> str:
+        """
+        执行一笔已签名交易（下单/撤单）
+
+        Args:
+            tx_type: 交易类型
+            tx_info: 交易内容
+
+        Returns:
+            交易哈希
+        """
+        with self._lock:
+            account_index = tx_info["AccountIndex"]
+            self._check_nonce(account_index, tx_info["ApiKeyIndex"], tx_info["Nonce"])
+            if tx_type not in (TX_TYPE_CREATE_ORDER, TX_TYPE_CANCEL_ORDER):
+                raise SimApiError(400, f"unsupported tx type: {tx_type}")
+            market = self.markets.get(tx_info["MarketIndex"])
+            if market is None:
+                raise SimApiError(400, f"market not found: {tx_info['MarketIndex']}")
+            if tx_type == TX_TYPE_CREATE_ORDER and tx_info["BaseAmount"] <= 0:
+                raise SimApiError(400, "invalid base amount")
+
+            # 通过校验的交易消耗nonce；撤销已不存在的订单与交易所一样在执行阶段失败，不返回错误
+            self._account(account_index)["nonces"][tx_info["ApiKeyIndex"]] = tx_info["Nonce"] + 1
+            self.tx_count += 1
+            if tx_type == TX_TYPE_CREATE_ORDER:
+                self._create_order(account_index, market, tx_info)
+            else:
+                self._cancel_order(account_index, market, tx_info["Index"])
+            self._flush()
+        return f"0x{account_index:x}{tx_info['Nonce']:016x}"
+
+    def _create_order(self, account_index: int, market: SimMarket, tx_info: Dict[str, Any]):
+        size = market.to_size(tx_info["BaseAmount"])
+        order = {
+            "order_index": next(self._order_ids),
+            "client_order_index": tx_info["ClientOrderIndex"],
+            "account_index": account_index,
+            "market_index": market.market_id,
+            "is_ask": bool(tx_info["IsAsk"]),
+            "price": market.to_price(tx_info["Price"]),
+            "initial": size,
+            "remaining": size,
+            "filled": Decimal(0),
+            "filled_quote": Decimal(0),
+            "type": tx_info["Type"],
+            "time_in_force": tx_info["TimeInForce"],
+            "status": "open",
+            "nonce": tx_info["Nonce"],
+            "timestamp": int(time.time() * 1000),
+        }
+        self._place(market, order)
+
+    def _place(self, market: SimMarket, order: Dict[str, Any]):
+        """撮合新订单，剩余部分按TIF挂单或撤销"""
+        opposite = not order["is_ask"]
+        best = market.best(opposite)
+        crosses = best is not None and (best <= order["price"] if not order["is_ask"] else best >= order["price"])
+        if order["time_in_force"] == TIME_IN_FORCE_POST_ONLY and crosses:
+            self._finish(order, "canceled-post-only")
+            return
+
+        self._match(market, order)
+        if order["remaining"] == 0:
+            self._finish(order, "filled")
+        elif order["type"] == ORDER_TYPE_MARKET or order["time_in_force"] == TIME_IN_FORCE_IOC:
+            self._finish(order, "canceled-not-enough-liquidity" if order["filled"] == 0 else "canceled")
+        else:
+            self._rest(market, order)
+            self._emit_order(order)
+
+    def _match(self, market: SimMarket, taker: Dict[str, Any]):
+        """按价格-时间优先与对手盘成交（市价单的price为最差可接受价格，0表示不限价）"""
+        limit = taker["price"]
+        for price, resting in market.iter_levels(not taker["is_ask"]):
+            if taker["remaining"] == 0:
+                break
+            if limit > 0 and (price > limit if not taker["is_ask"] else price < limit):
+                break
+            while resting and taker["remaining"] > 0:
+                maker = resting[0]
+                size = min(maker["remaining"], taker["remaining"])
+                self._trade(market, maker, taker, size, price)
+                if maker["remaining"] == 0:
+                    resting.popleft()
+                    self.orders.pop(maker["order_index"], None)
+                    self._finish(maker, "filled")
+            if not resting:
+                self._drop_level(market, not taker["is_ask"], price)
+            self._touched_levels.setdefault(market.market_id, set()).add((not taker["is_ask"], price))
+
+    def _trade(self, market: SimMarket, maker: Dict[str, Any], taker: Dict[str, Any], size: Decimal, price: Decimal):
+        quote = size * price
+        for order in (maker, taker):
+            order["remaining"] -= size
+            order["filled"] += size
+            order["filled_quote"] += quote
+        ask, bid = (maker, taker) if maker["is_ask"] else (taker, maker)
+        trade = {
+            "trade_id": next(self._trade_ids),
+            "market_id": market.market_id,
+            "size": str(size),
+            "price": str(price),
+            "usd_amount": str(quote),
+            "ask_id": ask["order_index"],
+            "bid_id": bid["order_index"],
+            "ask_account_id": ask["account_index"],
+            "bid_account_id": bid["account_index"],
+            "is_maker_ask": maker["is_ask"],
+            "timestamp": int(time.time() * 1000),
+        }
+        self.trades.append(trade)
+        for order, signed in ((bid, size), (ask, -size)):
+            if order["account_index"] == EXTERNAL_ACCOUNT:
+                continue
+            account = self._account(order["account_index"])
+            positions = account["positions"]
+            positions[market.market_id] = positions.get(market.market_id, Decimal(0)) + signed
+            account["cash"] -= signed * price
+            account["fills"] += 1
+            self._push_item(order["account_index"], "trades", market.market_id, trade)
+        if maker["remaining"] > 0:
+            self._emit_order(maker)
+
+    def _rest(self, market: SimMarket, order: Dict[str, Any]):
+        levels = market.levels[order["is_ask"]]
+        if order["price"] not in levels:
+            levels[order["price"]] = deque()
+            bisect.insort(market.prices[order["is_ask"]], order["price"])
+        levels[order["price"]].append(order)
+        self.orders[order["order_index"]] = order
+        self._touched_levels.setdefault(market.market_id, set()).add((order["is_ask"], order["price"]))
+
+    def _drop_level(self, market: SimMarket, is_ask: bool, price: Decimal):
+        if market.levels[is_ask].pop(price, None) is not None:
+            prices = market.prices[is_ask]
+            del prices[bisect.bisect_left(prices, price)]
+
+    def _cancel_order(self, account_index: int, market: SimMarket, order_index: int):
+        order = self.orders.get(order_index)
+        if order is None or order["account_index"] != account_index or order["market_index"] != market.market_id:
+            logging.debug(f"模拟撤单失败（订单不存在或已成交）: account={account_index}, order_index={order_index}")
+            return
+        resting = market.levels[order["is_ask"]].get(order["price"])
+        if resting is not None:
+            resting.remove(order)
+            if not resting:
+                self._drop_level(market, order["is_ask"], order["price"])
+        self.orders.pop(order_index, None)
+        self._touched_levels.setdefault(market.market_id, set()).add((order["is_ask"], order["price"]))
+        self._finish(order, "canceled")
+
+    def _finish(self, order: Dict[str, Any], status: str):
+        order["status"] = status
+        if order["account_index"] != EXTERNAL_ACCOUNT:
+            self._account(order["account_index"])["inactive"].appendleft(order)
+        self._emit_order(order)
+
+    # ---------- 推送 ----------
+
+    def _emit_order(self, order: Dict[str, Any]):
+        if order["account_index"] == EXTERNAL_ACCOUNT:
+            return
+        self._push_item(order["account_index"], "orders", order["market_index"], {
+            "order_index": order["order_index"],
+            "client_order_index": order["client_order_index"],
+            "market_index": order["market_index"],
+            "owner_account_index": order["account_index"],
+            "is_ask": order["is_ask"],
+            "price": str(order["price"]),
+            "initial_base_amount": str(order["initial"]),
+            "remaining_base_amount": str(order["remaining"]),
+            "filled_base_amount": str(order["filled"]),
+            "filled_quote_amount": str(order["filled_quote"]),
+            "status": order["status"],
+            "nonce": order["nonce"],
+            "timestamp": order["timestamp"],
+        })
+
+    def _push_item(self, account_index: int, field: str, market_id: int, item: Dict[str, Any]):
+        pending = self._pending_pushes.setdefault(account_index, {})
+        pending.setdefault(field, {}).setdefault(str(market_id), []).append(item)
+
+    def _account_snapshot(self, account: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "positions": {
+                str(market_id): {
+                    "market_id": market_id,
+                    "symbol": self.markets[market_id].symbol,
+                    "position": str(abs(size)),
+                    "sign": (1 if size > 0 else -1) if size != 0 else 0,
+                }
+                for market_id, size in account["positions"].items()
+            },
+            "available_balance": str(self._available_balance(account)),
+        }
+
+    def _flush(self):
+        """把本次交易产生的订单/成交/持仓变化推送给订阅者，订单簿变化推送增量"""
+        pushes, self._pending_pushes = self._pending_pushes, {}
+        for account_index, update in pushes.items():
+            subscribers = self._account_subscribers.get(account_index)
+            if not subscribers:
+                continue
+            update.update(self._account_snapshot(self._account(account_index)))
+            due = time.monotonic() + self.faults.ws_delay()
+            for subscriber in subscribers:
+                subscriber.put((due, update))
+
+        touched, self._touched_levels = self._touched_levels, {}
+        for market_id, levels in touched.items():
+            subscribers = self._book_subscribers.get(market_id)
+            market = self.markets[market_id]
+            begin_nonce = market.book_nonce
+            market.book_nonce += 1
+            if not subscribers:
+                continue
+            bids = [{"price": str(p), "size": str(market.level_size(False, p))} for is_ask, p in levels if not is_ask]
+            asks = [{"price": str(p), "size": str(market.level_size(True, p))} for is_ask, p in levels if is_ask]
+            message = {
+                "channel": f"order_book:{market_id}",
+                "order_book": {"bids": bids, "asks": asks, "begin_nonce": begin_nonce, "nonce": market.book_nonce},
+            }
+            due = time.monotonic() + self.faults.ws_delay()
+            for subscriber in subscribers:
+                subscriber.put((due, message))
+
+    def subscribe_account(self, account_index: int, subscriber: queue.Queue):
+        """订阅账户推送（先推送一次当前持仓）"""
+        with self._lock:
+            self._account_subscribers.setdefault(account_index, []).append(subscriber)
+            subscriber.put((time.monotonic(), self._account_snapshot(self._account(account_index))))
+
+    def subscribe_order_book(self, market_id: int, subscriber: queue.Queue):
+        """订阅订单簿（先推送完整快照）"""
+        with self._lock:
+            market = self.markets[market_id]
+            self._book_subscribers.setdefault(market_id, []).append(subscriber)
+            subscriber.put((time.monotonic(), {
+                "channel": f"order_book:{market_id}",
+                "order_book": {
+                    "bids": [{"price": str(p), "size": str(market.level_size(False, p))} for p in reversed(market.prices[False])],
+                    "asks": [{"price": str(p), "size": str(market.level_size(True, p))} for p in market.prices[True]],
+                    "nonce": market.book_nonce,
+                },
+            }))
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        """取消订阅"""
+        with self._lock:
+            for subscribers in list(self._account_subscribers.values()) + list(self._book_subscribers.values()):
+                if subscriber in subscribers:
+                    subscribers.remove(subscriber)
+
+    # ---------- 外部行情 ----------
+
+    def _external_order(self, market: SimMarket, is_ask: bool, price: Decimal, size: Decimal, market_order: bool = False):
+        order = {
+            "order_index": next(self._order_ids),
+            "client_order_index": 0,
+            "account_index": EXTERNAL_ACCOUNT,
+            "market_index": market.market_id,
+            "is_ask": is_ask,
+            "price": price,
+            "initial": size,
+            "remaining": size,
+            "filled": Decimal(0),
+            "filled_quote": Decimal(0),
+            "type": ORDER_TYPE_MARKET if market_order else ORDER_TYPE_LIMIT,
+            "time_in_force": TIME_IN_FORCE_IOC if market_order else TIME_IN_FORCE_GTT,
+            "status": "open",
+            "nonce": 0,
+            "timestamp": int(time.time() * 1000),
+        }
+        self._place(market, order)
+
+    def _replenish(self, market: SimMarket):
+        """围绕中间价补齐外部挂单，撤掉偏离过远的外部挂单"""
+        for is_ask in (True, False):
+            for k in range(1, self.book_levels + 1):
+                price = market.mid_price + market.tick * k if is_ask else market.mid_price - market.tick * k
+                best_opposite = market.best(not is_ask)
+                if best_opposite is not None and (price <= best_opposite if is_ask else price >= best_opposite):
+                    continue
+                external = sum(
+                    (o["remaining"] for o in market.levels[is_ask].get(price, ()) if o["account_index"] == EXTERNAL_ACCOUNT),
+                    Decimal(0)
+                )
+                if external < self.level_size:
+                    self._external_order(market, is_ask, price, self.level_size - external)
+            limit = market.tick * (self.book_levels + 1)
+            for price, resting in list(market.iter_levels(is_ask)):
+                if abs(price - market.mid_price) <= limit:
+                    continue
+                for order in [o for o in resting if o["account_index"] == EXTERNAL_ACCOUNT]:
+                    resting.remove(order)
+                    self.orders.pop(order["order_index"], None)
+                if not resting:
+                    self._drop_level(market, is_ask, price)
+                self._touched_levels.setdefault(market.market_id, set()).add((is_ask, price))
+
+    def step(self):
+        """行情推进一步：中间价随机游走，按概率出现扫过若干档的外部吃单，然后补齐流动性"""
+        with self._lock:
+            for market in self.markets.values():
+                market.mid_price += market.tick * self.rng.choice((-1, 0, 1))
+                if self.rng.random() < self.taker_probability:
+                    is_ask = self.rng.random() < 0.5
+                    sweep = self.rng.randint(1, self.max_sweep)
+                    size = sum(
+                        (market.level_size(not is_ask, price) for price, _ in
+                         itertools.islice(market.iter_levels(not is_ask), sweep)),
+                        Decimal(0)
+                    )
+                    if size > 0:
+                        self._external_order(market, is_ask, Decimal(0), size, market_order=True)
+                self._replenish(market)
+            self._flush()
+
+    def start(self):
+        """启动行情推进（必须在事件循环线程中调用）"""
+        if self._flow_task is None or self._flow_task.done():
+            self._flow_task = asyncio.get_running_loop().create_task(self._flow_loop())
+
+    def stop(self):
+        """停止行情推进"""
+        if self._flow_task and not self._flow_task.done():
+            self._flow_task.cancel()
+
+    async def _flow_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.flow_interval)
+                self.step()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.error(f"模拟行情推进异常: {e}", exc_info=True)
+
+    # ---------- 查询 ----------
+
+    def order_view(self, order: Dict[str, Any]) -> SimpleNamespace:
+        """订单 -> REST订单对象"""
+        return SimpleNamespace(
+            order_index=order["order_index"],
+            order_id=str(order["order_index"]),
+            client_order_index=order["client_order_index"],
+            market_index=order["market_index"],
+            owner_account_index=order["account_index"],
+            is_ask=order["is_ask"],
+            price=str(order["price"]),
+            initial_base_amount=str(order["initial"]),
+            remaining_base_amount=str(order["remaining"]),
+            filled_base_amount=str(order["filled"]),
+            filled_quote_amount=str(order["filled_quote"]),
+            status=order["status"],
+            nonce=order["nonce"],
+            timestamp=order["timestamp"],
+        )
+
+    def active_orders(self, account_index: int, market_id: int) -> List[SimpleNamespace]:
+        with self._lock:
+            return [
+                self.order_view(order) for order in self.orders.values()
+                if order["account_index"] == account_index and order["market_index"] == market_id
+            ]
+
+    def inactive_orders(self, account_index: int, market_id: int, limit: int) -> List[SimpleNamespace]:
+        with self._lock:
+            orders = [o for o in self._account(account_index)["inactive"] if o["market_index"] == market_id]
+            return [self.order_view(order) for order in orders[:limit]]
+
+    def book_orders(self, market_id: int, limit: int) -> SimpleNamespace:
+        with self._lock:
+            market = self.markets[market_id]
+            result = {}
+            for is_ask in (True, False):
+                orders = []
+                for _, resting in market.iter_levels(is_ask):
+                    orders.extend(self.order_view(order) for order in resting)
+                    if len(orders) >= limit:
+                        break
+                result[is_ask] = orders[:limit]
+            return SimpleNamespace(code=200, asks=result[True], bids=result[False],
+                                   total_asks=len(result[True]), total_bids=len(result[False]))
+
+    def account_view(self, account_index: int) -> SimpleNamespace:
+        with self._lock:
+            account = self._account(account_index)
+            snapshot = self._account_snapshot(account)
+            return SimpleNamespace(
+                index=account_index,
+                account_index=account_index,
+                collateral=str(self.collateral),
+                available_balance=snapshot["available_balance"],
+                positions=[SimpleNamespace(**position) for position in snapshot["positions"].values()],
+            )
+
+    def stats(self) -> str:
+        """返回统计"""
+        with self._lock:
+            accounts = [
+                f"{index}: fills={account['fills']}, positions="
+                f"{ {self.markets[m].symbol: str(size) for m, size in account['positions'].items()} }"
+                for index, account in self.accounts.items() if index != EXTERNAL_ACCOUNT
+            ]
+        return (
+            f"模拟交易所: 交易={self.tx_count}, 拒绝={self.rejected_txs}, 成交={len(self.trades)}, "
+            f"REST请求={self.faults.requests}, 注入429={self.faults.rate_limited}; " + "; ".join(accounts)
+        )
+
+
+# ---------- SDK替身 ----------
+
+class SimConfiguration:
+    """lighter.Configuration替身"""
+
+    def __init__(self, host: str = None, **kwargs):
+        self.host = host
+
+
+class SimApiClient:
+    """lighter.ApiClient替身"""
+
+    def __init__(self, configuration: SimConfiguration = None, **kwargs):
+        self.configuration = configuration
+        self.exchange = get_exchange()
+
+    async def close(self):
+        pass
+
+
+class SimOrderApi:
+    """lighter.OrderApi替身"""
+
+    def __init__(self, api_client: SimApiClient = None):
+        self.exchange = get_exchange()
+
+    async def order_books(self, market_id: int = 255, **kwargs):
+        await self.exchange.faults.before_request("order_books")
+        return SimpleNamespace(code=200, order_books=[
+            SimpleNamespace(
+                symbol=market.symbol,
+                market_id=market.market_id,
+                status="active",
+                supported_size_decimals=market.size_decimals,
+                supported_price_decimals=market.price_decimals,
+                min_base_amount=market.min_base_amount,
+            )
+            for market in self.exchange.markets.values() if market_id in (255, market.market_id)
+        ])
+
+    async def order_book_orders(self, market_id: int, limit: int = 10, **kwargs):
+        await self.exchange.faults.before_request("order_book_orders")
+        return self.exchange.book_orders(market_id, limit)
+
+    async def account_active_orders(self, account_index: int, market_id: int, auth: str = None, **kwargs):
+        await self.exchange.faults.before_request("account_active_orders")
+        return SimpleNamespace(code=200, orders=self.exchange.active_orders(account_index, market_id))
+
+    async def account_inactive_orders(self, account_index: int, limit: int = 10, market_id: int = None,
+                                      auth: str = None, **kwargs):
+        await self.exchange.faults.before_request("account_inactive_orders")
+        return SimpleNamespace(code=200, orders=self.exchange.inactive_orders(account_index, market_id, limit))
+
+
+class SimAccountApi:
+    """lighter.AccountApi替身"""
+
+    def __init__(self, api_client: SimApiClient = None):
+        self.exchange = get_exchange()
+
+    async def account(self, by: str, value: str, **kwargs):
+        await self.exchange.faults.before_request("account")
+        return SimpleNamespace(code=200, accounts=[self.exchange.account_view(int(value))])
+
+
+class SimTransactionApi:
+    """lighter.TransactionApi替身"""
+
+    def __init__(self, api_client: SimApiClient = None):
+        self.exchange = get_exchange()
+
+    async def next_nonce(self, account_index: int, api_key_index: int, **kwargs):
+        await self.exchange.faults.before_request("next_nonce")
+        return SimpleNamespace(code=200, nonce=self.exchange.next_nonce(account_index, api_key_index))
+
+    async def send_tx(self, tx_type: int, tx_info: str, **kwargs):
+        await self.exchange.faults.before_request("send_tx")
+        tx_hash = self.exchange.submit_tx(int(tx_type), json.loads(tx_info))
+        return SimpleNamespace(code=200, message=None, tx_hash=tx_hash)
+
+    async def send_tx_batch(self, tx_types: str, tx_infos: str, **kwargs):
+        await self.exchange.faults.before_request("send_tx_batch")
+        tx_hashes = []
+        for tx_type, tx_info in zip(json.loads(tx_types), json.loads(tx_infos)):
+            tx_info = json.loads(tx_info) if isinstance(tx_info, str) else tx_info
+            tx_hashes.append(self.exchange.submit_tx(int(tx_type), tx_info))
+        return SimpleNamespace(code=200, message=None, tx_hash=tx_hashes)
+
+
+class SimNonceManager:
+    """SDK乐观nonce管理器替身（本地递增，失败回退，可从服务端强制刷新）"""
+
+    def __init__(self, exchange: SimExchange, account_index: int, api_key_index: int):
+        self.exchange = exchange
+        self.account_index = account_index
+        self.api_key_index = api_key_index
+        self.nonce = {api_key_index: exchange.next_nonce(account_index, api_key_index) - 1}
+
+    def next_nonce(self) -> Tuple[int, int]:
+        self.nonce[self.api_key_index] += 1
+        return self.api_key_index, self.nonce[self.api_key_index]
+
+    def acknowledge_failure(self, api_key_index: int):
+        self.nonce[api_key_index] -= 1
+
+    def hard_refresh_nonce(self, api_key_index: int):
+        self.nonce[api_key_index] = self.exchange.next_nonce(self.account_index, api_key_index) - 1
+
+
+class SimSignerClient:
+    """lighter.SignerClient替身（签名结果为明文JSON，发送经过模拟的TransactionApi）"""
+
+    ORDER_TYPE_LIMIT = ORDER_TYPE_LIMIT
+    ORDER_TYPE_MARKET = ORDER_TYPE_MARKET
+    ORDER_TIME_IN_FORCE_IMMEDIATE_OR_CANCEL = TIME_IN_FORCE_IOC
+    ORDER_TIME_IN_FORCE_GOOD_TILL_TIME = TIME_IN_FORCE_GTT
+    ORDER_TIME_IN_FORCE_POST_ONLY = TIME_IN_FORCE_POST_ONLY
+    TX_TYPE_CREATE_ORDER = TX_TYPE_CREATE_ORDER
+    TX_TYPE_CANCEL_ORDER = TX_TYPE_CANCEL_ORDER
+
+    def __init__(self, url: str = None, private_key: str = None, account_index: int = 0,
+                 api_key_index: int = 0, **kwargs):
+        self.exchange = get_exchange()
+        self.url = url
+        self.account_index = account_index
+        self.api_key_index = api_key_index
+        self.api_client = SimApiClient(SimConfiguration(host=url))
+        self.nonce_manager = SimNonceManager(self.exchange, account_index, api_key_index)
+
+    def check_client(self):
+        return None
+
+    def create_auth_token_with_expiry(self, deadline: int = 600, **kwargs) -> Tuple[str, None]:
+        return f"sim:{self.account_index}:{self.api_key_index}:{int(time.time()) + deadline}", None
+
+    def _next_nonce(self, nonce: int) -> Tuple[int, int]:
+        if nonce == -1:
+            return self.nonce_manager.next_nonce()
+        return self.api_key_index, nonce
+
+    def sign_create_order(self, market_index: int, client_order_index: int, base_amount: int, price: int,
+                          is_ask: bool, order_type: int, time_in_force: int, reduce_only: bool = False,
+                          trigger_price: int = 0, order_expiry: int = -1, nonce: int = -1, **kwargs):
+        api_key_index, nonce = self._next_nonce(nonce)
+        return json.dumps({
+            "AccountIndex": self.account_index, "ApiKeyIndex": api_key_index,
+            "MarketIndex": market_index, "ClientOrderIndex": client_order_index,
+            "BaseAmount": int(base_amount), "Price": int(price), "IsAsk": int(bool(is_ask)),
+            "Type": order_type, "TimeInForce": time_in_force, "ReduceOnly": int(bool(reduce_only)),
+            "TriggerPrice": trigger_price, "OrderExpiry": order_expiry, "Nonce": nonce,
+        }), None
+
+    def sign_cancel_order(self, market_index: int, order_index: int, nonce: int = -1, **kwargs):
+        api_key_index, nonce = self._next_nonce(nonce)
+        return json.dumps({
+            "AccountIndex": self.account_index, "ApiKeyIndex": api_key_index,
+            "MarketIndex": market_index, "Index": order_index, "Nonce": nonce,
+        }), None
+
+    async def _send(self, tx_type: int, tx_info: str):
+        """发送交易，失败时与SDK一样回退nonce并返回错误字符串"""
+        try:
+            resp = await SimTransactionApi(self.api_client).send_tx(tx_type=tx_type, tx_info=tx_info)
+            return json.loads(tx_info), resp, None
+        except Exception as e:
+            self.nonce_manager.acknowledge_failure(self.api_key_index)
+            return None, None, str(e)
+
+    async def create_order(self, market_index: int, client_order_index: int, base_amount: int, price: int,
+                           is_ask: bool, order_type: int, time_in_force: int, reduce_only: bool = False,
+                           trigger_price: int = 0, order_expiry: int = -1, nonce: int = -1, **kwargs):
+        tx_info, _ = self.sign_create_order(
+            market_index, client_order_index, base_amount, price, is_ask, order_type, time_in_force,
+            reduce_only, trigger_price, order_expiry, nonce
+        )
+        return await self._send(TX_TYPE_CREATE_ORDER, tx_info)
+
+    async def create_market_order(self, market_index: int, client_order_index: int, base_amount: int,
+                                  avg_execution_price: int, is_ask: bool, reduce_only: bool = False,
+                                  nonce: int = -1, **kwargs):
+        return await self.create_order(
+            market_index, client_order_index, base_amount, avg_execution_price, is_ask,
+            ORDER_TYPE_MARKET, TIME_IN_FORCE_IOC, reduce_only, nonce=nonce
+        )
+
+    async def cancel_order(self, market_index: int, order_index: int, nonce: int = -1, **kwargs):
+        tx_info, _ = self.sign_cancel_order(market_index, order_index, nonce)
+        return await self._send(TX_TYPE_CANCEL_ORDER, tx_info)
+
+    async def close(self):
+        pass
+
+
+class _SimConnection:
+    """WebSocket连接替身（ws.send/ws.close）"""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def send(self, message: str):
+        pass
+
+    def close(self):
+        self.closed.set()
+
+
+class _SimStreamClient:
+    """按推送到期时间投递消息的WebSocket客户端基类（run()阻塞直到连接关闭）"""
+
+    ping_interval = 20
+
+    def __init__(self):
+        self.exchange = get_exchange()
+        self.ws = _SimConnection()
+        self._queue: queue.Queue = queue.Queue()
+
+    def _subscribe(self):
+        raise NotImplementedError
+
+    def _deliver(self, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    def _ping(self):
+        pass
+
+    def run(self):
+        self._subscribe()
+        last_message = time.monotonic()
+        try:
+            while not self.ws.closed.is_set():
+                try:
+                    due, message = self._queue.get(timeout=0.2)
+                except queue.Empty:
+                    if time.monotonic() - last_message > self.ping_interval:
+                        last_message = time.monotonic()
+                        self._ping()
+                    continue
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                last_message = time.monotonic()
+                self._deliver(message)
+        finally:
+            self.exchange.unsubscribe(self._queue)
+
+
+class SimWsClient(_SimStreamClient):
+    """lighter.WsClient替身（账户推送）"""
+
+    def __init__(self, host: str = None, path: str = None, order_book_ids: List[int] = None,
+                 account_ids: List[int] = None, on_order_book_update=None, on_account_update=None, **kwargs):
+        super().__init__()
+        self.account_ids = list(account_ids or [])
+        self.on_account_update = on_account_update
+
+    def _subscribe(self):
+        for account_id in self.account_ids:
+            self.exchange.subscribe_account(account_id, self._queue)
+
+    def _deliver(self, message: Dict[str, Any]):
+        for account_id in self.account_ids:
+            if self.on_account_update:
+                self.on_account_update(str(account_id), message)
+
+    def _ping(self):
+        for account_id in self.account_ids:
+            if self.on_account_update:
+                self.on_account_update(str(account_id), {"type": "ping"})
+
+
+class SimOrderBookWsClient(_SimStreamClient):
+    """order_book.OrderBookWsClient替身（订单簿快照/增量交给OrderBookFeed）"""
+
+    def __init__(self, feed, host: str = None, order_book_ids: List[int] = None):
+        super().__init__()
+        self.feed = feed
+        self.order_book_ids = list(order_book_ids or [])
+        self._snapshot_pending = set(self.order_book_ids)
+
+    def _subscribe(self):
+        for market_id in self.order_book_ids:
+            self.exchange.subscribe_order_book(market_id, self._queue)
+
+    def _deliver(self, message: Dict[str, Any]):
+        market_id = int(message["channel"].split(":")[1])
+        is_snapshot = market_id in self._snapshot_pending
+        self._snapshot_pending.discard(market_id)
+        self.feed.on_order_book_message(message, is_snapshot=is_snapshot)
@@ -0,0 +1,213 @@
+"""
+离线回放/压测入口
+用模拟交易所（sim_exchange）驱动策略，不连主网：
+- split模式（默认）：同一进程内运行 main_A + main_B 两个策略实例，经Redis通信，与实盘部署一致
+- single模式：运行 main.py 的单进程策略（进程内传输）
+- multi模式：运行 main_multi.py，--market 可用逗号分隔多个市场，各市场使用相同的挂单数量和档位
+运行固定时长后输出成交、对冲延迟、REST统计和最终持仓；同一seed下行情和故障序列一致
+
+用法:
+  python sim_runner.py --market ETH --quantity 0.1 --depth 2 --duration 60
+  python sim_runner.py --market ETH --quantity 0.1 --depth 2 --mode single --rate-limit 0.05 --tx-latency 80
+  python sim_runner.py --market ETH,BTC,SOL --quantity 0.1 --depth 2 --mode multi
+需要本地Redis（使用sim.redis_db，避免与实盘数据混用）
+"""
+
+import argparse
+import asyncio
+import copy
+import logging
+import os
+import tempfile
+from decimal import Decimal
+
+import yaml
+
+from sim_exchange import SimExchange
+from utils import load_config
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml")
+
+# 配置中未填写账户时使用的模拟账户索引
+SIM_ACCOUNT_INDEXES = {"account_a": 1001, "account_b": 1002}
+
+# 命令行参数 -> sim配置项
+SIM_OVERRIDES = {
+    "seed": "seed",
+    "rate_limit": "rate_limit_rate",
+    "rest_latency": "rest_latency_ms",
+    "tx_latency": "tx_latency_ms",
+    "ws_latency": "ws_latency_ms",
+}
+
+
+def build_sim_config(config: dict, sim_config: dict) -> dict:
+    """
+    生成模拟运行用的策略配置：交易所地址指向模拟交易所，Redis使用独立的db，未填写的账户用模拟账户补齐
+
+    Args:
+        config: 原始配置
+        sim_config: sim配置段
+
+    Returns:
+        新配置
+    """
+    config = copy.deepcopy(config)
+    config["lighter"]["base_url"] = "sim://exchange"
+    config["lighter"]["ws_url"] = "sim://exchange"
+    config["redis"]["db"] = sim_config.get("redis_db", 15)
+    for name, account_index in SIM_ACCOUNT_INDEXES.items():
+        account = config["accounts"][name]
+        if account.get("account_index") is None:
+            account["account_index"] = account_index
+        if account.get("api_key_index") is None:
+            account["api_key_index"] = 0
+    return config
+
+
+async def run_split(exchange: SimExchange, config_path: str, args) -> list:
+    """main_A + main_B 同进程运行"""
+    from main_A import HedgeStrategy as HedgeStrategyA
+    from main_B import HedgeStrategyB
+
+    strategy_a = HedgeStrategyA(config_path, args.market, args.quantity, args.depth)
+    strategy_b = HedgeStrategyB(config_path, args.market)
+    # B先就绪，A的第一笔成交才有人对冲
+    await strategy_b.initialize()
+    await strategy_a.initialize()
+    await run_for(exchange, args.duration, [strategy_b, strategy_a])
+    return [strategy_a, strategy_b]
+
+
+async def run_single(exchange: SimExchange, config_path: str, args) -> list:
+    """main.py 单进程模式运行"""
+    from main import HedgeStrategy
+
+    strategy = HedgeStrategy(config_path, args.market, args.quantity, args.depth)
+    await strategy.initialize()
+    await run_for(exchange, args.duration, [strategy])
+    return [strategy]
+
+
+async def run_multi(exchange: SimExchange, config_path: str, args) -> list:
+    """main_multi.py 多市场单进程模式运行"""
+    from main_multi import MultiMarketHedge
+
+    markets = [(name, args.quantity, args.depth) for name in args.market.split(",")]
+    runner = MultiMarketHedge(config_path, markets)
+    await runner.initialize()
+    await run_for(exchange, args.duration, [runner])
+    return [runner]
+
+
+async def run_for(exchange: SimExchange, duration: float, strategies: list):
+    """
+    运行策略指定时长后停止（先停行情，避免停止过程中残留挂单继续成交）
+
+    Args:
+        exchange: 模拟交易所
+        duration: 运行时长（秒）
+        strategies: 已初始化的策略实例
+    """
+    tasks = [asyncio.get_running_loop().create_task(strategy.run()) for strategy in strategies]
+    done, _ = await asyncio.wait(tasks, timeout=duration, return_when=asyncio.FIRST_EXCEPTION)
+    for task in done:
+        if task.exception():
+            logging.error(f"策略异常退出: {task.exception()}")
+
+    exchange.stop()
+    for strategy in strategies:
+        strategy.stop()
+    _, pending = await asyncio.wait(tasks, timeout=15)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending, timeout=5)
+
+
+def report(exchange: SimExchange, config: dict, strategies: list, duration: float):
+    """输出模拟运行统计（吞吐按策略运行时长计算，不含初始化和停止）"""
+    from rest_gateway import get_gateway
+
+    account_a = config["accounts"]["account_a"]["account_index"]
+    account_b = config["accounts"]["account_b"]["account_index"]
+
+    def count_fills(account_index):
+        return sum(1 for t in exchange.trades if account_index in (t["ask_account_id"], t["bid_account_id"]))
+
+    fills_a, fills_b = count_fills(account_a), count_fills(account_b)
+
+    print("=" * 60)
+    print(f"模拟运行 {duration:.1f}秒")
+    print(exchange.stats())
+    print(f"A成交笔数={fills_a}, B对冲成交笔数={fills_b}, 对冲吞吐={fills_b / duration:.2f}笔/秒")
+    for market_id, market in exchange.markets.items():
+        position_a = exchange.position(account_a, market_id)
+        position_b = exchange.position(account_b, market_id)
+        print(f"最终持仓[{market.symbol}]: A={position_a}, B={position_b}, 不平衡={position_a + position_b}")
+    for strategy in strategies:
+        for worker in getattr(strategy, "workers", [strategy]):
+            manager = getattr(worker, "account_b_manager", None)
+            if manager is not None:
+                print(manager.latency_tracker.summary())
+        monitor = getattr(strategy, "loop_monitor", None)
+        if monitor is not None:
+            print(monitor.summary())
+    print(f"REST网关统计: {get_gateway().metrics_summary()}")
+    print("=" * 60)
+
+
+async def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="模拟交易所回放/压测")
+    parser.add_argument("--market", type=str, required=True,
+                        help="市场名称（如 ETH, BTC, ENA；multi模式可用逗号分隔多个市场）")
+    parser.add_argument("--quantity", type=Decimal, required=True, help="挂单数量（base_amount）")
+    parser.add_argument("--depth", type=int, required=True, help="挂单档位（按价格档位计，同价多笔挂单算一档；1表示买1/卖1）")
+    parser.add_argument("--duration", type=float, default=60, help="运行时长（秒）")
+    parser.add_argument("--mode", choices=("split", "single", "multi"), default="split",
+                        help="split: main_A+main_B经Redis；single: main.py单进程；multi: main_multi.py多市场单进程")
+    parser.add_argument("--config", type=str, default=DEFAULT_CONFIG, help="配置文件路径")
+    parser.add_argument("--seed", type=int, help="随机种子（覆盖sim.seed）")
+    parser.add_argument("--rate-limit", type=float, help="REST请求返回429的概率（覆盖sim.rate_limit_rate）")
+    parser.add_argument("--rest-latency", type=float, help="查询类REST延迟毫秒（覆盖sim.rest_latency_ms）")
+    parser.add_argument("--tx-latency", type=float, help="下单延迟毫秒（覆盖sim.tx_latency_ms）")
+    parser.add_argument("--ws-latency", type=float, help="WebSocket推送延迟毫秒（覆盖sim.ws_latency_ms）")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    sim_config = dict(config.get("sim") or {})
+    for arg_name, key in SIM_OVERRIDES.items():
+        value = getattr(args, arg_name)
+        if value is not None:
+            sim_config[key] = value
+
+    run_config = build_sim_config(config, sim_config)
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+        yaml.safe_dump(run_config, f, allow_unicode=True)
+        config_path = f.name
+
+    exchange = SimExchange.from_config(sim_config, args.market)
+    exchange.install()
+    exchange.start()
+    try:
+        if args.mode == "split":
+            strategies = await run_split(exchange, config_path, args)
+        elif args.mode == "multi":
+            strategies = await run_multi(exchange, config_path, args)
+        else:
+            strategies = await run_single(exchange, config_path, args)
+        report(exchange, run_config, strategies, args.duration)
+    finally:
+        exchange.stop()
+        exchange.uninstall()
+        os.unlink(config_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    asyncio.run(main())
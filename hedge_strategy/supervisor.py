@@ -0,0 +1,519 @@
+"""
+多账户对分片运行（supervisor）
+从配置的supervisor.pairs读取 账户对 × 市场 列表，分片到固定数量的工作进程：
+- 工作进程数默认等于CPU核数（不超过账户对数量），账户对按市场数均衡分配，同一账户对的所有市场在同一进程
+  （共享SignerClient、nonce分配器和账户推送订阅，见main_multi.py）
+- 每个工作进程在一个事件循环上运行分到的所有账户对；进程级组件（事件循环监控、REST网关、HTTP连接池）每个进程一份，
+  rate_limit.weight_per_minute可按进程数均分，同机部署时总请求额度可控
+- 工作进程异常退出后按指数退避重启；RSS超过memory_limit_mb时主动重启
+- 工作进程定期上报指标快照，supervisor在metrics端点按shard标签汇总导出
+
+用法:
+  python supervisor.py [--config config.yaml] [--workers 4]
+  python supervisor.py --plan     # 只打印分片方案
+"""
+
+import argparse
+import asyncio
+import copy
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from main_multi import MultiMarketHedge, parse_market
+from metrics import MetricsRegistry, MetricsServer, REGISTRY, render_snapshots
+from rest_gateway import configure_gateway, get_gateway
+from http_pool import configure_http_pool, get_http_pool
+from loop_monitor import start_loop_monitor
+from utils import load_config
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml")
+
+# supervisor自身的指标（不注册到工作进程共用的REGISTRY）
+SUPERVISOR_REGISTRY = MetricsRegistry()
+WORKER_UP = SUPERVISOR_REGISTRY.gauge("hedge_supervisor_worker_up", "工作进程是否存活", ("shard",))
+WORKER_RESTARTS = SUPERVISOR_REGISTRY.counter(
+    "hedge_supervisor_worker_restarts_total", "工作进程重启次数", ("shard", "reason")
+)
+WORKER_RSS = SUPERVISOR_REGISTRY.gauge("hedge_supervisor_worker_rss_bytes", "工作进程常驻内存", ("shard",))
+WORKER_PAIRS = SUPERVISOR_REGISTRY.gauge("hedge_supervisor_worker_pairs", "工作进程运行的账户对数量", ("shard",))
+
+
+def load_pairs(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    读取并校验supervisor.pairs
+
+    Args:
+        config: 完整配置
+
+    Returns:
+        [{"name", "account_a", "account_b", "markets": [(市场名称, 挂单数量, 挂单档位)]}]
+    """
+    pairs = []
+    api_keys = set()
+    names = set()
+    for i, pair_config in enumerate((config.get("supervisor") or {}).get("pairs") or []):
+        account_a = pair_config.get("account_a") or {}
+        account_b = pair_config.get("account_b") or {}
+        for account in (account_a, account_b):
+            for field in ("account_index", "api_key_index", "api_key_private_key"):
+                if account.get(field) is None:
+                    raise ValueError(f"supervisor.pairs[{i}]缺少{field}")
+            # 同一API key的nonce只能由一个进程分配
+            api_key = (account["account_index"], account["api_key_index"])
+            if api_key in api_keys:
+                raise ValueError(f"supervisor.pairs[{i}]的API key重复: account={api_key[0]}, api_key={api_key[1]}")
+            api_keys.add(api_key)
+
+        # 与Redis持仓key（hedge:positions:{a}_{b}:{market}）一致
+        name = f"{account_a.get('account_name', 'account_a')}_{account_b.get('account_name', 'account_b')}"
+        if name in names:
+            raise ValueError(f"supervisor.pairs[{i}]的账户名称重复: {name}（Redis持仓key会冲突）")
+        names.add(name)
+
+        try:
+            markets = [parse_market(market) for market in pair_config.get("markets") or []]
+        except argparse.ArgumentTypeError as e:
+            raise ValueError(f"supervisor.pairs[{i}]: {e}")
+        if not markets:
+            raise ValueError(f"supervisor.pairs[{i}]没有配置市场")
+        pairs.append({"name": name, "account_a": account_a, "account_b": account_b, "markets": markets})
+    return pairs
+
+
+def assign_shards(pairs: List[Dict[str, Any]], workers: int) -> List[List[Dict[str, Any]]]:
+    """
+    把账户对分配到工作进程（按市场数从多到少，每次放进当前市场数最少的进程）
+
+    Args:
+        pairs: load_pairs的结果
+        workers: 工作进程数
+
+    Returns:
+        每个工作进程的账户对列表
+    """
+    shards: List[List[Dict[str, Any]]] = [[] for _ in range(max(1, min(workers, len(pairs))))]
+    loads = [0] * len(shards)
+    for pair in sorted(pairs, key=lambda p: len(p["markets"]), reverse=True):
+        shard_id = loads.index(min(loads))
+        shards[shard_id].append(pair)
+        loads[shard_id] += len(pair["markets"])
+    return shards
+
+
+def build_pair_config(config: Dict[str, Any], pair: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    生成单个账户对的运行配置（accounts段替换为该账户对）
+
+    Args:
+        config: 完整配置
+        pair: 账户对
+
+    Returns:
+        新配置
+    """
+    pair_config = copy.deepcopy(config)
+    pair_config.pop("supervisor", None)
+    pair_config["accounts"] = {"account_a": dict(pair["account_a"]), "account_b": dict(pair["account_b"])}
+    return pair_config
+
+
+def shard_main(shard_id: int, pairs: List[Dict[str, Any]], config: Dict[str, Any], config_path: str,
+               metrics_queue):
+    """
+    工作进程入口
+
+    Args:
+        shard_id: 分片编号
+        pairs: 本进程的账户对
+        config: 本进程的配置（rate_limit已按进程数调整）
+        config_path: 配置文件路径
+        metrics_queue: 指标快照上报队列
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s [%(levelname)s] [shard{shard_id}] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    shard = ShardWorker(shard_id, pairs, config, config_path, metrics_queue)
+    sys.exit(asyncio.run(shard.run()))
+
+
+class ShardWorker:
+    """工作进程：一个事件循环上运行多个账户对"""
+
+    def __init__(self, shard_id: int, pairs: List[Dict[str, Any]], config: Dict[str, Any], config_path: str,
+                 metrics_queue):
+        """
+        初始化工作进程
+
+        Args:
+            shard_id: 分片编号
+            pairs: 本进程的账户对
+            config: 本进程的配置
+            config_path: 配置文件路径
+            metrics_queue: 指标快照上报队列
+        """
+        self.shard_id = shard_id
+        self.pairs = pairs
+        self.config = config
+        self.config_path = config_path
+        self.metrics_queue = metrics_queue
+        self.metrics_interval = (config.get("supervisor") or {}).get("metrics_interval", 5)
+        self.runners: List[MultiMarketHedge] = []
+        self.loop_monitor = None
+        self.stopping = False
+
+    async def run(self) -> int:
+        """
+        运行所有账户对，任一账户对意外退出时停止整个进程等待supervisor重启
+
+        Returns:
+            进程退出码
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        self.loop_monitor = start_loop_monitor(self.config.get("loop_monitor"))
+        configure_gateway(self.config.get("rate_limit"))
+        configure_http_pool(self.config.get("http_pool"))
+        metrics_task = loop.create_task(self._report_metrics())
+        exit_code = 0
+        try:
+            for pair in self.pairs:
+                runner = MultiMarketHedge(
+                    self.config_path, pair["markets"],
+                    config=build_pair_config(self.config, pair), standalone=False
+                )
+                self.runners.append(runner)
+                logging.info(f"初始化账户对 {pair['name']}: markets={[m[0] for m in pair['markets']]}")
+                await runner.initialize()
+        except Exception as e:
+            logging.error(f"账户对初始化失败: {e}")
+            self.stopping = True
+            exit_code = 1
+
+        if self.stopping:
+            for runner in self.runners:
+                await runner.cleanup()
+        else:
+            logging.info(f"🚀 分片{self.shard_id}启动完成: 账户对={[p['name'] for p in self.pairs]}")
+            tasks = {loop.create_task(runner.run()): pair for runner, pair in zip(self.runners, self.pairs)}
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if not self.stopping:
+                for task in done:
+                    logging.error(f"账户对 {tasks[task]['name']} 意外退出，停止分片等待重启")
+                exit_code = 1
+                self.stop()
+            if pending:
+                await asyncio.wait(pending)
+
+        metrics_task.cancel()
+        self._put_snapshot()
+        http_pool = get_http_pool()
+        logging.info(http_pool.stats())
+        await http_pool.close()
+        logging.info(f"REST网关统计: {get_gateway().metrics_summary()}")
+        if self.loop_monitor:
+            self.loop_monitor.stop()
+            logging.info(self.loop_monitor.summary())
+        return exit_code
+
+    async def _report_metrics(self):
+        """定期上报指标快照"""
+        while True:
+            self._put_snapshot()
+            await asyncio.sleep(self.metrics_interval)
+
+    def _put_snapshot(self):
+        try:
+            self.metrics_queue.put_nowait((self.shard_id, os.getpid(), REGISTRY.snapshot()))
+        except Exception as e:
+            logging.debug(f"上报指标失败: {e}")
+
+    def stop(self):
+        """停止所有账户对"""
+        if self.stopping:
+            return
+        logging.info("收到停止信号...")
+        self.stopping = True
+        for runner in self.runners:
+            runner.stop()
+
+
+class ShardProcess:
+    """supervisor侧的工作进程记录"""
+
+    def __init__(self, shard_id: int, pairs: List[Dict[str, Any]], config: Dict[str, Any]):
+        """
+        初始化记录
+
+        Args:
+            shard_id: 分片编号
+            pairs: 分到的账户对
+            config: 工作进程配置
+        """
+        self.shard_id = shard_id
+        self.pairs = pairs
+        self.config = config
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.restart_at: Optional[float] = None
+        self.terminate_at: Optional[float] = None
+        self.consecutive_crashes = 0
+        self.restarts = 0
+        self.last_exitcode: Optional[int] = None
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process is not None else None
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def rss_bytes(self) -> Optional[int]:
+        """读取常驻内存（仅Linux，读不到时返回None）"""
+        if not self.is_alive():
+            return None
+        try:
+            with open(f"/proc/{self.process.pid}/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def label(self) -> str:
+        return f"shard{self.shard_id}({', '.join(p['name'] for p in self.pairs)})"
+
+
+class Supervisor:
+    """工作进程管理：启动、崩溃重启、内存上限、指标汇总"""
+
+    def __init__(self, config_path: str, workers: Optional[int] = None):
+        """
+        初始化supervisor
+
+        Args:
+            config_path: 配置文件路径
+            workers: 工作进程数（覆盖supervisor.workers）
+        """
+        self.config_path = config_path
+        self.config = load_config(config_path)
+        settings = self.config.get("supervisor") or {}
+        self.pairs = load_pairs(self.config)
+        if not self.pairs:
+            raise ValueError("supervisor.pairs为空")
+
+        workers = workers or settings.get("workers") or os.cpu_count() or 1
+        self.shards = assign_shards(self.pairs, workers)
+        self.restart_backoff = settings.get("restart_backoff", 2)
+        self.max_restart_backoff = settings.get("max_restart_backoff", 300)
+        self.stable_seconds = settings.get("stable_seconds", 600)
+        self.memory_limit = settings.get("memory_limit_mb", 0) * 1024 * 1024
+        self.shutdown_timeout = settings.get("shutdown_timeout", 30)
+        self.status_interval = settings.get("status_interval", 60)
+
+        # 工作进程只需要自己的账户对，不下发其他账户对的私钥
+        shard_config = copy.deepcopy(self.config)
+        shard_config["supervisor"] = {k: v for k, v in settings.items() if k != "pairs"}
+        if settings.get("split_rate_limit", True):
+            rate_limit = dict(shard_config.get("rate_limit") or {})
+            rate_limit["weight_per_minute"] = rate_limit.get("weight_per_minute", 24000) // len(self.shards)
+            shard_config["rate_limit"] = rate_limit
+
+        self.context = multiprocessing.get_context("spawn")
+        self.metrics_queue = self.context.Queue()
+        self.processes = [ShardProcess(i, pairs, shard_config) for i, pairs in enumerate(self.shards)]
+        self.snapshots: Dict[str, list] = {}
+        self.metrics_server: Optional[MetricsServer] = None
+        self.stopping = False
+
+    def plan(self) -> str:
+        """返回分片方案"""
+        lines = [f"工作进程={len(self.shards)}, 账户对={len(self.pairs)}, "
+                 f"市场={sum(len(p['markets']) for p in self.pairs)}"]
+        for shard_id, pairs in enumerate(self.shards):
+            markets = sum(len(p["markets"]) for p in pairs)
+            lines.append(f"  shard{shard_id}: 市场={markets}")
+            for pair in pairs:
+                lines.append(f"    {pair['name']}: {', '.join(f'{m[0]}:{m[1]}:{m[2]}' for m in pair['markets'])}")
+        return "\n".join(lines)
+
+    def render(self) -> str:
+        """汇总导出（MetricsServer调用）"""
+        return render_snapshots(self.snapshots, "shard") + SUPERVISOR_REGISTRY.render()
+
+    async def run(self):
+        """启动所有工作进程并监控，直到stop()"""
+        logging.info("=" * 60)
+        logging.info("对冲supervisor启动")
+        for line in self.plan().split("\n"):
+            logging.info(line)
+        logging.info("=" * 60)
+
+        metrics_config = self.config.get("metrics") or {}
+        if metrics_config.get("enabled"):
+            self.metrics_server = MetricsServer(
+                registry=self, host=metrics_config.get("host", "127.0.0.1"), port=metrics_config.get("port", 9100)
+            )
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logging.error(f"指标端点启动失败: {e}")
+                self.metrics_server = None
+
+        for shard in self.processes:
+            self._start(shard)
+
+        last_status = time.time()
+        try:
+            while not self.stopping:
+                await asyncio.sleep(1)
+                self._drain_metrics()
+                for shard in self.processes:
+                    self._check(shard)
+                if time.time() - last_status >= self.status_interval:
+                    last_status = time.time()
+                    logging.info(self.stats())
+        finally:
+            await self._shutdown()
+
+    def _start(self, shard: ShardProcess):
+        """启动（或重启）工作进程"""
+        shard.process = self.context.Process(
+            target=shard_main,
+            args=(shard.shard_id, shard.pairs, shard.config, self.config_path, self.metrics_queue),
+            name=f"hedge-shard{shard.shard_id}"
+        )
+        shard.process.start()
+        shard.started_at = time.time()
+        shard.restart_at = None
+        shard.terminate_at = None
+        WORKER_UP.labels(shard=shard.shard_id).set(1)
+        WORKER_PAIRS.labels(shard=shard.shard_id).set(len(shard.pairs))
+        logging.info(f"✅ 已启动 {shard.label()}: pid={shard.pid}")
+
+    def _check(self, shard: ShardProcess):
+        """检查工作进程：退出后安排重启，超内存时终止"""
+        now = time.time()
+        if shard.restart_at is not None:
+            if now >= shard.restart_at:
+                shard.restarts += 1
+                self._start(shard)
+            return
+
+        if not shard.is_alive():
+            shard.last_exitcode = shard.process.exitcode
+            reason = "memory" if shard.terminate_at is not None else "crash"
+            if now - shard.started_at >= self.stable_seconds:
+                shard.consecutive_crashes = 0
+            shard.consecutive_crashes += 1
+            delay = min(self.restart_backoff * (2 ** (shard.consecutive_crashes - 1)), self.max_restart_backoff)
+            shard.restart_at = now + delay
+            WORKER_UP.labels(shard=shard.shard_id).set(0)
+            WORKER_RSS.labels(shard=shard.shard_id).set(0)
+            WORKER_RESTARTS.labels(shard=shard.shard_id, reason=reason).inc()
+            logging.error(f"❌ {shard.label()} 退出: exitcode={shard.last_exitcode}, "
+                          f"运行{now - shard.started_at:.0f}秒，{delay:.0f}秒后重启")
+            return
+
+        rss = shard.rss_bytes()
+        if rss is not None:
+            WORKER_RSS.labels(shard=shard.shard_id).set(rss)
+        if shard.terminate_at is not None:
+            # 超时仍未退出则强制结束
+            if now - shard.terminate_at > self.shutdown_timeout:
+                logging.error(f"{shard.label()} 未在{self.shutdown_timeout}秒内退出，强制结束")
+                shard.process.kill()
+        elif self.memory_limit and rss is not None and rss > self.memory_limit:
+            logging.warning(f"⚠️ {shard.label()} 内存{rss / 1024 / 1024:.0f}MB超过上限"
+                            f"{self.memory_limit / 1024 / 1024:.0f}MB，重启")
+            shard.terminate_at = now
+            shard.process.terminate()
+
+    def _drain_metrics(self):
+        """取出工作进程上报的指标快照（只保留当前进程的）"""
+        current = {shard.shard_id: shard.pid for shard in self.processes}
+        while True:
+            try:
+                shard_id, pid, snapshot = self.metrics_queue.get_nowait()
+            except queue.Empty:
+                break
+            if current.get(shard_id) == pid:
+                self.snapshots[str(shard_id)] = snapshot
+
+    async def _shutdown(self):
+        """停止所有工作进程（先SIGTERM让各账户对撤单清理，超时后强制结束）"""
+        logging.info("停止所有工作进程...")
+        alive = [shard for shard in self.processes if shard.is_alive()]
+        for shard in alive:
+            shard.process.terminate()
+        deadline = time.time() + self.shutdown_timeout
+        for shard in alive:
+            await asyncio.to_thread(shard.process.join, max(0.0, deadline - time.time()))
+            if shard.process.is_alive():
+                logging.error(f"{shard.label()} 未在{self.shutdown_timeout}秒内退出，强制结束")
+                shard.process.kill()
+                await asyncio.to_thread(shard.process.join, 5)
+            WORKER_UP.labels(shard=shard.shard_id).set(0)
+        self._drain_metrics()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        logging.info(self.stats())
+        logging.info("supervisor已退出")
+
+    def stop(self):
+        """停止supervisor"""
+        logging.info("收到停止信号...")
+        self.stopping = True
+
+    def stats(self) -> str:
+        """返回各工作进程状态和汇总的对冲结果"""
+        hedge_results: Dict[str, float] = {}
+        for snapshot in self.snapshots.values():
+            for name, _, _, samples in snapshot:
+                if name != "hedge_results_total":
+                    continue
+                for _, labels, value in samples:
+                    status = dict(labels).get("status", "")
+                    hedge_results[status] = hedge_results.get(status, 0) + value
+        lines = [f"对冲结果汇总: {hedge_results}"]
+        for shard in self.processes:
+            rss = shard.rss_bytes()
+            rss_text = f"{rss / 1024 / 1024:.0f}MB" if rss is not None else "-"
+            lines.append(f"  {shard.label()}: pid={shard.pid}, alive={shard.is_alive()}, "
+                         f"rss={rss_text}, restarts={shard.restarts}, last_exitcode={shard.last_exitcode}")
+        return "\n".join(lines)
+
+
+async def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='跨账户对冲策略（多账户对分片supervisor）')
+    parser.add_argument('--config', type=str, default=DEFAULT_CONFIG, help='配置文件路径')
+    parser.add_argument('--workers', type=int, help='工作进程数（覆盖supervisor.workers，默认CPU核数）')
+    parser.add_argument('--plan', action='store_true', help='只打印分片方案')
+    args = parser.parse_args()
+
+    supervisor = Supervisor(args.config, workers=args.workers)
+    if args.plan:
+        print(supervisor.plan())
+        return
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, supervisor.stop)
+    await supervisor.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] [supervisor] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    asyncio.run(main())
@@ -0,0 +1,29 @@
+"""
+pytest公共配置
+策略模块按脚本方式平铺在hedge_strategy目录下互相导入，这里把该目录加入sys.path
+
+未安装lighter SDK时注册一个只含类型占位的lighter模块，订单簿、限流网关、nonce分配器等
+只在类型注解和基类里引用SDK的模块可以照常导入测试；需要真实SDK的测试检查LIGHTER_STUBBED后跳过
+"""
+
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 策略模块导入时引用的SDK名称
+LIGHTER_PLACEHOLDERS = (
+    "ApiClient", "Configuration", "OrderApi", "AccountApi", "TransactionApi",
+    "SignerClient", "WsClient", "OrderBook",
+)
+
+try:
+    import lighter  # noqa: F401
+    LIGHTER_STUBBED = False
+except ImportError:
+    lighter = types.ModuleType("lighter")
+    for _name in LIGHTER_PLACEHOLDERS:
+        setattr(lighter, _name, type(_name, (), {}))
+    sys.modules["lighter"] = lighter
+    LIGHTER_STUBBED = True
@@ -0,0 +1,126 @@
+"""AStateMachine：对冲失败暂停后的恢复"""
+
+import asyncio
+from decimal import Decimal
+
+from a_state_machine import (
+    AState, AStateMachine, EVENT_HEDGE_FAILED, EVENT_HEDGE_SUCCESS, EVENT_ORDER_FILLED,
+)
+
+
+class _AccountAManager:
+    """A账户管理器替身：记录挂单，按B通知设置/解除暂停"""
+
+    def __init__(self):
+        self.pause_trading = False
+        self.quotes = []
+
+    async def create_limit_buy_order(self, *args):
+        self.quotes.append("buy")
+        return True
+
+    async def create_limit_sell_order(self, *args):
+        self.quotes.append("sell")
+        return True
+
+    def resume_trading(self, reason=""):
+        self.pause_trading = False
+
+
+def _state_machine(snapshots=None):
+    manager = _AccountAManager()
+    snapshots = list(snapshots or [])
+
+    async def reconcile():
+        return snapshots.pop(0)
+
+    async def fetch_active_orders():
+        return []
+
+    async def on_hedge_timeout():
+        pass
+
+    machine = AStateMachine(
+        manager, requote_engine=None, base_amount_multiplier=10000, price_multiplier=100,
+        reconcile=reconcile, fetch_active_orders=fetch_active_orders, on_hedge_timeout=on_hedge_timeout
+    )
+    return machine, manager
+
+
+def _snapshot(balanced, position_size="0.1", sign=1, active_orders=()):
+    return {
+        "active_orders": list(active_orders),
+        "position_size": position_size,
+        "sign": sign,
+        "hedge_valid": balanced,
+        "hedge_message": "对冲正常" if balanced else "持仓大小不匹配",
+        "hedge_balanced": balanced,
+    }
+
+
+async def _pause_after_failed_hedge(machine, manager, order_index=7):
+    """挂单 → 成交 → B对冲失败"""
+    await machine._maybe_quote()
+    await machine._on_event(EVENT_ORDER_FILLED, {"order_index": order_index, "size": "0.1", "side": "buy"})
+    assert machine.state == AState.AWAITING_HEDGE
+    manager.pause_trading = True
+    await machine._on_event(EVENT_HEDGE_FAILED, {"status": "failed", "a_order_index": order_index, "retry_in": 1.0})
+    assert machine.state == AState.PAUSED
+    assert machine.hedge_deadline is None
+
+
+def test_final_retry_success_leaves_paused():
+    machine, manager = _state_machine()
+
+    async def run():
+        await _pause_after_failed_hedge(machine, manager)
+        # 中间对冲、其他订单的对冲都不解除暂停
+        await machine._on_event(EVENT_HEDGE_SUCCESS, {"a_order_index": 7, "a_order_final": False})
+        await machine._on_event(EVENT_HEDGE_SUCCESS, {"a_order_index": 8, "a_order_final": True})
+        await machine._on_event(EVENT_HEDGE_SUCCESS, {"a_order_final": True})
+        assert machine.state == AState.PAUSED
+        assert manager.pause_trading
+
+        await machine._on_event(EVENT_HEDGE_SUCCESS, {"a_order_index": 7, "a_order_final": True})
+        assert machine.state == AState.IDLE
+        assert not manager.pause_trading
+        assert machine.awaiting_order_index is None
+        await machine._maybe_quote()
+
+    asyncio.run(run())
+    assert machine.cycles == 1
+    # 恢复后按持仓挂平仓单
+    assert manager.quotes == ["buy", "sell"]
+    assert machine.state == AState.QUOTING
+
+
+def test_reconcile_balanced_leaves_paused():
+    machine, manager = _state_machine([_snapshot(False), _snapshot(True)])
+
+    async def run():
+        await _pause_after_failed_hedge(machine, manager)
+        await machine._reconcile()
+        assert machine.state == AState.PAUSED
+        await machine._reconcile()
+
+    asyncio.run(run())
+    assert machine.state == AState.IDLE
+    assert not manager.pause_trading
+    assert machine.blocked_reason is None
+    assert machine.position_size == Decimal("0.1")
+
+
+def test_reconcile_balanced_with_resting_order_resumes_quoting():
+    class _Order:
+        additional_properties = {}
+
+    machine, manager = _state_machine([_snapshot(True, active_orders=[_Order()])])
+
+    async def run():
+        await _pause_after_failed_hedge(machine, manager)
+        await machine._reconcile()
+
+    asyncio.run(run())
+    # 挂单仍在交易所，直接回到挂单中，不会重复挂单
+    assert machine.state == AState.QUOTING
+    assert manager.quotes == ["buy"]
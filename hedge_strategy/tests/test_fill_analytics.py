@@ -0,0 +1,70 @@
+"""fill_analytics.fill_times：同价排队成交、穿价成交、不成交"""
+
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from fill_analytics import MarketHistory, fill_times
+
+SECOND = 1_000_000_000
+NAN = float("nan")
+
+
+def _history(samples, trades):
+    return MarketHistory([1], samples, trades)
+
+
+def _sample(ts, bid, bid_queue, ask=101.0, ask_queue=1.0):
+    return (ts, (bid + ask) / 2 if not math.isnan(bid) else ask, [bid], [bid_queue], [ask], [ask_queue])
+
+
+def test_fill_after_queue_consumed():
+    history = _history(
+        [_sample(0, 100.0, 1.0)],
+        [
+            (SECOND // 2, 100.0, 0.5, False),
+            (SECOND, 100.0, 0.5, True),  # maker为卖方，不会吃到买单
+            (2 * SECOND, 100.0, 0.7, False),
+        ],
+    )
+    # 排队1.0 + 挂单0.1，第二笔同价成交后累计1.2才成交
+    assert fill_times(history, 0, True, 0.1).tolist() == [2.0]
+    # 挂单量更大时等不到成交
+    assert fill_times(history, 0, True, 0.5).tolist() == [math.inf]
+
+
+def test_trade_through_fills_immediately():
+    history = _history(
+        [_sample(0, 100.0, 5.0)],
+        [(SECOND, 100.0, 0.1, False), (3 * SECOND, 99.5, 0.01, False)],
+    )
+    assert fill_times(history, 0, True, 0.1).tolist() == [3.0]
+
+
+def test_sell_side_uses_maker_ask_trades():
+    history = _history(
+        [_sample(0, 100.0, 1.0, ask=101.0, ask_queue=0.0)],
+        [(SECOND, 101.0, 0.05, True), (2 * SECOND, 101.5, 0.01, True)],
+    )
+    assert fill_times(history, 0, False, 0.1).tolist() == [2.0]
+    assert fill_times(history, 0, True, 0.1).tolist() == [math.inf]
+
+
+def test_trades_at_sample_time_are_excluded():
+    history = _history(
+        [_sample(SECOND, 100.0, 0.0), _sample(2 * SECOND, NAN, NAN), _sample(3 * SECOND, 100.0, 0.0)],
+        [(SECOND, 99.0, 1.0, False), (2 * SECOND, 100.0, 1.0, False)],
+    )
+    result = fill_times(history, 0, True, 0.1)
+    assert result[0] == 1.0
+    assert math.isnan(result[1])
+    assert result[2] == math.inf
+
+
+def test_no_trades():
+    history = _history([_sample(0, 100.0, 1.0), _sample(SECOND, NAN, NAN)], [])
+    result = fill_times(history, 0, True, 0.1)
+    assert result[0] == math.inf
+    assert math.isnan(result[1])
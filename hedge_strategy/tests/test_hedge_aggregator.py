@@ -0,0 +1,220 @@
+"""HedgeAggregator：部分成交合并、残余、超时、失败重试"""
+
+import asyncio
+from decimal import Decimal
+
+from hedge_aggregator import HedgeAggregator
+
+
+class _Recorder:
+    """记录对冲/关闭/确认回调，可指定前几次对冲失败"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.hedges = []
+        self.closed = []
+        self.acked = []
+
+    async def hedge(self, message):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("hedge rejected")
+        self.hedges.append(message)
+
+    async def on_order_closed(self, market_index, order_index, residual):
+        self.closed.append((market_index, order_index, residual))
+
+    def on_hedged(self, ack_ids):
+        self.acked.extend(ack_ids)
+
+
+def _aggregator(recorder, **kwargs):
+    kwargs.setdefault("min_base_amount", Decimal("0.01"))
+    return HedgeAggregator(recorder.hedge, recorder.on_order_closed, on_hedged=recorder.on_hedged, **kwargs)
+
+
+def _fill(order_index, size, price="3000", is_final=None, side="buy", stream_id=None):
+    message = {
+        "account_index": 1001,
+        "market_index": 0,
+        "order_index": order_index,
+        "filled_base_amount": size,
+        "filled_quote_amount": str(Decimal(size) * Decimal(price)),
+        "avg_price": price,
+        "timestamp": 1760600000,
+        "side": side,
+    }
+    if is_final is not None:
+        message["is_final"] = is_final
+    if stream_id is not None:
+        message["stream_id"] = stream_id
+    return message
+
+
+def test_partial_fills_merge_into_one_hedge():
+    recorder = _Recorder()
+
+    async def run():
+        aggregator = _aggregator(recorder, batch_size=Decimal("1"), max_delay=10)
+        await aggregator.add_fill(_fill(1, "0.2", "3000", is_final=False, stream_id="1-0"))
+        await aggregator.add_fill(_fill(1, "0.3", "3010", is_final=False, stream_id="2-0"))
+        assert recorder.hedges == []
+        await aggregator.add_fill(_fill(1, "0.1", "3020", is_final=True, stream_id="3-0"))
+        aggregator.stop()
+        return aggregator
+
+    aggregator = asyncio.run(run())
+    assert len(recorder.hedges) == 1
+    hedge = recorder.hedges[0]
+    assert Decimal(hedge["filled_base_amount"]) == Decimal("0.6")
+    assert Decimal(hedge["avg_price"]) == (Decimal("600") + Decimal("903") + Decimal("302")) / Decimal("0.6")
+    assert hedge["is_final"] is True
+    assert "stream_id" not in hedge
+    assert recorder.acked == ["1-0", "2-0", "3-0"]
+    assert aggregator.buckets == {}
+
+
+def test_threshold_triggers_without_final():
+    recorder = _Recorder()
+
+    async def run():
+        aggregator = _aggregator(recorder, batch_size=Decimal("0.5"), max_delay=10)
+        await aggregator.add_fill(_fill(1, "0.3", is_final=False))
+        await aggregator.add_fill(_fill(1, "0.3", is_final=False))
+        aggregator.stop()
+
+    asyncio.run(run())
+    assert [h["filled_base_amount"] for h in recorder.hedges] == ["0.6"]
+    assert recorder.hedges[0]["is_final"] is False
+
+
+def test_timer_flushes_pending_fills():
+    recorder = _Recorder()
+
+    async def run():
+        aggregator = _aggregator(recorder, batch_size=Decimal("1"), max_delay=0.05)
+        await aggregator.add_fill(_fill(1, "0.2", is_final=False))
+        await asyncio.sleep(0.15)
+        aggregator.stop()
+
+    asyncio.run(run())
+    assert [h["filled_base_amount"] for h in recorder.hedges] == ["0.2"]
+
+
+def test_dust_carries_over_as_residual():
+    recorder = _Recorder()
+
+    async def run():
+        aggregator = _aggregator(recorder, min_base_amount=Decimal("0.1"))
+        await aggregator.add_fill(_fill(1, "0.04", is_final=True, stream_id="1-0"))
+        await aggregator.add_fill(_fill(2, "0.5", is_final=True, stream_id="2-0"))
+        await aggregator.add_fill(_fill(3, "0.05", side="sell", stream_id="3-0"))
+        return aggregator
+
+    aggregator = asyncio.run(run())
+    # 订单1低于最小下单量，关闭时上报残余；订单2对冲时一并带上
+    assert recorder.closed == [(0, 1, Decimal("0.04")), (0, 3, Decimal("0.05"))]
+    assert [h["filled_base_amount"] for h in recorder.hedges] == ["0.54"]
+    assert recorder.acked == ["1-0", "2-0"]
+    # 卖方向的残余单独记录，不与买方向合并
+    assert aggregator.residual[(0, "sell")][0] == Decimal("0.05")
+    assert "sell=0.05" in aggregator.residual_summary()
+
+
+def test_zero_size_final_closes_order():
+    recorder = _Recorder()
+
+    async def run():
+        aggregator = _aggregator(recorder)
+        await aggregator.add_fill(_fill(1, "0", is_final=True, stream_id="1-0"))
+
+    asyncio.run(run())
+    assert recorder.hedges == []
+    assert recorder.closed == [(0, 1, Decimal(0))]
+    assert recorder.acked == ["1-0"]
+
+
+def test_failed_hedge_is_retried_with_backoff():
+    recorder = _Recorder(failures=2)
+
+    async def run():
+        aggregator = _aggregator(recorder, retry_delay=0.02, max_retry_delay=0.05, alert_after=2)
+        await aggregator.add_fill(_fill(1, "0.3", is_final=True, stream_id="1-0"))
+        assert aggregator.residual[(0, "buy")][0] == Decimal("0.3")
+        assert recorder.acked == []
+        await asyncio.sleep(0.3)
+        return aggregator
+
+    aggregator = asyncio.run(run())
+    assert [h["filled_base_amount"] for h in recorder.hedges] == ["0.3"]
+    assert recorder.acked == ["1-0"]
+    assert aggregator.residual == {}
+    assert aggregator._retries == {}
+    assert aggregator.hedges_sent == 3
+
+
+def test_failure_notified_once_and_retry_reports_final_hedge():
+    recorder = _Recorder(failures=2)
+    notices = []
+
+    async def on_hedge_failed(message, retry_in):
+        notices.append((message["order_index"], message["is_final"], retry_in))
+
+    async def run():
+        aggregator = _aggregator(recorder, retry_delay=0.02, max_retry_delay=0.05, on_hedge_failed=on_hedge_failed)
+        await aggregator.add_fill(_fill(1, "0.3", is_final=True))
+        await asyncio.sleep(0.3)
+
+    asyncio.run(run())
+    # 重试期间的再次失败不重复通知，A只暂停一次
+    assert notices == [(1, True, 0.02)]
+    # 重试成功的对冲仍对应失败的A订单且为最终对冲，A据此解除暂停
+    assert [(h["order_index"], h["is_final"]) for h in recorder.hedges] == [(1, True)]
+
+
+def test_failure_notice_error_does_not_break_retry():
+    recorder = _Recorder(failures=1)
+
+    async def on_hedge_failed(message, retry_in):
+        raise RuntimeError("redis down")
+
+    async def run():
+        aggregator = _aggregator(recorder, retry_delay=0.02, on_hedge_failed=on_hedge_failed)
+        await aggregator.add_fill(_fill(1, "0.3", is_final=True))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert [h["filled_base_amount"] for h in recorder.hedges] == ["0.3"]
+
+
+def test_new_fill_absorbs_failed_residual():
+    recorder = _Recorder(failures=1)
+
+    async def run():
+        aggregator = _aggregator(recorder, retry_delay=10)
+        await aggregator.add_fill(_fill(1, "0.3", is_final=True))
+        await aggregator.add_fill(_fill(2, "0.2", is_final=True))
+        # 残余已随订单2对冲，待执行的重试被取消
+        return aggregator
+
+    aggregator = asyncio.run(run())
+    assert [h["filled_base_amount"] for h in recorder.hedges] == ["0.5"]
+    assert aggregator._retries == {}
+    assert aggregator.residual == {}
+
+
+def test_stop_cancels_timers():
+    recorder = _Recorder(failures=1)
+
+    async def run():
+        aggregator = _aggregator(recorder, batch_size=Decimal("1"), max_delay=0.05, retry_delay=0.05)
+        await aggregator.add_fill(_fill(1, "0.2", is_final=False))
+        await aggregator.add_fill(_fill(2, "0.3", side="sell", is_final=True))
+        aggregator.stop()
+        await asyncio.sleep(0.15)
+        return aggregator
+
+    aggregator = asyncio.run(run())
+    assert recorder.hedges == []
+    assert aggregator.buckets[1]["size"] == Decimal("0.2")
+    assert aggregator.residual[(0, "sell")][0] == Decimal("0.3")
@@ -0,0 +1,74 @@
+"""latency_tracker：直方图精度、分位数、链路追踪"""
+
+import random
+
+import pytest
+
+from latency_tracker import LatencyHistogram, LatencyTracker, extract_trace, stamp
+
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentiles() == [0, 0, 0]
+    assert histogram.snapshot()["count"] == 0
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram(sub_bucket_bits=7)
+    for value in range(256):
+        histogram.record(value)
+    assert histogram.percentiles((0.0, 0.5, 1.0)) == [0, 127, 255]
+
+
+def test_relative_error_bound():
+    histogram = LatencyHistogram(sub_bucket_bits=7)
+    rng = random.Random(7)
+    for _ in range(2000):
+        value = rng.randint(1, 10 ** 10)
+        lowest = histogram._lowest(histogram._index(value))
+        assert lowest <= value
+        assert (value - lowest) / value <= 1 / 128
+
+
+def test_percentiles_and_max():
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.record(ms * 1_000_000)
+    histogram.record(-5)  # 负值按0计
+    p50, p99 = histogram.percentiles((0.5, 0.99))
+    assert p50 == pytest.approx(50_000_000, rel=1 / 128)
+    assert p99 == pytest.approx(99_000_000, rel=1 / 128)
+    assert histogram.count == 101
+    assert histogram.max_ns == 100_000_000
+    assert histogram.snapshot()["max_ms"] == 100.0
+
+
+def test_stamp_does_not_overwrite():
+    message = {"fill_received_ns": 1}
+    stamp(message, "fill_received_ns")
+    stamp(message, "published_ns")
+    assert message["fill_received_ns"] == 1
+    assert message["published_ns"] >= 1
+    message["b_received_ns"] = None
+    assert set(extract_trace(message)) == {"fill_received_ns", "published_ns"}
+
+
+def test_record_trace_splits_adjacent_stages():
+    tracker = LatencyTracker("test")
+    tracker.record_trace({"fill_received_ns": 0, "published_ns": 1_000_000, "hedge_submit_ns": 3_000_000})
+    snapshot = tracker.snapshot()
+    assert set(snapshot) == {
+        "fill_received→published",
+        "published→hedge_submit",
+        "total(fill_received→hedge_submit)",
+    }
+    assert snapshot["published→hedge_submit"]["p50_ms"] == pytest.approx(2.0, rel=1 / 128)
+    assert snapshot["total(fill_received→hedge_submit)"]["max_ms"] == 3.0
+    assert "count=1" in tracker.summary()
+
+
+def test_single_stage_trace_records_nothing():
+    tracker = LatencyTracker("test")
+    tracker.record_trace({"published_ns": 5})
+    assert tracker.snapshot() == {}
+    assert tracker.summary() == "test: 无数据"
@@ -0,0 +1,158 @@
+"""NonceAllocator：本地分配、回退、异步同步、预留释放"""
+
+import asyncio
+from types import SimpleNamespace
+
+from nonce_allocator import NonceAllocator
+
+
+class _InnerNonceManager:
+    """SDK原nonce管理器：只在首次分配时被调用"""
+
+    def __init__(self, api_key_index, start):
+        self.api_key_index = api_key_index
+        self.start = start
+        self.calls = 0
+
+    def next_nonce(self):
+        self.calls += 1
+        return self.api_key_index, self.start
+
+
+def _allocator(start=10, server_nonces=()):
+    signer = SimpleNamespace(
+        account_index=1001, api_key_index=3, api_client=None,
+        nonce_manager=_InnerNonceManager(3, start)
+    )
+    allocator = NonceAllocator(signer)
+    server_nonces = list(server_nonces)
+    allocator.fetches = 0
+
+    async def fetch(api_key_index):
+        allocator.fetches += 1
+        await asyncio.sleep(0)
+        return server_nonces.pop(0) if len(server_nonces) > 1 else server_nonces[0]
+
+    allocator._fetch_server_nonce = fetch
+    return allocator
+
+
+def test_installs_on_signer_and_allocates_locally():
+    allocator = _allocator(start=10)
+    assert allocator.signer_client.nonce_manager is allocator
+    assert [allocator.next_nonce() for _ in range(3)] == [(3, 10), (3, 11), (3, 12)]
+    assert allocator._inner.calls == 1
+    assert allocator.in_flight_count() == 3
+
+
+def test_release_rolls_back_only_last_nonce():
+    allocator = _allocator(start=10)
+    for _ in range(3):
+        allocator.next_nonce()
+    allocator.release(3, 11)  # 中间的空洞不回退
+    assert allocator.next_nonce() == (3, 13)
+    allocator.release(3, 13)
+    assert allocator.next_nonce() == (3, 13)
+    assert allocator.rollbacks == 1
+
+
+def test_acknowledge_failure_releases_current_nonce():
+    allocator = _allocator(start=10)
+    allocator.next_nonce()
+    allocator.acknowledge_failure(3)
+    assert allocator.next_nonce() == (3, 10)
+    assert allocator.in_flight_count() == 1
+
+
+def test_confirm_and_is_latest():
+    allocator = _allocator(start=10)
+    allocator.next_nonce()
+    assert allocator.is_latest(3, 10)
+    allocator.next_nonce()
+    assert not allocator.is_latest(3, 10)
+    allocator.confirm(3, 10)
+    allocator.observe_account_update({"orders": {"0": [{"nonce": 11}]}})
+    assert allocator.in_flight_count() == 0
+    assert allocator.confirmed == 2
+
+
+def test_concurrent_invalid_nonce_coalesces_resync():
+    allocator = _allocator(start=10, server_nonces=[20])
+
+    async def run():
+        allocator.next_nonce()
+        await asyncio.gather(*(allocator.handle_invalid_nonce(3) for _ in range(5)))
+
+    asyncio.run(run())
+    assert allocator.fetches == 1
+    assert allocator.next_nonce() == (3, 20)
+
+
+def test_resync_keeps_in_flight_nonces():
+    allocator = _allocator(start=10, server_nonces=[11])
+
+    async def run():
+        for _ in range(4):  # 10..13 在途
+            allocator.next_nonce()
+        allocator.hard_refresh_nonce(3)  # 13 属于当前协程，被释放
+        await allocator._resync_tasks[3]
+
+    asyncio.run(run())
+    # 10已确认，11、12仍在途，不会被重新分配
+    assert allocator.in_flight_count() == 2
+    assert allocator.next_nonce() == (3, 13)
+
+
+def test_resync_drops_in_flight_when_server_stalls():
+    allocator = _allocator(start=10, server_nonces=[11])
+
+    async def run():
+        for _ in range(3):
+            allocator.next_nonce()
+        await allocator._schedule_resync(3)
+        assert allocator.in_flight_count() == 2
+        await allocator._schedule_resync(3)
+
+    asyncio.run(run())
+    assert allocator.in_flight_count() == 0
+    assert allocator.next_nonce() == (3, 11)
+
+
+def test_stale_allocation_does_not_block():
+    allocator = _allocator(start=10, server_nonces=[30])
+
+    async def run():
+        allocator.next_nonce()
+        allocator.acknowledge_failure(0)  # 其他key：无法定位，只标记待同步
+        allocator._stale.add(3)
+        nonce = allocator.next_nonce()  # 仍按本地计数分配，同步在后台进行
+        await allocator._resync_tasks[3]
+        return nonce
+
+    assert asyncio.run(run()) == (3, 11)
+    assert allocator.next_nonce() == (3, 30)
+
+
+def test_reservation_hook_runs_before_regular_allocation():
+    allocator = _allocator(start=10)
+    reserved = allocator.next_nonce(reserve=True)
+    allocator.add_reservation_hook(lambda: allocator.release(*reserved))
+    assert allocator.next_nonce(reserve=True) == (3, 11)
+    allocator.release(3, 11)
+    # 普通分配先释放预留，复用预留的nonce，不留空洞
+    assert allocator.next_nonce() == (3, 10)
+
+
+def test_observe_server_nonce():
+    allocator = _allocator(start=10)
+    allocator.next_nonce()
+    allocator.observe_server_nonce(3, 15)  # 其他进程用了同一个key
+    assert allocator.in_flight_count() == 0
+    assert allocator.next_nonce() == (3, 15)
+    allocator.confirm(3, 15)
+    allocator.observe_server_nonce(3, 12)  # 查询结果早于WebSocket确认，不回退
+    assert allocator.next_nonce() == (3, 16)
+    allocator.release(3, 16)
+    allocator.observe_server_nonce(3, 20)
+    allocator.observe_server_nonce(3, 17)  # 本地领先且无在途交易，回退到服务端值
+    assert allocator.next_nonce() == (3, 17)
@@ -0,0 +1,134 @@
+"""LocalOrderBook：快照、增量、序列断档"""
+
+import asyncio
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+import utils
+from order_book import LocalOrderBook, OrderBookFeed
+from rest_gateway import RestGateway
+
+
+def _levels(*pairs):
+    return [{"price": price, "size": size} for price, size in pairs]
+
+
+@pytest.fixture
+def book():
+    book = LocalOrderBook(0)
+    book.apply_snapshot(
+        bids=_levels(("2999.50", "1.0"), ("3000.00", "2.0"), ("2999.00", "3.0")),
+        asks=_levels(("3001.00", "1.5"), ("3000.50", "0.5")),
+        offset=10, nonce=100
+    )
+    return book
+
+
+def test_snapshot_orders_levels(book):
+    assert book.best_bid() == ("3000.00", "2.0")
+    assert book.best_ask() == ("3000.50", "0.5")
+    assert book.price_at_depth(1, is_bid=True) == "3000.00"
+    assert book.price_at_depth(3, is_bid=True) == "2999.00"
+    assert book.price_at_depth(2, is_bid=False) == "3001.00"
+    assert book.depth_size() == (3, 2)
+
+
+def test_depth_out_of_range(book):
+    assert book.price_at_depth(4, is_bid=True) is None
+    assert book.price_at_depth(3, is_bid=False) is None
+    assert book.price_at_depth(0, is_bid=True) is None
+
+
+def test_delta_updates_and_deletes_levels(book):
+    assert book.apply_delta(
+        bids=_levels(("3000.00", "0"), ("3000.25", "4.0")),
+        asks=_levels(("3000.50", "0.7")),
+        offset=11, begin_nonce=100, nonce=101
+    )
+    assert book.best_bid() == ("3000.25", "4.0")
+    assert book.price_at_depth(2, is_bid=True) == "2999.50"
+    assert book.level_size("3000.00", is_bid=True) == Decimal(0)
+    assert book.level_size("3000.50", is_bid=False) == Decimal("0.7")
+    assert book.depth_size() == (3, 2)
+
+
+def test_deleting_missing_level_is_noop(book):
+    assert book.apply_delta(bids=_levels(("1.00", "0")), asks=[], offset=11)
+    assert book.depth_size() == (3, 2)
+
+
+def test_stale_offset_is_dropped(book):
+    assert book.apply_delta(bids=_levels(("3000.00", "9.0")), asks=[], offset=10)
+    assert book.best_bid() == ("3000.00", "2.0")
+    assert book.offset == 10
+
+
+def test_nonce_gap_invalidates_book(book):
+    assert not book.apply_delta(bids=_levels(("3000.00", "9.0")), asks=[], offset=11, begin_nonce=99, nonce=101)
+    assert not book.valid
+    assert book.best_bid() is None
+    assert book.price_at_depth(1, is_bid=True) is None
+    # 失效后的增量全部拒绝，直到重新加载快照
+    assert not book.apply_delta(bids=[], asks=[], offset=12)
+    book.apply_snapshot(bids=_levels(("2990", "1")), asks=[], offset=20, nonce=200)
+    assert book.best_bid() == ("2990", "1")
+    assert book.best_ask() is None
+
+
+def test_invalidate(book):
+    book.invalidate("test")
+    assert book.price_at_depth(1, is_bid=False) is None
+
+
+def _rest_gateway(monkeypatch, bids, asks):
+    """REST兜底返回的单笔挂单（同一价格可以有多笔）"""
+    async def order_book_orders(market_id, limit):
+        return SimpleNamespace(
+            bids=[SimpleNamespace(price=p, remaining_base_amount=s) for p, s in bids][:limit],
+            asks=[SimpleNamespace(price=p, remaining_base_amount=s) for p, s in asks][:limit],
+        )
+
+    gateway = RestGateway()
+    gateway.order_api = lambda api_client: SimpleNamespace(order_book_orders=order_book_orders)
+    monkeypatch.setattr(utils, "get_gateway", lambda: gateway)
+
+
+def test_rest_fallback_counts_price_levels(monkeypatch):
+    bids = [("3000.00", "0.1"), ("3000.00", "0.2"), ("3000.00", "0.3"), ("2999.50", "1"), ("2999.00", "1")]
+    asks = [("3000.50", "0.1"), ("3000.50", "0.1"), ("3001.00", "1")]
+    _rest_gateway(monkeypatch, bids, asks)
+
+    async def run():
+        return [
+            await utils.get_orderbook_price_at_depth(None, 0, 2, is_bid=True),
+            await utils.get_orderbook_price_at_depth(None, 0, 3, is_bid=True),
+            await utils.get_orderbook_price_at_depth(None, 0, 2, is_bid=False),
+            await utils.get_orderbook_price_at_depth(None, 0, 3, is_bid=False),
+        ]
+
+    assert asyncio.run(run()) == ["2999.50", "2999.00", "3001.00", None]
+
+
+def test_mirror_and_rest_fallback_agree(monkeypatch):
+    bids = [("3000.00", "0.1"), ("3000.00", "0.2"), ("2999.50", "1"), ("2999.00", "1")]
+    asks = [("3000.50", "0.1"), ("3000.50", "0.4"), ("3001.00", "1")]
+    _rest_gateway(monkeypatch, bids, asks)
+    feed = OrderBookFeed("ws://unused", [0])
+    feed.get_book(0).apply_snapshot(
+        bids=_levels(("3000.00", "0.3"), ("2999.50", "1"), ("2999.00", "1")),
+        asks=_levels(("3000.50", "0.5"), ("3001.00", "1")),
+    )
+
+    async def prices():
+        return [await feed.get_price_at_depth(None, 0, depth, is_bid)
+                for depth in (1, 2, 3) for is_bid in (True, False)]
+
+    from_mirror = asyncio.run(prices())
+    # 本地订单簿没有卖3档，只有这一次回退REST
+    assert feed.rest_fallback_count == 1
+    feed.get_book(0).invalidate("test")
+    from_rest = asyncio.run(prices())
+    assert from_mirror == from_rest == ["3000.00", "3000.50", "2999.50", "3001.00", "2999.00", None]
+    assert feed.rest_fallback_count == 7
@@ -0,0 +1,126 @@
+"""rest_gateway：令牌桶排队、请求合并、429退避"""
+
+import asyncio
+import time
+
+import pytest
+
+import rest_gateway
+from rest_gateway import RateLimitExceeded, RestGateway, TokenBucket
+
+
+def test_bucket_staggers_concurrent_acquires():
+    async def run():
+        bucket = TokenBucket(capacity=2, refill_per_second=10)
+        return await asyncio.gather(*(bucket.acquire(1) for _ in range(5)))
+
+    waits = asyncio.run(run())
+    assert waits[:2] == [0.0, 0.0]
+    for expected, waited in zip((0.1, 0.2, 0.3), waits[2:]):
+        assert waited == pytest.approx(expected, abs=0.02)
+
+
+def test_bucket_weight_capped_at_capacity():
+    async def run():
+        bucket = TokenBucket(capacity=5, refill_per_second=100)
+        return await bucket.acquire(50)
+
+    assert asyncio.run(run()) == 0.0
+
+
+def test_cancelled_acquire_refunds_tokens():
+    async def run():
+        bucket = TokenBucket(capacity=1, refill_per_second=1)
+        await bucket.acquire(1)
+        waiter = asyncio.ensure_future(bucket.acquire(1))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return bucket.tokens
+
+    assert asyncio.run(run()) > -0.5
+
+
+def test_drain_keeps_reservations():
+    bucket = TokenBucket(capacity=10, refill_per_second=1)
+    bucket.drain()
+    assert bucket.tokens <= 0.01
+    bucket.tokens = -3
+    bucket.drain()
+    assert bucket.tokens < -2
+
+
+def test_identical_reads_are_coalesced():
+    calls = []
+
+    async def order_books(market_id, auth=None):
+        calls.append(market_id)
+        await asyncio.sleep(0.01)
+        return f"book-{market_id}"
+
+    async def run():
+        gateway = RestGateway()
+        results = await asyncio.gather(
+            gateway.request("order_books", order_books, market_id=0, auth="a"),
+            gateway.request("order_books", order_books, market_id=0, auth="b"),
+            gateway.request("order_books", order_books, market_id=1),
+            gateway.request("order_books", order_books, coalesce=False, market_id=0),
+        )
+        # 在途请求完成后不再合并
+        results.append(await gateway.request("order_books", order_books, market_id=0))
+        return gateway, results
+
+    gateway, results = asyncio.run(run())
+    assert results == ["book-0", "book-0", "book-1", "book-0", "book-0"]
+    assert sorted(calls) == [0, 0, 0, 1]
+    assert gateway.metrics["order_books"].coalesced == 1
+    assert gateway.metrics["order_books"].calls == 4
+    assert not gateway._in_flight
+
+
+def test_coalesced_waiters_share_errors():
+    async def failing(**kwargs):
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        gateway = RestGateway()
+        return gateway, await asyncio.gather(
+            gateway.request("account", failing, by="index", value="1"),
+            gateway.request("account", failing, by="index", value="1"),
+            return_exceptions=True,
+        )
+
+    gateway, results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert gateway.metrics["account"].errors == 1
+
+
+def test_rate_limited_requests_back_off_and_give_up(monkeypatch):
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        await real_sleep(0)
+
+    class TooManyRequests(Exception):
+        status = 429
+
+    async def limited(**kwargs):
+        raise TooManyRequests()
+
+    monkeypatch.setattr(rest_gateway.asyncio, "sleep", fake_sleep)
+
+    async def run():
+        gateway = RestGateway(max_retries=3, max_backoff=5)
+        with pytest.raises(RateLimitExceeded):
+            await gateway.request("send_tx", limited, coalesce=False)
+        return gateway
+
+    started = time.monotonic()
+    gateway = asyncio.run(run())
+    assert time.monotonic() - started < 1
+    assert gateway.metrics["send_tx"].rate_limited == 3
+    assert [s for s in sleeps if s >= 1] == [2, 4, 5]
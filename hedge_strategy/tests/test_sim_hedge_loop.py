@@ -0,0 +1,81 @@
+"""
+A→Redis→B 对冲闭环（模拟交易所 + split模式）
+需要本地Redis（使用sim.redis_db），连不上时跳过
+"""
+
+import asyncio
+import importlib
+import os
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import LIGHTER_STUBBED
+
+if LIGHTER_STUBBED:
+    pytest.skip("模拟交易所替换的是真实lighter SDK的接口", allow_module_level=True)
+redis = pytest.importorskip("redis")
+yaml = pytest.importorskip("yaml")
+
+import sim_runner
+from sim_exchange import SimExchange
+from utils import load_config
+
+DURATION = 20
+QUANTITY = Decimal("0.1")
+
+
+@pytest.fixture
+def sim_setup(tmp_path):
+    config = load_config(sim_runner.DEFAULT_CONFIG)
+    sim_config = dict(config.get("sim") or {})
+    run_config = sim_runner.build_sim_config(config, sim_config)
+
+    redis_config = run_config["redis"]
+    try:
+        redis.Redis(
+            host=redis_config.get("host", "localhost"), port=redis_config.get("port", 6379),
+            db=redis_config["db"], socket_connect_timeout=1
+        ).ping()
+    except Exception as e:
+        pytest.skip(f"Redis不可用: {e}")
+
+    config_path = os.path.join(str(tmp_path), "sim.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(run_config, f, allow_unicode=True)
+    return run_config, sim_config, config_path
+
+
+def test_split_mode_hedges_every_fill(sim_setup):
+    run_config, sim_config, config_path = sim_setup
+    # install()需要在导入策略模块之后调用
+    for module in ("main_A", "main_B"):
+        importlib.import_module(module)
+
+    exchange = SimExchange.from_config(sim_config, "ETH")
+    args = SimpleNamespace(market="ETH", quantity=QUANTITY, depth=1, duration=DURATION)
+
+    async def run():
+        exchange.install()
+        exchange.start()
+        try:
+            await sim_runner.run_split(exchange, config_path, args)
+        finally:
+            exchange.stop()
+            exchange.uninstall()
+
+    asyncio.run(run())
+
+    account_a = run_config["accounts"]["account_a"]["account_index"]
+    account_b = run_config["accounts"]["account_b"]["account_index"]
+    fills_a = [t for t in exchange.trades if account_a in (t["ask_account_id"], t["bid_account_id"])]
+    fills_b = [t for t in exchange.trades if account_b in (t["ask_account_id"], t["bid_account_id"])]
+    assert fills_a, "模拟运行期间A没有成交"
+    assert fills_b, "A成交后B没有对冲"
+
+    for market_id in exchange.markets:
+        position_a = exchange.position(account_a, market_id)
+        position_b = exchange.position(account_b, market_id)
+        # 停止时可能有一笔A成交尚未对冲完成，不平衡不超过一次挂单数量
+        assert abs(position_a + position_b) <= QUANTITY, (position_a, position_b)
@@ -0,0 +1,81 @@
+"""wire_format：二进制/JSON编码往返与回退"""
+
+import json
+
+import pytest
+
+import wire_format
+
+
+def _fill_message(**overrides):
+    message = {
+        "account_index": 1001,
+        "market_index": 0,
+        "order_index": 281475000000041,
+        "filled_base_amount": "0.1000",
+        "filled_quote_amount": "300.05",
+        "avg_price": "3000.5",
+        "timestamp": 1760600000,
+        "side": "buy",
+    }
+    message.update(overrides)
+    return message
+
+
+@pytest.mark.parametrize("extra", [
+    {},
+    {"is_final": True},
+    {"is_final": False, "fill_received_ns": 123456789, "published_ns": 123456999},
+    {"status": "success", "a_order_index": 42, "a_order_final": False, "side": "sell"},
+])
+def test_binary_round_trip(extra):
+    message = _fill_message(**extra)
+    payload = wire_format.encode(message, wire_format.FORMAT_BINARY)
+    assert payload[0] == wire_format.MAGIC
+    assert wire_format.decode(payload) == message
+
+
+def test_decimal_precision_preserved():
+    message = _fill_message(filled_base_amount="0.00020", avg_price="109400.0", filled_quote_amount="1E-8")
+    decoded = wire_format.decode(wire_format.encode(message, wire_format.FORMAT_BINARY))
+    assert decoded["filled_base_amount"] == "0.00020"
+    assert decoded["avg_price"] == "109400.0"
+    assert decoded["filled_quote_amount"] == "1E-8"
+
+
+@pytest.mark.parametrize("message", [
+    {"action": "close_all", "market": "ETH", "timestamp": 1760600000},  # 超出schema的字段
+    _fill_message(status="failed"),  # 失败通知
+    _fill_message(side="long"),  # 未知方向
+    _fill_message(market_index=70000),  # 超出uint16
+    _fill_message(filled_base_amount="not-a-number"),
+    _fill_message(order_index=1 << 64),  # 超出int64
+])
+def test_unsupported_messages_fall_back_to_json(message):
+    assert wire_format.encode_binary(message) is None
+    payload = wire_format.encode(message, wire_format.FORMAT_BINARY)
+    assert json.loads(payload) == message
+    assert wire_format.decode(payload) == message
+
+
+def test_decode_accepts_json_str_and_bytes():
+    message = _fill_message(is_final=True)
+    assert wire_format.decode(json.dumps(message)) == message
+    assert wire_format.decode(json.dumps(message).encode()) == message
+
+
+def test_decode_v1_payload():
+    message = _fill_message(fill_received_ns=5)
+    body = wire_format.FILL_BODY_V1.pack(
+        1001, 0, message["order_index"], 1000, -4, 30005, -2, 30005, -1,
+        message["timestamp"], 0, wire_format.FLAG_HAS_FILL_RECEIVED_NS, 5, 0
+    )
+    payload = wire_format.HEADER.pack(wire_format.MAGIC, 1, wire_format.MSG_FILL) + body
+    assert wire_format.decode(payload) == message
+
+
+def test_decode_rejects_unknown_version():
+    payload = bytearray(wire_format.encode(_fill_message(), wire_format.FORMAT_BINARY))
+    payload[1] = 99
+    with pytest.raises(ValueError):
+        wire_format.decode(bytes(payload))
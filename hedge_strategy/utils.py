@@ -3,7 +3,6 @@
 包含市场查询、价格解析等辅助功能
 """
 
-import asyncio
 import logging
 import os
 import sys
@@ -16,6 +15,12 @@ from lighter import OrderBook
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'temp_lighter'))
 
 import lighter
+from rest_gateway import get_gateway, RateLimitExceeded
+from auth_token_cache import get_auth_token_cache
+
+# order_book_orders按单笔挂单返回：每个价格档位预留的挂单数，以及接口单次返回上限
+ORDERS_PER_LEVEL = 10
+MAX_ORDER_BOOK_ORDERS = 250
 
 
 async def get_market_index_by_name(api_client: lighter.ApiClient, market_name: str) -> Optional[OrderBook]:
@@ -29,39 +34,29 @@ async def get_market_index_by_name(api_client: lighter.ApiClient, market_name: s
     Returns:
         market_index，如果未找到则返回None
     """
-    max_retries = 5
-    retry_count = 0
-
-    while retry_count < max_retries:
-        try:
-            # 创建OrderApi实例
-            order_api = lighter.OrderApi(api_client)
-            # 获取所有市场信息（market_id=255表示获取所有市场）
-            order_books = await order_api.order_books(market_id=255)
-
-            # 遍历所有市场找到匹配的symbol
-            for order_book in order_books.order_books:
-                if order_book.symbol.upper() == market_name.upper():
-                    logging.info(f"找到市场 {market_name}, market_index={order_book.market_id}")
-                    # return order_book.market_id
-                    return order_book
-
-            logging.error(f"未找到市场: {market_name}")
-            return None
+    gateway = get_gateway()
+    try:
+        # 获取所有市场信息（market_id=255表示获取所有市场），限流和429重试由网关统一处理
+        order_books = await gateway.request(
+            "order_books",
+            gateway.order_api(api_client).order_books,
+            market_id=255
+        )
+    except RateLimitExceeded:
+        raise Exception(f"API限流严重，无法查询市场 {market_name}")
+    except Exception as e:
+        logging.error(f"查询市场索引失败: {e}")
+        raise
 
-        except Exception as e:
-            if "429" in str(e) or "Too Many Requests" in str(e):
-                retry_count += 1
-                wait_time = min(2 ** retry_count, 30)  # 指数退避，最大30秒
-                logging.warning(f"API限流，等待{wait_time}秒后重试 (尝试 {retry_count}/{max_retries})")
-                await asyncio.sleep(wait_time)
-                continue
-            else:
-                logging.error(f"查询市场索引失败: {e}")
-                raise
+    # 遍历所有市场找到匹配的symbol
+    for order_book in order_books.order_books:
+        if order_book.symbol.upper() == market_name.upper():
+            logging.info(f"找到市场 {market_name}, market_index={order_book.market_id}")
+            # return order_book.market_id
+            return order_book
 
-    logging.error(f"查询市场索引失败，已重试{max_retries}次")
-    raise Exception(f"API限流严重，无法查询市场 {market_name}")
+    logging.error(f"未找到市场: {market_name}")
+    return None
 
 
 async def get_orderbook_price_at_depth(
@@ -72,6 +67,8 @@ async def get_orderbook_price_at_depth(
 ) -> Optional[str]:
     """
     获取订单簿指定档位的价格
+
+    档位按价格聚合计数（同一价格的多笔挂单算一档），与本地订单簿镜像一致
     
     Args:
         api_client: lighter API客户端
@@ -82,41 +79,37 @@ async def get_orderbook_price_at_depth(
     Returns:
         价格字符串，如果档位不存在则返回None
     """
-    max_retries = 3
-    retry_count = 0
-
-    while retry_count < max_retries:
-        try:
-            order_api = lighter.OrderApi(api_client)
-            # 获取订单簿数据，limit设置为depth以确保有足够的档位
-            order_book_orders = await order_api.order_book_orders(market_index, limit=max(depth, 10))
-
-            # 选择买盘或卖盘
-            orders = order_book_orders.bids if is_bid else order_book_orders.asks
-
-            # 检查是否有足够的档位
-            if len(orders) < depth:
-                logging.error(f"订单簿档位不足，需要第{depth}档，但只有{len(orders)}档")
-                return None
+    gateway = get_gateway()
+    try:
+        # order_book_orders按单笔挂单返回，多取一些以覆盖depth个不同价格（请求权重与limit无关）
+        order_book_orders = await gateway.request(
+            "order_book_orders",
+            gateway.order_api(api_client).order_book_orders,
+            market_id=market_index,
+            limit=min(max(depth * ORDERS_PER_LEVEL, 10), MAX_ORDER_BOOK_ORDERS)
+        )
+    except RateLimitExceeded:
+        raise Exception(f"API限流严重，无法获取市场{market_index}的订单簿价格")
+    except Exception as e:
+        logging.error(f"获取订单簿价格失败: {e}")
+        raise
 
-            # 获取指定档位的价格（索引从0开始，所以减1）
-            price = orders[depth - 1].price
-            logging.info(f"市场{market_index} {'买' if is_bid else '卖'}{depth}档价格: {price}")
-            return price
+    # 选择买盘或卖盘，按价格聚合为档位（挂单已按价格优先排序）
+    orders = order_book_orders.bids if is_bid else order_book_orders.asks
+    levels = []
+    for order in orders:
+        if not levels or Decimal(str(order.price)) != Decimal(str(levels[-1])):
+            levels.append(order.price)
 
-        except Exception as e:
-            if "429" in str(e) or "Too Many Requests" in str(e):
-                retry_count += 1
-                wait_time = min(2 ** retry_count, 10)  # 指数退避，最大10秒
-                logging.warning(f"获取订单簿API限流，等待{wait_time}秒后重试 (尝试 {retry_count}/{max_retries})")
-                await asyncio.sleep(wait_time)
-                continue
-            else:
-                logging.error(f"获取订单簿价格失败: {e}")
-                raise
+    # 检查是否有足够的档位
+    if len(levels) < depth:
+        logging.error(f"订单簿档位不足，需要第{depth}档，但只有{len(levels)}档")
+        return None
 
-    logging.error(f"获取订单簿价格失败，已重试{max_retries}次")
-    raise Exception(f"API限流严重，无法获取市场{market_index}的订单簿价格")
+    # 获取指定档位的价格（索引从0开始，所以减1）
+    price = levels[depth - 1]
+    logging.info(f"市场{market_index} {'买' if is_bid else '卖'}{depth}档价格: {price}")
+    return price
 
 
 async def get_orderbook(
@@ -136,8 +129,13 @@ async def get_orderbook(
         订单簿对象
     """
     try:
-        order_api = lighter.OrderApi(api_client)
-        order_book_orders = await order_api.order_book_orders(market_index, limit=limit)
+        gateway = get_gateway()
+        order_book_orders = await gateway.request(
+            "order_book_orders",
+            gateway.order_api(api_client).order_book_orders,
+            market_id=market_index,
+            limit=limit
+        )
         return order_book_orders
     except Exception as e:
         logging.error(f"获取订单簿失败: {e}")
@@ -158,24 +156,20 @@ async def cancel_all_orders(
         market_index: 市场索引
     """
     try:
-        # 生成认证token（增加重试机制）
-        auth_token = None
-        for auth_retry in range(3):
-            auth_token, auth_error = signer_client.create_auth_token_with_expiry()
-            if auth_error is None:
-                break
-            logging.warning(f"生成认证token失败 (尝试 {auth_retry + 1}/3): {auth_error}")
-            await asyncio.sleep(0.5)
+        # 获取认证token（缓存复用，过期前后台刷新）
+        auth_token, auth_error = get_auth_token_cache(signer_client).get_token()
 
         if auth_token is None:
             logging.warning("无法生成认证token，跳过清理历史订单")
             return
 
-        order_api = lighter.OrderApi(signer_client.api_client)
+        gateway = get_gateway()
 
         # 获取所有活跃订单
         try:
-            orders = await order_api.account_active_orders(
+            orders = await gateway.request(
+                "account_active_orders",
+                gateway.order_api(signer_client.api_client).account_active_orders,
                 account_index=account_index,
                 market_id=market_index,
                 auth=auth_token
@@ -221,24 +215,20 @@ async def get_account_active_orders(
         market_index: 市场索引
     """
     try:
-        # 生成认证token（增加重试机制）
-        auth_token = None
-        for auth_retry in range(3):
-            auth_token, auth_error = signer_client.create_auth_token_with_expiry()
-            if auth_error is None:
-                break
-            logging.warning(f"生成认证token失败 (尝试 {auth_retry + 1}/3): {auth_error}")
-            await asyncio.sleep(0.5)
+        # 获取认证token（缓存复用，过期前后台刷新）
+        auth_token, auth_error = get_auth_token_cache(signer_client).get_token()
 
         if auth_token is None:
             logging.warning("无法生成认证token，跳过清理历史订单")
             return
 
-        order_api = lighter.OrderApi(signer_client.api_client)
+        gateway = get_gateway()
 
         # 获取所有活跃订单
         try:
-            orders = await order_api.account_active_orders(
+            orders = await gateway.request(
+                "account_active_orders",
+                gateway.order_api(signer_client.api_client).account_active_orders,
                 account_index=account_index,
                 market_id=market_index,
                 auth=auth_token
@@ -250,7 +240,8 @@ async def get_account_active_orders(
 
         if not orders.orders or len(orders.orders) == 0:
             logging.info(f"账户{account_index}在市场{market_index}没有活跃订单")
-            return
+            # 查询成功但没有订单时返回空列表，与查询失败（None）区分
+            return []
 
         return orders.orders
 
@@ -280,10 +271,15 @@ async def get_positions(
     try:
         """Get positions and account equity using official SDK."""
         # Use shared API client
-        account_api = lighter.AccountApi(api_client)
+        gateway = get_gateway()
 
         # Get account info
-        account_data = await account_api.account(by="index", value=str(account_index))
+        account_data = await gateway.request(
+            "account",
+            gateway.account_api(api_client).account,
+            by="index",
+            value=str(account_index)
+        )
 
         if not account_data or not account_data.accounts:
             logging.warning("Failed to get positions")
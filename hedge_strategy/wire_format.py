@@ -0,0 +1,223 @@
+"""
+消息线路格式
+成交/对冲消息默认是JSON（数值字段为字符串化的Decimal）。这里定义一个带版本号的紧凑二进制格式：
+- 固定struct布局，数量/价格按 (整数尾数, 十进制指数) 存储，不丢精度
+- 首字节为0xC1（UTF-8中永远不会出现），解码时据此区分二进制和JSON，旧格式消息照常解码
+- 超出schema的消息（平仓信号、失败通知等）自动回退为JSON
+"""
+
+import json
+import struct
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Optional, Tuple, Union
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+
+MAGIC = 0xC1
+VERSION = 2
+MSG_FILL = 1
+
+# magic, version, 消息类型
+HEADER = struct.Struct("<BBB")
+# account_index, market_index, order_index,
+# filled_base_amount(尾数, 指数), filled_quote_amount(尾数, 指数), avg_price(尾数, 指数),
+# timestamp, side, flags, fill_received_ns, a_order_index
+FILL_BODY_V1 = struct.Struct("<qHqqbqbqbqBBqq")
+# v2: 追加 published_ns（延迟追踪）
+FILL_BODY = struct.Struct("<qHqqbqbqbqBBqqq")
+FILL_BODIES = {1: FILL_BODY_V1, 2: FILL_BODY}
+
+DECIMAL_FIELDS = ("filled_base_amount", "filled_quote_amount", "avg_price")
+FILL_FIELDS = frozenset((
+    "account_index", "market_index", "order_index", *DECIMAL_FIELDS, "timestamp", "side",
+    "is_final", "a_order_final", "fill_received_ns", "a_order_index", "status", "published_ns",
+))
+
+# flags位
+FLAG_HAS_IS_FINAL = 0x01
+FLAG_IS_FINAL = 0x02
+FLAG_HAS_A_ORDER_FINAL = 0x04
+FLAG_A_ORDER_FINAL = 0x08
+FLAG_HAS_FILL_RECEIVED_NS = 0x10
+FLAG_HAS_A_ORDER_INDEX = 0x20
+FLAG_STATUS_SUCCESS = 0x40
+FLAG_HAS_PUBLISHED_NS = 0x80
+
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def _pack_decimal(value: Union[str, Decimal]) -> Optional[Tuple[int, int]]:
+    """Decimal字符串 -> (尾数, 指数)，超出int64/int8范围时返回None"""
+    if isinstance(value, str) and "e" not in value and "E" not in value:
+        # 常见的定点小数字符串直接拆分，避免构造Decimal
+        integer, _, fraction = value.partition(".")
+        try:
+            mantissa = int(integer + fraction)
+        except ValueError:
+            return None
+        exponent = -len(fraction)
+    elif isinstance(value, (str, Decimal)):
+        try:
+            sign, digits, exponent = Decimal(value).as_tuple()
+        except InvalidOperation:
+            return None
+        if not isinstance(exponent, int):
+            return None
+        mantissa = int("".join(map(str, digits)) or "0")
+        if sign:
+            mantissa = -mantissa
+    else:
+        return None
+    if not -128 <= exponent <= 127 or not INT64_MIN <= mantissa <= INT64_MAX:
+        return None
+    return mantissa, exponent
+
+
+def _unpack_decimal(mantissa: int, exponent: int) -> str:
+    """(尾数, 指数) -> Decimal字符串"""
+    return str(Decimal(mantissa).scaleb(exponent))
+
+
+def _is_int64(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and INT64_MIN <= value <= INT64_MAX
+
+
+def encode_binary(message: Dict[str, Any]) -> Optional[bytes]:
+    """
+    按二进制schema编码成交/对冲成功消息
+
+    Args:
+        message: 消息字典（create_filled_message格式，可带is_final等扩展字段）
+
+    Returns:
+        编码结果；消息不符合schema时返回None（调用方回退JSON）
+    """
+    if not FILL_FIELDS.issuperset(message.keys()):
+        return None
+    if message.get("side") not in ("buy", "sell") or message.get("status", "success") != "success":
+        return None
+    for field in ("account_index", "order_index", "timestamp"):
+        if not _is_int64(message.get(field)):
+            return None
+    market_index = message.get("market_index")
+    if not isinstance(market_index, int) or not 0 <= market_index <= 0xFFFF:
+        return None
+
+    decimals = []
+    for field in DECIMAL_FIELDS:
+        packed = _pack_decimal(message.get(field))
+        if packed is None:
+            return None
+        decimals.extend(packed)
+
+    flags = 0
+    if "status" in message:
+        flags |= FLAG_STATUS_SUCCESS
+    if "is_final" in message:
+        flags |= FLAG_HAS_IS_FINAL | (FLAG_IS_FINAL if message["is_final"] else 0)
+    if "a_order_final" in message:
+        flags |= FLAG_HAS_A_ORDER_FINAL | (FLAG_A_ORDER_FINAL if message["a_order_final"] else 0)
+
+    fill_received_ns = message.get("fill_received_ns")
+    if fill_received_ns is not None:
+        if not _is_int64(fill_received_ns):
+            return None
+        flags |= FLAG_HAS_FILL_RECEIVED_NS
+    a_order_index = message.get("a_order_index")
+    if a_order_index is not None:
+        if not _is_int64(a_order_index):
+            return None
+        flags |= FLAG_HAS_A_ORDER_INDEX
+    published_ns = message.get("published_ns")
+    if published_ns is not None:
+        if not _is_int64(published_ns):
+            return None
+        flags |= FLAG_HAS_PUBLISHED_NS
+
+    return HEADER.pack(MAGIC, VERSION, MSG_FILL) + FILL_BODY.pack(
+        message["account_index"], market_index, message["order_index"],
+        *decimals,
+        message["timestamp"], 1 if message["side"] == "sell" else 0, flags,
+        fill_received_ns or 0, a_order_index or 0, published_ns or 0
+    )
+
+
+def decode_binary(payload: bytes) -> Dict[str, Any]:
+    """
+    解码二进制消息为与JSON格式一致的字典
+
+    Args:
+        payload: encode_binary的结果
+
+    Returns:
+        消息字典（数量/价格字段为字符串）
+    """
+    magic, version, msg_type = HEADER.unpack_from(payload)
+    body = FILL_BODIES.get(version)
+    if magic != MAGIC or body is None or msg_type != MSG_FILL:
+        raise ValueError(f"不支持的消息格式: magic={magic:#x}, version={version}, type={msg_type}")
+
+    fields = body.unpack_from(payload, HEADER.size)
+    (account_index, market_index, order_index,
+     base_m, base_e, quote_m, quote_e, price_m, price_e,
+     timestamp, side, flags, fill_received_ns, a_order_index) = fields[:14]
+    published_ns = fields[14] if version >= 2 else 0
+
+    message = {
+        "account_index": account_index,
+        "market_index": market_index,
+        "order_index": order_index,
+        "filled_base_amount": _unpack_decimal(base_m, base_e),
+        "filled_quote_amount": _unpack_decimal(quote_m, quote_e),
+        "avg_price": _unpack_decimal(price_m, price_e),
+        "timestamp": timestamp,
+        "side": "sell" if side else "buy",
+    }
+    if flags & FLAG_STATUS_SUCCESS:
+        message["status"] = "success"
+    if flags & FLAG_HAS_IS_FINAL:
+        message["is_final"] = bool(flags & FLAG_IS_FINAL)
+    if flags & FLAG_HAS_A_ORDER_FINAL:
+        message["a_order_final"] = bool(flags & FLAG_A_ORDER_FINAL)
+    if flags & FLAG_HAS_FILL_RECEIVED_NS:
+        message["fill_received_ns"] = fill_received_ns
+    if flags & FLAG_HAS_A_ORDER_INDEX:
+        message["a_order_index"] = a_order_index
+    if flags & FLAG_HAS_PUBLISHED_NS:
+        message["published_ns"] = published_ns
+    return message
+
+
+def encode(message: Dict[str, Any], wire_format: str = FORMAT_JSON) -> bytes:
+    """
+    按指定格式编码消息
+
+    Args:
+        message: 消息字典
+        wire_format: "json" 或 "binary"（不符合二进制schema的消息回退JSON）
+
+    Returns:
+        编码结果
+    """
+    if wire_format == FORMAT_BINARY:
+        payload = encode_binary(message)
+        if payload is not None:
+            return payload
+    return json.dumps(message).encode()
+
+
+def decode(payload: Union[bytes, str]) -> Dict[str, Any]:
+    """
+    解码消息，自动识别二进制和JSON（兼容旧格式发送方）
+
+    Args:
+        payload: Redis收到的原始数据
+
+    Returns:
+        消息字典
+    """
+    if isinstance(payload, (bytes, bytearray)) and payload[:1] == bytes((MAGIC,)):
+        return decode_binary(payload)
+    return json.loads(payload)